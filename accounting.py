@@ -1,8 +1,11 @@
 # accounting.py
-from flask import Blueprint, render_template, request, redirect, url_for, g, abort, flash, jsonify
-from sqlalchemy import func
+from flask import Blueprint, Response, render_template, request, redirect, url_for, g, abort, flash, jsonify
+from sqlalchemy import and_, func, or_
+from sqlalchemy import insert as sa_insert
+from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import SQLAlchemyError
-from models import db, Rol, Empresa, EmpresaEmpleado, Asiento, DetalleAsiento, PlanCuenta, ChangeLog
+from models import db, Rol, Empresa, EmpresaEmpleado, Asiento, CierreEjercicio, DetalleAsiento, MapeoTransaccion, PlanCuenta, Transaccion
+from services import admision, agregados, archivo, auditoria, busqueda_asientos, busqueda_cuentas, cache_reportes, comparativos, consultas, ejercicios, estados_materializados, eventos, libro_residente, plan, saldos_diarios, sincronizacion, sse, transacciones
 from datetime import date
 from decimal import Decimal
 
@@ -25,13 +28,17 @@ def _empresa_del_usuario():
         - empleado: empresa afiliada
         - docente: None (debe filtrar por ?empresa=ID)
     """
+    if "empresa_usuario" in g:
+        return g.empresa_usuario  # ya resuelta en este pedido (p. ej. por el control de admisión)
+    emp = None  # docente
     if g.user.rol == Rol.dueno:
         e = Empresa.query.filter_by(id_gerente=g.user.id).first()
-        return e.id_empresa if e else None
-    if g.user.rol == Rol.empleado:
+        emp = e.id_empresa if e else None
+    elif g.user.rol == Rol.empleado:
         rel = EmpresaEmpleado.query.filter_by(id_usuario=g.user.id).first()
-        return rel.id_empresa if rel else None
-    return None  # docente
+        emp = rel.id_empresa if rel else None
+    g.empresa_usuario = emp
+    return emp
 
 # --- routes ---
 
@@ -143,9 +150,52 @@ def _asiento_to_dict(a: Asiento):
         doc_respaldatorio=a.doc_respaldatorio,
         id_usuario=a.id_usuario,
         leyenda=a.leyenda,
+        clase=a.clase,
         detalles=[_detalle_to_dict(d) for d in a.detalles],
     )
 
+def _asientos_archivados(empresa_id: int, desde=None, hasta=None, limite=None, **filtros) -> list:
+    """Asientos de los ejercicios archivados que entran en [desde, hasta], con la forma de
+    _asiento_to_dict más archivado=True, del más nuevo al más viejo. Los tramos filtran y
+    cortan en 'limite' (filtros: ver archivo.Tramo.asientos), así no se lee el archivo entero."""
+    filas = []
+    for tramo in reversed(archivo.tramos(empresa_id, desde, hasta)):
+        resto = None if limite is None else limite - len(filas)
+        if resto is not None and resto <= 0:
+            break
+        filas.extend(tramo.asientos(desde, hasta, limite=resto, descendente=True, **filtros))
+    if not filas:
+        return []
+    ids = {d["id_cuenta"] for a in filas for d in a["detalles"]}
+    cuentas = {c.id_cuenta: c for c in PlanCuenta.query.filter(PlanCuenta.id_cuenta.in_(ids))}
+    out = []
+    for a in filas:
+        detalles = []
+        for d in a["detalles"]:
+            c = cuentas.get(d["id_cuenta"])
+            detalles.append(dict(
+                id_detalle=d["id_detalle"],
+                id_cuenta=d["id_cuenta"],
+                cuenta=c.cuenta if c else d["cuenta"],
+                rubro=c.rubro if c else None,
+                subrubro=c.subrubro if c else None,
+                tipo=d["tipo"],
+                importe=float(d["importe"]),
+            ))
+        out.append(dict(
+            id_asiento=a["id"],
+            id_empresa=empresa_id,
+            fecha=a["fecha"].isoformat(),
+            num_asiento=a["num"],
+            doc_respaldatorio=a["doc"],
+            id_usuario=a["id_usuario"],
+            leyenda=a["leyenda"],
+            clase=a["clase"],
+            archivado=True,
+            detalles=detalles,
+        ))
+    return out
+
 def _asignar_codigos_rubro_subrubro(rubro: str, subrubro: str) -> tuple:
     """Asigna automáticamente los códigos de rubro y subrubro según el tipo"""
     rubro_upper = (rubro or "").strip().upper()
@@ -218,12 +268,8 @@ def _normal_side_for(c: PlanCuenta) -> str:
     # por defecto
     return "D"
 
-@bp.get("/api/cuentas")
-@login_required
-def api_cuentas_list():
-    empresa_id = _empresa_actual_from_request()
-    cuentas = PlanCuenta.query.filter_by(id_empresa=empresa_id).order_by(PlanCuenta.cuenta.asc()).all()
-    data = [dict(
+def _cuenta_to_dict(c: PlanCuenta) -> dict:
+    return dict(
         id_cuenta=c.id_cuenta,
         cuenta=c.cuenta,
         rubro=c.rubro,
@@ -231,8 +277,167 @@ def api_cuentas_list():
         cod_rubro=c.cod_rubro,
         cod_subrubro=c.cod_subrubro,
         normal=_normal_side_for(c),
-    ) for c in cuentas]
-    return jsonify(data)
+    )
+
+def _rango(desde_s, hasta_s):
+    """(desde, hasta) como date; 400 si alguna no es YYYY-MM-DD."""
+    try:
+        return consultas.fechas(desde_s, hasta_s)
+    except ValueError:
+        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
+
+def _saldos_por_cuenta(q, cuentas, nb_map) -> dict:
+    """Saldo por id_cuenta según su naturaleza (nb_map) para los renglones de q (motor vectorizado)."""
+    signos = [1 if nb_map[c.id_cuenta] == "D" else -1 for c in cuentas]
+    indice = {c.id_cuenta: i for i, c in enumerate(cuentas)}
+    mov = agregados.cargar(q.all(), indice)
+    saldos = agregados.normalizar(agregados.saldos_por_cuenta(mov, len(cuentas)), signos)
+    return {c.id_cuenta: agregados.de_centavos(saldos[i]) for i, c in enumerate(cuentas)}
+
+def _cuentas_reporte(empresa_id: int, libro) -> list:
+    """Plan visible de la empresa: del libro residente si está cargado."""
+    return libro.cuentas if libro is not None else plan.cuentas_de_empresa(empresa_id).all()
+
+def _saldos_reporte(q, empresa_id: int, desde_s, hasta_s, cuentas, nb_map, libro=None) -> dict:
+    """Como _saldos_por_cuenta, pero si 'hasta' cae en un ejercicio archivado lee del archivo
+    y, si hay libro residente, suma sus arreglos en vez de ejecutar q."""
+    tramo = archivo.tramo(empresa_id, hasta_s)
+    if tramo is not None:
+        cts = tramo.saldos(desde_s, hasta_s)
+    elif libro is not None:
+        inicio = ejercicios.inicio_ejercicio(empresa_id, date.fromisoformat(hasta_s) if hasta_s else None)
+        cts = libro.saldos(desde_s, hasta_s, inicio)
+    else:
+        return _saldos_por_cuenta(q, cuentas, nb_map)
+    return {
+        c.id_cuenta: agregados.de_centavos(cts.get(c.id_cuenta, 0) * (1 if nb_map[c.id_cuenta] == "D" else -1))
+        for c in cuentas
+    }
+
+# Clasificación heurística de los estados
+def _grupo_estados(txt: str):
+    if any(k in txt for k in ["ingreso", "ventas", "ingresos"]):
+        return "ingreso"
+    if any(k in txt for k in ["gasto", "costos", "costo"]):
+        return "gasto"
+    if any(k in txt for k in ["activo", "banco", "bancos", "caja", "clientes", "inventario"]):
+        return "activo"
+    if any(k in txt for k in ["pasivo", "proveedores", "deudas", "obligaciones"]):
+        return "pasivo"
+    if any(k in txt for k in ["patrimonio", "capital"]):
+        return "patrimonio"
+    return None
+
+def _estados_de(cuentas, nb_map, txt_map, saldos) -> dict:
+    """Estado de resultados (er) y situación (bg) a partir de saldos normalizados por cuenta."""
+    ingresos = Decimal("0"); gastos = Decimal("0"); costo_ventas = Decimal("0"); activo = Decimal("0"); pasivo = Decimal("0"); patrimonio = Decimal("0")
+    for c in cuentas:
+        txt = txt_map[c.id_cuenta]
+        saldo = saldos[c.id_cuenta]
+        grupo = _grupo_estados(txt)
+        if grupo == "ingreso":
+            ingresos += saldo if nb_map[c.id_cuenta] == "H" else -saldo
+        elif grupo == "gasto":
+            # separar costos (cuando el texto contiene 'costo')
+            val = (saldo if nb_map[c.id_cuenta] == "D" else -saldo)
+            gastos += val
+            if "costo" in txt:
+                costo_ventas += val
+        elif grupo == "activo":
+            activo += saldo if nb_map[c.id_cuenta] == "D" else -saldo
+        elif grupo == "pasivo":
+            pasivo += saldo if nb_map[c.id_cuenta] == "H" else -saldo
+        elif grupo == "patrimonio":
+            patrimonio += saldo if nb_map[c.id_cuenta] == "H" else -saldo
+    utilidad = ingresos + gastos  # gastos negativo si mapeo es correcto
+    return dict(
+        er=dict(ingresos=float(ingresos), ventas=float(ingresos), gastos=float(-gastos), costo_ventas=float(-costo_ventas), utilidad=float(utilidad)),
+        bg=dict(activo=float(activo), pasivo=float(pasivo), patrimonio=float(patrimonio), pasivo_patrimonio_utilidad=float(pasivo + patrimonio + utilidad)),
+    )
+
+def _patrimonial_de(cuentas, nb_map, saldos) -> list:
+    """Estado patrimonial: importe (Decimal) por rubro y subrubro, agrupando sin distinguir mayúsculas."""
+    grupos = {}  # clave: (rubro_upper, subrubro_upper) -> {cod_rubro, rubro, cod_subrubro, subrubro, importe}
+    for c in cuentas:
+        if not c.rubro and not c.subrubro:
+            continue
+        # Clave de agrupación en mayúsculas; se muestran los valores originales de la primera cuenta
+        clave = ((c.rubro or "").strip().upper(), (c.subrubro or "").strip().upper())
+        if clave not in grupos:
+            cod_rubro_auto, cod_subrubro_auto = _asignar_codigos_rubro_subrubro(c.rubro or "", c.subrubro or "")
+            grupos[clave] = {
+                "cod_rubro": cod_rubro_auto or "",
+                "rubro": c.rubro or "",
+                "cod_subrubro": cod_subrubro_auto or "",
+                "subrubro": c.subrubro or "",
+                "importe": Decimal("0")
+            }
+        # El saldo ya está normalizado según la naturaleza de la cuenta: se suma el valor absoluto
+        grupos[clave]["importe"] += abs(saldos[c.id_cuenta])
+    return list(grupos.values())
+
+def _arbol_de(cuentas, nb_map, saldos) -> dict:
+    """Rubro → subrubro → cuenta con los subtotales de todos los niveles en una sola pasada
+    (lo que daría GROUP BY ROLLUP(rubro, subrubro, cuenta)). Mismos grupos e importes que el
+    estado patrimonial: se agrupa sin distinguir mayúsculas y se suma el valor absoluto."""
+    total = Decimal("0")
+    rubros = {}
+    for c in sorted(cuentas, key=lambda x: (x.cuenta or "").upper()):
+        if not c.rubro and not c.subrubro:
+            continue
+        kr, ks = (c.rubro or "").strip().upper(), (c.subrubro or "").strip().upper()
+        r = rubros.get(kr)
+        if r is None:
+            cod_rubro, _ = _asignar_codigos_rubro_subrubro(c.rubro or "", "")
+            r = rubros[kr] = dict(rubro=c.rubro or "", cod_rubro=cod_rubro or "", importe=Decimal("0"), cuentas=0, subrubros={})
+        sub = r["subrubros"].get(ks)
+        if sub is None:
+            _, cod_subrubro = _asignar_codigos_rubro_subrubro(c.rubro or "", c.subrubro or "")
+            sub = r["subrubros"][ks] = dict(subrubro=c.subrubro or "", cod_subrubro=cod_subrubro or "", importe=Decimal("0"), cuentas=[])
+        saldo = saldos[c.id_cuenta]
+        sub["cuentas"].append(dict(
+            id_cuenta=c.id_cuenta, cuenta=c.cuenta, normal=nb_map[c.id_cuenta],
+            saldo=float(saldo), importe=float(abs(saldo)),
+        ))
+        sub["importe"] += abs(saldo)
+        r["importe"] += abs(saldo)
+        r["cuentas"] += 1
+        total += abs(saldo)
+    return dict(
+        importe=float(total),
+        cuentas=sum(r["cuentas"] for r in rubros.values()),
+        rubros=[
+            dict(r, importe=float(r["importe"]), subrubros=[
+                dict(sub, importe=float(sub["importe"])) for _k, sub in sorted(r["subrubros"].items())
+            ])
+            for _k, r in sorted(rubros.items())
+        ],
+    )
+
+def _fecha_al(al_s: str) -> date:
+    try:
+        return date.fromisoformat(al_s)
+    except ValueError:
+        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
+
+@bp.get("/api/cuentas")
+@login_required
+def api_cuentas_list():
+    empresa_id = _empresa_actual_from_request()
+    cuentas = plan.cuentas_de_empresa(empresa_id).order_by(PlanCuenta.cuenta.asc()).all()
+    return jsonify([_cuenta_to_dict(c) for c in cuentas])
+
+@bp.get("/api/cuentas/search")
+@login_required
+def api_cuentas_search():
+    """Autocompletado: cuentas que coinciden con q (cuenta, código o subrubro), por relevancia."""
+    empresa_id = _empresa_actual_from_request()
+    q = (request.args.get("q") or "").strip()
+    limite = min(max(request.args.get("limite", 20, type=int), 1), 100)
+    if not q:
+        return jsonify([])
+    cargar = lambda: [_cuenta_to_dict(c) for c in plan.cuentas_de_empresa(empresa_id).all()]
+    return jsonify(busqueda_cuentas.cache.buscar(empresa_id, q, limite, cargar))
 
 @bp.post("/api/cuentas")
 @login_required
@@ -289,13 +494,12 @@ def api_cuentas_create():
         db.session.add(pc)
         db.session.flush()
         # Auditoría
-        db.session.add(ChangeLog(
-            entidad="cuenta",
-            id_entidad=pc.id_cuenta,
-            accion="create",
-            id_usuario=getattr(g, 'user', None).id if getattr(g, 'user', None) else None,
-            datos=f"{{\"codigo\":\"{codigo_cuenta}\",\"nombre\":\"{nombre}\",\"tipo\":\"{tipo}\"}}",
-        ))
+        auditoria.registrar(
+            "cuenta", pc.id_cuenta, "create",
+            id_usuario=g.user.id, id_empresa=empresa_id,
+            datos=dict(codigo=codigo_cuenta, nombre=nombre, tipo=tipo),
+        )
+        eventos.notificar(empresa_id, "cuenta", "create", pc.id_cuenta, cuenta=_cuenta_to_dict(pc))
         db.session.commit()
         return jsonify(dict(
             id_cuenta=pc.id_cuenta,
@@ -309,71 +513,274 @@ def api_cuentas_create():
         db.session.rollback()
         abort(500, description="Error al crear la cuenta")
 
+def _asegurar_personalizable(cuenta: PlanCuenta, empresa_id: int):
+    """Personalizar una compartida mueve sus renglones a la copia; los de ejercicios
+    cerrados (en la base o en el archivo) no se tocan, así que en ese caso no se puede."""
+    cerrada = ejercicios.fecha_cerrada(empresa_id)
+    if cerrada is None:
+        return
+    if plan.en_uso(cuenta.id_cuenta, empresa_id, hasta=cerrada) or archivo.usa_cuenta(empresa_id, cuenta.id_cuenta):
+        abort(409, description="La cuenta tiene movimientos en ejercicios cerrados y no se puede personalizar")
+
+@bp.patch("/api/cuentas/<int:cuenta_id>")
+@login_required
+def api_cuentas_update(cuenta_id: int):
+    """Personaliza una cuenta. Si es compartida, se crea la copia propia de la empresa
+    (con los renglones de la empresa) y las demás empresas no se enteran."""
+    if not request.is_json:
+        abort(400, description="JSON requerido")
+    payload = request.get_json()
+    empresa_id = _empresa_actual_from_request()
+    _ensure_owner_access(empresa_id)
+    cuenta = plan.cuenta_de_empresa(cuenta_id, empresa_id)
+    if not cuenta:
+        abort(404, description="Cuenta no encontrada")
+    cambios = {}
+    if "nombre" in payload:
+        cambios["cuenta"] = (payload.get("nombre") or "").strip().upper()
+        if not cambios["cuenta"]:
+            abort(400, description="Nombre requerido")
+    if "codigo" in payload:
+        cambios["cod_rubro"] = (payload.get("codigo") or "").strip().upper() or None
+    if "subrubro" in payload:
+        cambios["subrubro"] = (payload.get("subrubro") or "").strip() or None
+        cambios["cod_subrubro"] = _asignar_codigos_rubro_subrubro(cuenta.rubro, cambios["subrubro"])[1]
+    if not cambios:
+        abort(400, description="Nada para actualizar (nombre, codigo o subrubro)")
+    if cuenta.id_empresa is None:
+        _asegurar_personalizable(cuenta, empresa_id)
+    try:
+        deltas = {}
+        if cuenta.id_empresa is None:
+            cuenta, deltas = plan.materializar(cuenta, empresa_id, **cambios)
+        else:
+            for k, v in cambios.items():
+                setattr(cuenta, k, v)
+        db.session.flush()
+        auditoria.registrar(
+            "cuenta", cuenta.id_cuenta, "update",
+            id_usuario=g.user.id, id_empresa=empresa_id,
+            datos=dict(cambios, id_base=cuenta.id_base),
+        )
+        data = _cuenta_to_dict(cuenta)
+        eventos.notificar(
+            empresa_id, "cuenta", "update", cuenta.id_cuenta,
+            deltas=deltas, id_base=cuenta.id_base, cuenta=data,
+        )
+        db.session.commit()
+        return jsonify(dict(data, id_base=cuenta.id_base))
+    except SQLAlchemyError:
+        db.session.rollback()
+        abort(500, description="Error al actualizar la cuenta")
+
 @bp.delete("/api/cuentas/<int:cuenta_id>")
 @login_required
 def api_cuentas_delete(cuenta_id: int):
     empresa_id = _empresa_actual_from_request()
     _ensure_owner_access(empresa_id)
-    cuenta = PlanCuenta.query.filter_by(id_cuenta=cuenta_id, id_empresa=empresa_id).first()
+    cuenta = plan.cuenta_de_empresa(cuenta_id, empresa_id)
     if not cuenta:
         abort(404, description="Cuenta no encontrada")
     
-    # Verificar si la cuenta está siendo usada en algún asiento
-    tiene_detalles = DetalleAsiento.query.filter_by(id_cuenta=cuenta_id).first()
-    if tiene_detalles:
+    # Verificar si la cuenta está siendo usada en algún asiento de la empresa
+    if plan.en_uso(cuenta_id, empresa_id) or archivo.usa_cuenta(empresa_id, cuenta_id):
         abort(400, description="No se puede eliminar una cuenta que está siendo usada en asientos")
     
     try:
         nombre_cuenta = cuenta.cuenta
-        db.session.delete(cuenta)
-        db.session.add(ChangeLog(
-            entidad="cuenta",
-            id_entidad=cuenta_id,
-            accion="delete",
-            id_usuario=g.user.id,
-            datos=f'{{"cuenta":"{nombre_cuenta}"}}',
-        ))
+        if cuenta.id_empresa is None:
+            plan.ocultar(cuenta, empresa_id)  # compartida: se oculta solo para esta empresa
+        elif cuenta.id_base is not None:
+            cuenta.oculta = True  # personalizada: borrarla haría reaparecer la compartida
+        else:
+            db.session.delete(cuenta)
+        auditoria.registrar(
+            "cuenta", cuenta_id, "delete",
+            id_usuario=g.user.id, id_empresa=empresa_id,
+            datos=dict(cuenta=nombre_cuenta),
+        )
+        eventos.notificar(empresa_id, "cuenta", "delete", cuenta_id)
         db.session.commit()
         return jsonify({"status": "deleted"})
     except SQLAlchemyError:
         db.session.rollback()
         abort(500, description="Error al eliminar la cuenta")
 
+@bp.get("/api/changes")
+@login_required
+def api_changes():
+    """Sincronización incremental: asientos y cuentas que cambiaron desde la versión since.
+    Sin since (o si no corresponde a esta empresa) devuelve todo con completo=true.
+    archivados: asientos que pasaron al archivo (no cambian, quedan de solo lectura).
+    """
+    empresa_id = _empresa_actual_from_request()
+    desde = request.args.get("since", 0, type=int)
+    version = sincronizacion.version_actual(empresa_id)
+    if desde <= 0 or desde > version:
+        asientos = (
+            Asiento.query.filter_by(id_empresa=empresa_id)
+            .options(selectinload(Asiento.detalles).joinedload(DetalleAsiento.cuenta_ref))
+            .order_by(Asiento.fecha.desc(), Asiento.num_asiento.desc())
+            .all()
+        )
+        cuentas = plan.cuentas_de_empresa(empresa_id).order_by(PlanCuenta.cuenta.asc()).all()
+        return jsonify(dict(
+            empresa=empresa_id,
+            version=version,
+            completo=True,
+            asientos=[_asiento_to_dict(a) for a in asientos] + _asientos_archivados(empresa_id),
+            cuentas=[_cuenta_to_dict(c) for c in cuentas],
+            eliminados=dict(asientos=[], cuentas=[]),
+            archivados=[],
+        ))
+
+    ultimo = sincronizacion.cambios_desde(empresa_id, desde, version)
+    vivos = {"asiento": set(), "cuenta": set()}
+    eliminados = {"asiento": set(), "cuenta": set()}
+    archivados = set()  # siguen igual, ahora de solo lectura en el archivo
+    for (entidad, id_entidad), accion in ultimo.items():
+        if accion == "archivado":
+            archivados.add(id_entidad)
+            continue
+        (eliminados if accion == "delete" else vivos)[entidad].add(id_entidad)
+    asientos = []
+    if vivos["asiento"]:
+        asientos = (
+            Asiento.query.filter(Asiento.id_empresa == empresa_id, Asiento.id_asiento.in_(vivos["asiento"]))
+            .options(selectinload(Asiento.detalles).joinedload(DetalleAsiento.cuenta_ref))
+            .all()
+        )
+    cuentas = []
+    if vivos["cuenta"]:
+        cuentas = plan.cuentas_de_empresa(empresa_id).filter(PlanCuenta.id_cuenta.in_(vivos["cuenta"])).all()
+    # lo que ya no existe (o dejó de ser visible) también es una baja
+    eliminados["asiento"] |= vivos["asiento"] - {a.id_asiento for a in asientos}
+    eliminados["cuenta"] |= vivos["cuenta"] - {c.id_cuenta for c in cuentas}
+    return jsonify(dict(
+        empresa=empresa_id,
+        version=version,
+        completo=False,
+        asientos=[_asiento_to_dict(a) for a in asientos],
+        cuentas=[_cuenta_to_dict(c) for c in cuentas],
+        eliminados=dict(asientos=sorted(eliminados["asiento"]), cuentas=sorted(eliminados["cuenta"])),
+        archivados=sorted(archivados),
+    ))
+
+@bp.get("/api/stream")
+@login_required
+def api_stream():
+    """Eventos en vivo de la empresa (asientos y cuentas) como Server-Sent Events.
+    204 si el worker no puede sostener la conexión: el cliente pasa a consultar /api/changes."""
+    empresa_id = _empresa_actual_from_request()
+    if not sse.difusor.transmite(request.environ):
+        return Response(status=204)
+    ultimo_id = request.headers.get("Last-Event-ID") or request.args.get("ultimo")
+    return Response(
+        sse.difusor.flujo(empresa_id, ultimo_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @bp.get("/api/asientos")
 @login_required
+@admision.limitar("reporte", _empresa_actual_from_request)
 def api_asientos_list():
     empresa_id = _empresa_actual_from_request()
-    q = Asiento.query.filter_by(id_empresa=empresa_id)
     # filtros opcionales de fecha
-    desde_s = request.args.get("desde")
-    hasta_s = request.args.get("hasta")
-    from datetime import date as _date
-    try:
-        if desde_s:
-            q = q.filter(Asiento.fecha >= _date.fromisoformat(desde_s))
-        if hasta_s:
-            q = q.filter(Asiento.fecha <= _date.fromisoformat(hasta_s))
-    except Exception:
-        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
-    asientos = q.order_by(Asiento.fecha.desc(), Asiento.num_asiento.desc()).all()
-    return jsonify([_asiento_to_dict(a) for a in asientos])
+    desde, hasta = _rango(request.args.get("desde"), request.args.get("hasta"))
+    asientos = consultas.asientos(empresa_id, desde, hasta).scalars()
+    # los ejercicios archivados son anteriores a todo lo que sigue en la base
+    return jsonify([_asiento_to_dict(a) for a in asientos] + _asientos_archivados(empresa_id, desde, hasta))
 
-@bp.post("/api/asientos")
+@bp.get("/api/asientos/search")
 @login_required
-def api_asientos_create():
-    if not request.is_json:
-        abort(400, description="JSON requerido")
-    payload = request.get_json()
+def api_asientos_search():
+    """Búsqueda de asientos, paginada por cursor (fecha, num_asiento) descendente.
+    Filtros: q (texto en leyenda/doc_respaldatorio), cuenta, importe_min, importe_max,
+    usuario, desde, hasta, limite, cursor. cuenta e importe se aplican a un mismo renglón.
+    """
     empresa_id = _empresa_actual_from_request()
-    _ensure_owner_access(empresa_id)
-    from datetime import date
+    limite = min(max(request.args.get("limite", 50, type=int), 1), 200)
+    q = Asiento.query.filter(Asiento.id_empresa == empresa_id)
+
+    texto = busqueda_asientos.filtro_texto(request.args.get("q"))
+    if texto is not None:
+        q = q.filter(texto)
     try:
-        fecha = date.fromisoformat(payload.get("fecha") or date.today().isoformat())
+        desde = date.fromisoformat(request.args["desde"]) if request.args.get("desde") else None
+        hasta = date.fromisoformat(request.args["hasta"]) if request.args.get("hasta") else None
+    except ValueError:
+        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
+    if desde:
+        q = q.filter(Asiento.fecha >= desde)
+    if hasta:
+        q = q.filter(Asiento.fecha <= hasta)
+    usuario = request.args.get("usuario", type=int) if request.args.get("usuario") else None
+    if usuario is not None:
+        q = q.filter(Asiento.id_usuario == usuario)
+
+    renglon = []
+    cuenta = request.args.get("cuenta", type=int) if request.args.get("cuenta") else None
+    if cuenta is not None:
+        renglon.append(DetalleAsiento.id_cuenta == cuenta)
+    try:
+        imp_min = Decimal(request.args["importe_min"]) if request.args.get("importe_min") else None
+        imp_max = Decimal(request.args["importe_max"]) if request.args.get("importe_max") else None
     except Exception:
-        abort(400, description="Fecha inválida")
-    doc = (payload.get("doc") or "").strip()
-    leyenda = (payload.get("leyenda") or "").strip()
-    renglones = payload.get("renglones") or []
+        abort(400, description="Importe inválido")
+    if imp_min is not None:
+        renglon.append(DetalleAsiento.importe >= imp_min)
+    if imp_max is not None:
+        renglon.append(DetalleAsiento.importe <= imp_max)
+    if renglon:
+        q = q.filter(db.session.query(DetalleAsiento.id_detalle).filter(
+            DetalleAsiento.id_asiento == Asiento.id_asiento, *renglon).exists())
+
+    cursor = request.args.get("cursor")
+    c_fecha = c_num = None
+    if cursor:
+        try:
+            f_s, n_s = cursor.split("_", 1)
+            c_fecha, c_num = date.fromisoformat(f_s), int(n_s)
+        except ValueError:
+            abort(400, description="Cursor inválido")
+        q = q.filter(or_(Asiento.fecha < c_fecha, and_(Asiento.fecha == c_fecha, Asiento.num_asiento < c_num)))
+
+    asientos = (
+        q.options(selectinload(Asiento.detalles).joinedload(DetalleAsiento.cuenta_ref))
+        .order_by(Asiento.fecha.desc(), Asiento.num_asiento.desc())
+        .limit(limite + 1)
+        .all()
+    )
+    items = [_asiento_to_dict(a) for a in asientos]
+    if len(items) <= limite:
+        # la página llegó a los ejercicios archivados (todos anteriores a la base): se completa con ellos
+        palabras = busqueda_asientos.terminos(request.args.get("q"))
+        tope = min(hasta, c_fecha) if hasta and c_fecha else (hasta or c_fecha)
+        items.extend(_asientos_archivados(
+            empresa_id, desde, tope, limite=limite + 1 - len(items),
+            antes_de=(c_fecha, c_num) if c_fecha is not None else None,
+            usuario=usuario, cuenta=cuenta, importe_min=imp_min, importe_max=imp_max,
+            texto=(lambda leyenda, doc: busqueda_asientos.coincide(palabras, leyenda, doc)) if palabras else None,
+        ))
+    siguiente = None
+    if len(items) > limite:
+        ultimo = items[limite - 1]
+        siguiente = f"{ultimo['fecha']}_{ultimo['num_asiento']}"
+    return jsonify(dict(items=items[:limite], siguiente=siguiente))
+
+def _asegurar_modificable(asiento: Asiento, *fechas):
+    """Los asientos de cierre/apertura y los de ejercicios cerrados no se tocan."""
+    if asiento is not None and asiento.clase != "normal":
+        abort(409, description="Los asientos de cierre y apertura no se pueden modificar")
+    empresa_id = asiento.id_empresa if asiento is not None else _empresa_actual_from_request()
+    if ejercicios.en_periodo_cerrado(empresa_id, *fechas):
+        abort(409, description="La fecha pertenece a un ejercicio cerrado")
+
+def _validar_renglones(renglones, empresa_id: int) -> list:
+    """Valida los renglones de un asiento (Debe = Haber > 0, cuentas de la empresa).
+    Devuelve [(id_cuenta, tipo, importe, id_detalle|None)].
+    """
     if len(renglones) < 2:
         abort(400, description="Debe haber al menos dos renglones")
     suma_debe = Decimal("0")
@@ -400,18 +807,42 @@ def api_asientos_create():
             suma_debe += monto
         else:
             suma_haber += monto
-        detalles.append((c_id_int, t, monto))
+        id_det = r.get("id_detalle")
+        try:
+            id_det = int(id_det) if id_det not in (None, "") else None
+        except Exception:
+            abort(400, description="id_detalle inválido")
+        detalles.append((c_id_int, t, monto, id_det))
         cuenta_ids.add(c_id_int)
     if suma_debe == 0 or suma_haber == 0 or suma_debe != suma_haber:
         abort(400, description="La partida debe estar balanceada (Debe = Haber > 0)")
     if cuenta_ids:
-        cuentas = PlanCuenta.query.filter(PlanCuenta.id_cuenta.in_(cuenta_ids)).all()
-        cuentas_map = {c.id_cuenta: c for c in cuentas}
-        if len(cuentas_map) != len(cuenta_ids):
+        existentes = db.session.query(func.count(PlanCuenta.id_cuenta)).filter(
+            PlanCuenta.id_cuenta.in_(cuenta_ids)).scalar()
+        if existentes != len(cuenta_ids):
             abort(400, description="Alguna cuenta no existe.")
-        for c in cuentas_map.values():
-            if c.id_empresa != empresa_id:
-                abort(400, description="Solo se pueden usar cuentas de la empresa seleccionada.")
+        visibles = plan.cuentas_de_empresa(empresa_id).filter(PlanCuenta.id_cuenta.in_(cuenta_ids)).count()
+        if visibles != len(cuenta_ids):
+            abort(400, description="Solo se pueden usar cuentas de la empresa seleccionada.")
+    return detalles
+
+@bp.post("/api/asientos")
+@login_required
+def api_asientos_create():
+    if not request.is_json:
+        abort(400, description="JSON requerido")
+    payload = request.get_json()
+    empresa_id = _empresa_actual_from_request()
+    _ensure_owner_access(empresa_id)
+    from datetime import date
+    try:
+        fecha = date.fromisoformat(payload.get("fecha") or date.today().isoformat())
+    except Exception:
+        abort(400, description="Fecha inválida")
+    _asegurar_modificable(None, fecha)
+    doc = (payload.get("doc") or "").strip()
+    leyenda = (payload.get("leyenda") or "").strip()
+    detalles = [d[:3] for d in _validar_renglones(payload.get("renglones") or [], empresa_id)]
     # correlativo por empresa
     last_num = db.session.query(func.max(Asiento.num_asiento)).filter_by(id_empresa=empresa_id).scalar() or 0
     nuevo_num = last_num + 1
@@ -434,19 +865,109 @@ def api_asientos_create():
                 importe=monto,
             ))
         # Auditoría
-        db.session.add(ChangeLog(
-            entidad="asiento",
-            id_entidad=a.id_asiento,
-            accion="create",
-            id_usuario=g.user.id,
-            datos=f"{{\"fecha\":\"{fecha.isoformat()}\",\"num\":{nuevo_num},\"renglones\":{len(detalles)}}}"
-        ))
+        auditoria.registrar(
+            "asiento", a.id_asiento, "create",
+            id_usuario=g.user.id, id_empresa=empresa_id,
+            datos=dict(fecha=fecha.isoformat(), num=nuevo_num, renglones=len(detalles)),
+        )
+        eventos.notificar(
+            empresa_id, "asiento", "create", a.id_asiento,
+            deltas=eventos.neto(eventos.deltas_renglones(detalles, fecha)),
+            asiento=_asiento_to_dict(a),
+        )
         db.session.commit()
         return jsonify(_asiento_to_dict(a)), 201
     except SQLAlchemyError as e:
         db.session.rollback()
         abort(500, description="Error al guardar el asiento")
 
+@bp.route("/api/asientos/<int:asiento_id>", methods=["PUT", "PATCH"])
+@login_required
+def api_asientos_update(asiento_id: int):
+    """Modifica un asiento conservando su número.
+    PUT exige todos los renglones; PATCH acepta solo los campos a cambiar.
+    Los renglones se comparan con los guardados (por id_detalle o, si no viene,
+    por cuenta/tipo/importe) y solo se tocan los que cambian.
+    """
+    if not request.is_json:
+        abort(400, description="JSON requerido")
+    payload = request.get_json()
+    empresa_id = _empresa_actual_from_request()
+    _ensure_owner_access(empresa_id)
+    asiento = Asiento.query.filter_by(id_asiento=asiento_id, id_empresa=empresa_id).first()
+    if not asiento:
+        abort(404, description="Asiento no encontrado")
+    if request.method == "PUT" and "renglones" not in payload:
+        abort(400, description="PUT requiere los renglones completos")
+
+    fecha_ant = asiento.fecha
+    renglones_ant = [(d.id_cuenta, d.tipo, d.importe) for d in asiento.detalles]
+    if "fecha" in payload:
+        try:
+            asiento.fecha = date.fromisoformat(payload.get("fecha"))
+        except Exception:
+            abort(400, description="Fecha inválida")
+    _asegurar_modificable(asiento, fecha_ant, asiento.fecha)
+    if "doc" in payload:
+        asiento.doc_respaldatorio = (payload.get("doc") or "").strip()
+    if "leyenda" in payload:
+        asiento.leyenda = (payload.get("leyenda") or "").strip()
+
+    cambios = dict(actualizados=0, insertados=0, eliminados=0)
+    if "renglones" in payload:
+        nuevos = _validar_renglones(payload.get("renglones") or [], empresa_id)
+        existentes = {d.id_detalle: d for d in asiento.detalles}
+        sin_id = []
+        for c_id, t, monto, id_det in nuevos:
+            d = existentes.pop(id_det, None) if id_det is not None else None
+            if d is None:
+                sin_id.append((c_id, t, monto))
+                continue
+            if (d.id_cuenta, d.tipo, d.importe) != (c_id, t, monto):
+                d.id_cuenta, d.tipo, d.importe = c_id, t, monto
+                cambios["actualizados"] += 1
+        # Sin id_detalle: primero los idénticos quedan como están, después se reusa
+        # un renglón libre (mejor si es de la misma cuenta y tipo) y recién ahí se inserta.
+        libres = list(existentes.values())
+        pendientes = []
+        for c_id, t, monto in sin_id:
+            igual = next((d for d in libres if (d.id_cuenta, d.tipo, d.importe) == (c_id, t, monto)), None)
+            if igual is not None:
+                libres.remove(igual)
+            else:
+                pendientes.append((c_id, t, monto))
+        for c_id, t, monto in pendientes:
+            d = next((d for d in libres if (d.id_cuenta, d.tipo) == (c_id, t)), None) or (libres[0] if libres else None)
+            if d is not None:
+                libres.remove(d)
+                d.id_cuenta, d.tipo, d.importe = c_id, t, monto
+                cambios["actualizados"] += 1
+                continue
+            asiento.detalles.append(DetalleAsiento(id_cuenta=c_id, tipo=t, importe=monto))
+            cambios["insertados"] += 1
+        for d in libres:
+            asiento.detalles.remove(d)
+            cambios["eliminados"] += 1
+
+    renglones_nuevos = [(d.id_cuenta, d.tipo, d.importe) for d in asiento.detalles]
+    deltas = eventos.neto(
+        eventos.deltas_renglones(renglones_ant, fecha_ant, signo=-1),
+        eventos.deltas_renglones(renglones_nuevos, asiento.fecha),
+    )
+    try:
+        auditoria.registrar(
+            "asiento", asiento.id_asiento, "update",
+            id_usuario=g.user.id, id_empresa=empresa_id,
+            datos=dict(num=asiento.num_asiento, fecha=asiento.fecha.isoformat(), **cambios),
+        )
+        data = _asiento_to_dict(asiento)
+        eventos.notificar(empresa_id, "asiento", "update", asiento.id_asiento, deltas=deltas, asiento=data)
+        db.session.commit()
+        return jsonify(dict(data, cambios=cambios))
+    except SQLAlchemyError:
+        db.session.rollback()
+        abort(500, description="Error al modificar el asiento")
+
 @bp.delete("/api/asientos/<int:asiento_id>")
 @login_required
 def api_asientos_delete(asiento_id: int):
@@ -455,104 +976,372 @@ def api_asientos_delete(asiento_id: int):
     asiento = Asiento.query.filter_by(id_asiento=asiento_id, id_empresa=empresa_id).first()
     if not asiento:
         abort(404, description="Asiento no encontrado")
+    _asegurar_modificable(asiento, asiento.fecha)
     try:
-        db.session.delete(asiento)
-        db.session.add(ChangeLog(
-            entidad="asiento",
-            id_entidad=asiento_id,
-            accion="delete",
-            id_usuario=g.user.id,
-            datos=f'{{"num":{asiento.num_asiento}}}',
+        deltas = eventos.neto(eventos.deltas_renglones(
+            [(d.id_cuenta, d.tipo, d.importe) for d in asiento.detalles], asiento.fecha, signo=-1,
         ))
+        db.session.delete(asiento)
+        auditoria.registrar(
+            "asiento", asiento_id, "delete",
+            id_usuario=g.user.id, id_empresa=empresa_id,
+            datos=dict(num=asiento.num_asiento),
+        )
+        eventos.notificar(empresa_id, "asiento", "delete", asiento_id, deltas=deltas)
         db.session.commit()
         return jsonify({"status": "deleted"})
     except SQLAlchemyError:
         db.session.rollback()
         abort(500, description="Error al eliminar el asiento")
 
+@bp.get("/api/cierres")
+@login_required
+def api_cierres_list():
+    empresa_id = _empresa_actual_from_request()
+    cierres = CierreEjercicio.query.filter_by(id_empresa=empresa_id).order_by(CierreEjercicio.fecha_cierre.desc()).all()
+    return jsonify([dict(
+        id_cierre=c.id_cierre,
+        fecha_cierre=c.fecha_cierre.isoformat(),
+        id_asiento_cierre=c.id_asiento_cierre,
+        id_asiento_apertura=c.id_asiento_apertura,
+        id_cuenta_resultados=c.id_cuenta_resultados,
+        id_usuario=c.id_usuario,
+        archivado=c.archivado.isoformat() if c.archivado else None,
+    ) for c in cierres])
+
+@bp.post("/api/cierres")
+@login_required
+def api_cierres_create():
+    """Cierre de ejercicio: {fecha: YYYY-MM-DD, id_cuenta_resultados?}."""
+    if not request.is_json:
+        abort(400, description="JSON requerido")
+    payload = request.get_json()
+    empresa_id = _empresa_actual_from_request()
+    _ensure_owner_access(empresa_id)
+    try:
+        fecha = date.fromisoformat(payload.get("fecha") or "")
+    except ValueError:
+        abort(400, description="Fecha de cierre inválida. Use YYYY-MM-DD")
+    try:
+        cierre, a_cierre, a_apertura, cuenta_nueva = ejercicios.cerrar(
+            empresa_id, fecha, id_usuario=g.user.id,
+            id_cuenta_resultados=payload.get("id_cuenta_resultados"),
+        )
+        if cuenta_nueva is not None:
+            eventos.notificar(empresa_id, "cuenta", "create", cuenta_nueva.id_cuenta, cuenta=_cuenta_to_dict(cuenta_nueva))
+        for a in (a_cierre, a_apertura):
+            eventos.notificar(
+                empresa_id, "asiento", "create", a.id_asiento,
+                deltas=eventos.neto(eventos.deltas_renglones(
+                    [(d.id_cuenta, d.tipo, d.importe) for d in a.detalles], a.fecha)),
+                asiento=_asiento_to_dict(a), clase=a.clase,
+            )
+        auditoria.registrar(
+            "cierre", cierre.id_cierre, "create",
+            id_usuario=g.user.id, id_empresa=empresa_id,
+            datos=dict(fecha=fecha.isoformat(), asiento_cierre=a_cierre.num_asiento, asiento_apertura=a_apertura.num_asiento),
+        )
+        db.session.commit()
+    except ejercicios.ErrorCierre as e:
+        db.session.rollback()
+        abort(400, description=str(e))
+    except SQLAlchemyError:
+        db.session.rollback()
+        abort(500, description="Error al cerrar el ejercicio")
+    return jsonify(dict(
+        id_cierre=cierre.id_cierre,
+        fecha_cierre=fecha.isoformat(),
+        asiento_cierre=_asiento_to_dict(a_cierre),
+        asiento_apertura=_asiento_to_dict(a_apertura),
+    )), 201
+
+def _transaccion_to_dict(t: Transaccion) -> dict:
+    return dict(
+        id_transaccion=t.id_transaccion,
+        tipo=t.tipo,
+        fecha=t.fecha.isoformat() if t.fecha else None,
+        doc=t.doc_respaldatorio,
+        contacto=t.contacto,
+        importe=float(t.importe or 0),
+        condicion=t.condicion,
+        estado=t.estado,
+        id_asiento=t.id_asiento,
+        error=t.error,
+    )
+
+@bp.get("/api/transacciones")
+@login_required
+def api_transacciones_list():
+    """Transacciones de la empresa; filtros: estado, desde, hasta, limite (por defecto 500)."""
+    empresa_id = _empresa_actual_from_request()
+    q = Transaccion.query.filter_by(id_empresa=empresa_id)
+    if request.args.get("estado"):
+        q = q.filter(Transaccion.estado == request.args["estado"])
+    try:
+        if request.args.get("desde"):
+            q = q.filter(Transaccion.fecha >= date.fromisoformat(request.args["desde"]))
+        if request.args.get("hasta"):
+            q = q.filter(Transaccion.fecha <= date.fromisoformat(request.args["hasta"]))
+    except ValueError:
+        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
+    limite = min(max(request.args.get("limite", 500, type=int), 1), 5000)
+    filas = q.order_by(Transaccion.fecha.desc(), Transaccion.id_transaccion.desc()).limit(limite).all()
+    return jsonify([_transaccion_to_dict(t) for t in filas])
+
+@bp.post("/api/transacciones")
+@login_required
+def api_transacciones_create():
+    """Encola transacciones: un objeto o {transacciones: [...]} con tipo, fecha, importe,
+    y opcionalmente doc, contacto y condicion. Se contabilizan con /api/transacciones/contabilizar."""
+    if not request.is_json:
+        abort(400, description="JSON requerido")
+    payload = request.get_json()
+    empresa_id = _empresa_actual_from_request()
+    _ensure_owner_access(empresa_id)
+    items = payload.get("transacciones") if isinstance(payload, dict) and "transacciones" in payload else payload
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list) or not items:
+        abort(400, description="Se requiere al menos una transacción")
+    filas = []
+    for i, t in enumerate(items, start=1):
+        if t.get("tipo") not in transacciones.TIPOS:
+            abort(400, description=f"Transacción {i}: tipo inválido (ingreso o egreso)")
+        try:
+            fecha = date.fromisoformat(t.get("fecha") or "")
+        except ValueError:
+            abort(400, description=f"Transacción {i}: fecha inválida. Use YYYY-MM-DD")
+        importe = transacciones.importe_valido(t.get("importe"))
+        if importe is None:
+            abort(400, description=f"Transacción {i}: importe debe ser positivo")
+        filas.append(dict(
+            id_empresa=empresa_id, tipo=t["tipo"], fecha=fecha, importe=importe, estado="pendiente",
+            doc_respaldatorio=(t.get("doc") or "").strip()[:100] or None,
+            contacto=(t.get("contacto") or "").strip()[:100] or None,
+            condicion=(t.get("condicion") or "").strip()[:100] or None,
+        ))
+    try:
+        db.session.execute(sa_insert(Transaccion), filas)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        abort(500, description="Error al guardar las transacciones")
+    return jsonify(dict(creadas=len(filas))), 201
+
+@bp.get("/api/transacciones/mapeos")
+@login_required
+def api_transacciones_mapeos():
+    empresa_id = _empresa_actual_from_request()
+    filas = MapeoTransaccion.query.filter_by(id_empresa=empresa_id).order_by(
+        MapeoTransaccion.tipo, MapeoTransaccion.condicion).all()
+    return jsonify([dict(
+        tipo=m.tipo, condicion=m.condicion, id_cuenta_debe=m.id_cuenta_debe, id_cuenta_haber=m.id_cuenta_haber,
+    ) for m in filas])
+
+@bp.put("/api/transacciones/mapeos")
+@login_required
+def api_transacciones_mapeos_update():
+    """Reemplaza los mapeos: [{tipo, condicion (vacía: cualquiera), id_cuenta_debe, id_cuenta_haber}]."""
+    if not request.is_json:
+        abort(400, description="JSON requerido")
+    payload = request.get_json()
+    empresa_id = _empresa_actual_from_request()
+    _ensure_owner_access(empresa_id)
+    items = payload.get("mapeos") if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        abort(400, description="Se requiere una lista de mapeos")
+    nuevos, vistos, cuentas = [], set(), set()
+    for m in items:
+        if m.get("tipo") not in transacciones.TIPOS:
+            abort(400, description="Tipo inválido (ingreso o egreso)")
+        condicion = (m.get("condicion") or "").strip()[:100] or None
+        clave = (m["tipo"], (condicion or "").lower())
+        if clave in vistos:
+            abort(400, description=f"Mapeo repetido para {m['tipo']} / {condicion or 'cualquier condición'}")
+        vistos.add(clave)
+        try:
+            debe, haber = int(m.get("id_cuenta_debe")), int(m.get("id_cuenta_haber"))
+        except (TypeError, ValueError):
+            abort(400, description="Cuentas del mapeo inválidas")
+        if debe == haber:
+            abort(400, description="Debe y haber deben ser cuentas distintas")
+        cuentas.update((debe, haber))
+        nuevos.append(dict(id_empresa=empresa_id, tipo=m["tipo"], condicion=condicion,
+                           id_cuenta_debe=debe, id_cuenta_haber=haber))
+    if cuentas and plan.cuentas_de_empresa(empresa_id).filter(PlanCuenta.id_cuenta.in_(cuentas)).count() != len(cuentas):
+        abort(400, description="Solo se pueden usar cuentas de la empresa seleccionada.")
+    try:
+        MapeoTransaccion.query.filter_by(id_empresa=empresa_id).delete(synchronize_session=False)
+        if nuevos:
+            db.session.execute(sa_insert(MapeoTransaccion), nuevos)
+        auditoria.registrar("mapeo_transacciones", empresa_id, "update", id_usuario=g.user.id,
+                            id_empresa=empresa_id, datos=dict(mapeos=len(nuevos)))
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        abort(500, description="Error al guardar los mapeos")
+    return api_transacciones_mapeos()
+
+@bp.post("/api/transacciones/contabilizar")
+@login_required
+def api_transacciones_contabilizar():
+    """Genera los asientos de las transacciones pendientes: {hasta?, limite?, reintentar?}.
+    reintentar vuelve a pendientes las que quedaron con error (p. ej. tras cargar un mapeo)."""
+    payload = request.get_json(silent=True) or {}
+    empresa_id = _empresa_actual_from_request()
+    _ensure_owner_access(empresa_id)
+    try:
+        hasta = date.fromisoformat(payload["hasta"]) if payload.get("hasta") else None
+    except ValueError:
+        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
+    limite = min(max(int(payload.get("limite") or transacciones.LOTE), 1), transacciones.LOTE)
+    try:
+        if payload.get("reintentar"):
+            Transaccion.query.filter_by(id_empresa=empresa_id, estado="error").update(
+                dict(estado="pendiente", error=None), synchronize_session=False)
+        resultado = transacciones.contabilizar(empresa_id, id_usuario=g.user.id, hasta=hasta, limite=limite)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        abort(500, description="Error al contabilizar las transacciones")
+    return jsonify(resultado)
+
 @bp.get("/api/mayor")
 @login_required
+@admision.limitar("reporte", _empresa_actual_from_request)
 def api_mayor():
     empresa_id = _empresa_actual_from_request()
     cuenta_id = request.args.get("cuenta", type=int)
     if not cuenta_id:
         abort(400, description="Parámetro cuenta requerido")
-    cuenta = db.session.get(PlanCuenta, cuenta_id)
-    if not cuenta or cuenta.id_empresa != empresa_id:
+    al_s = request.args.get("al")
+    if not al_s:
+        datos = cache_reportes.cache.obtener(
+            empresa_id, "mayor", cuenta=cuenta_id, desde=request.args.get("desde"), hasta=request.args.get("hasta"),
+        )
+        por_pagina = request.args.get("por_pagina", type=int)
+        if por_pagina:
+            datos = _pagina_mayor(datos, request.args.get("pagina", 1, type=int), por_pagina)
+        return jsonify(datos)
+    # ?al=YYYY-MM-DD[,YYYY-MM-DD...]: solo saldos, desde los acumulados diarios
+    cuenta = plan.cuenta_de_empresa(cuenta_id, empresa_id)
+    if not cuenta:
         abort(404, description="Cuenta no encontrada")
     nb = _normal_side_for(cuenta)
-    # Traer detalles de la cuenta por orden
-    q = (
-        db.session.query(DetalleAsiento, Asiento)
-        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
-        .filter(Asiento.id_empresa == empresa_id, DetalleAsiento.id_cuenta == cuenta_id)
+    signo = 1 if nb == "D" else -1
+    saldos_al = [
+        dict(al=f.isoformat(), saldo=float(agregados.de_centavos(
+            signo * saldos_diarios.saldo_a_fecha(empresa_id, cuenta_id, f))))
+        for f in (_fecha_al(x) for x in al_s.split(",") if x)
+    ]
+    return jsonify(dict(
+        cuenta=dict(id_cuenta=cuenta.id_cuenta, nombre=cuenta.cuenta),
+        normal=nb,
+        saldo=saldos_al[-1]["saldo"] if saldos_al else 0.0,
+        side="Deudor" if nb == "D" else "Acreedor",
+        saldos=saldos_al,
+        movimientos=[],
+    ))
+
+def _pagina_mayor(datos: dict, pagina: int, por_pagina: int) -> dict:
+    """Una página de movimientos (la primera es la más vieja); el saldo corrido sigue siendo el del mayor completo."""
+    movs = datos["movimientos"]
+    por_pagina = min(max(por_pagina, 1), 1000)
+    paginas = max(1, -(-len(movs) // por_pagina))
+    pagina = min(max(pagina, 1), paginas)
+    inicio = (pagina - 1) * por_pagina
+    return dict(
+        datos,
+        movimientos=movs[inicio:inicio + por_pagina],
+        saldo_anterior=movs[inicio - 1]["saldo"] if inicio else 0.0,
+        pagina=pagina, paginas=paginas, total_movimientos=len(movs),
     )
+
+def _mayor_datos(empresa_id: int, cuenta: int, desde=None, hasta=None) -> dict:
+    cuenta_id = cuenta
+    libro = libro_residente.obtener(empresa_id)
+    cuenta = libro.cuenta(cuenta_id) if libro is not None else plan.cuenta_de_empresa(cuenta_id, empresa_id)
+    if not cuenta:
+        abort(404, description="Cuenta no encontrada")
+    nb = _normal_side_for(cuenta)
+    side = "Deudor" if nb == "D" else "Acreedor"
     # Filtros opcionales de fecha
-    desde_s = request.args.get("desde")
-    hasta_s = request.args.get("hasta")
-    from datetime import date as _date
-    try:
-        if desde_s:
-            q = q.filter(Asiento.fecha >= _date.fromisoformat(desde_s))
-        if hasta_s:
-            q = q.filter(Asiento.fecha <= _date.fromisoformat(hasta_s))
-    except Exception:
-        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
-    dets = q.order_by(Asiento.fecha.asc(), Asiento.num_asiento.asc(), DetalleAsiento.id_detalle.asc()).all()
+    desde_s, hasta_s = desde, hasta
+    _rango(desde_s, hasta_s)
+    tramo = archivo.tramo(empresa_id, hasta_s)
+    if tramo is not None:
+        # ejercicio archivado: (fecha, leyenda, importe, tipo) desde el archivo
+        filas = [
+            (f, leyenda, agregados.de_centavos(abs(cts)), "debe" if cts > 0 else "haber")
+            for f, leyenda, cts in tramo.movimientos(cuenta_id, desde_s, hasta_s)
+        ]
+    elif libro is not None:
+        # libro residente: renglones de los arreglos, leyendas de asientos_diarios
+        inicio = ejercicios.inicio_ejercicio(empresa_id, date.fromisoformat(hasta_s) if hasta_s else None)
+        movs = libro.movimientos(cuenta_id, desde_s, hasta_s, inicio)
+        ids = sorted({a for _f, a, _c in movs})
+        leyendas = {}
+        for k in range(0, len(ids), 500):
+            leyendas.update(db.session.query(Asiento.id_asiento, Asiento.leyenda).filter(Asiento.id_asiento.in_(ids[k:k + 500])).all())
+        filas = [
+            (f, leyendas.get(a), agregados.de_centavos(abs(cts)), "debe" if cts > 0 else "haber")
+            for f, a, cts in movs
+        ]
+    else:
+        # renglones de la cuenta por orden
+        filas = consultas.mayor(empresa_id, cuenta_id, desde_s, hasta_s).all()
     saldo = Decimal("0")
     movs = []
-    for d, a in dets:
-        if d.tipo == "debe":
-            saldo += (d.importe if nb == "D" else -d.importe)
+    for fecha, leyenda, importe, tipo in filas:
+        if tipo == "debe":
+            saldo += (importe if nb == "D" else -importe)
         else:
-            saldo += (d.importe if nb == "H" else -d.importe)
+            saldo += (importe if nb == "H" else -importe)
         movs.append(dict(
-            fecha=a.fecha.isoformat(),
-            concepto=a.leyenda or "",
-            debe=float(d.importe) if d.tipo == "debe" else 0.0,
-            haber=float(d.importe) if d.tipo == "haber" else 0.0,
+            fecha=fecha.isoformat(),
+            concepto=leyenda or "",
+            debe=float(importe) if tipo == "debe" else 0.0,
+            haber=float(importe) if tipo == "haber" else 0.0,
             saldo=float(saldo),
         ))
-    side = "Deudor" if nb == "D" else "Acreedor"
-    return jsonify(dict(
+    return dict(
         cuenta=dict(id_cuenta=cuenta.id_cuenta, nombre=cuenta.cuenta),
         normal=nb,
         saldo=float(saldo),
         side=side,
         movimientos=movs,
-    ))
+    )
 
 @bp.get("/api/balance")
 @login_required
+@admision.limitar("reporte", _empresa_actual_from_request)
 def api_balance():
     empresa_id = _empresa_actual_from_request()
-    cuentas = PlanCuenta.query.filter_by(id_empresa=empresa_id).all()
-    # Precalcular saldos por cuenta
-    saldos = {c.id_cuenta: Decimal("0") for c in cuentas}
-    nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
-    q = (
-        db.session.query(DetalleAsiento, Asiento)
-        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
-        .filter(Asiento.id_empresa == empresa_id)
-    )
-    # filtros de fecha opcionales
     desde_s = request.args.get("desde")
     hasta_s = request.args.get("hasta")
-    from datetime import date as _date
-    try:
-        if desde_s:
-            q = q.filter(Asiento.fecha >= _date.fromisoformat(desde_s))
-        if hasta_s:
-            q = q.filter(Asiento.fecha <= _date.fromisoformat(hasta_s))
-    except Exception:
-        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
-    dets = q.all()
-    for d, a in dets:
-        nb = nb_map.get(d.id_cuenta, "D")
-        if d.tipo == "debe":
-            saldos[d.id_cuenta] += (d.importe if nb == "D" else -d.importe)
-        else:
-            saldos[d.id_cuenta] += (d.importe if nb == "H" else -d.importe)
+    al_s = request.args.get("al")
+    if al_s:
+        return jsonify(_balance_datos(empresa_id, desde_s, hasta_s, al=al_s))
+    return jsonify(cache_reportes.cache.obtener(empresa_id, "balance", desde=desde_s, hasta=hasta_s))
+
+def _balance_datos(empresa_id: int, desde=None, hasta=None, al=None) -> dict:
+    libro = libro_residente.obtener(empresa_id)
+    cuentas = _cuentas_reporte(empresa_id, libro)
+    nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
+    # filtros de fecha opcionales
+    desde_s, hasta_s, al_s = desde, hasta, al
+    _rango(desde_s, hasta_s)
+    q = consultas.renglones(empresa_id, desde_s, hasta_s)
+    if al_s:
+        # saldos a una fecha desde los acumulados diarios, sin sumar renglones
+        cts = saldos_diarios.saldos_a_fecha(empresa_id, _fecha_al(al_s))
+        saldos = {
+            c.id_cuenta: agregados.de_centavos(cts.get(c.id_cuenta, 0) * (1 if nb_map[c.id_cuenta] == "D" else -1))
+            for c in cuentas
+        }
+    else:
+        # Precalcular saldos por cuenta
+        saldos = _saldos_reporte(q, empresa_id, desde_s, hasta_s, cuentas, nb_map, libro)
     rows = []
     td = Decimal("0"); th = Decimal("0")
     for c in sorted(cuentas, key=lambda x: (x.cuenta or "")):
@@ -573,190 +1362,195 @@ def api_balance():
             deudor=float(deudor),
             acreedor=float(acreedor),
         ))
-    return jsonify(dict(rows=rows, total_debe=float(td), total_haber=float(th), cuadra=abs(td - th) < Decimal("0.005")))
+    return dict(rows=rows, total_debe=float(td), total_haber=float(th), cuadra=abs(td - th) < Decimal("0.005"))
 
 @bp.get("/api/estado-patrimonial")
 @login_required
+@admision.limitar("reporte", _empresa_actual_from_request)
 def api_estado_patrimonial():
     """Endpoint para estado de situación patrimonial agrupado por rubro y subrubro"""
     empresa_id = _empresa_actual_from_request()
-    cuentas = PlanCuenta.query.filter_by(id_empresa=empresa_id).all()
-    
-    # Precalcular saldos por cuenta
-    saldos = {c.id_cuenta: Decimal("0") for c in cuentas}
-    nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
-    
-    q = (
-        db.session.query(DetalleAsiento, Asiento)
-        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
-        .filter(Asiento.id_empresa == empresa_id)
-    )
-    
     # Filtros de fecha opcionales
     desde_s = request.args.get("desde")
     hasta_s = request.args.get("hasta")
-    from datetime import date as _date
-    try:
-        if desde_s:
-            q = q.filter(Asiento.fecha >= _date.fromisoformat(desde_s))
-        if hasta_s:
-            q = q.filter(Asiento.fecha <= _date.fromisoformat(hasta_s))
-    except Exception:
-        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
-    
-    dets = q.all()
-    for d, a in dets:
-        nb = nb_map.get(d.id_cuenta, "D")
-        if d.tipo == "debe":
-            saldos[d.id_cuenta] += (d.importe if nb == "D" else -d.importe)
-        else:
-            saldos[d.id_cuenta] += (d.importe if nb == "H" else -d.importe)
+    if not desde_s and not hasta_s:
+        rows = estados_materializados.patrimonial(empresa_id)
+        if rows is not None:
+            return jsonify(dict(rows=rows))
+    libro = libro_residente.obtener(empresa_id)
+    cuentas = _cuentas_reporte(empresa_id, libro)
     
-    # Agrupar por rubro y subrubro (normalizando a mayúsculas para comparación)
-    grupos = {}  # clave: (rubro_upper, subrubro_upper) -> {cod_rubro, rubro, cod_subrubro, subrubro, importe}
-    
-    for c in cuentas:
-        if not c.rubro and not c.subrubro:
-            continue
-        
-        # Normalizar a mayúsculas para agrupación y comparación
-        rubro_upper = (c.rubro or "").strip().upper()
-        subrubro_upper = (c.subrubro or "").strip().upper()
-        
-        # Obtener valores originales (preservando mayúsculas originales si existen)
-        rubro_original = c.rubro or ""
-        subrubro_original = c.subrubro or ""
-        
-        # Calcular códigos automáticos del rubro y subrubro
-        cod_rubro_auto, cod_subrubro_auto = _asignar_codigos_rubro_subrubro(rubro_original, subrubro_original)
-        
-        # Calcular saldo normalizado (valor absoluto para el importe)
-        nb = nb_map[c.id_cuenta]
-        saldo = saldos[c.id_cuenta]
-        # El saldo ya está normalizado según la naturaleza de la cuenta
-        # Tomamos el valor absoluto para el importe
-        importe = abs(saldo)
-        
-        # Clave de agrupación (usando mayúsculas para comparación)
-        clave = (rubro_upper, subrubro_upper)
-        
-        if clave not in grupos:
-            grupos[clave] = {
-                "cod_rubro": cod_rubro_auto or "",
-                "rubro": rubro_original,
-                "cod_subrubro": cod_subrubro_auto or "",
-                "subrubro": subrubro_original,
-                "importe": Decimal("0")
-            }
-        
-        grupos[clave]["importe"] += importe
+    nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
     
-    # Convertir a lista y ordenar
-    rows = []
-    for (rubro_upper, subrubro_upper), datos in grupos.items():
-        rows.append({
-            "cod_rubro": datos["cod_rubro"],
-            "rubro": datos["rubro"],
-            "cod_subrubro": datos["cod_subrubro"],
-            "subrubro": datos["subrubro"],
-            "importe": float(datos["importe"])
-        })
+    _rango(desde_s, hasta_s)
+    q = consultas.renglones(empresa_id, desde_s, hasta_s)
     
-    # Ordenar por rubro y subrubro (usando mayúsculas para consistencia en la comparación)
+    # Precalcular saldos por cuenta
+    saldos = _saldos_reporte(q, empresa_id, desde_s, hasta_s, cuentas, nb_map, libro)
+    rows = [dict(g, importe=float(g["importe"])) for g in _patrimonial_de(cuentas, nb_map, saldos)]
     rows.sort(key=lambda x: (
         (x["rubro"] or "").upper(),
         (x["subrubro"] or "").upper()
     ))
-    
     return jsonify(dict(rows=rows))
 
 @bp.get("/api/estados")
 @login_required
+@admision.limitar("reporte", _empresa_actual_from_request)
 def api_estados():
     empresa_id = _empresa_actual_from_request()
-    cuentas = PlanCuenta.query.filter_by(id_empresa=empresa_id).all()
+    if request.args.get("periodo"):
+        cuentas = plan.cuentas_de_empresa(empresa_id).all()
+        nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
+        txt_map = {c.id_cuenta: (" ".join(filter(None, [c.rubro, c.subrubro])).lower()) for c in cuentas}
+        return _estados_comparativos(empresa_id, cuentas, nb_map, txt_map)
+    if not request.args.get("desde") and not request.args.get("hasta"):
+        mat = estados_materializados.saldos(empresa_id)
+        if mat is not None:
+            cuentas, saldos = mat
+            nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
+            txt_map = {c.id_cuenta: (" ".join(filter(None, [c.rubro, c.subrubro])).lower()) for c in cuentas}
+            return jsonify(_estados_de(cuentas, nb_map, txt_map, saldos))
+    return jsonify(cache_reportes.cache.obtener(
+        empresa_id, "estados", desde=request.args.get("desde"), hasta=request.args.get("hasta"),
+    ))
+
+def _estados_datos(empresa_id: int, desde=None, hasta=None) -> dict:
+    libro = libro_residente.obtener(empresa_id)
+    cuentas = _cuentas_reporte(empresa_id, libro)
     nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
     txt_map = {c.id_cuenta: (" ".join(filter(None, [c.rubro, c.subrubro])).lower()) for c in cuentas}
-    saldos = {c.id_cuenta: Decimal("0") for c in cuentas}
-    q = (
-        db.session.query(DetalleAsiento, Asiento)
-        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
-        .filter(Asiento.id_empresa == empresa_id)
-    )
-    desde_s = request.args.get("desde")
-    hasta_s = request.args.get("hasta")
-    from datetime import date as _date
+    desde_s, hasta_s = desde, hasta
+    _rango(desde_s, hasta_s)
+    q = consultas.renglones(empresa_id, desde_s, hasta_s)
+    saldos = _saldos_reporte(q, empresa_id, desde_s, hasta_s, cuentas, nb_map, libro)
+    return _estados_de(cuentas, nb_map, txt_map, saldos)
+
+def _estados_comparativos(empresa_id: int, cuentas, nb_map, txt_map):
+    """?periodo=mes|trimestre|anio&desde&hasta: una columna por período y su variación."""
+    hoy = date.today()
     try:
-        if desde_s:
-            q = q.filter(Asiento.fecha >= _date.fromisoformat(desde_s))
-        if hasta_s:
-            q = q.filter(Asiento.fecha <= _date.fromisoformat(hasta_s))
-    except Exception:
+        hasta = date.fromisoformat(request.args.get("hasta") or hoy.isoformat())
+        desde = date.fromisoformat(request.args.get("desde") or date(hasta.year, 1, 1).isoformat())
+        pers = comparativos.periodos(request.args.get("periodo"), desde, hasta)
+    except comparativos.ErrorPeriodo as e:
+        abort(400, description=str(e))
+    except ValueError:
         abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
-    dets = q.all()
-    for d, a in dets:
-        nb = nb_map.get(d.id_cuenta, "D")
-        if d.tipo == "debe":
-            saldos[d.id_cuenta] += (d.importe if nb == "D" else -d.importe)
-        else:
-            saldos[d.id_cuenta] += (d.importe if nb == "H" else -d.importe)
-    # Clasificación heurística
-    def is_ingreso(txt):
-        return any(k in txt for k in ["ingreso", "ventas", "ingresos"])
-    def is_gasto(txt):
-        return any(k in txt for k in ["gasto", "costos", "costo"])
-    def is_activo(txt):
-        return any(k in txt for k in ["activo", "banco", "bancos", "caja", "clientes", "inventario"])
-    def is_pasivo(txt):
-        return any(k in txt for k in ["pasivo", "proveedores", "deudas", "obligaciones"])
-    def is_patrimonio(txt):
-        return any(k in txt for k in ["patrimonio", "capital"])
+    flujos, saldos = comparativos.movimientos(empresa_id, pers)
 
-    ingresos = Decimal("0"); gastos = Decimal("0"); costo_ventas = Decimal("0"); activo = Decimal("0"); pasivo = Decimal("0"); patrimonio = Decimal("0")
-    for c in cuentas:
-        txt = txt_map[c.id_cuenta]
-        saldo = saldos[c.id_cuenta]
-        if is_ingreso(txt):
-            ingresos += saldo if nb_map[c.id_cuenta] == "H" else -saldo
-        elif is_gasto(txt):
-            # separar costos (cuando el texto contiene 'costo')
-            val = (saldo if nb_map[c.id_cuenta] == "D" else -saldo)
-            gastos += val
-            if "costo" in txt:
-                costo_ventas += val
-        elif is_activo(txt):
-            activo += saldo if nb_map[c.id_cuenta] == "D" else -saldo
-        elif is_pasivo(txt):
-            pasivo += saldo if nb_map[c.id_cuenta] == "H" else -saldo
-        elif is_patrimonio(txt):
-            patrimonio += saldo if nb_map[c.id_cuenta] == "H" else -saldo
-    utilidad = ingresos + gastos  # gastos negativo si mapeo es correcto
+    def normalizar(cts):
+        return {
+            c.id_cuenta: agregados.de_centavos(cts.get(c.id_cuenta, 0) * (1 if nb_map[c.id_cuenta] == "D" else -1))
+            for c in cuentas
+        }
+    columnas = []
+    por_cuenta = {c.id_cuenta: [] for c in cuentas}
+    for flujo, saldo in zip(flujos, saldos):
+        # resultados: movimiento del período; patrimoniales: saldo al cierre del período
+        er = _estados_de(cuentas, nb_map, txt_map, normalizar(flujo))["er"]
+        bg = _estados_de(cuentas, nb_map, txt_map, normalizar(saldo))["bg"]
+        columnas.append(dict(er=er, bg=bg))
+        for c in cuentas:
+            grupo = _grupo_estados(txt_map[c.id_cuenta])
+            cts = (flujo if grupo in ("ingreso", "gasto") else saldo).get(c.id_cuenta, 0)
+            por_cuenta[c.id_cuenta].append(float(agregados.de_centavos(cts * (1 if nb_map[c.id_cuenta] == "D" else -1))))
+
+    def serie(estado, clave):
+        valores = [col[estado][clave] for col in columnas]
+        return dict(valores=valores, variacion=comparativos.variaciones(valores))
+    filas = []
+    for c in sorted(cuentas, key=lambda x: (x.cod_rubro or "", x.cuenta or "")):
+        grupo = _grupo_estados(txt_map[c.id_cuenta])
+        valores = por_cuenta[c.id_cuenta]
+        if grupo is None or not any(valores):
+            continue
+        filas.append(dict(
+            id_cuenta=c.id_cuenta, cuenta=c.cuenta, rubro=c.rubro, subrubro=c.subrubro, grupo=grupo,
+            valores=valores, variacion=comparativos.variaciones(valores),
+        ))
     return jsonify(dict(
-        er=dict(ingresos=float(ingresos), ventas=float(ingresos), gastos=float(-gastos), costo_ventas=float(-costo_ventas), utilidad=float(utilidad)),
-        bg=dict(activo=float(activo), pasivo=float(pasivo), patrimonio=float(patrimonio), pasivo_patrimonio_utilidad=float(pasivo + patrimonio + utilidad)),
+        periodo=request.args.get("periodo"),
+        periodos=[dict(clave=k, desde=i.isoformat(), hasta=f.isoformat()) for k, i, f in pers],
+        er={k: serie("er", k) for k in columnas[0]["er"]},
+        bg={k: serie("bg", k) for k in columnas[0]["bg"]},
+        cuentas=filas,
     ))
 
+@bp.get("/api/arbol")
+@login_required
+@admision.limitar("reporte", _empresa_actual_from_request)
+def api_arbol():
+    """Un nivel del árbol rubro → subrubro → cuenta con su subtotal: sin parámetros los rubros,
+    ?rubro= sus subrubros, ?rubro=&subrubro= sus cuentas. Cada hijo trae 'abrir' (los
+    parámetros para pedir sus hijos) o, si es una cuenta, 'mayor' (para /api/mayor?por_pagina=).
+    Acepta desde/hasta como el estado patrimonial."""
+    empresa_id = _empresa_actual_from_request()
+    desde_s, hasta_s = request.args.get("desde"), request.args.get("hasta")
+    arbol = None
+    if not desde_s and not hasta_s:
+        mat = estados_materializados.saldos(empresa_id)
+        if mat is not None:
+            cuentas, saldos = mat
+            arbol = _arbol_de(cuentas, {c.id_cuenta: _normal_side_for(c) for c in cuentas}, saldos)
+    if arbol is None:
+        arbol = cache_reportes.cache.obtener(empresa_id, "arbol", desde=desde_s, hasta=hasta_s)
+    rubro, subrubro = request.args.get("rubro"), request.args.get("subrubro")
+    nodo = dict(nivel="total", importe=arbol["importe"], cuentas=arbol["cuentas"])
+    if rubro is None:
+        hijos = [
+            dict(nivel="rubro", rubro=r["rubro"], cod_rubro=r["cod_rubro"], importe=r["importe"],
+                 cuentas=r["cuentas"], abrir=dict(rubro=r["rubro"]))
+            for r in arbol["rubros"]
+        ]
+        return jsonify(dict(nodo=nodo, hijos=hijos))
+    r = next((x for x in arbol["rubros"] if x["rubro"].strip().upper() == rubro.strip().upper()), None)
+    if r is None:
+        abort(404, description="Rubro no encontrado")
+    nodo = dict(nivel="rubro", rubro=r["rubro"], cod_rubro=r["cod_rubro"], importe=r["importe"], cuentas=r["cuentas"])
+    if subrubro is None:
+        hijos = [
+            dict(nivel="subrubro", rubro=r["rubro"], subrubro=sub["subrubro"], cod_subrubro=sub["cod_subrubro"],
+                 importe=sub["importe"], cuentas=len(sub["cuentas"]), abrir=dict(rubro=r["rubro"], subrubro=sub["subrubro"]))
+            for sub in r["subrubros"]
+        ]
+        return jsonify(dict(nodo=nodo, hijos=hijos))
+    sub = next((x for x in r["subrubros"] if x["subrubro"].strip().upper() == subrubro.strip().upper()), None)
+    if sub is None:
+        abort(404, description="Subrubro no encontrado")
+    nodo = dict(nivel="subrubro", rubro=r["rubro"], subrubro=sub["subrubro"], cod_subrubro=sub["cod_subrubro"],
+                importe=sub["importe"], cuentas=len(sub["cuentas"]))
+    hijos = [dict(c, nivel="cuenta", mayor=dict(cuenta=c["id_cuenta"])) for c in sub["cuentas"]]
+    return jsonify(dict(nodo=nodo, hijos=hijos))
+
+def _arbol_datos(empresa_id: int, desde=None, hasta=None) -> dict:
+    libro = libro_residente.obtener(empresa_id)
+    cuentas = _cuentas_reporte(empresa_id, libro)
+    nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
+    _rango(desde, hasta)
+    saldos = _saldos_reporte(consultas.renglones(empresa_id, desde, hasta), empresa_id, desde, hasta, cuentas, nb_map, libro)
+    return _arbol_de(cuentas, nb_map, saldos)
+
 @bp.get("/api/indices")
 @login_required
+@admision.limitar("reporte", _empresa_actual_from_request)
 def api_indices():
     empresa_id = _empresa_actual_from_request()
-    cuentas = PlanCuenta.query.filter_by(id_empresa=empresa_id).all()
+    comp = estados_materializados.indices(empresa_id)
+    if comp is not None:
+        return jsonify(_indices_de(comp))
+    return jsonify(cache_reportes.cache.obtener(empresa_id, "indices"))
+
+def _indices_datos(empresa_id: int) -> dict:
+    libro = libro_residente.obtener(empresa_id)
+    cuentas = _cuentas_reporte(empresa_id, libro)
     nb_map = {c.id_cuenta: _normal_side_for(c) for c in cuentas}
     txt_map = {c.id_cuenta: (" ".join(filter(None, [c.rubro, c.subrubro])).lower()) for c in cuentas}
-    from decimal import Decimal
-    saldos = {c.id_cuenta: Decimal("0") for c in cuentas}
-    dets = (
-        db.session.query(DetalleAsiento, Asiento)
-        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
-        .filter(Asiento.id_empresa == empresa_id)
-        .all()
-    )
-    for d, a in dets:
-        nb = nb_map.get(d.id_cuenta, "D")
-        if d.tipo == "debe":
-            saldos[d.id_cuenta] += (d.importe if nb == "D" else -d.importe)
-        else:
-            saldos[d.id_cuenta] += (d.importe if nb == "H" else -d.importe)
+    saldos = _saldos_reporte(consultas.renglones(empresa_id), empresa_id, None, None, cuentas, nb_map, libro)
+    return _indices_de(_componentes_indices(cuentas, nb_map, txt_map, saldos))
+
+def _componentes_indices(cuentas, nb_map, txt_map, saldos) -> dict:
+    """Sumas (Decimal) por clasificación con las que se calculan los índices."""
     # Clasificaciones
     def is_activo_corriente(txt):
         keys = ["corriente", "caja", "banco", "bancos", "efectivo", "clientes", "inventario", "existencias"]
@@ -797,17 +1591,33 @@ def api_indices():
             if "costo" in txt:
                 costo_ventas += val
     utilidad = ventas + gastos
+    return dict(activo_corriente=ac, pasivo_corriente=pc, activo=a_tot, pasivo=p_tot, patrimonio=pat, ventas=ventas, utilidad=utilidad, costo_ventas=costo_ventas)
+
+def _indices_de(comp: dict) -> dict:
     def safe_div(n, d):
         try:
             return float(n) / float(d) if float(d) != 0.0 else None
         except Exception:
             return None
     data = dict(
-        liquidez=safe_div(ac, pc),
-        solvencia=safe_div(a_tot, p_tot),
-        endeudamiento=safe_div(p_tot, pat),
-        costo_ventas=safe_div(costo_ventas, ventas),
-        roi=safe_div(utilidad, pat),
-        componentes=dict(activo_corriente=float(ac), pasivo_corriente=float(pc), activo=float(a_tot), pasivo=float(p_tot), patrimonio=float(pat), ventas=float(ventas), utilidad=float(utilidad), costo_ventas=float(costo_ventas))
+        liquidez=safe_div(comp["activo_corriente"], comp["pasivo_corriente"]),
+        solvencia=safe_div(comp["activo"], comp["pasivo"]),
+        endeudamiento=safe_div(comp["pasivo"], comp["patrimonio"]),
+        costo_ventas=safe_div(comp["costo_ventas"], comp["ventas"]),
+        roi=safe_div(comp["utilidad"], comp["patrimonio"]),
+        componentes={k: float(comp[k]) for k in ("activo_corriente", "pasivo_corriente", "activo", "pasivo", "patrimonio", "ventas", "utilidad", "costo_ventas")}
     )
-    return jsonify(data)
+    return data
+
+def _derivados_estados(cuentas, nb_map, saldos):
+    """Para estados_materializados: (filas del estado patrimonial, componentes de los índices)."""
+    txt_map = {c.id_cuenta: (" ".join(filter(None, [c.rubro, c.subrubro])).lower()) for c in cuentas}
+    return _patrimonial_de(cuentas, nb_map, saldos), _componentes_indices(cuentas, nb_map, txt_map, saldos)
+
+# Cálculos que sirve y precalienta la caché de reportes
+cache_reportes.registrar("mayor", _mayor_datos)
+cache_reportes.registrar("balance", _balance_datos)
+cache_reportes.registrar("estados", _estados_datos)
+cache_reportes.registrar("indices", _indices_datos)
+cache_reportes.registrar("arbol", _arbol_datos)
+estados_materializados.registrar(_normal_side_for, _derivados_estados)
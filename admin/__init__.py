@@ -1,7 +1,159 @@
-from flask import Blueprint, render_template
+import json
+import os
+from datetime import date, datetime, timedelta
+from io import BytesIO
+
+from flask import Blueprint, render_template, request, abort, jsonify, send_file
+from sqlalchemy import and_, or_
+
+from models import db, ChangeLog, Usuario
+from services import admision, auditoria, coalescencia, perfilador
+from services.security import roles_required
 
 bp = Blueprint("admin", __name__, url_prefix="/admin")
 
 @bp.route("/")
 def index():
     return render_template("admin/index.html")
+
+def _parse_ts(valor: str, fin: bool = False):
+    """Acepta YYYY-MM-DD o ISO completo; un 'hasta' de solo fecha incluye todo ese día."""
+    try:
+        if len(valor) == 10:
+            d = datetime.combine(date.fromisoformat(valor), datetime.min.time())
+            return d + timedelta(days=1) if fin else d
+        return datetime.fromisoformat(valor)
+    except ValueError:
+        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD o ISO 8601")
+
+@bp.get("/api/auditoria")
+@roles_required("admin", "docente")
+def api_auditoria():
+    """Bitácora paginada por cursor (ts, id) descendente.
+    Filtros: entidad, usuario, empresa, desde, hasta, limite, cursor.
+    Lee lo ya volcado a change_log; lo confirmado en este worker que sigue en
+    la cola se vuelca en segundo plano y se informa en 'pendientes'.
+    """
+    pendientes = auditoria.escritor.apurar()
+
+    limite = min(max(request.args.get("limite", 50, type=int), 1), 500)
+    q = db.session.query(ChangeLog, Usuario.nombre).outerjoin(Usuario, Usuario.id == ChangeLog.id_usuario)
+    if request.args.get("entidad"):
+        q = q.filter(ChangeLog.entidad == request.args["entidad"])
+    if request.args.get("usuario"):
+        q = q.filter(ChangeLog.id_usuario == request.args.get("usuario", type=int))
+    if request.args.get("empresa"):
+        q = q.filter(ChangeLog.id_empresa == request.args.get("empresa", type=int))
+    if request.args.get("desde"):
+        q = q.filter(ChangeLog.ts >= _parse_ts(request.args["desde"]))
+    if request.args.get("hasta"):
+        q = q.filter(ChangeLog.ts < _parse_ts(request.args["hasta"], fin=True))
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            ts_s, id_s = cursor.rsplit("_", 1)
+            c_ts, c_id = datetime.fromisoformat(ts_s), int(id_s)
+        except ValueError:
+            abort(400, description="Cursor inválido")
+        q = q.filter(or_(ChangeLog.ts < c_ts, and_(ChangeLog.ts == c_ts, ChangeLog.id < c_id)))
+    filas = q.order_by(ChangeLog.ts.desc(), ChangeLog.id.desc()).limit(limite + 1).all()
+
+    items = []
+    for log, nombre in filas[:limite]:
+        try:
+            datos = json.loads(log.datos) if log.datos else None
+        except ValueError:
+            datos = log.datos  # registros viejos armados a mano
+        items.append(dict(
+            id=log.id,
+            entidad=log.entidad,
+            id_entidad=log.id_entidad,
+            accion=log.accion,
+            id_usuario=log.id_usuario,
+            usuario=nombre,
+            id_empresa=log.id_empresa,
+            ts=log.ts.isoformat(),
+            datos=datos,
+        ))
+    siguiente = None
+    if len(filas) > limite:
+        ultimo = filas[limite - 1][0]
+        siguiente = f"{ultimo.ts.isoformat()}_{ultimo.id}"
+    return jsonify(dict(items=items, siguiente=siguiente, pendientes=pendientes))
+
+@bp.get("/api/carga")
+@roles_required("admin")
+def api_carga():
+    """Métricas de este worker: control de admisión y cálculos compartidos por reporte."""
+    return jsonify(dict(
+        pid=os.getpid(),
+        admision=admision.admision.estado(),
+        coalescencia=coalescencia.coalescedor.estado(),
+    ))
+
+def _perfilador_activo():
+    if not perfilador.perfilador.activo:
+        abort(404, description="Perfilador apagado (PERFILADOR=false)")
+
+@bp.get("/api/perfilador")
+@roles_required("admin")
+def api_perfilador():
+    """Captura armada (compartida por los workers) y capturas guardadas."""
+    _perfilador_activo()
+    return jsonify(dict(perfilador.perfilador.estado(), capturas=perfilador.perfilador.capturas()))
+
+@bp.post("/api/perfilador")
+@roles_required("admin")
+def api_perfilador_armar():
+    """Arma una captura: {endpoint, empresa, cantidad, tasa, formato: colapsado|pstats, minutos}.
+    Reemplaza a la que hubiera armada.
+    """
+    _perfilador_activo()
+    payload = request.get_json(silent=True) or {}
+    try:
+        empresa = payload.get("empresa")
+        captura = perfilador.perfilador.armar(
+            endpoint=(payload.get("endpoint") or "").strip() or None,
+            empresa=int(empresa) if empresa not in (None, "") else None,
+            cantidad=int(payload.get("cantidad", 10)),
+            tasa=float(payload.get("tasa", 1)),
+            formato=payload.get("formato") or "colapsado",
+            minutos=float(payload.get("minutos", 10)),
+        )
+    except (TypeError, ValueError) as e:
+        abort(400, description=str(e))
+    return jsonify(captura), 201
+
+@bp.delete("/api/perfilador")
+@roles_required("admin")
+def api_perfilador_desarmar():
+    _perfilador_activo()
+    return jsonify(dict(desarmado=perfilador.perfilador.desarmar()))
+
+@bp.get("/api/perfilador/<id_captura>")
+@roles_required("admin")
+def api_perfilador_captura(id_captura):
+    """Pedidos de una captura; con ?descargar=1 el perfil sumado (o ?archivo= uno solo):
+    texto colapsado (flamegraph.pl, speedscope) o pstats (python -m pstats, snakeviz).
+    """
+    _perfilador_activo()
+    if not request.args.get("descargar") and not request.args.get("archivo"):
+        pedidos = perfilador.perfilador.detalle(id_captura)
+        if not pedidos:
+            abort(404, description="Captura inexistente")
+        return jsonify(dict(id=id_captura, pedidos=pedidos))
+    res = perfilador.perfilador.exportar(id_captura, request.args.get("archivo"))
+    if res is None:
+        abort(404, description="Captura inexistente")
+    contenido, formato = res
+    if formato == "pstats":
+        return send_file(BytesIO(contenido), mimetype="application/octet-stream", as_attachment=True,
+                         download_name=f"perfil-{id_captura}.prof")
+    return send_file(BytesIO(contenido), mimetype="text/plain", as_attachment=True,
+                     download_name=f"perfil-{id_captura}.folded")
+
+@bp.delete("/api/perfilador/<id_captura>")
+@roles_required("admin")
+def api_perfilador_borrar(id_captura):
+    _perfilador_activo()
+    return jsonify(dict(borrados=perfilador.perfilador.borrar(id_captura)))
@@ -1,5 +1,8 @@
 # app.py
-from flask import Flask, render_template, session, g, current_app
+import importlib
+
+import click
+from flask import Flask, render_template, session, g, current_app, request
 from flask_wtf import CSRFProtect
 from flask_wtf.csrf import generate_csrf
 from config import Config
@@ -29,8 +32,30 @@ except Exception as e:
     print("[INFO] reports blueprint no disponible:", e)
     reports_bp = None
 
+# Servicios con init_app, en orden de arranque. Como los blueprints opcionales:
+# si a alguno le falta una dependencia (p. ej. numpy) la app arranca sin él.
+SERVICIOS = (
+    "auditoria", "busqueda_cuentas", "busqueda_asientos", "sse", "bus_libro", "archivo",
+    "cache_reportes", "libro_residente", "estados_materializados", "admision", "perfilador",
+)
+servicios = {}
+for _nombre in SERVICIOS:
+    try:
+        servicios[_nombre] = importlib.import_module(f"services.{_nombre}")
+    except Exception as e:
+        print(f"[INFO] servicio {_nombre} no disponible:", e)
+
 csrf = CSRFProtect()
 
+# GET de /accounting/api que pueden leer de la réplica (además del blueprint de reportes).
+# La búsqueda de asientos (índice FTS solo en el primario), /api/changes y /api/stream
+# (versiones y deltas: una réplica atrasada haría saltear cambios) quedan en el primario.
+LECTURAS_REPLICA = frozenset({
+    "accounting.api_cuentas_list", "accounting.api_mayor", "accounting.api_balance",
+    "accounting.api_estado_patrimonial", "accounting.api_estados", "accounting.api_arbol",
+    "accounting.api_indices",
+})
+
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -41,6 +66,10 @@ def create_app():
     with app.app_context():
         db.create_all()
 
+    # Bitácora en lotes, índices de búsqueda, SSE, bus entre workers, cachés, admisión, perfilador
+    for servicio in servicios.values():
+        servicio.init_app(app)
+
     # OAuth (Google)
     init_oauth(app)
 
@@ -53,6 +82,13 @@ def create_app():
             # Evita warning de SQLAlchemy 2.x
             g.user = db.session.get(Usuario, uid)
 
+    # Lecturas de reportes a la réplica (si está configurada)
+    @app.before_request
+    def route_reads():
+        g.db_replica = request.method == "GET" and (
+            request.blueprint == "reports" or request.endpoint in LECTURAS_REPLICA
+        )
+
     # Variables globales para Jinja (en todas las plantillas)
     @app.context_processor
     def inject_globals():
@@ -81,6 +117,103 @@ def create_app():
     if reports_bp:
         app.register_blueprint(reports_bp)
 
+    # Migración única al plan de cuentas compartido: flask --app app migrar-plan
+    @app.cli.command("migrar-plan")
+    def migrar_plan():
+        from services.plan import migrar_a_plan_compartido
+        print("Plan compartido:", migrar_a_plan_compartido())
+
+    # Archivo columnar de ejercicios cerrados: flask --app app archivar-ejercicios --empresa ID [--hasta YYYY-MM-DD]
+    @app.cli.command("archivar-ejercicios")
+    @click.option("--empresa", type=int, required=True)
+    @click.option("--hasta", default=None, help="Archiva los ejercicios cerrados hasta esta fecha (por defecto todos)")
+    def archivar_ejercicios(empresa, hasta):
+        from datetime import date
+        from models import CierreEjercicio
+        from services import archivo
+        q = CierreEjercicio.query.filter(CierreEjercicio.id_empresa == empresa, CierreEjercicio.archivado.is_(None))
+        if hasta:
+            q = q.filter(CierreEjercicio.fecha_cierre <= date.fromisoformat(hasta))
+        for cierre in q.order_by(CierreEjercicio.fecha_cierre.asc()).all():
+            try:
+                m = archivo.archivar(cierre)
+                db.session.commit()
+            except archivo.ErrorArchivo as e:
+                db.session.rollback()
+                raise click.ClickException(f"{cierre.fecha_cierre}: {e}")
+            print(f"Archivado al {m['hasta']}: {m['asientos']} asientos, {m['renglones']} renglones")
+
+    # Saldos acumulados por día (tras migrar o ante dudas): flask --app app recalcular-saldos-diarios [--empresa ID] [--verificar]
+    @app.cli.command("recalcular-saldos-diarios")
+    @click.option("--empresa", type=int, default=None)
+    @click.option("--verificar", is_flag=True, help="Solo compara con un recálculo completo")
+    def recalcular_saldos_diarios(empresa, verificar):
+        from models import Empresa
+        from services import saldos_diarios
+        ids = [empresa] if empresa else [e.id_empresa for e in Empresa.query.order_by(Empresa.id_empresa)]
+        errores = 0
+        for id_empresa in ids:
+            if verificar:
+                difs = saldos_diarios.verificar(id_empresa)
+                errores += bool(difs)
+                print(f"Empresa {id_empresa}: " + ("; ".join(difs) if difs else "ok"))
+            else:
+                filas = saldos_diarios.reconstruir(id_empresa)
+                db.session.commit()
+                print(f"Empresa {id_empresa}: {filas} saldos diarios")
+        if errores:
+            raise click.ClickException(f"{errores} empresa(s) con diferencias")
+
+    # Precalentado de reportes (cron, p. ej. antes de clase): flask --app app precalentar-reportes [--empresa ID] [--dias 7]
+    @app.cli.command("precalentar-reportes")
+    @click.option("--empresa", type=int, default=None)
+    @click.option("--dias", type=int, default=7, help="Empresas con cambios en los últimos N días")
+    def precalentar_reportes(empresa, dias):
+        from services import cache_reportes
+        ids = [empresa] if empresa else cache_reportes.empresas_activas(dias)
+        for id_empresa in ids:
+            hechos = cache_reportes.cache.precalentar(id_empresa, cache_reportes.cuentas_recientes(id_empresa))
+            print(f"Empresa {id_empresa}: {hechos} reportes calculados")
+
+    # Estados materializados (tras migrar o ante dudas): flask --app app recalcular-estados [--empresa ID] [--verificar]
+    @app.cli.command("recalcular-estados")
+    @click.option("--empresa", type=int, default=None)
+    @click.option("--verificar", is_flag=True, help="Solo compara con un recálculo completo")
+    def recalcular_estados(empresa, verificar):
+        from models import Empresa
+        from services import estados_materializados
+        ids = [empresa] if empresa else [e.id_empresa for e in Empresa.query.order_by(Empresa.id_empresa)]
+        errores = 0
+        for id_empresa in ids:
+            if verificar:
+                difs = estados_materializados.verificar(id_empresa)
+                errores += bool(difs)
+                print(f"Empresa {id_empresa}: " + ("; ".join(difs) if difs else "ok"))
+            else:
+                cuentas = estados_materializados.reconstruir(id_empresa)
+                db.session.commit()
+                print(f"Empresa {id_empresa}: {cuentas} cuentas")
+        if errores:
+            raise click.ClickException(f"{errores} empresa(s) con diferencias")
+
+    # Contabilización de transacciones pendientes: flask --app app contabilizar-transacciones --empresa ID [--hasta YYYY-MM-DD]
+    @app.cli.command("contabilizar-transacciones")
+    @click.option("--empresa", type=int, required=True)
+    @click.option("--hasta", default=None, help="Solo transacciones con fecha hasta este día")
+    def contabilizar_transacciones(empresa, hasta):
+        from datetime import date
+        from services import transacciones
+        hasta = date.fromisoformat(hasta) if hasta else None
+        total = errores = 0
+        while True:
+            r = transacciones.contabilizar(empresa, hasta=hasta)
+            db.session.commit()
+            total += r["asientos"]
+            errores += len(r["errores"])
+            if not r["quedan"] or not (r["asientos"] or r["errores"]):
+                break
+        print(f"Empresa {empresa}: {total} asientos, {errores} con error")
+
     # Diagnóstico en consola
     print("BLUEPRINTS cargados:", list(app.blueprints.keys()))
     return app
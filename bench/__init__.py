@@ -0,0 +1,6 @@
+# bench/__init__.py
+"""
+Benchmarks de los cálculos del libro, sin base de datos.
+
+    python -m bench.saldos [renglones] [cuentas]
+"""
@@ -0,0 +1,161 @@
+# bench/saldos.py
+"""
+Benchmark del balance de sumas y saldos de punta a punta: de la consulta a la
+base hasta el JSON de la respuesta.
+
+    python -m bench.saldos [renglones] [cuentas]
+
+Crea una base SQLite temporal (nunca usa DATABASE_URL), carga una empresa con
+renglones sintéticos y mide tres caminos:
+
+- Decimal: lo que hacía api_balance antes del motor vectorizado (carga los
+  objetos DetalleAsiento/Asiento y suma Decimal renglón por renglón);
+- consulta: _balance_datos sin libro residente (SELECT de centavos con signo
+  reducido con services/agregados.py);
+- residente: _balance_datos con el libro residente ya cargado.
+
+Antes de informar tiempos verifica que los tres JSON sean idénticos.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+_DIR = tempfile.mkdtemp(prefix="bench-saldos-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DIR}/bench.db"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+for variable, sub in (
+    ("AUDITORIA_WAL_DIR", "auditoria"),
+    ("BUS_LIBRO_ARCHIVO", "bus_libro.mmap"),
+    ("ARCHIVO_DIR", "archivo"),
+    ("REPORTES_CACHE_DIR", "cache_reportes"),
+    ("PERFILADOR_DIR", "perfiles"),
+):
+    os.environ[variable] = os.path.join(_DIR, sub)
+os.environ["REPORTES_PRECALENTAR"] = "false"
+
+from sqlalchemy import insert  # noqa: E402
+
+import accounting  # noqa: E402
+from app import app  # noqa: E402
+from models import db, Asiento, DetalleAsiento, Empresa, PlanCuenta, Rol, Usuario  # noqa: E402
+from services import libro_residente, plan  # noqa: E402
+
+RUBROS = (("1", "ACTIVO"), ("2", "PASIVO"), ("3", "PATRIMONIO NETO"), ("4", "INGRESOS"), ("5", "GASTOS"))
+
+
+def cargar_empresa(n_renglones: int, n_cuentas: int, seed: int = 7) -> int:
+    """Empresa con n_cuentas propias y asientos de dos renglones hasta sumar n_renglones."""
+    rnd = random.Random(seed)
+    u = Usuario(nombre="Bench", correo="bench@bench.test", rol=Rol.dueno)
+    db.session.add(u)
+    db.session.flush()
+    e = Empresa(nombre="Bench SA", id_gerente=u.id)
+    db.session.add(e)
+    db.session.flush()
+    for i in range(n_cuentas):
+        cod, rubro = RUBROS[i % len(RUBROS)]
+        db.session.add(PlanCuenta(id_empresa=e.id_empresa, cod_rubro=cod, rubro=rubro,
+                                  cod_subrubro=f"{cod}.1", subrubro=rubro, cuenta=f"CUENTA {i:04d}"))
+    db.session.flush()
+    ids = [c.id_cuenta for c in PlanCuenta.query.filter_by(id_empresa=e.id_empresa)]
+
+    inicio = date(2024, 1, 1)
+    n_asientos = n_renglones // 2
+    db.session.execute(insert(Asiento), [
+        dict(id_asiento=i + 1, id_empresa=e.id_empresa, num_asiento=i + 1, id_usuario=u.id, leyenda="bench",
+             fecha=inicio + timedelta(days=rnd.randint(0, 364)))
+        for i in range(n_asientos)
+    ])
+    detalles = []
+    for i in range(n_asientos):
+        debe, haber = rnd.sample(ids, 2)
+        importe = Decimal(rnd.randint(1, 10_000_000)) / 100
+        detalles.append(dict(id_asiento=i + 1, id_cuenta=debe, tipo="debe", importe=importe))
+        detalles.append(dict(id_asiento=i + 1, id_cuenta=haber, tipo="haber", importe=importe))
+    db.session.execute(insert(DetalleAsiento), detalles)
+    db.session.commit()
+    return e.id_empresa
+
+
+def balance_decimal(empresa_id: int) -> dict:
+    """api_balance antes del motor vectorizado (sin filtros de fecha)."""
+    cuentas = plan.cuentas_de_empresa(empresa_id).all()
+    saldos = {c.id_cuenta: Decimal("0") for c in cuentas}
+    nb_map = {c.id_cuenta: accounting._normal_side_for(c) for c in cuentas}
+    dets = (
+        db.session.query(DetalleAsiento, Asiento)
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .filter(Asiento.id_empresa == empresa_id)
+        .all()
+    )
+    for d, a in dets:
+        nb = nb_map.get(d.id_cuenta, "D")
+        if d.tipo == "debe":
+            saldos[d.id_cuenta] += (d.importe if nb == "D" else -d.importe)
+        else:
+            saldos[d.id_cuenta] += (d.importe if nb == "H" else -d.importe)
+    rows = []
+    td = Decimal("0"); th = Decimal("0")
+    for c in sorted(cuentas, key=lambda x: (x.cuenta or "")):
+        nb = nb_map[c.id_cuenta]
+        saldo = saldos[c.id_cuenta]
+        deudor = saldo if (nb == "D" and saldo >= 0) or (nb == "H" and saldo < 0) else Decimal("0")
+        acreedor = saldo if (nb == "H" and saldo >= 0) or (nb == "D" and saldo < 0) else Decimal("0")
+        if deudor < 0:
+            deudor = -deudor
+        if acreedor < 0:
+            acreedor = -acreedor
+        td += deudor
+        th += acreedor
+        rows.append(dict(id_cuenta=c.id_cuenta, cod_rubro=c.cod_rubro, cuenta=c.cuenta,
+                         deudor=float(deudor), acreedor=float(acreedor)))
+    return dict(rows=rows, total_debe=float(td), total_haber=float(th), cuadra=abs(td - th) < Decimal("0.005"))
+
+
+def medir(fn, repeticiones=3):
+    """Mejor tiempo de fn() -> JSON, con la sesión limpia en cada vuelta."""
+    mejor = None
+    res = None
+    for _ in range(repeticiones):
+        db.session.remove()
+        t0 = time.perf_counter()
+        res = app.json.dumps(fn())
+        dt = time.perf_counter() - t0
+        mejor = dt if mejor is None else min(mejor, dt)
+    return mejor, res
+
+
+def main():
+    n_renglones = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    n_cuentas = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+
+    with app.app_context():
+        db.create_all()
+        empresa_id = cargar_empresa(n_renglones, n_cuentas)
+
+        t_dec, ref = medir(lambda: balance_decimal(empresa_id))
+        almacen, libro_residente.almacen.app = libro_residente.almacen.app, None
+        t_sql, por_consulta = medir(lambda: accounting._balance_datos(empresa_id))
+        libro_residente.almacen.app = almacen
+        t_libro = None
+        if almacen is not None:
+            libro_residente.obtener(empresa_id)  # carga inicial, fuera de la medición
+            t_libro, residente = medir(lambda: accounting._balance_datos(empresa_id))
+            assert residente == ref, "el libro residente difiere del cálculo con Decimal"
+        assert por_consulta == ref, "la consulta vectorizada difiere del cálculo con Decimal"
+
+    print(f"renglones={n_renglones:,} cuentas={n_cuentas} (JSON idénticos al centavo)")
+    print(f"balance  Decimal:   {t_dec * 1000:9.1f} ms")
+    print(f"balance  consulta:  {t_sql * 1000:9.1f} ms  x{t_dec / t_sql:.1f}")
+    if t_libro is not None:
+        print(f"balance  residente: {t_libro * 1000:9.1f} ms  x{t_dec / t_libro:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ from flask import Blueprint, request, redirect, url_for, render_template, g, abo
 from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from models import db, Empresa, Usuario, EmpresaEmpleado, Rol
-from services.plan import clonar_plan_para_empresa  # asegúrate de tener este módulo
+from services.plan import asegurar_plan_compartido
 
 bp = Blueprint("companies", __name__, url_prefix="/companies")
 
@@ -165,10 +165,10 @@ def create_company():
     e = Empresa(nombre=name, id_gerente=g.user.id)
     try:
         db.session.add(e)
-        db.session.flush()  # asegura e.id_empresa para clonar plan
+        db.session.flush()
 
-        # clonar plan de cuentas para esta empresa (si tu servicio lo requiere)
-        clonar_plan_para_empresa(e.id_empresa)
+        # el plan de cuentas es compartido: no se copia nada por empresa
+        asegurar_plan_compartido()
 
         db.session.commit()
         flash("Empresa creada correctamente ✅", "success")
@@ -3,11 +3,99 @@ import os
 from dotenv import load_dotenv, find_dotenv  # pip install python-dotenv (opcional si usás .env)
 load_dotenv(find_dotenv())
 
+
+def _engine_options(url: str) -> dict:
+    """Opciones del engine/pool por worker. SQLite usa su propio pool y no admite tamaños."""
+    opts = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "280")),  # < wait_timeout de MySQL
+    }
+    if not url.startswith("sqlite"):
+        opts.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        )
+    return opts
+
+
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "mysql+pymysql://root:@localhost/sistema_contable")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
+
+    # Réplica de solo lectura (opcional): reportes y GET /accounting/api/* leen de acá
+    DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+    SQLALCHEMY_BINDS = (
+        {"replica": {"url": DATABASE_REPLICA_URL, **_engine_options(DATABASE_REPLICA_URL)}}
+        if DATABASE_REPLICA_URL else {}
+    )
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
 
+    # Bitácora: directorio del WAL (por defecto instance/auditoria)
+    AUDITORIA_WAL_DIR = os.getenv("AUDITORIA_WAL_DIR")
+
+    # Búsqueda de cuentas: índices en memoria por empresa (segundos de vigencia, máximo de empresas)
+    BUSQUEDA_CUENTAS_TTL = int(os.getenv("BUSQUEDA_CUENTAS_TTL", "300"))
+    BUSQUEDA_CUENTAS_MAX_EMPRESAS = int(os.getenv("BUSQUEDA_CUENTAS_MAX_EMPRESAS", "200"))
+
+    # Eventos en vivo (SSE): mensajes en cola por conexión, duración máxima de cada conexión y si se
+    # transmite ("auto": solo con workers gevent o el servidor de desarrollo; "siempre"; "nunca")
+    SSE_COLA_MAX = int(os.getenv("SSE_COLA_MAX", "100"))
+    SSE_DURACION_MAX = int(os.getenv("SSE_DURACION_MAX", "300"))
+    SSE_MODO = os.getenv("SSE_MODO", "auto").lower()
+
+    # Bus de invalidación entre workers (registro compartido por mmap, por defecto instance/bus_libro.mmap)
+    BUS_LIBRO = os.getenv("BUS_LIBRO", "true").lower() in ("1", "true", "yes")
+    BUS_LIBRO_ARCHIVO = os.getenv("BUS_LIBRO_ARCHIVO")
+    BUS_LIBRO_INTERVALO = float(os.getenv("BUS_LIBRO_INTERVALO", "0.1"))
+    BUS_LIBRO_INTERVALO_MAX = float(os.getenv("BUS_LIBRO_INTERVALO_MAX", "0.5"))
+
+    # Archivo columnar de ejercicios cerrados (por defecto instance/archivo)
+    ARCHIVO_DIR = os.getenv("ARCHIVO_DIR")
+
+    # Caché de reportes por versión del libro (por defecto instance/cache_reportes; archivos por empresa) y precalentado:
+    # segundos sin cambios antes de recalcular, tope de espera y horas previas a cada turno de clase
+    REPORTES_CACHE_DIR = os.getenv("REPORTES_CACHE_DIR")
+    REPORTES_CACHE_ARCHIVOS = int(os.getenv("REPORTES_CACHE_ARCHIVOS", "200"))
+    REPORTES_PRECALENTAR = os.getenv("REPORTES_PRECALENTAR", "true").lower() in ("1", "true", "yes")
+    REPORTES_DEBOUNCE = float(os.getenv("REPORTES_DEBOUNCE", "2"))
+    REPORTES_DEBOUNCE_MAX = float(os.getenv("REPORTES_DEBOUNCE_MAX", "30"))
+    REPORTES_PRECALENTAR_HORAS = os.getenv("REPORTES_PRECALENTAR_HORAS", "07:30,13:30").split(",")
+    REPORTES_HILOS = int(os.getenv("REPORTES_HILOS", "2"))
+
+    # Libro residente en memoria por empresa para los reportes: presupuesto total en MB
+    LIBRO_RESIDENTE = os.getenv("LIBRO_RESIDENTE", "true").lower() in ("1", "true", "yes")
+    LIBRO_MEMORIA_MB = float(os.getenv("LIBRO_MEMORIA_MB", "256"))
+
+    # Estados patrimonial, de resultados, de fondos e índices mantenidos en tablas por cada cambio
+    ESTADOS_MATERIALIZADOS = os.getenv("ESTADOS_MATERIALIZADOS", "true").lower() in ("1", "true", "yes")
+    # Reconstrucción completa tras cambios del plan o cierres: segundos sin cambios y tope de espera
+    ESTADOS_DEBOUNCE = float(os.getenv("ESTADOS_DEBOUNCE", "1"))
+    ESTADOS_DEBOUNCE_MAX = float(os.getenv("ESTADOS_DEBOUNCE_MAX", "10"))
+
+    # Control de admisión por proceso para reportes y exportaciones: lugares simultáneos, cola y espera máxima (s)
+    ADMISION = os.getenv("ADMISION", "true").lower() in ("1", "true", "yes")
+    ADMISION_CLASES = {
+        "reporte": dict(
+            limite=int(os.getenv("ADMISION_REPORTES", "4")),
+            cola=int(os.getenv("ADMISION_REPORTES_COLA", "16")),
+            espera=float(os.getenv("ADMISION_ESPERA", "10")),
+        ),
+        "exportacion": dict(
+            limite=int(os.getenv("ADMISION_EXPORTACIONES", "1")),
+            cola=int(os.getenv("ADMISION_EXPORTACIONES_COLA", "4")),
+            espera=float(os.getenv("ADMISION_ESPERA", "10")),
+        ),
+    }
+
+    # Perfilado a pedido desde /admin/api/perfilador: directorio de capturas (por defecto instance/perfiles),
+    # intervalo de muestreo y cada cuántos segundos cada worker mira si hay una captura armada
+    PERFILADOR = os.getenv("PERFILADOR", "true").lower() in ("1", "true", "yes")
+    PERFILADOR_DIR = os.getenv("PERFILADOR_DIR")
+    PERFILADOR_INTERVALO = float(os.getenv("PERFILADOR_INTERVALO", "0.005"))
+    PERFILADOR_REVISAR = float(os.getenv("PERFILADOR_REVISAR", "1"))
+
     # ❌ NO hardcodear secretos
     OAUTH_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
     OAUTH_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
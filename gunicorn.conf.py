@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+"""
+Configuración de producción; gunicorn la lee sola al correr `gunicorn app:app`
+desde la raíz del proyecto.
+
+Workers gevent: cada conexión de /accounting/api/stream es un greenlet que
+espera en su Condition sin ocupar el worker. Con otra clase de worker (`-k
+sync`, `-k gthread`) el endpoint no transmite y el navegador pasa a consultar
+/api/changes cada tanto (ver services/sse.py).
+"""
+import os
+
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_connections = int(os.getenv("GUNICORN_CONEXIONES", "1000"))
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
@@ -0,0 +1,8 @@
+# loadtest/__init__.py
+"""
+Prueba de carga con mezcla de operaciones y usuarios concurrentes.
+
+    python -m loadtest [--escenario clase] [--url http://127.0.0.1:8000] [--duracion 60] [--escala 1]
+
+Ver loadtest/carga.py.
+"""
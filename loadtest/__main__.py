@@ -0,0 +1,5 @@
+import sys
+
+from loadtest.carga import main
+
+sys.exit(main())
@@ -0,0 +1,452 @@
+# loadtest/carga.py
+"""
+Arnés de carga: usuarios simulados concurrentes con una mezcla de operaciones.
+
+Cada escenario (loadtest/escenarios.json) define perfiles con cantidad de
+usuarios, pausa entre pedidos (segundos, al azar en [min, max]) y la mezcla de
+operaciones con su peso:
+
+- alumno: dueño de su propia empresa de práctica; es el único que carga asientos.
+- empleado: afiliado a una de esas empresas; lee reportes y exporta el diario.
+- docente: recorre los reportes de cualquier empresa con ?empresa=ID.
+
+Operaciones: crear_asiento, listar_asientos, mayor, balance, estados, arbol,
+exportar_diario.
+
+Antes de correr se preparan (si no existen) los usuarios *@carga.local, una
+empresa "Carga N" por alumno y 'historia' asientos por empresa, contabilizados
+en lote con services/transacciones. La base se indica siempre a mano
+(--database o LOADTEST_DATABASE_URL, nunca la DATABASE_URL de la aplicación) y
+solo se aceptan un SQLite local o una base cuyo nombre diga que es de prueba
+(test, prueba o carga). Los usuarios que ya existen no cambian de rol: si
+alguno tiene otro, la preparación se corta.
+
+Dos modos:
+- sin --url: la aplicación corre en este proceso (cliente de pruebas de Flask,
+  un hilo por usuario), con la base local;
+- con --url: pedidos HTTP a una instancia ya levantada (p. ej. gunicorn) que
+  use esa misma base y la misma SECRET_KEY; la cookie de sesión y el token CSRF
+  de cada usuario se firman acá.
+
+El informe da, por operación, pedidos, pedidos por segundo, porcentaje de
+errores (5xx, 4xx que no son 429, y fallas de conexión), rechazos del control
+de admisión (429) y latencias p50/p95/p99; las esperas por bloqueos de la base
+(InnoDB, solo MySQL) y las métricas de /admin/api/carga del worker que atendió.
+Con umbrales (loadtest/umbrales.json) sale con código 1 si alguno no se cumple.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(AQUI))
+
+OPERACIONES = ("crear_asiento", "listar_asientos", "mayor", "balance", "estados", "arbol", "exportar_diario")
+DOMINIO = "carga.local"
+MARCAS_DE_PRUEBA = ("test", "prueba", "carga")
+
+
+def base_de_prueba(url: str) -> bool:
+    """True si la base es un SQLite local o su nombre la marca como de prueba."""
+    from sqlalchemy.engine import make_url
+    u = make_url(url)
+    if u.get_backend_name() == "sqlite":
+        return True
+    nombre = (u.database or "").lower()
+    return any(marca in nombre for marca in MARCAS_DE_PRUEBA)
+
+
+# --- preparación de datos ---
+def _usuario(correo: str, nombre: str, rol):
+    from models import db, Usuario
+    u = Usuario.query.filter_by(correo=correo).first()
+    if u is None:
+        u = Usuario(nombre=nombre, correo=correo, rol=rol)
+        db.session.add(u)
+        db.session.flush()
+    elif u.rol != rol:
+        raise ValueError(f"{correo} ya existe con rol {u.rol.value} (se esperaba {rol.value}); no se cambian roles")
+    return u
+
+
+def _cuentas_visibles(empresa_id: int) -> list:
+    """Ids de cuentas de la empresa; si el plan compartido está vacío crea un plan mínimo propio."""
+    from models import db, PlanCuenta
+    from services import plan
+    ids = [c.id_cuenta for c in plan.cuentas_de_empresa(empresa_id).all()]
+    if len(ids) >= 4:
+        return ids
+    for cod, rubro, cod_sub, subrubro, cuenta in (
+        ("1", "ACTIVO", "1.1", "ACTIVO CORRIENTE", "CAJA"), ("1", "ACTIVO", "1.1", "ACTIVO CORRIENTE", "BANCOS"),
+        ("2", "PASIVO", "2.1", "PASIVO CORRIENTE", "PROVEEDORES"), ("3", "PATRIMONIO", "3.1", "PATRIMONIO NETO", "CAPITAL"),
+        ("4", "RESULTADO", "4.1", "INGRESOS", "VENTAS"), ("5", "RESULTADO", "5.1", "EGRESOS", "COSTO DE VENTAS"),
+    ):
+        db.session.add(PlanCuenta(id_empresa=empresa_id, cod_rubro=cod, rubro=rubro, cod_subrubro=cod_sub,
+                                  subrubro=subrubro, cuenta=cuenta))
+    db.session.flush()
+    return [c.id_cuenta for c in plan.cuentas_de_empresa(empresa_id).all()]
+
+
+def _historia(empresa_id: int, cuentas: list, cantidad: int, rnd: random.Random):
+    """Completa 'cantidad' asientos del año en curso con el motor de transacciones."""
+    from sqlalchemy import func, insert
+    from models import db, Asiento, MapeoTransaccion, Transaccion
+    from services import transacciones
+    faltan = cantidad - (db.session.query(func.count(Asiento.id_asiento)).filter_by(id_empresa=empresa_id).scalar() or 0)
+    if faltan <= 0:
+        return
+    if not MapeoTransaccion.query.filter_by(id_empresa=empresa_id).first():
+        db.session.add_all([
+            MapeoTransaccion(id_empresa=empresa_id, tipo="ingreso", condicion=None,
+                             id_cuenta_debe=cuentas[0], id_cuenta_haber=cuentas[-1]),
+            MapeoTransaccion(id_empresa=empresa_id, tipo="egreso", condicion=None,
+                             id_cuenta_debe=cuentas[-2], id_cuenta_haber=cuentas[1]),
+        ])
+    hoy = date.today()
+    dias = max((hoy - date(hoy.year, 1, 1)).days, 1)
+    db.session.execute(insert(Transaccion), [
+        dict(id_empresa=empresa_id, tipo=rnd.choice(transacciones.TIPOS), estado="pendiente",
+             fecha=date(hoy.year, 1, 1) + timedelta(days=rnd.randrange(dias)),
+             importe=Decimal(rnd.randint(100, 5_000_00)) / 100, contacto="carga", doc_respaldatorio="carga")
+        for _ in range(faltan)
+    ])
+    while transacciones.contabilizar(empresa_id)["quedan"]:
+        db.session.commit()
+    db.session.commit()
+
+
+def preparar(app, perfiles: dict, historia: int, semilla: int = 1) -> dict:
+    """Usuarios, empresas e historia del escenario; devuelve quién es quién."""
+    from models import db, Empresa, EmpresaEmpleado, Rol
+    rnd = random.Random(semilla)
+    n_alumnos = max(perfiles.get("alumno", {}).get("usuarios", 0), 1)
+    with app.app_context():
+        alumnos, empresas, cuentas = [], [], {}
+        for i in range(n_alumnos):
+            u = _usuario(f"alumno{i}@{DOMINIO}", f"Alumno {i}", Rol.dueno)
+            e = Empresa.query.filter_by(id_gerente=u.id).first()
+            if e is None:
+                e = Empresa(nombre=f"Carga {i}", id_gerente=u.id)
+                db.session.add(e)
+                db.session.flush()
+            cuentas[e.id_empresa] = _cuentas_visibles(e.id_empresa)
+            alumnos.append((u.id, e.id_empresa))
+            empresas.append(e.id_empresa)
+        empleados = []
+        for i in range(perfiles.get("empleado", {}).get("usuarios", 0)):
+            u = _usuario(f"empleado{i}@{DOMINIO}", f"Empleado {i}", Rol.empleado)
+            rel = EmpresaEmpleado.query.filter_by(id_usuario=u.id).first()
+            if rel is None:
+                rel = EmpresaEmpleado(id_empresa=empresas[i % len(empresas)], id_usuario=u.id)
+                db.session.add(rel)
+            empleados.append((u.id, rel.id_empresa))
+        docentes = [
+            (_usuario(f"docente{i}@{DOMINIO}", f"Docente {i}", Rol.docente).id, None)
+            for i in range(perfiles.get("docente", {}).get("usuarios", 0))
+        ]
+        admin = _usuario(f"admin@{DOMINIO}", "Admin carga", Rol.admin).id
+        db.session.commit()
+        for emp in empresas:
+            _historia(emp, cuentas[emp], historia, rnd)
+    return dict(alumno=alumnos, empleado=empleados, docente=docentes, admin=admin,
+                empresas=empresas, cuentas=cuentas)
+
+
+# --- clientes ---
+class ClienteLocal:
+    """La aplicación en este proceso (cliente de pruebas de Flask)."""
+
+    def __init__(self, app, uid: int):
+        self.c = app.test_client()
+        with self.c.session_transaction() as s:
+            s["uid"] = uid
+
+    def pedir(self, metodo: str, ruta: str, cuerpo=None):
+        r = self.c.open(ruta, method=metodo, json=cuerpo)
+        n = len(r.get_data())
+        r.close()
+        return r.status_code, n
+
+
+class ClienteHTTP:
+    """Una instancia levantada aparte; la sesión y el CSRF se firman con la SECRET_KEY de la app."""
+
+    def __init__(self, app, base: str, uid: int, timeout: float = 120):
+        from flask import session
+        from flask_wtf.csrf import generate_csrf
+        self.base = base.rstrip("/")
+        self.timeout = timeout
+        with app.test_request_context():
+            session["uid"] = uid
+            self.csrf = generate_csrf()
+            firmada = app.session_interface.get_signing_serializer(app).dumps(dict(session))
+        self.cookie = f"{app.config.get('SESSION_COOKIE_NAME', 'session')}={firmada}"
+
+    def pedir(self, metodo: str, ruta: str, cuerpo=None):
+        datos = json.dumps(cuerpo).encode() if cuerpo is not None else None
+        req = urllib.request.Request(self.base + ruta, data=datos, method=metodo, headers={
+            "Cookie": self.cookie, "X-CSRFToken": self.csrf, "Content-Type": "application/json",
+        })
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                return r.status, len(r.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read() or b"")
+
+
+# --- operaciones: (método, ruta, cuerpo) ---
+def _qs_empresa(ctx) -> str:
+    return f"&empresa={ctx['empresa']}" if ctx["perfil"] == "docente" else ""
+
+
+def _fecha_del_anio(rnd) -> date:
+    hoy = date.today()
+    return date(hoy.year, 1, 1) + timedelta(days=rnd.randrange(max((hoy - date(hoy.year, 1, 1)).days, 1)))
+
+
+def op_crear_asiento(ctx, rnd):
+    debe, haber = rnd.sample(ctx["cuentas"], 2)
+    importe = f"{rnd.randint(100, 100_000) / 100:.2f}"
+    return "POST", "/accounting/api/asientos", dict(
+        fecha=_fecha_del_anio(rnd).isoformat(), leyenda="carga", doc="carga",
+        renglones=[dict(id_cuenta=debe, tipo="debe", importe=importe), dict(id_cuenta=haber, tipo="haber", importe=importe)],
+    )
+
+
+def op_listar_asientos(ctx, rnd):
+    desde = date.today() - timedelta(days=30)
+    return "GET", f"/accounting/api/asientos?desde={desde.isoformat()}{_qs_empresa(ctx)}", None
+
+
+def op_mayor(ctx, rnd):
+    return "GET", f"/accounting/api/mayor?cuenta={rnd.choice(ctx['cuentas'])}&por_pagina=50&pagina=1{_qs_empresa(ctx)}", None
+
+
+def op_balance(ctx, rnd):
+    hasta = "" if rnd.random() < 0.5 else f"&hasta={_fecha_del_anio(rnd).isoformat()}"
+    return "GET", f"/accounting/api/balance?{hasta}{_qs_empresa(ctx)}", None
+
+
+def op_estados(ctx, rnd):
+    return "GET", f"/accounting/api/estados?{_qs_empresa(ctx)}", None
+
+
+def op_arbol(ctx, rnd):
+    return "GET", f"/accounting/api/arbol?{_qs_empresa(ctx)}", None
+
+
+def op_exportar_diario(ctx, rnd):
+    desde = date.today().replace(day=1) if rnd.random() < 0.7 else date(date.today().year, 1, 1)
+    return "GET", f"/reports/diario/export?desde={desde.isoformat()}", None
+
+
+# --- corrida ---
+def _usuario_simulado(cliente, perfil: str, cfg: dict, ctx_base: dict, fin: float, semilla: int, salida: list):
+    rnd = random.Random(semilla)
+    ops = [o for o in cfg["mezcla"] if o in OPERACIONES]
+    pesos = [cfg["mezcla"][o] for o in ops]
+    pausa_min, pausa_max = cfg.get("pausa", (0.5, 2.0))
+    while time.monotonic() < fin:
+        op = rnd.choices(ops, pesos)[0]
+        ctx = dict(ctx_base, perfil=perfil)
+        if perfil == "docente":
+            ctx["empresa"] = rnd.choice(ctx_base["empresas"])
+            ctx["cuentas"] = ctx_base["cuentas_por_empresa"][ctx["empresa"]]
+        metodo, ruta, cuerpo = globals()[f"op_{op}"](ctx, rnd)
+        inicio = time.perf_counter()
+        try:
+            estado, _n = cliente.pedir(metodo, ruta, cuerpo)
+        except Exception:
+            estado = 0   # conexión rechazada, timeout
+        salida.append((op, estado, (time.perf_counter() - inicio) * 1000.0))
+        time.sleep(rnd.uniform(pausa_min, pausa_max))
+
+
+def _percentil(ordenados: list, p: float) -> float:
+    if not ordenados:
+        return 0.0
+    k = max(0, min(len(ordenados) - 1, int(round(p / 100.0 * len(ordenados) + 0.5)) - 1))
+    return ordenados[k]
+
+
+def resumir(muestras: list, segundos: float) -> dict:
+    por_op = defaultdict(list)
+    for op, estado, ms in muestras:
+        por_op[op].append((estado, ms))
+    ops = {}
+    for op, filas in sorted(por_op.items()):
+        lat = sorted(ms for _e, ms in filas)
+        errores = sum(1 for e, _ms in filas if e == 0 or e >= 500 or (400 <= e < 500 and e != 429))
+        rechazos = sum(1 for e, _ms in filas if e == 429)
+        ops[op] = dict(
+            pedidos=len(filas), rps=round(len(filas) / segundos, 2),
+            errores_pct=round(100.0 * errores / len(filas), 2), rechazos_pct=round(100.0 * rechazos / len(filas), 2),
+            p50_ms=round(_percentil(lat, 50), 1), p95_ms=round(_percentil(lat, 95), 1),
+            p99_ms=round(_percentil(lat, 99), 1), max_ms=round(lat[-1], 1),
+            estados={str(e): n for e, n in sorted(Counter(e for e, _ms in filas).items())},
+        )
+    total = len(muestras) or 1
+    return dict(
+        segundos=round(segundos, 1), pedidos=len(muestras), rps=round(len(muestras) / segundos, 2),
+        errores_pct=round(sum(o["errores_pct"] * o["pedidos"] for o in ops.values()) / total, 2),
+        rechazos_pct=round(sum(o["rechazos_pct"] * o["pedidos"] for o in ops.values()) / total, 2),
+        operaciones=ops,
+    )
+
+
+def bloqueos(app):
+    """Contadores de esperas por bloqueos de filas (InnoDB); None si la base no los expone."""
+    from sqlalchemy import text
+    from models import db
+    with app.app_context():
+        if db.engine.dialect.name != "mysql":
+            return None
+        filas = db.session.execute(text("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock%'")).all()
+        db.session.rollback()
+        return {k: int(v) for k, v in filas}
+
+
+def verificar_umbrales(resumen: dict, umbrales: dict) -> list:
+    """Lista de incumplimientos (vacía si todo está dentro de los umbrales)."""
+    fallas = []
+
+    def _comparar(nombre, datos, lim):
+        for clave, valor in lim.items():
+            medida, tipo = (clave[:-4], "max") if clave.endswith("_max") else (clave[:-4], "min") if clave.endswith("_min") else (clave, "max")
+            actual = datos.get(medida)
+            if actual is None:
+                continue
+            if (tipo == "max" and actual > valor) or (tipo == "min" and actual < valor):
+                fallas.append(f"{nombre}: {medida} = {actual} ({'>' if tipo == 'max' else '<'} {valor})")
+
+    _comparar("global", resumen, umbrales.get("global", {}))
+    for op, lim in umbrales.get("operaciones", {}).items():
+        datos = resumen["operaciones"].get(op)
+        if datos is None:
+            continue
+        _comparar(op, datos, lim)
+    return fallas
+
+
+def imprimir(resumen: dict, bloq, carga, fallas: list):
+    print(f"\n{resumen['pedidos']} pedidos en {resumen['segundos']} s: {resumen['rps']} por segundo, "
+          f"{resumen['errores_pct']} % errores, {resumen['rechazos_pct']} % rechazos (429)")
+    print(f"{'operación':<17}{'pedidos':>8}{'rps':>8}{'err %':>7}{'429 %':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for op, o in resumen["operaciones"].items():
+        print(f"{op:<17}{o['pedidos']:>8}{o['rps']:>8}{o['errores_pct']:>7}{o['rechazos_pct']:>7}"
+              f"{o['p50_ms']:>9}{o['p95_ms']:>9}{o['p99_ms']:>9}{o['max_ms']:>9}")
+    if bloq is None:
+        print("Esperas por bloqueos: no disponibles para esta base (solo MySQL/InnoDB)")
+    else:
+        print(f"Esperas por bloqueos (InnoDB): {bloq.get('Innodb_row_lock_waits', 0)} esperas, "
+              f"{bloq.get('Innodb_row_lock_time', 0)} ms en total, máximo {bloq.get('Innodb_row_lock_time_max', 0)} ms")
+    if carga:
+        print("Worker que atendió /admin/api/carga:", json.dumps(carga, ensure_ascii=False))
+    for f in fallas:
+        print("UMBRAL NO CUMPLIDO:", f)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m loadtest", description="Prueba de carga con usuarios concurrentes")
+    ap.add_argument("--escenario", default="clase")
+    ap.add_argument("--escenarios", default=os.path.join(AQUI, "escenarios.json"))
+    ap.add_argument("--umbrales", default=os.path.join(AQUI, "umbrales.json"), help="'' para no verificar")
+    ap.add_argument("--database", default=os.getenv("LOADTEST_DATABASE_URL"),
+                    help="URL de la base de prueba (o LOADTEST_DATABASE_URL); se llena con datos de carga")
+    ap.add_argument("--url", default=None, help="Instancia ya levantada; sin esto la app corre en este proceso")
+    ap.add_argument("--duracion", type=float, default=None, help="Segundos (por defecto los del escenario)")
+    ap.add_argument("--escala", type=float, default=1.0, help="Multiplica la cantidad de usuarios de cada perfil")
+    ap.add_argument("--historia", type=int, default=None, help="Asientos previos por empresa")
+    ap.add_argument("--semilla", type=int, default=1)
+    ap.add_argument("--json", default=None, help="Guarda el resumen en este archivo")
+    args = ap.parse_args(argv)
+    if not args.database:
+        ap.error("falta --database (o LOADTEST_DATABASE_URL): la prueba de carga escribe en esa base")
+    if not base_de_prueba(args.database):
+        ap.error(f"{args.database} no parece una base de prueba: use un SQLite local o una base con "
+                 f"{', '.join(MARCAS_DE_PRUEBA)} en el nombre")
+
+    with open(args.escenarios, encoding="utf-8") as f:
+        esc = json.load(f)[args.escenario]
+    perfiles = {
+        nombre: dict(cfg, usuarios=max(1, round(cfg["usuarios"] * args.escala)))
+        for nombre, cfg in esc["perfiles"].items() if cfg.get("usuarios")
+    }
+    duracion = args.duracion or esc.get("duracion", 60)
+
+    # config.py lee el entorno al importarse; la réplica de la aplicación no se usa
+    os.environ["DATABASE_URL"] = args.database
+    os.environ["DATABASE_REPLICA_URL"] = ""
+    from app import app
+    if args.url is None:
+        app.config["WTF_CSRF_ENABLED"] = False
+    print(f"Preparando escenario '{args.escenario}' ...")
+    try:
+        gente = preparar(app, perfiles, args.historia if args.historia is not None else esc.get("historia", 0),
+                         args.semilla)
+    except ValueError as e:
+        print(f"No se pudo preparar el escenario: {e}", file=sys.stderr)
+        return 2
+
+    def cliente(uid):
+        return ClienteHTTP(app, args.url, uid) if args.url else ClienteLocal(app, uid)
+
+    bloq_antes = bloqueos(app)
+    fin = time.monotonic() + duracion
+    hilos, salidas = [], []
+    n = 0
+    for perfil, cfg in perfiles.items():
+        for uid, emp in gente[perfil][:cfg["usuarios"]]:
+            ctx = dict(empresa=emp, empresas=gente["empresas"], cuentas=gente["cuentas"].get(emp, []),
+                       cuentas_por_empresa=gente["cuentas"])
+            salida = []
+            salidas.append(salida)
+            hilos.append(threading.Thread(
+                target=_usuario_simulado, name=f"{perfil}-{uid}", daemon=True,
+                args=(cliente(uid), perfil, cfg, ctx, fin, args.semilla * 10_000 + n, salida),
+            ))
+            n += 1
+    print(f"{len(hilos)} usuarios simulados durante {duracion:g} s" + (f" contra {args.url}" if args.url else " (en proceso)"))
+    inicio = time.monotonic()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    segundos = time.monotonic() - inicio
+    bloq_despues = bloqueos(app)
+
+    resumen = resumir([m for s in salidas for m in s], segundos)
+    bloq = None
+    if bloq_antes is not None and bloq_despues is not None:
+        bloq = {k: bloq_despues[k] - bloq_antes.get(k, 0) for k in bloq_despues}
+        bloq["Innodb_row_lock_time_max"] = bloq_despues.get("Innodb_row_lock_time_max", 0)
+    try:
+        c = cliente(gente["admin"])
+        if args.url:
+            with urllib.request.urlopen(urllib.request.Request(
+                    args.url.rstrip("/") + "/admin/api/carga", headers={"Cookie": c.cookie}), timeout=10) as r:
+                carga = json.loads(r.read())
+        else:
+            carga = c.c.get("/admin/api/carga").get_json()
+    except Exception:
+        carga = None
+    umbrales = {}
+    if args.umbrales:
+        with open(args.umbrales, encoding="utf-8") as f:
+            umbrales = json.load(f).get(args.escenario, {})
+    fallas = verificar_umbrales(resumen, umbrales)
+    imprimir(resumen, bloq, carga, fallas)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(dict(escenario=args.escenario, resumen=resumen, bloqueos=bloq, carga=carga, fallas=fallas),
+                      f, ensure_ascii=False, indent=2)
+    return 1 if fallas else 0
@@ -0,0 +1,130 @@
+-- Migraciones (MySQL/MariaDB) para bases creadas con versiones anteriores de schema.sql.
+-- Ejecutar en orden solo las secciones que falten; una instalación nueva usa schema.sql directamente.
+USE sistema_contable;
+
+-- Bitácora: empresa e índices para la API de auditoría
+ALTER TABLE change_log
+  ADD COLUMN id_empresa INT NULL AFTER id_usuario,
+  ADD INDEX ix_changelog_ts (ts, id),
+  ADD INDEX ix_changelog_empresa_ts (id_empresa, ts, id),
+  ADD INDEX ix_changelog_usuario_ts (id_usuario, ts, id),
+  ADD INDEX ix_changelog_entidad_ts (entidad, ts, id);
+
+-- Plan de cuentas compartido (copia en escritura). Después de aplicar,
+-- ejecutar una vez: flask --app app migrar-plan
+ALTER TABLE plan_cuentas
+  MODIFY id_empresa INT NULL,
+  ADD COLUMN id_base INT NULL,
+  ADD COLUMN oculta BOOLEAN NOT NULL DEFAULT FALSE,
+  ADD INDEX ix_pc_base (id_base),
+  ADD CONSTRAINT fk_pc_base FOREIGN KEY (id_base) REFERENCES plan_cuentas(id_cuenta)
+    ON UPDATE CASCADE ON DELETE CASCADE;
+
+-- Búsqueda de asientos: texto completo e índices compuestos
+ALTER TABLE asientos_diarios
+  ADD INDEX ix_asiento_empresa_fecha (id_empresa, fecha, num_asiento),
+  ADD INDEX ix_asiento_empresa_usuario_fecha (id_empresa, id_usuario, fecha),
+  ADD FULLTEXT INDEX ft_asiento_texto (leyenda, doc_respaldatorio);
+ALTER TABLE detalle_asiento
+  ADD INDEX ix_detalle_asiento (id_asiento),
+  ADD INDEX ix_detalle_cuenta_importe (id_cuenta, importe, id_asiento),
+  ADD INDEX ix_detalle_importe (importe, id_asiento);
+
+-- Sincronización incremental: versión del libro por empresa y cambios por versión
+ALTER TABLE empresas ADD COLUMN version_libro BIGINT NOT NULL DEFAULT 0;
+CREATE TABLE IF NOT EXISTS cambios_libro (
+  id INT PRIMARY KEY AUTO_INCREMENT,
+  id_empresa INT NOT NULL,
+  version BIGINT NOT NULL,
+  entidad VARCHAR(20) NOT NULL,
+  id_entidad INT NOT NULL,
+  accion VARCHAR(10) NOT NULL,
+  INDEX ix_cambios_empresa_version (id_empresa, version),
+  CONSTRAINT fk_cambios_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- Cierre de ejercicio
+ALTER TABLE asientos_diarios ADD COLUMN clase VARCHAR(10) NOT NULL DEFAULT 'normal';
+CREATE TABLE IF NOT EXISTS cierres_ejercicio (
+  id_cierre INT PRIMARY KEY AUTO_INCREMENT,
+  id_empresa INT NOT NULL,
+  fecha_cierre DATE NOT NULL,
+  id_asiento_cierre INT,
+  id_asiento_apertura INT,
+  id_cuenta_resultados INT,
+  id_usuario INT,
+  ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT uq_cierre_empresa_fecha UNIQUE (id_empresa, fecha_cierre),
+  CONSTRAINT fk_cierre_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT fk_cierre_asiento_c FOREIGN KEY (id_asiento_cierre) REFERENCES asientos_diarios(id_asiento),
+  CONSTRAINT fk_cierre_asiento_a FOREIGN KEY (id_asiento_apertura) REFERENCES asientos_diarios(id_asiento),
+  CONSTRAINT fk_cierre_cuenta FOREIGN KEY (id_cuenta_resultados) REFERENCES plan_cuentas(id_cuenta),
+  CONSTRAINT fk_cierre_usr FOREIGN KEY (id_usuario) REFERENCES usuarios(id)
+    ON DELETE SET NULL ON UPDATE CASCADE
+);
+
+-- Archivo columnar de ejercicios cerrados
+ALTER TABLE cierres_ejercicio ADD COLUMN archivado DATETIME NULL;
+
+-- Saldos acumulados por cuenta y día; luego: flask --app app recalcular-saldos-diarios
+CREATE TABLE IF NOT EXISTS saldos_diarios (
+  id_empresa INT NOT NULL,
+  id_cuenta INT NOT NULL,
+  fecha DATE NOT NULL,
+  acumulado BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (id_empresa, id_cuenta, fecha),
+  CONSTRAINT fk_sd_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT fk_sd_cuenta FOREIGN KEY (id_cuenta) REFERENCES plan_cuentas(id_cuenta)
+);
+
+-- Estados materializados; luego: flask --app app recalcular-estados
+ALTER TABLE estado_resultados
+  ADD COLUMN id_cuenta INT NULL AFTER id_empresa,
+  ADD INDEX ix_er_empresa_cuenta (id_empresa, id_cuenta);
+ALTER TABLE estado_fondos
+  ADD COLUMN id_cuenta INT NULL AFTER id_empresa,
+  ADD INDEX ix_ef_empresa_cuenta (id_empresa, id_cuenta);
+ALTER TABLE analisis_indices
+  ADD COLUMN version BIGINT NULL,
+  ADD CONSTRAINT uq_ai_empresa UNIQUE (id_empresa);
+
+-- Contabilización de transacciones en lote
+ALTER TABLE transacciones
+  ADD COLUMN estado VARCHAR(15) NOT NULL DEFAULT 'pendiente',
+  ADD COLUMN id_asiento INT NULL,
+  ADD COLUMN error VARCHAR(200),
+  MODIFY tipo ENUM('ingreso','egreso') NOT NULL,
+  MODIFY fecha DATE NOT NULL,
+  MODIFY importe DECIMAL(12,2) NOT NULL,
+  ADD INDEX ix_tr_empresa_estado_fecha (id_empresa, estado, fecha, id_transaccion),
+  ADD CONSTRAINT fk_tr_asiento FOREIGN KEY (id_asiento) REFERENCES asientos_diarios(id_asiento) ON DELETE SET NULL;
+CREATE TABLE IF NOT EXISTS mapeo_transacciones (
+  id_mapeo INT PRIMARY KEY AUTO_INCREMENT,
+  id_empresa INT NOT NULL,
+  tipo ENUM('ingreso','egreso') NOT NULL,
+  condicion VARCHAR(100),
+  id_cuenta_debe INT NOT NULL,
+  id_cuenta_haber INT NOT NULL,
+  CONSTRAINT uq_mapeo_tr UNIQUE (id_empresa, tipo, condicion),
+  CONSTRAINT fk_mapeo_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT fk_mapeo_debe FOREIGN KEY (id_cuenta_debe) REFERENCES plan_cuentas(id_cuenta),
+  CONSTRAINT fk_mapeo_haber FOREIGN KEY (id_cuenta_haber) REFERENCES plan_cuentas(id_cuenta)
+);
+
+-- Bitácora: solo para bases que aplicaron la sección anterior con la clave
+-- foránea fk_changelog_emp (ON DELETE CASCADE). Borrar una empresa no borra su historia.
+ALTER TABLE change_log DROP FOREIGN KEY fk_changelog_emp;
+
+-- Plan compartido: clave única de las cuentas compartidas. Antes, con el código
+-- nuevo, ejecutar flask --app app migrar-plan: fusiona las compartidas repetidas
+-- (sincronizaciones concurrentes) y después hay que correr recalcular-saldos-diarios
+-- y recalcular-estados si informó alguna fusionada.
+ALTER TABLE plan_cuentas
+  ADD COLUMN clave_compartida VARCHAR(420) GENERATED ALWAYS AS (CASE WHEN id_empresa IS NULL THEN CONCAT(
+    COALESCE(cod_rubro, ''), '|', COALESCE(rubro, ''), '|', COALESCE(cod_subrubro, ''), '|',
+    COALESCE(subrubro, ''), '|', COALESCE(cuenta, '')) END) STORED,
+  ADD CONSTRAINT uq_pc_compartida UNIQUE (clave_compartida);
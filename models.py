@@ -1,10 +1,31 @@
 # models.py
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from sqlalchemy import Enum, UniqueConstraint, ForeignKey
 from sqlalchemy.orm import relationship
 import enum
 
-db = SQLAlchemy()
+class RoutingSession(Session):
+    """Sesión que envía las lecturas a la réplica ("replica" en SQLALCHEMY_BINDS)
+    cuando el request lo habilita con g.db_replica. Los flush y cualquier sesión
+    con cambios pendientes siguen yendo al primario.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and has_app_context()
+            and getattr(g, "db_replica", False)
+            and not (self.new or self.dirty or self.deleted)
+        ):
+            replica = self._db.engines.get("replica")
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 # --------- Enum de roles ---------
 class Rol(enum.Enum):
@@ -37,6 +58,8 @@ class Empresa(db.Model):
     nombre = db.Column(db.String(100), unique=True, nullable=False)
     descripcion = db.Column(db.Text)
     id_gerente = db.Column(db.Integer, ForeignKey("usuarios.id"), unique=True)
+    # Versión del libro (asientos y plan de cuentas): sube con cada cambio, ver CambioLibro
+    version_libro = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
 
     # Dueño (objeto Usuario)
     dueno = relationship("Usuario", foreign_keys=[id_gerente], uselist=False)
@@ -69,22 +92,39 @@ class EmpresaEmpleado(db.Model):
 
 # --- MODELOS CONTABLES MÍNIMOS ---
 
-from sqlalchemy import Enum as SAEnum, UniqueConstraint
+from sqlalchemy import Enum as SAEnum, UniqueConstraint, case, func
+from sqlalchemy.orm import deferred
 from datetime import date
 
 class PlanCuenta(db.Model):
     __tablename__ = "plan_cuentas"
 
     id_cuenta = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa"), nullable=False)
+    # NULL = cuenta compartida (de la plantilla), visible para todas las empresas
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa"), index=True)
     cod_rubro = db.Column(db.String(50))
     rubro = db.Column(db.String(100))
     cod_subrubro = db.Column(db.String(50))
     subrubro = db.Column(db.String(100))
     cuenta = db.Column(db.String(100))
+    # Copia propia de una compartida: la reemplaza (u oculta) solo para esta empresa
+    id_base = db.Column(db.Integer, db.ForeignKey("plan_cuentas.id_cuenta"), index=True)
+    oculta = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    # Solo en las compartidas (NULL en las propias): con la clave única, dos procesos que
+    # sincronizan la plantilla a la vez no pueden duplicarlas. Diferida: bases migradas
+    # que todavía no tienen la columna siguen leyendo el plan (ver migraciones.sql)
+    clave_compartida = deferred(db.Column(db.String(420), db.Computed(case((
+        id_empresa.is_(None),
+        func.coalesce(cod_rubro, "") + "|" + func.coalesce(rubro, "") + "|" + func.coalesce(cod_subrubro, "")
+        + "|" + func.coalesce(subrubro, "") + "|" + func.coalesce(cuenta, ""),
+    )), persisted=True)))
 
     empresa = relationship("Empresa")
 
+    __table_args__ = (
+        UniqueConstraint("clave_compartida", name="uq_pc_compartida"),
+    )
+
     def __repr__(self):
         return f"<PlanCuenta {self.id_cuenta} {self.cuenta}>"
 
@@ -98,9 +138,15 @@ class Asiento(db.Model):
     doc_respaldatorio = db.Column(db.String(100))
     id_usuario = db.Column(db.Integer, db.ForeignKey("usuarios.id"))
     leyenda = db.Column(db.Text)
+    # 'normal' | 'cierre' | 'apertura' (los dos últimos los genera el cierre de ejercicio)
+    clase = db.Column(db.String(10), nullable=False, default="normal", server_default="normal")
 
     __table_args__ = (
         UniqueConstraint("id_empresa", "num_asiento", name="uq_asiento_empresa"),
+        db.Index("ix_asiento_empresa_fecha", "id_empresa", "fecha", "num_asiento"),
+        db.Index("ix_asiento_empresa_usuario_fecha", "id_empresa", "id_usuario", "fecha"),
+        # texto completo: FULLTEXT en MySQL; en SQLite lo cubre la tabla FTS5 (services/busqueda_asientos.py)
+        db.Index("ft_asiento_texto", "leyenda", "doc_respaldatorio", mysql_prefix="FULLTEXT").ddl_if(dialect="mysql"),
     )
 
     detalles = db.relationship(
@@ -125,9 +171,168 @@ class DetalleAsiento(db.Model):
     tipo = db.Column(SAEnum("debe", "haber", name="tipo_asiento"), nullable=False)
     importe = db.Column(db.Numeric(12, 2), nullable=False)
 
+    __table_args__ = (
+        db.Index("ix_detalle_asiento", "id_asiento"),
+        db.Index("ix_detalle_cuenta_importe", "id_cuenta", "importe", "id_asiento"),
+        db.Index("ix_detalle_importe", "importe", "id_asiento"),
+    )
+
     asiento = db.relationship("Asiento", back_populates="detalles")
     cuenta_ref = db.relationship("PlanCuenta")
 
+# --------- Transacciones (se contabilizan en lote, services/transacciones.py) ---------
+class Transaccion(db.Model):
+    __tablename__ = "transacciones"
+
+    id_transaccion = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), nullable=False)
+    tipo = db.Column(SAEnum("ingreso", "egreso", name="tipo_transaccion"), nullable=False)
+    doc_respaldatorio = db.Column(db.String(100))
+    fecha = db.Column(db.Date, nullable=False)
+    contacto = db.Column(db.String(100))
+    importe = db.Column(db.Numeric(12, 2), nullable=False)
+    condicion = db.Column(db.String(100))
+    # 'pendiente' | 'contabilizada' | 'error' (con el motivo en 'error')
+    estado = db.Column(db.String(15), nullable=False, default="pendiente", server_default="pendiente")
+    id_asiento = db.Column(db.Integer, db.ForeignKey("asientos_diarios.id_asiento", ondelete="SET NULL"))
+    error = db.Column(db.String(200))
+
+    __table_args__ = (
+        db.Index("ix_tr_empresa_estado_fecha", "id_empresa", "estado", "fecha", "id_transaccion"),
+    )
+
+class MapeoTransaccion(db.Model):
+    """Cuentas del asiento de una transacción según tipo y condición (condición NULL: cualquiera)."""
+    __tablename__ = "mapeo_transacciones"
+
+    id_mapeo = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), nullable=False)
+    tipo = db.Column(SAEnum("ingreso", "egreso", name="tipo_transaccion"), nullable=False)
+    condicion = db.Column(db.String(100))
+    id_cuenta_debe = db.Column(db.Integer, db.ForeignKey("plan_cuentas.id_cuenta"), nullable=False)
+    id_cuenta_haber = db.Column(db.Integer, db.ForeignKey("plan_cuentas.id_cuenta"), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("id_empresa", "tipo", "condicion", name="uq_mapeo_tr"),
+    )
+
+# --------- Ejercicios ---------
+class CierreEjercicio(db.Model):
+    """Ejercicio cerrado: sus asientos (fecha <= fecha_cierre) ya no se modifican y los
+    reportes posteriores arrancan del asiento de apertura."""
+    __tablename__ = "cierres_ejercicio"
+
+    id_cierre = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), nullable=False)
+    fecha_cierre = db.Column(db.Date, nullable=False)
+    id_asiento_cierre = db.Column(db.Integer, db.ForeignKey("asientos_diarios.id_asiento"))
+    id_asiento_apertura = db.Column(db.Integer, db.ForeignKey("asientos_diarios.id_asiento"))
+    id_cuenta_resultados = db.Column(db.Integer, db.ForeignKey("plan_cuentas.id_cuenta"))
+    id_usuario = db.Column(db.Integer, db.ForeignKey("usuarios.id"))
+    ts = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+    archivado = db.Column(db.DateTime)  # sus renglones se movieron al archivo columnar
+
+    __table_args__ = (
+        UniqueConstraint("id_empresa", "fecha_cierre", name="uq_cierre_empresa_fecha"),
+    )
+
+# --------- Saldos acumulados ---------
+class SaldoDiario(db.Model):
+    """Saldo acumulado (centavos debe - haber) de una cuenta al cierre de cada día con movimientos."""
+    __tablename__ = "saldos_diarios"
+
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), primary_key=True)
+    id_cuenta = db.Column(db.Integer, db.ForeignKey("plan_cuentas.id_cuenta"), primary_key=True)
+    fecha = db.Column(db.Date, primary_key=True)
+    acumulado = db.Column(db.BigInteger, nullable=False, default=0)
+
+# --------- Estados materializados (services/estados_materializados.py) ---------
+class EstadoSituacionPatrimonial(db.Model):
+    __tablename__ = "estado_situacion_patrimonial"
+
+    id_estado = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), nullable=False, index=True)
+    cod_rubro = db.Column(db.String(50))
+    rubro = db.Column(db.String(100))
+    cod_subrubro = db.Column(db.String(50))
+    subrubro = db.Column(db.String(100))
+    importe = db.Column(db.Numeric(12, 2))
+
+class EstadoResultados(db.Model):
+    """Saldo de cada cuenta de resultado en el ejercicio en curso."""
+    __tablename__ = "estado_resultados"
+
+    id_resultado = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), nullable=False)
+    id_cuenta = db.Column(db.Integer)  # sin FK: la fila se rehace al borrar la cuenta
+    cod_rubro = db.Column(db.String(50))
+    rubro = db.Column(db.String(100))
+    cod_subrubro = db.Column(db.String(50))
+    subrubro = db.Column(db.String(100))
+    cuenta = db.Column(db.String(100))
+    saldo = db.Column(db.Numeric(12, 2))
+
+    __table_args__ = (
+        db.Index("ix_er_empresa_cuenta", "id_empresa", "id_cuenta"),
+    )
+
+class EstadoFondos(db.Model):
+    """Saldo de cada cuenta patrimonial en el ejercicio en curso."""
+    __tablename__ = "estado_fondos"
+
+    id_fondo = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), nullable=False)
+    id_cuenta = db.Column(db.Integer)  # sin FK: la fila se rehace al borrar la cuenta
+    cod_rubro = db.Column(db.String(50))
+    rubro = db.Column(db.String(100))
+    cod_subrubro = db.Column(db.String(50))
+    subrubro = db.Column(db.String(100))
+    cuenta = db.Column(db.String(100))
+    importe = db.Column(db.Numeric(12, 2))
+
+    __table_args__ = (
+        db.Index("ix_ef_empresa_cuenta", "id_empresa", "id_cuenta"),
+    )
+
+class AnalisisIndices(db.Model):
+    """Una fila por empresa; 'version' es la versión del libro que reflejan los cuatro estados."""
+    __tablename__ = "analisis_indices"
+
+    id_indice = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), nullable=False, unique=True)
+    activos_corrientes = db.Column(db.Numeric(12, 2))
+    pasivos_corrientes = db.Column(db.Numeric(12, 2))
+    indice_de_liquidez = db.Column(db.Numeric(12, 4))
+    saldos_activos = db.Column(db.Numeric(12, 2))
+    saldos_pasivos = db.Column(db.Numeric(12, 2))
+    indice_de_solvencia = db.Column(db.Numeric(12, 4))
+    saldo_de_pasivo = db.Column(db.Numeric(12, 2))
+    saldo_pn = db.Column(db.Numeric(12, 2))
+    indice_de_endeudamiento = db.Column(db.Numeric(12, 4))
+    costo_mercancias_vendidas = db.Column(db.Numeric(12, 2))
+    ventas = db.Column(db.Numeric(12, 2))
+    indice_costo_ventas = db.Column(db.Numeric(12, 4))
+    utilidad_del_ejercicio = db.Column(db.Numeric(12, 2))
+    patrimonio_neto = db.Column(db.Numeric(12, 2))
+    indice_retorno_inversion = db.Column(db.Numeric(12, 4))
+    version = db.Column(db.BigInteger)
+
+# --------- Sincronización ---------
+class CambioLibro(db.Model):
+    """Qué asiento/cuenta cambió en cada versión del libro de una empresa (sync incremental)."""
+    __tablename__ = "cambios_libro"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_empresa = db.Column(db.Integer, db.ForeignKey("empresas.id_empresa", ondelete="CASCADE"), nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)
+    entidad = db.Column(db.String(20), nullable=False)   # 'asiento' | 'cuenta'
+    id_entidad = db.Column(db.Integer, nullable=False)
+    accion = db.Column(db.String(10), nullable=False)    # 'create' | 'update' | 'delete' | 'archivado'
+
+    __table_args__ = (
+        db.Index("ix_cambios_empresa_version", "id_empresa", "version"),
+    )
+
 # --------- Auditoría ---------
 class ChangeLog(db.Model):
     __tablename__ = "change_log"
@@ -137,9 +342,18 @@ class ChangeLog(db.Model):
     id_entidad = db.Column(db.Integer, nullable=False)
     accion = db.Column(db.String(20), nullable=False)   # 'create', 'update', 'delete'
     id_usuario = db.Column(db.Integer, db.ForeignKey("usuarios.id"))
+    # sin clave foránea: la bitácora sobrevive a la baja de la empresa
+    id_empresa = db.Column(db.Integer)
     ts = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
     datos = db.Column(db.Text)  # JSON (string) con cambios relevantes
 
+    __table_args__ = (
+        db.Index("ix_changelog_ts", "ts", "id"),
+        db.Index("ix_changelog_empresa_ts", "id_empresa", "ts", "id"),
+        db.Index("ix_changelog_usuario_ts", "id_usuario", "ts", "id"),
+        db.Index("ix_changelog_entidad_ts", "entidad", "ts", "id"),
+    )
+
     usuario = relationship("Usuario")
 
     def __repr__(self):
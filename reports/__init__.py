@@ -1,7 +1,8 @@
-from flask import Blueprint, render_template, request, g, redirect, url_for, abort, send_file, make_response
+from flask import Blueprint, render_template, request, g, redirect, url_for, abort, send_file, make_response, jsonify
 from io import BytesIO
-from accounting import _empresa_del_usuario
-from models import db, Asiento, DetalleAsiento, PlanCuenta
+from datetime import date
+from accounting import _empresa_del_usuario, _grupo_estados, _normal_side_for, _rango
+from services import admision, archivo, coalescencia, consultas, plan, series, sincronizacion
 
 bp = Blueprint("reports", __name__, url_prefix="/reports")
 
@@ -43,40 +44,47 @@ def diario():
 @bp.route("/diario/export")
 @login_required
 @owners_employees_only
+@admision.limitar("exportacion", _empresa_del_usuario)
 def diario_export_pdf():
     # Determinar empresa del usuario (docentes no acceden a reportes)
     emp_id = _empresa_del_usuario()
     if not emp_id:
         abort(400, description="Usuario sin empresa asociada")
-    # Traer asientos con detalles
-    q = (
-        db.session.query(Asiento, DetalleAsiento, PlanCuenta)
-        .outerjoin(DetalleAsiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
-        .outerjoin(PlanCuenta, PlanCuenta.id_cuenta == DetalleAsiento.id_cuenta)
-        .filter(Asiento.id_empresa == emp_id)
-    )
     desde_s = request.args.get("desde")
     hasta_s = request.args.get("hasta")
-    from datetime import date as _date
-    try:
-        if desde_s:
-            q = q.filter(Asiento.fecha >= _date.fromisoformat(desde_s))
-        if hasta_s:
-            q = q.filter(Asiento.fecha <= _date.fromisoformat(hasta_s))
-    except Exception:
-        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
-    rows = q.order_by(Asiento.fecha.asc(), Asiento.num_asiento.asc(), DetalleAsiento.id_detalle.asc()).all()
-    # Estructurar por asiento
+    desde, hasta = _rango(desde_s, hasta_s)
+    # Pedidos iguales simultáneos (misma empresa, rango y versión del libro) generan un solo archivo
+    clave = (emp_id, "diario_export", (desde, hasta), sincronizacion.version_actual(emp_id))
+    contenido, es_pdf = coalescencia.una_vez(clave, lambda: _diario_exportado(emp_id, desde_s, hasta_s, desde, hasta))
+    if es_pdf:
+        return send_file(BytesIO(contenido), mimetype="application/pdf", as_attachment=True, download_name="libro_diario.pdf")
+    # Fallback a HTML descargable
+    resp = make_response(contenido)
+    resp.headers['Content-Type'] = 'text/html; charset=utf-8'
+    resp.headers['Content-Disposition'] = 'attachment; filename=libro_diario.html'
+    return resp
+
+def _diario_exportado(emp_id, desde_s, hasta_s, desde, hasta):
+    """(contenido, es_pdf): el PDF del libro diario o, si no se puede generar, el HTML."""
+    # Traer asientos con detalles (un renglón por fila)
+    rows = consultas.diario(emp_id, desde, hasta).all()
+    # Estructurar por asiento (primero los ejercicios archivados que entran en el rango)
     diario = []
+    for tramo in archivo.tramos(emp_id, desde_s, hasta_s):
+        for a in tramo.asientos(desde_s, hasta_s):
+            diario.append(dict(
+                id=a["id"], fecha=a["fecha"].isoformat(), num=a["num"], leyenda=a["leyenda"],
+                detalles=[dict(cuenta=d["cuenta"], tipo=d["tipo"], importe=float(d["importe"])) for d in a["detalles"]],
+            ))
     cur = None
     last_id = None
-    for a, d, pc in rows:
-        if a.id_asiento != last_id:
-            cur = dict(id=a.id_asiento, fecha=a.fecha.isoformat(), num=a.num_asiento, leyenda=a.leyenda or "", detalles=[])
+    for id_asiento, fecha, num, leyenda, cuenta, tipo, importe in rows:
+        if id_asiento != last_id:
+            cur = dict(id=id_asiento, fecha=fecha.isoformat(), num=num, leyenda=leyenda or "", detalles=[])
             diario.append(cur)
-            last_id = a.id_asiento
-        if d is not None:
-            cur["detalles"].append(dict(cuenta=(pc.cuenta if pc else ''), tipo=d.tipo, importe=float(d.importe)))
+            last_id = id_asiento
+        if tipo is not None:
+            cur["detalles"].append(dict(cuenta=cuenta or '', tipo=tipo, importe=float(importe)))
     # Renderizar HTML
     html = render_template("reports/diario_pdf.html", diario=diario)
     # Intentar generar PDF con xhtml2pdf
@@ -84,14 +92,9 @@ def diario_export_pdf():
         from xhtml2pdf import pisa
         pdf_io = BytesIO()
         pisa.CreatePDF(html, dest=pdf_io)
-        pdf_io.seek(0)
-        return send_file(pdf_io, mimetype="application/pdf", as_attachment=True, download_name="libro_diario.pdf")
+        return pdf_io.getvalue(), True
     except Exception:
-        # Fallback a HTML descargable
-        resp = make_response(html)
-        resp.headers['Content-Type'] = 'text/html; charset=utf-8'
-        resp.headers['Content-Disposition'] = 'attachment; filename=libro_diario.html'
-        return resp
+        return html.encode("utf-8"), False
 
 # Libro Mayor
 @bp.route("/mayor")
@@ -107,6 +110,74 @@ def mayor():
 def graficos():
     return render_template("reports/graficos.html")
 
+_CAJA = ("caja", "banco", "efectivo", "disponibilidades")
+
+@bp.route("/api/series")
+@login_required
+@owners_employees_only
+@admision.limitar("reporte", _empresa_del_usuario)
+def api_series():
+    """Series para graficos: saldo por rubro, ingresos vs gastos, caja y bancos, composición del activo.
+    ?agrupar=dia|semana|mes&desde&hasta&puntos=N"""
+    emp_id = _empresa_del_usuario()
+    if not emp_id:
+        abort(400, description="Usuario sin empresa asociada")
+    agrupar = request.args.get("agrupar", "mes")
+    puntos = min(max(request.args.get("puntos", 120, type=int), 2), 1000)
+    try:
+        hasta = date.fromisoformat(request.args.get("hasta") or date.today().isoformat())
+        desde = date.fromisoformat(request.args.get("desde") or date(hasta.year, 1, 1).isoformat())
+    except ValueError:
+        abort(400, description="Formato de fecha inválido. Use YYYY-MM-DD")
+
+    niveles = {"Caja y bancos": {}}
+    rubros, activo = [], []
+    flujos = {"Ingresos": {}, "Gastos": {}}
+    for c in plan.cuentas_de_empresa(emp_id).all():
+        signo = 1 if _normal_side_for(c) == "D" else -1
+        rubro = (c.rubro or "Sin rubro").strip().title()
+        clave = f"rubro:{rubro}"
+        if clave not in niveles:
+            niveles[clave] = {}
+            rubros.append(rubro)
+        niveles[clave][c.id_cuenta] = signo
+        txt = " ".join(filter(None, [c.rubro, c.subrubro])).lower()
+        grupo = _grupo_estados(txt)
+        if grupo == "ingreso":
+            flujos["Ingresos"][c.id_cuenta] = -1
+        elif grupo == "gasto":
+            flujos["Gastos"][c.id_cuenta] = 1
+        if grupo == "activo":
+            sub = f"activo:{c.subrubro or 'Sin subrubro'}"
+            if sub not in niveles:
+                niveles[sub] = {}
+                activo.append(sub)
+            niveles[sub][c.id_cuenta] = signo
+        nombre = " ".join(filter(None, [c.cuenta, c.subrubro])).lower()
+        if any(k in nombre for k in _CAJA):
+            niveles["Caja y bancos"][c.id_cuenta] = signo
+    try:
+        r = series.calcular(emp_id, agrupar, desde, hasta, niveles, flujos, puntos)
+    except series.ErrorSerie as e:
+        abort(400, description=str(e))
+    n = r["niveles"]
+    return jsonify(dict(
+        agrupar=agrupar,
+        desde=desde.isoformat(),
+        hasta=hasta.isoformat(),
+        labels=r["labels"],
+        series=dict(
+            rubros=[dict(label=k, data=n[f"rubro:{k}"]) for k in rubros],
+            resultado=[dict(label=k, data=v) for k, v in r["flujos"].items()],
+            caja=[dict(label="Caja y bancos", data=n["Caja y bancos"])],
+        ),
+        # saldo al final del rango por subrubro del activo
+        composicion_activo=dict(
+            labels=[k.split(":", 1)[1] for k in activo],
+            data=[abs(n[k][-1]) if n[k] else 0.0 for k in activo],
+        ),
+    ))
+
 # Estado de Situacion Patrimonial
 @bp.route("/estado")
 @login_required
@@ -17,6 +17,7 @@ CREATE TABLE IF NOT EXISTS empresas (
   nombre VARCHAR(100) NOT NULL UNIQUE,
   descripcion TEXT,
   id_gerente INT UNIQUE,                        -- dueño (1:1)
+  version_libro BIGINT NOT NULL DEFAULT 0,      -- sube con cada cambio de asientos/cuentas
   CONSTRAINT fk_empresas_dueno FOREIGN KEY (id_gerente) REFERENCES usuarios(id)
     ON UPDATE CASCADE ON DELETE SET NULL
 );
@@ -32,20 +33,32 @@ CREATE TABLE IF NOT EXISTS empresa_empleados (
     ON UPDATE CASCADE ON DELETE CASCADE
 );
 
--- PLAN DE CUENTAS por empresa (clonado desde plantilla)
+-- PLAN DE CUENTAS: filas compartidas (id_empresa NULL, desde la plantilla)
+-- + filas propias de cada empresa (altas, personalizaciones y bajas de compartidas)
 CREATE TABLE IF NOT EXISTS plan_cuentas (
   id_cuenta INT PRIMARY KEY AUTO_INCREMENT,
-  id_empresa INT NOT NULL,
+  id_empresa INT NULL,
   cod_rubro VARCHAR(50),
   rubro VARCHAR(100),
   cod_subrubro VARCHAR(50),
   subrubro VARCHAR(100),
   cuenta VARCHAR(100),
+  id_base INT NULL,                             -- cuenta compartida que esta fila reemplaza
+  oculta BOOLEAN NOT NULL DEFAULT FALSE,        -- baja de la compartida id_base para la empresa
+  -- solo en las compartidas (NULL en las propias): la plantilla no se duplica con sincronizaciones concurrentes
+  clave_compartida VARCHAR(420) GENERATED ALWAYS AS (CASE WHEN id_empresa IS NULL THEN CONCAT(
+    COALESCE(cod_rubro, ''), '|', COALESCE(rubro, ''), '|', COALESCE(cod_subrubro, ''), '|',
+    COALESCE(subrubro, ''), '|', COALESCE(cuenta, '')) END) STORED,
+  INDEX ix_pc_empresa (id_empresa),
+  INDEX ix_pc_base (id_base),
+  CONSTRAINT uq_pc_compartida UNIQUE (clave_compartida),
   CONSTRAINT fk_pc_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT fk_pc_base FOREIGN KEY (id_base) REFERENCES plan_cuentas(id_cuenta)
     ON UPDATE CASCADE ON DELETE CASCADE
 );
 
--- Plantilla global (opcional) para clonado inicial
+-- Plantilla global: origen de las cuentas compartidas
 CREATE TABLE IF NOT EXISTS plan_cuentas_plantilla (
   id_tpl INT PRIMARY KEY AUTO_INCREMENT,
   cod_rubro VARCHAR(50),
@@ -55,18 +68,19 @@ CREATE TABLE IF NOT EXISTS plan_cuentas_plantilla (
   cuenta VARCHAR(100)
 );
 
--- Transacciones (si las usas fuera del asiento)
-CREATE TABLE IF NOT EXISTS transacciones (
-  id_transaccion INT PRIMARY KEY AUTO_INCREMENT,
+-- Cuentas del asiento de cada transacción según tipo y condición (NULL: cualquiera)
+CREATE TABLE IF NOT EXISTS mapeo_transacciones (
+  id_mapeo INT PRIMARY KEY AUTO_INCREMENT,
   id_empresa INT NOT NULL,
-  tipo ENUM('ingreso','egreso'),
-  doc_respaldatorio VARCHAR(100),
-  fecha DATE,
-  contacto VARCHAR(100),
-  importe DECIMAL(12,2),
+  tipo ENUM('ingreso','egreso') NOT NULL,
   condicion VARCHAR(100),
-  CONSTRAINT fk_tr_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
-    ON UPDATE CASCADE ON DELETE CASCADE
+  id_cuenta_debe INT NOT NULL,
+  id_cuenta_haber INT NOT NULL,
+  CONSTRAINT uq_mapeo_tr UNIQUE (id_empresa, tipo, condicion),
+  CONSTRAINT fk_mapeo_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT fk_mapeo_debe FOREIGN KEY (id_cuenta_debe) REFERENCES plan_cuentas(id_cuenta),
+  CONSTRAINT fk_mapeo_haber FOREIGN KEY (id_cuenta_haber) REFERENCES plan_cuentas(id_cuenta)
 );
 
 CREATE TABLE IF NOT EXISTS asientos_diarios (
@@ -78,33 +92,113 @@ CREATE TABLE IF NOT EXISTS asientos_diarios (
   datos_adjuntos TEXT,
   id_usuario INT,                               -- quien lo cargó
   leyenda TEXT,
+  clase VARCHAR(10) NOT NULL DEFAULT 'normal',  -- normal | cierre | apertura
   CONSTRAINT uq_asiento_empresa UNIQUE (id_empresa, num_asiento),
+  INDEX ix_asiento_empresa_fecha (id_empresa, fecha, num_asiento),
+  INDEX ix_asiento_empresa_usuario_fecha (id_empresa, id_usuario, fecha),
+  FULLTEXT INDEX ft_asiento_texto (leyenda, doc_respaldatorio),
   CONSTRAINT fk_ad_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
     ON UPDATE CASCADE ON DELETE CASCADE,
   CONSTRAINT fk_ad_usr FOREIGN KEY (id_usuario) REFERENCES usuarios(id)
     ON DELETE SET NULL ON UPDATE CASCADE
 );
 
+-- Transacciones (si las usas fuera del asiento)
+CREATE TABLE IF NOT EXISTS transacciones (
+  id_transaccion INT PRIMARY KEY AUTO_INCREMENT,
+  id_empresa INT NOT NULL,
+  tipo ENUM('ingreso','egreso') NOT NULL,
+  doc_respaldatorio VARCHAR(100),
+  fecha DATE NOT NULL,
+  contacto VARCHAR(100),
+  importe DECIMAL(12,2) NOT NULL,
+  condicion VARCHAR(100),
+  estado VARCHAR(15) NOT NULL DEFAULT 'pendiente',  -- pendiente | contabilizada | error
+  id_asiento INT NULL,                          -- asiento generado al contabilizar
+  error VARCHAR(200),
+  INDEX ix_tr_empresa_estado_fecha (id_empresa, estado, fecha, id_transaccion),
+  CONSTRAINT fk_tr_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT fk_tr_asiento FOREIGN KEY (id_asiento) REFERENCES asientos_diarios(id_asiento)
+    ON DELETE SET NULL
+);
+
 CREATE TABLE IF NOT EXISTS detalle_asiento (
   id_detalle INT PRIMARY KEY AUTO_INCREMENT,
   id_asiento INT NOT NULL,
   id_cuenta INT NOT NULL,
   tipo ENUM('debe','haber') NOT NULL,
   importe DECIMAL(12,2) NOT NULL CHECK (importe >= 0),
+  INDEX ix_detalle_asiento (id_asiento),
+  INDEX ix_detalle_cuenta_importe (id_cuenta, importe, id_asiento),
+  INDEX ix_detalle_importe (importe, id_asiento),
   CONSTRAINT fk_da_asiento FOREIGN KEY (id_asiento) REFERENCES asientos_diarios(id_asiento)
     ON UPDATE CASCADE ON DELETE CASCADE,
   CONSTRAINT fk_da_cuenta FOREIGN KEY (id_cuenta) REFERENCES plan_cuentas(id_cuenta)
     ON UPDATE CASCADE ON DELETE RESTRICT
 );
 
+-- Ejercicios cerrados (asientos inmutables hasta fecha_cierre; reportes desde la apertura)
+CREATE TABLE IF NOT EXISTS cierres_ejercicio (
+  id_cierre INT PRIMARY KEY AUTO_INCREMENT,
+  id_empresa INT NOT NULL,
+  fecha_cierre DATE NOT NULL,
+  id_asiento_cierre INT,
+  id_asiento_apertura INT,
+  id_cuenta_resultados INT,
+  id_usuario INT,
+  ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+  archivado DATETIME NULL,
+  CONSTRAINT uq_cierre_empresa_fecha UNIQUE (id_empresa, fecha_cierre),
+  CONSTRAINT fk_cierre_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT fk_cierre_asiento_c FOREIGN KEY (id_asiento_cierre) REFERENCES asientos_diarios(id_asiento),
+  CONSTRAINT fk_cierre_asiento_a FOREIGN KEY (id_asiento_apertura) REFERENCES asientos_diarios(id_asiento),
+  CONSTRAINT fk_cierre_cuenta FOREIGN KEY (id_cuenta_resultados) REFERENCES plan_cuentas(id_cuenta),
+  CONSTRAINT fk_cierre_usr FOREIGN KEY (id_usuario) REFERENCES usuarios(id)
+    ON DELETE SET NULL ON UPDATE CASCADE
+);
+
+-- Saldos acumulados por cuenta y día (balance a una fecha)
+CREATE TABLE IF NOT EXISTS saldos_diarios (
+  id_empresa INT NOT NULL,
+  id_cuenta INT NOT NULL,
+  fecha DATE NOT NULL,
+  acumulado BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (id_empresa, id_cuenta, fecha),
+  CONSTRAINT fk_sd_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  CONSTRAINT fk_sd_cuenta FOREIGN KEY (id_cuenta) REFERENCES plan_cuentas(id_cuenta)
+);
+
+-- Cambios por versión del libro (sincronización incremental del cliente)
+CREATE TABLE IF NOT EXISTS cambios_libro (
+  id INT PRIMARY KEY AUTO_INCREMENT,
+  id_empresa INT NOT NULL,
+  version BIGINT NOT NULL,
+  entidad VARCHAR(20) NOT NULL,
+  id_entidad INT NOT NULL,
+  accion VARCHAR(10) NOT NULL,
+  INDEX ix_cambios_empresa_version (id_empresa, version),
+  CONSTRAINT fk_cambios_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
 CREATE TABLE IF NOT EXISTS change_log (
   id INT PRIMARY KEY AUTO_INCREMENT,
   entidad VARCHAR(50) NOT NULL,
   id_entidad INT NOT NULL,
   accion VARCHAR(20) NOT NULL,
   id_usuario INT,
+  id_empresa INT,
   ts DATETIME DEFAULT CURRENT_TIMESTAMP,
   datos TEXT,
+  INDEX ix_changelog_ts (ts, id),
+  INDEX ix_changelog_empresa_ts (id_empresa, ts, id),
+  INDEX ix_changelog_usuario_ts (id_usuario, ts, id),
+  INDEX ix_changelog_entidad_ts (entidad, ts, id),
+  -- id_empresa sin clave foránea: la bitácora sobrevive a la baja de la empresa y
+  -- el volcado diferido no falla si la empresa se borró antes de insertar
   CONSTRAINT fk_changelog_user FOREIGN KEY (id_usuario) REFERENCES usuarios(id)
     ON UPDATE CASCADE ON DELETE SET NULL
 );
@@ -140,12 +234,14 @@ CREATE TABLE IF NOT EXISTS estado_situacion_patrimonial (
 CREATE TABLE IF NOT EXISTS estado_resultados (
   id_resultado INT PRIMARY KEY AUTO_INCREMENT,
   id_empresa INT NOT NULL,
+  id_cuenta INT,
   cod_rubro VARCHAR(50),
   rubro VARCHAR(100),
   cod_subrubro VARCHAR(50),
   subrubro VARCHAR(100),
   cuenta VARCHAR(100),
   saldo DECIMAL(12,2),
+  INDEX ix_er_empresa_cuenta (id_empresa, id_cuenta),
   CONSTRAINT fk_er_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
     ON UPDATE CASCADE ON DELETE CASCADE
 );
@@ -153,12 +249,14 @@ CREATE TABLE IF NOT EXISTS estado_resultados (
 CREATE TABLE IF NOT EXISTS estado_fondos (
   id_fondo INT PRIMARY KEY AUTO_INCREMENT,
   id_empresa INT NOT NULL,
+  id_cuenta INT,
   cod_rubro VARCHAR(50),
   rubro VARCHAR(100),
   cod_subrubro VARCHAR(50),
   subrubro VARCHAR(100),
   cuenta VARCHAR(100),
   importe DECIMAL(12,2),
+  INDEX ix_ef_empresa_cuenta (id_empresa, id_cuenta),
   CONSTRAINT fk_ef_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
     ON UPDATE CASCADE ON DELETE CASCADE
 );
@@ -181,6 +279,8 @@ CREATE TABLE IF NOT EXISTS analisis_indices (
   utilidad_del_ejercicio DECIMAL(12,2),
   patrimonio_neto DECIMAL(12,2),
   indice_retorno_inversion DECIMAL(12,4),
+  version BIGINT,                               -- versión del libro que reflejan los estados
+  CONSTRAINT uq_ai_empresa UNIQUE (id_empresa),
   CONSTRAINT fk_ai_emp FOREIGN KEY (id_empresa) REFERENCES empresas(id_empresa)
     ON UPDATE CASCADE ON DELETE CASCADE
 );
@@ -0,0 +1,200 @@
+# services/admision.py
+"""
+Control de admisión para los endpoints pesados (reportes y exportaciones).
+
+Cada clase de endpoint tiene un cupo de pedidos simultáneos por proceso
+(limite) y una cola de espera acotada (cola). Los que esperan se ordenan por
+empresa y se atienden por turnos: al liberarse un lugar pasa el primero de la
+empresa siguiente, no el más viejo, y una empresa no ocupa más de por_empresa
+lugares a la vez. Así una clase que pide diez PDFs no deja sin reportes al resto.
+
+Con la cola llena, o si la espera pasa de 'espera' segundos, se responde 429
+con Retry-After estimado con la duración media de la clase. Mientras espera, el
+pedido devuelve su conexión al pool para no quitársela a las escrituras.
+Altas de asientos y lecturas livianas no pasan por acá.
+
+Un pedido admitido que se pone a esperar el cálculo de otro (coalescencia)
+cede su lugar con ceder(): no lo vuelve a pedir, solo arma la respuesta.
+
+Con gunicorn el cupo es por worker: el total es limite x workers.
+"""
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import abort, g, has_request_context, jsonify, make_response
+
+from models import db
+
+
+class Turno:
+    __slots__ = ("empresa_id", "evento", "concedido")
+
+    def __init__(self, empresa_id):
+        self.empresa_id = empresa_id
+        self.evento = threading.Event()
+        self.concedido = False
+
+
+class Lugar:
+    """Lugar concedido al pedido en curso (g._admision)."""
+    __slots__ = ("clase", "empresa_id", "inicio", "cedido")
+
+    def __init__(self, clase, empresa_id):
+        self.clase = clase
+        self.empresa_id = empresa_id
+        self.inicio = time.monotonic()
+        self.cedido = False
+
+
+class Clase:
+    def __init__(self, nombre: str, limite: int, cola: int, espera: float, por_empresa: int = None):
+        self.nombre = nombre
+        self.limite = max(1, limite)
+        self.cola = max(0, cola)
+        self.espera = espera
+        self.por_empresa = max(1, por_empresa or math.ceil(self.limite / 2))
+        self.lock = threading.Lock()
+        self.en_curso = 0
+        self.activos = Counter()
+        self.esperando = OrderedDict()   # empresa -> deque[Turno], en orden de turno
+        self.en_cola = 0
+        self.duracion = 1.0              # media móvil en segundos
+        self.admitidos = 0
+        self.rechazados = 0
+
+    def _despachar(self):
+        """Concede lugares libres por turnos de empresa (con self.lock tomado)."""
+        while self.en_curso < self.limite and self.esperando:
+            for empresa_id, turnos in self.esperando.items():
+                if self.activos[empresa_id] < self.por_empresa:
+                    break
+            else:
+                return  # solo esperan empresas que ya usan su parte
+            t = turnos.popleft()
+            del self.esperando[empresa_id]
+            if turnos:
+                self.esperando[empresa_id] = turnos  # al final: le toca de nuevo después de las demás
+            self.en_cola -= 1
+            self.en_curso += 1
+            self.activos[empresa_id] += 1
+            self.admitidos += 1
+            t.concedido = True
+            t.evento.set()
+
+    def reintentar_en(self) -> int:
+        return max(1, math.ceil(self.duracion * (self.en_cola + 1) / self.limite))
+
+    def entrar(self, empresa_id) -> bool:
+        """True si obtuvo lugar (hay que llamar a salir); False si se rechaza."""
+        t = Turno(empresa_id)
+        with self.lock:
+            if self.en_cola >= self.cola and self.en_curso >= self.limite:
+                self.rechazados += 1
+                return False
+            self.esperando.setdefault(empresa_id, deque()).append(t)
+            self.en_cola += 1
+            self._despachar()
+            if t.concedido:
+                return True
+            if self.en_cola > self.cola:
+                # había lugar libre pero reservado a otras empresas y la cola ya estaba llena
+                self._quitar(t)
+                self.rechazados += 1
+                return False
+        db.session.rollback()  # devuelve la conexión al pool mientras espera
+        t.evento.wait(self.espera)
+        with self.lock:
+            if t.concedido:
+                return True
+            self._quitar(t)
+            self.rechazados += 1
+            return False
+
+    def _quitar(self, t: Turno):
+        turnos = self.esperando.get(t.empresa_id)
+        if turnos and t in turnos:
+            turnos.remove(t)
+            self.en_cola -= 1
+            if not turnos:
+                del self.esperando[t.empresa_id]
+
+    def salir(self, empresa_id, segundos: float = None):
+        """Libera el lugar; 'segundos' (si se da) entra en la duración media."""
+        with self.lock:
+            self.en_curso -= 1
+            self.activos[empresa_id] -= 1
+            if self.activos[empresa_id] <= 0:
+                del self.activos[empresa_id]
+            if segundos is not None:
+                self.duracion = 0.8 * self.duracion + 0.2 * segundos
+            self._despachar()
+
+    def estado(self) -> dict:
+        with self.lock:
+            return dict(
+                limite=self.limite, cola=self.cola, en_curso=self.en_curso, en_cola=self.en_cola,
+                empresas_esperando=len(self.esperando), duracion_media=round(self.duracion, 3),
+                admitidos=self.admitidos, rechazados=self.rechazados,
+            )
+
+
+class Admision:
+    def __init__(self):
+        self.activo = False
+        self.clases = {}
+
+    def init_app(self, app):
+        self.activo = app.config.get("ADMISION", True)
+        for nombre, cfg in app.config.get("ADMISION_CLASES", {}).items():
+            self.clases[nombre] = Clase(nombre, **cfg)
+
+    def limitar(self, nombre: str, empresa):
+        """Decorador de vista: 'empresa' es la función que resuelve la empresa del pedido."""
+        def deco(f):
+            @wraps(f)
+            def wrap(*args, **kwargs):
+                clase = self.clases.get(nombre)
+                if not self.activo or clase is None:
+                    return f(*args, **kwargs)
+                empresa_id = empresa()
+                if not clase.entrar(empresa_id):
+                    resp = make_response(jsonify(
+                        error="Demasiados reportes en curso, reintente en unos segundos", clase=nombre), 429)
+                    resp.headers["Retry-After"] = str(clase.reintentar_en())
+                    abort(resp)
+                lugar = g._admision = Lugar(clase, empresa_id)
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    g.pop("_admision", None)
+                    if not lugar.cedido:
+                        clase.salir(empresa_id, time.monotonic() - lugar.inicio)
+            return wrap
+        return deco
+
+    @contextmanager
+    def ceder(self):
+        """Libera el lugar del pedido en curso (si tiene uno) antes de una espera
+        larga que no consume cupo. No se recupera al salir del bloque."""
+        lugar = g.get("_admision") if has_request_context() else None
+        if lugar is not None and not lugar.cedido:
+            lugar.cedido = True
+            lugar.clase.salir(lugar.empresa_id)
+            db.session.rollback()  # como en la cola: la conexión vuelve al pool mientras espera
+        yield
+
+    def estado(self) -> dict:
+        return {nombre: c.estado() for nombre, c in self.clases.items()}
+
+
+admision = Admision()
+limitar = admision.limitar
+ceder = admision.ceder
+
+
+def init_app(app):
+    admision.init_app(app)
@@ -0,0 +1,102 @@
+# services/agregados.py
+"""
+Motor de agregación vectorizado para libros grandes.
+
+Los renglones se cargan como arreglos int64 paralelos (índice de cuenta,
+centavos con signo y ordinal de fecha) y los saldos por cuenta, por período y
+acumulados se calculan con reducciones de NumPy. Trabajar en centavos enteros mantiene el resultado
+idéntico al cálculo con Decimal.
+"""
+import numpy as np
+
+from services.centavos import CENTAVO, a_centavos, centavos_sql, de_centavos  # noqa: F401 (se reexportan)
+
+
+class Movimientos:
+    """Renglones como arreglos paralelos.
+
+    - idx: posición de la cuenta en el índice del plan
+    - centavos: importe con signo (debe +, haber -)
+    - ordinal: fecha del asiento como date.toordinal()
+    """
+    __slots__ = ("idx", "centavos", "ordinal")
+
+    def __init__(self, idx, centavos, ordinal):
+        self.idx = idx
+        self.centavos = centavos
+        self.ordinal = ordinal
+
+    def __len__(self):
+        return len(self.idx)
+
+
+def cargar(rows, indice: dict) -> Movimientos:
+    """rows: iterable de (id_cuenta, centavos con signo, fecha).
+    indice: id_cuenta -> posición. Los renglones de cuentas ajenas al índice se ignoran.
+    """
+    rows = rows if isinstance(rows, list) else list(rows)
+    n = len(rows)
+    get = indice.get
+    idx = np.fromiter((get(r[0], -1) for r in rows), dtype=np.int64, count=n)
+    cts = np.fromiter((r[1] for r in rows), dtype=np.int64, count=n)
+    ords = np.fromiter((r[2].toordinal() for r in rows), dtype=np.int64, count=n)
+    ok = idx >= 0
+    return Movimientos(idx[ok], cts[ok], ords[ok])
+
+
+def saldos_por_cuenta(mov: Movimientos, n: int):
+    """Saldo debe-haber en centavos por posición de cuenta (int64[n])."""
+    out = np.zeros(n, dtype=np.int64)
+    # add.at (y no bincount) para acumular en int64 sin pasar por float64
+    np.add.at(out, mov.idx, mov.centavos)
+    return out
+
+
+def saldos_por_periodo(mov: Movimientos, n: int, cortes):
+    """Centavos por período y posición de cuenta (int64[len(cortes) + 1, n]).
+
+    cortes: ordinales crecientes del inicio de cada período. El renglón cae en
+    el último corte <= su fecha; la fila 0 junta los anteriores al primer corte
+    y la fila i + 1 es el período i.
+    """
+    cortes = np.asarray(cortes, dtype=np.int64)
+    periodo = np.searchsorted(cortes, mov.ordinal, side="right")
+    out = np.zeros((len(cortes) + 1, n), dtype=np.int64)
+    np.add.at(out, (periodo, mov.idx), mov.centavos)
+    return out
+
+
+def acumulados(por_periodo, inicial=0):
+    """Saldo al final de cada período: suma acumulada de las filas más el saldo inicial."""
+    return np.cumsum(por_periodo, axis=0, dtype=np.int64) + np.asarray(inicial, dtype=np.int64)
+
+
+def acumulados_diarios(mov: Movimientos):
+    """Saldo de cada cuenta al final de cada día con movimientos.
+
+    Devuelve (idx, ordinal, acumulado), ordenados por cuenta y fecha: los
+    renglones se ordenan, se suman por día con reduceat y la suma acumulada
+    se reinicia en el primer día de cada cuenta.
+    """
+    if not len(mov):
+        vacio = np.zeros(0, dtype=np.int64)
+        return vacio, vacio, vacio
+    orden = np.lexsort((mov.ordinal, mov.idx))
+    idx, ords, cts = mov.idx[orden], mov.ordinal[orden], mov.centavos[orden]
+    nuevo_dia = np.ones(len(idx), dtype=bool)
+    nuevo_dia[1:] = (idx[1:] != idx[:-1]) | (ords[1:] != ords[:-1])
+    inicios = np.flatnonzero(nuevo_dia)
+    por_dia = np.add.reduceat(cts, inicios)
+    idx, ords = idx[inicios], ords[inicios]
+    acumulado = np.cumsum(por_dia)
+    nueva_cuenta = np.ones(len(idx), dtype=bool)
+    nueva_cuenta[1:] = idx[1:] != idx[:-1]
+    primeros = np.flatnonzero(nueva_cuenta)
+    previo = acumulado[primeros] - por_dia[primeros]
+    acumulado -= np.repeat(previo, np.diff(np.append(primeros, len(idx))))
+    return idx, ords, acumulado
+
+
+def normalizar(saldos, signos):
+    """Aplica la naturaleza de cada cuenta: signos[i] = 1 (deudora) o -1 (acreedora)."""
+    return saldos * np.asarray(signos, dtype=np.int64)
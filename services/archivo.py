@@ -0,0 +1,458 @@
+# services/archivo.py
+"""
+Archivo columnar de ejercicios cerrados.
+
+archivar() exporta los asientos de un ejercicio ya cerrado a
+ARCHIVO_DIR/<empresa>/<fecha_cierre>/: un .npy de ancho fijo por columna más
+manifest.json. Antes de borrar nada de asientos_diarios / detalle_asiento se
+vuelven a abrir los archivos y se comparan con la base la cantidad de
+asientos y renglones, el total debe, el total haber y el saldo de cada
+cuenta. Si algo no coincide el archivo se descarta y la base queda intacta.
+
+Los asientos archivados siguen existiendo: en cambios_libro quedan con la
+acción "archivado" (no "delete") y el listado, la búsqueda, la sincronización
+y el libro diario los leen de tramos().
+
+Los reportes cuyo "hasta" cae en un ejercicio archivado leen de tramo(): las
+columnas se abren con np.load(mmap_mode="r"), así el sistema operativo pagina
+solo el rango de fechas que se consulta y los workers comparten las páginas.
+Los renglones están ordenados por fecha, número de asiento e id de renglón.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from sqlalchemy import case, delete, func, select, update
+
+from models import db, Asiento, CierreEjercicio, DetalleAsiento, PlanCuenta
+from services import ejercicios, sincronizacion
+from services.centavos import centavos_sql, de_centavos
+
+VERSION = 1
+CLASES = ("normal", "cierre", "apertura")
+_CIERRE = CLASES.index("cierre")
+
+# columna -> dtype. a_*: un valor por asiento; r_*: un valor por renglón.
+# Los textos van como bytes UTF-8 concatenados (*_txt) más desplazamientos (*_off, n + 1).
+COLUMNAS = {
+    "a_id": "int64",
+    "a_num": "int64",
+    "a_fecha": "int32",       # date.toordinal()
+    "a_clase": "int8",        # posición en CLASES
+    "a_usuario": "int64",     # -1 = sin usuario
+    "a_leyenda_off": "int64",
+    "a_leyenda_txt": "uint8",
+    "a_doc_off": "int64",
+    "a_doc_txt": "uint8",
+    "r_id": "int64",
+    "r_asiento": "int32",     # posición en las columnas a_*
+    "r_cuenta": "int64",
+    "r_centavos": "int64",    # debe +, haber -
+    "r_fecha": "int32",
+}
+
+_dir = None
+_abiertos = OrderedDict()    # ruta -> Tramo
+_lock = threading.Lock()
+_MAX_ABIERTOS = 32
+
+
+class ErrorArchivo(ValueError):
+    pass
+
+
+def init_app(app):
+    global _dir
+    _dir = app.config.get("ARCHIVO_DIR") or os.path.join(app.instance_path, "archivo")
+
+
+def _ruta(empresa_id: int, fecha_cierre: date) -> str:
+    return os.path.join(_dir, str(empresa_id), fecha_cierre.isoformat())
+
+
+def _fecha(valor):
+    if isinstance(valor, str):
+        return date.fromisoformat(valor) if valor else None
+    return valor
+
+
+def _sha256(ruta: str) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _textos(valores):
+    """Lista de str -> (desplazamientos int64[n + 1], bytes uint8)."""
+    datos = [(v or "").encode("utf-8") for v in valores]
+    off = np.zeros(len(datos) + 1, dtype=np.int64)
+    np.cumsum([len(d) for d in datos], out=off[1:])
+    return off, np.frombuffer(b"".join(datos), dtype=np.uint8)
+
+
+class Tramo:
+    """Un ejercicio archivado, con sus columnas mapeadas en memoria (solo lectura)."""
+    __slots__ = ("ruta", "manifest", "col", "desde", "hasta", "cuentas")
+
+    def __init__(self, ruta: str):
+        with open(os.path.join(ruta, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != VERSION:
+            raise ErrorArchivo(f"Versión de archivo no soportada en {ruta}")
+        self.ruta = ruta
+        self.col = {n: np.load(os.path.join(ruta, n + ".npy"), mmap_mode="r") for n in self.manifest["columnas"]}
+        self.desde = _fecha(self.manifest["desde"])
+        self.hasta = _fecha(self.manifest["hasta"])
+        self.cuentas = {int(k): v for k, v in self.manifest["cuentas"].items()}
+
+    def _rango(self, desde=None, hasta=None):
+        """slice de renglones con fecha en [desde, hasta] (las fechas están ordenadas)."""
+        f = self.col["r_fecha"]
+        desde, hasta = _fecha(desde), _fecha(hasta)
+        lo = int(np.searchsorted(f, desde.toordinal(), side="left")) if desde else 0
+        hi = int(np.searchsorted(f, hasta.toordinal(), side="right")) if hasta else len(f)
+        return slice(lo, hi)
+
+    def _texto(self, campo: str, i: int) -> str:
+        off = self.col[f"a_{campo}_off"]
+        return bytes(self.col[f"a_{campo}_txt"][off[i]:off[i + 1]]).decode("utf-8")
+
+    def saldos(self, desde=None, hasta=None) -> dict:
+        """{id_cuenta: centavos debe - haber} sin asientos de cierre, como los reportes."""
+        r = self._rango(desde, hasta)
+        cuentas = self.col["r_cuenta"][r]
+        cts = self.col["r_centavos"][r]
+        ok = self.col["a_clase"][self.col["r_asiento"][r]] != _CIERRE
+        ids, inv = np.unique(cuentas[ok], return_inverse=True)
+        out = np.zeros(len(ids), dtype=np.int64)
+        np.add.at(out, inv, cts[ok])
+        return {int(i): int(v) for i, v in zip(ids, out)}
+
+    def totales_diarios(self, cuentas=None) -> list:
+        """[(id_cuenta, fecha, clase, centavos)] sumados por cuenta, día y clase de asiento."""
+        cuenta = self.col["r_cuenta"]
+        ok = np.isin(cuenta, list(cuentas)) if cuentas is not None else np.ones(len(cuenta), dtype=bool)
+        if not ok.any():
+            return []
+        claves = np.stack([
+            cuenta[ok],
+            self.col["r_fecha"][ok].astype(np.int64),
+            self.col["a_clase"][self.col["r_asiento"][ok]].astype(np.int64),
+        ], axis=1)
+        unicas, inv = np.unique(claves, axis=0, return_inverse=True)
+        suma = np.zeros(len(unicas), dtype=np.int64)
+        np.add.at(suma, inv.ravel(), self.col["r_centavos"][ok])
+        return [
+            (int(c), date.fromordinal(int(f)), CLASES[int(k)], int(v))
+            for (c, f, k), v in zip(unicas, suma)
+        ]
+
+    def movimientos(self, id_cuenta: int, desde=None, hasta=None) -> list:
+        """Renglones de una cuenta para el mayor: [(fecha, leyenda, centavos)] en orden."""
+        r = self._rango(desde, hasta)
+        pos = np.nonzero(self.col["r_cuenta"][r] == id_cuenta)[0] + r.start
+        out = []
+        for p in pos:
+            a = int(self.col["r_asiento"][p])
+            if self.col["a_clase"][a] == _CIERRE:
+                continue
+            out.append((date.fromordinal(int(self.col["r_fecha"][p])), self._texto("leyenda", a),
+                        int(self.col["r_centavos"][p])))
+        return out
+
+    def _asiento(self, a: int) -> dict:
+        """Asiento en la posición a con sus renglones (contiguos, en el mismo orden)."""
+        usuario = int(self.col["a_usuario"][a])
+        r_asiento = self.col["r_asiento"]
+        lo = int(np.searchsorted(r_asiento, a, side="left"))
+        hi = int(np.searchsorted(r_asiento, a, side="right"))
+        detalles = []
+        for p in range(lo, hi):
+            cts = int(self.col["r_centavos"][p])
+            id_cuenta = int(self.col["r_cuenta"][p])
+            detalles.append(dict(
+                id_detalle=int(self.col["r_id"][p]), id_cuenta=id_cuenta, cuenta=self.cuentas.get(id_cuenta, ""),
+                tipo="debe" if cts > 0 else "haber", importe=de_centavos(abs(cts)),
+            ))
+        return dict(
+            id=int(self.col["a_id"][a]), num=int(self.col["a_num"][a]),
+            fecha=date.fromordinal(int(self.col["a_fecha"][a])),
+            clase=CLASES[int(self.col["a_clase"][a])], id_usuario=None if usuario < 0 else usuario,
+            leyenda=self._texto("leyenda", a), doc=self._texto("doc", a), detalles=detalles,
+        )
+
+    def asientos(self, desde=None, hasta=None, antes_de=None, limite=None, usuario=None, cuenta=None,
+                 importe_min=None, importe_max=None, texto=None, descendente=False) -> list:
+        """Asientos del rango con sus renglones (incluye el de cierre), en orden o, con
+        descendente, del más nuevo al más viejo.
+
+        Los filtros numéricos se resuelven sobre las columnas y solo se arman los
+        asientos que pasan, hasta 'limite':
+        - antes_de: (fecha, número), cursor de la búsqueda: solo los anteriores;
+        - usuario: id_usuario;
+        - cuenta / importe_min / importe_max: algún renglón que cumpla todos a la vez;
+        - texto: función (leyenda, doc) -> bool, se evalúa al final.
+        """
+        fechas = self.col["a_fecha"]
+        desde, hasta = _fecha(desde), _fecha(hasta)
+        lo = int(np.searchsorted(fechas, desde.toordinal(), side="left")) if desde else 0
+        hi = int(np.searchsorted(fechas, hasta.toordinal(), side="right")) if hasta else len(fechas)
+        if antes_de is not None:
+            c_fecha, c_num = antes_de
+            ini = int(np.searchsorted(fechas, c_fecha.toordinal(), side="left"))
+            fin = int(np.searchsorted(fechas, c_fecha.toordinal(), side="right"))
+            # el mismo día del cursor está ordenado por número: se corta en el primero >= c_num
+            hi = min(hi, ini + int(np.searchsorted(self.col["a_num"][ini:fin], c_num, side="left")))
+        if lo >= hi:
+            return []
+        ok = np.ones(hi - lo, dtype=bool)
+        if usuario is not None:
+            ok &= self.col["a_usuario"][lo:hi] == usuario
+        if cuenta is not None or importe_min is not None or importe_max is not None:
+            r = slice(int(np.searchsorted(self.col["r_asiento"], lo, side="left")),
+                      int(np.searchsorted(self.col["r_asiento"], hi, side="left")))
+            renglon = np.ones(r.stop - r.start, dtype=bool)
+            if cuenta is not None:
+                renglon &= self.col["r_cuenta"][r] == cuenta
+            cts = np.abs(self.col["r_centavos"][r])
+            if importe_min is not None:
+                renglon &= cts >= math.ceil(Decimal(importe_min) * 100)
+            if importe_max is not None:
+                renglon &= cts <= math.floor(Decimal(importe_max) * 100)
+            con_renglon = np.zeros(hi - lo, dtype=bool)
+            con_renglon[self.col["r_asiento"][r][renglon] - lo] = True
+            ok &= con_renglon
+        posiciones = np.flatnonzero(ok) + lo
+        out = []
+        for a in (posiciones[::-1] if descendente else posiciones).tolist():
+            if texto is not None and not texto(self._texto("leyenda", a), self._texto("doc", a)):
+                continue
+            out.append(self._asiento(a))
+            if limite is not None and len(out) >= limite:
+                break
+        return out
+
+def abrir(ruta: str) -> Tramo:
+    with _lock:
+        t = _abiertos.get(ruta)
+        if t is not None:
+            _abiertos.move_to_end(ruta)
+            return t
+    t = Tramo(ruta)
+    with _lock:
+        _abiertos[ruta] = t
+        while len(_abiertos) > _MAX_ABIERTOS:
+            _abiertos.popitem(last=False)
+    return t
+
+
+def tramo(empresa_id: int, hasta):
+    """Tramo archivado del ejercicio que contiene 'hasta'; None si ese ejercicio está en la base."""
+    hasta = _fecha(hasta)
+    if hasta is None:
+        return None
+    cierre = (
+        CierreEjercicio.query
+        .filter(CierreEjercicio.id_empresa == empresa_id, CierreEjercicio.fecha_cierre >= hasta)
+        .order_by(CierreEjercicio.fecha_cierre.asc())
+        .first()
+    )
+    if cierre is None or cierre.archivado is None:
+        return None
+    return abrir(_ruta(empresa_id, cierre.fecha_cierre))
+
+
+def tramos(empresa_id: int, desde=None, hasta=None) -> list:
+    """Tramos archivados que se superponen con [desde, hasta], en orden cronológico."""
+    desde, hasta = _fecha(desde), _fecha(hasta)
+    q = CierreEjercicio.query.filter(
+        CierreEjercicio.id_empresa == empresa_id, CierreEjercicio.archivado.isnot(None))
+    if desde is not None:
+        q = q.filter(CierreEjercicio.fecha_cierre >= desde)
+    out = []
+    anterior = None
+    for c in q.order_by(CierreEjercicio.fecha_cierre.asc()):
+        # el tramo empieza al día siguiente del cierre anterior: no hace falta abrirlo para saberlo
+        if hasta is not None and anterior is not None and anterior >= hasta:
+            break
+        out.append(abrir(_ruta(empresa_id, c.fecha_cierre)))
+        anterior = c.fecha_cierre
+    return out
+
+
+def usa_cuenta(empresa_id: int, id_cuenta: int) -> bool:
+    """Si algún ejercicio archivado de la empresa tiene renglones en la cuenta."""
+    return any(id_cuenta in t.cuentas for t in tramos(empresa_id))
+
+
+# ---------------- Exportación ----------------
+
+def _filtro(empresa_id: int, desde, hasta) -> list:
+    cond = [Asiento.id_empresa == empresa_id, Asiento.fecha <= hasta]
+    if desde is not None:
+        cond.append(Asiento.fecha >= desde)
+    return cond
+
+
+def _esperado(filtro) -> dict:
+    """Totales de la base para el rango, con consultas independientes de la exportación."""
+    cts = centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe)
+    renglones = (
+        select(DetalleAsiento.id_cuenta, cts.label("cts"))
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .where(*filtro)
+        .subquery()
+    )
+    por_cuenta = {
+        int(i): int(v or 0) for i, v in db.session.execute(
+            select(renglones.c.id_cuenta, func.sum(renglones.c.cts)).group_by(renglones.c.id_cuenta))
+    }
+    n, debe, haber = db.session.execute(select(
+        func.count(),
+        func.sum(case((renglones.c.cts > 0, renglones.c.cts), else_=0)),
+        func.sum(case((renglones.c.cts < 0, -renglones.c.cts), else_=0)),
+    )).one()
+    asientos = db.session.execute(select(func.count()).select_from(Asiento).where(*filtro)).scalar()
+    return dict(asientos=int(asientos), renglones=int(n), total_debe=int(debe or 0),
+                total_haber=int(haber or 0), por_cuenta=por_cuenta)
+
+
+def _escribir(ruta: str, empresa_id: int, cierre: CierreEjercicio, desde, filtro) -> dict:
+    filas_a = db.session.execute(
+        select(Asiento.id_asiento, Asiento.num_asiento, Asiento.fecha, Asiento.clase,
+               Asiento.id_usuario, Asiento.leyenda, Asiento.doc_respaldatorio)
+        .where(*filtro)
+        .order_by(Asiento.fecha, Asiento.num_asiento, Asiento.id_asiento)
+    ).all()
+    filas_r = db.session.execute(
+        select(DetalleAsiento.id_detalle, DetalleAsiento.id_asiento, DetalleAsiento.id_cuenta,
+               centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe), Asiento.fecha)
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .where(*filtro)
+        .order_by(Asiento.fecha, Asiento.num_asiento, Asiento.id_asiento, DetalleAsiento.id_detalle)
+    ).all()
+    pos = {a[0]: i for i, a in enumerate(filas_a)}
+    na, nr = len(filas_a), len(filas_r)
+    ley_off, ley_txt = _textos([a[5] for a in filas_a])
+    doc_off, doc_txt = _textos([a[6] for a in filas_a])
+    columnas = dict(
+        a_id=np.fromiter((a[0] for a in filas_a), np.int64, na),
+        a_num=np.fromiter((a[1] or 0 for a in filas_a), np.int64, na),
+        a_fecha=np.fromiter((a[2].toordinal() for a in filas_a), np.int32, na),
+        a_clase=np.fromiter((CLASES.index(a[3] or "normal") for a in filas_a), np.int8, na),
+        a_usuario=np.fromiter((-1 if a[4] is None else a[4] for a in filas_a), np.int64, na),
+        a_leyenda_off=ley_off, a_leyenda_txt=ley_txt,
+        a_doc_off=doc_off, a_doc_txt=doc_txt,
+        r_id=np.fromiter((r[0] for r in filas_r), np.int64, nr),
+        r_asiento=np.fromiter((pos[r[1]] for r in filas_r), np.int32, nr),
+        r_cuenta=np.fromiter((r[2] for r in filas_r), np.int64, nr),
+        r_centavos=np.fromiter((r[3] for r in filas_r), np.int64, nr),
+        r_fecha=np.fromiter((r[4].toordinal() for r in filas_r), np.int32, nr),
+    )
+    os.makedirs(ruta)
+    meta = {}
+    for nombre, dtype in COLUMNAS.items():
+        arr = np.ascontiguousarray(columnas[nombre], dtype=dtype)
+        archivo_col = os.path.join(ruta, nombre + ".npy")
+        np.save(archivo_col, arr)
+        meta[nombre] = dict(dtype=dtype, filas=len(arr), sha256=_sha256(archivo_col))
+    ids_cuenta = sorted({r[2] for r in filas_r})
+    nombres = dict(db.session.execute(
+        select(PlanCuenta.id_cuenta, PlanCuenta.cuenta).where(PlanCuenta.id_cuenta.in_(ids_cuenta))
+    ).all()) if ids_cuenta else {}
+    cts = columnas["r_centavos"]
+    manifest = dict(
+        version=VERSION,
+        empresa=empresa_id,
+        id_cierre=cierre.id_cierre,
+        id_asiento_cierre=cierre.id_asiento_cierre,
+        desde=desde.isoformat() if desde else None,
+        hasta=cierre.fecha_cierre.isoformat(),
+        asientos=na,
+        renglones=nr,
+        total_debe=int(cts[cts > 0].sum()),
+        total_haber=int(-cts[cts < 0].sum()),
+        columnas=meta,
+        cuentas={str(i): nombres.get(i, "") for i in ids_cuenta},
+        creado=datetime.utcnow().isoformat(timespec="seconds"),
+    )
+    with open(os.path.join(ruta, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+
+def verificar(ruta: str, esperado: dict):
+    """Reabre el archivo (mmap) y lo compara con los totales de la base; ErrorArchivo si difiere."""
+    t = Tramo(ruta)
+    for nombre, meta in t.manifest["columnas"].items():
+        if len(t.col[nombre]) != meta["filas"] or _sha256(os.path.join(ruta, nombre + ".npy")) != meta["sha256"]:
+            raise ErrorArchivo(f"Columna {nombre} dañada")
+    cts = t.col["r_centavos"]
+    obtenido = dict(
+        asientos=len(t.col["a_id"]),
+        renglones=len(cts),
+        total_debe=int(cts[cts > 0].sum()),
+        total_haber=int(-cts[cts < 0].sum()),
+    )
+    ids, inv = np.unique(t.col["r_cuenta"], return_inverse=True)
+    suma = np.zeros(len(ids), dtype=np.int64)
+    np.add.at(suma, inv, cts)
+    obtenido["por_cuenta"] = {int(i): int(v) for i, v in zip(ids, suma)}
+    for clave, valor in esperado.items():
+        if obtenido[clave] != valor:
+            raise ErrorArchivo(f"El archivo no coincide con la base ({clave})")
+
+
+def archivar(cierre: CierreEjercicio) -> dict:
+    """Archiva el ejercicio que termina en 'cierre' y borra sus asientos de la base (sin commit).
+    Devuelve el manifest."""
+    if cierre.archivado is not None:
+        raise ErrorArchivo("El ejercicio ya está archivado")
+    empresa_id = cierre.id_empresa
+    previo = ejercicios.ultimo_cierre(empresa_id, antes_de=cierre.fecha_cierre)
+    if previo is not None and previo.archivado is None:
+        raise ErrorArchivo(f"Primero hay que archivar el ejercicio cerrado al {previo.fecha_cierre.isoformat()}")
+    desde = previo.fecha_cierre + timedelta(days=1) if previo else None
+    filtro = _filtro(empresa_id, desde, cierre.fecha_cierre)
+
+    ruta = _ruta(empresa_id, cierre.fecha_cierre)
+    tmp = ruta + ".tmp"
+    # restos de un intento anterior que no llegó al commit
+    for r in (tmp, ruta):
+        if os.path.isdir(r):
+            shutil.rmtree(r)
+    with _lock:
+        _abiertos.pop(ruta, None)
+    try:
+        manifest = _escribir(tmp, empresa_id, cierre, desde, filtro)
+        verificar(tmp, _esperado(filtro))
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    os.replace(tmp, ruta)
+
+    ids = select(Asiento.id_asiento).where(*filtro)
+    borrados = [i for (i,) in db.session.execute(ids)]
+    for col in (CierreEjercicio.id_asiento_cierre, CierreEjercicio.id_asiento_apertura):
+        db.session.execute(
+            update(CierreEjercicio).where(col.in_(ids)).values({col.key: None})
+            .execution_options(synchronize_session=False)
+        )
+    db.session.execute(delete(DetalleAsiento).where(DetalleAsiento.id_asiento.in_(ids))
+                       .execution_options(synchronize_session=False))
+    db.session.execute(delete(Asiento).where(*filtro).execution_options(synchronize_session=False))
+    if borrados:
+        # no es una baja: siguen existiendo, de solo lectura, en el archivo
+        sincronizacion.avanzar(empresa_id, [("asiento", i, "archivado") for i in borrados])
+    cierre.archivado = datetime.utcnow()
+    db.session.flush()
+    return manifest
@@ -0,0 +1,286 @@
+# services/auditoria.py
+"""
+Bitácora (change_log) con escritura diferida y en lotes.
+
+registrar() deja el evento en la sesión actual. Antes del commit de la base
+(before_commit) los eventos de la transacción se agregan, con fsync, a un
+archivo de escritura anticipada (WAL) por proceso, marcados con un id de
+transacción. Si el commit se confirma pasan a una cola en memoria y un hilo por
+proceso la vuelca a change_log en lotes; si hay rollback se anota en el WAL que
+esa transacción se descartó.
+
+Al arrancar, cada worker reclama (os.replace a un nombre con su pid) los WAL
+de procesos caídos y los reinserta, salvo las transacciones descartadas. La
+entrega es al-menos-una-vez: un cambio confirmado nunca se queda sin su evento.
+Si el proceso cae justo durante el commit, sin saber si la base lo confirmó,
+el evento también se inserta.
+
+Sin init_app() (scripts, consola) registrar() escribe el ChangeLog en la misma
+transacción, como antes.
+"""
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event, insert
+
+from models import db, ChangeLog, RoutingSession
+
+_PENDIENTES = "auditoria_pendientes"
+_TX = "auditoria_tx"
+
+
+class EscritorAuditoria:
+    def __init__(self):
+        self.app = None
+        self.cola = queue.Queue()
+        self.hay_datos = threading.Event()
+        self.urgente = threading.Event()
+        self.lock = threading.Lock()
+        self.hilo = None
+        self.pid = None
+        self.tam_lote = 200
+        self.intervalo = 0.5
+        self.fsync = True
+        self.dir_wal = None
+        self.en_vuelo = {}  # id de transacción -> eventos ya en el WAL, sin commit todavía
+
+    # --- configuración ---
+    def init_app(self, app):
+        self.app = app
+        self.tam_lote = app.config.get("AUDITORIA_TAM_LOTE", 200)
+        self.intervalo = app.config.get("AUDITORIA_INTERVALO", 0.5)
+        self.fsync = app.config.get("AUDITORIA_FSYNC", True)
+        self.dir_wal = app.config.get("AUDITORIA_WAL_DIR") or os.path.join(app.instance_path, "auditoria")
+        os.makedirs(self.dir_wal, exist_ok=True)
+        with app.app_context():
+            self._recuperar_huerfanos()
+        atexit.register(self.vaciar)
+
+    @property
+    def activo(self) -> bool:
+        return self.app is not None
+
+    def _wal(self) -> str:
+        return os.path.join(self.dir_wal, f"auditoria-{os.getpid()}.wal")
+
+    def _asegurar_hilo(self):
+        # Se arranca de forma perezosa para que cada worker (post-fork) tenga el suyo
+        if self.hilo is not None and self.pid == os.getpid() and self.hilo.is_alive():
+            return
+        with self.lock:
+            if self.hilo is not None and self.pid == os.getpid() and self.hilo.is_alive():
+                return
+            self.pid = os.getpid()
+            self.hilo = threading.Thread(target=self._bucle, name="auditoria", daemon=True)
+            self.hilo.start()
+
+    # --- productores ---
+    def _escribir(self, registros: list):
+        """Agrega líneas al WAL del proceso (con self.lock tomado)."""
+        with open(self._wal(), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, default=str) + "\n" for r in registros))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def anotar(self, eventos: list) -> str:
+        """Antes del commit: persiste los eventos en el WAL. Devuelve el id de transacción."""
+        tx = uuid.uuid4().hex
+        for n, e in enumerate(eventos):
+            e["tx"], e["n"] = tx, n
+        with self.lock:
+            self._escribir(eventos)
+            self.en_vuelo[tx] = eventos
+        return tx
+
+    def confirmar(self, tx: str):
+        """La base confirmó: los eventos quedan para el próximo lote."""
+        with self.lock:
+            for e in self.en_vuelo.pop(tx, ()):
+                self.cola.put(e)
+        self.hay_datos.set()
+        self._asegurar_hilo()
+
+    def descartar(self, tx: str):
+        """Rollback: la recuperación no tiene que insertar esos eventos."""
+        with self.lock:
+            if self.en_vuelo.pop(tx, None) is not None:
+                self._escribir([dict(tx=tx, descartada=True)])
+
+    # --- consumidor ---
+    def _bucle(self):
+        while True:
+            self.hay_datos.wait()
+            # junta un lote: espera el intervalo salvo que ya haya uno completo o lo apuren
+            if self.cola.qsize() < self.tam_lote and not self.urgente.is_set():
+                self.urgente.wait(self.intervalo)
+            self.urgente.clear()
+            self.hay_datos.clear()
+            try:
+                self.vaciar()
+            except Exception:
+                self.app.logger.exception("[AUDITORIA] no se pudo volcar el lote; se reintenta")
+                self.hay_datos.set()
+                time.sleep(self.intervalo)
+
+    def apurar(self) -> int:
+        """Pide al hilo que vuelque ya lo encolado, sin esperar el intervalo ni bloquear.
+        Devuelve cuántos eventos confirmados de este proceso faltan volcar."""
+        pendientes = self.cola.qsize()
+        if self.activo and pendientes:
+            self.urgente.set()
+            self.hay_datos.set()
+            self._asegurar_hilo()
+        return pendientes
+
+    def vaciar(self):
+        """Vuelca a change_log todo lo encolado hasta ahora en este proceso."""
+        if not self.activo:
+            return
+        with self.lock:
+            wal = self._wal()
+            if self.cola.empty() or not os.path.exists(wal):
+                return
+            # Todo lo encolado está en el WAL: lo rotamos y drenamos la cola juntos;
+            # lo que sigue en vuelo se vuelve a anotar en el WAL nuevo
+            rotado = f"{wal}.{datetime.now():%Y%m%d%H%M%S%f}"
+            os.replace(wal, rotado)
+            if self.en_vuelo:
+                self._escribir([e for evs in self.en_vuelo.values() for e in evs])
+            eventos = []
+            while True:
+                try:
+                    eventos.append(self.cola.get_nowait())
+                except queue.Empty:
+                    break
+        try:
+            with self.app.app_context():
+                self._insertar(eventos)
+        except Exception:
+            # se reintenta desde el archivo rotado
+            with self.lock:
+                for e in eventos:
+                    self.cola.put(e)
+                with open(self._wal(), "a", encoding="utf-8") as f:
+                    with open(rotado, encoding="utf-8") as g:
+                        f.write(g.read())
+                os.remove(rotado)
+            raise
+        os.remove(rotado)
+
+    def _insertar(self, eventos: list):
+        filas = [
+            dict({k: v for k, v in e.items() if k not in ("tx", "n")},
+                 ts=datetime.fromisoformat(e["ts"]) if isinstance(e.get("ts"), str) else e.get("ts"))
+            for e in eventos
+        ]
+        for i in range(0, len(filas), self.tam_lote):
+            db.session.execute(insert(ChangeLog), filas[i:i + self.tam_lote])
+        db.session.commit()
+
+    def _recuperar_huerfanos(self):
+        """Reinserta los WAL de procesos que ya no existen.
+        Cada archivo se reclama primero renombrándolo con el pid propio: si otro worker
+        que arranca a la vez lo tomó antes, ya no está y se saltea."""
+        reclamados = []
+        for path in sorted(glob.glob(os.path.join(self.dir_wal, "auditoria-*.wal*"))):
+            try:
+                pid = int(os.path.basename(path).split("-")[1].split(".")[0])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _proceso_vivo(pid):
+                continue
+            if pid == os.getpid() and ".rec" in os.path.basename(path):
+                continue  # ya reclamado por este proceso
+            destino = os.path.join(self.dir_wal, f"auditoria-{os.getpid()}.wal.rec{len(reclamados)}-{uuid.uuid4().hex[:8]}")
+            try:
+                os.replace(path, destino)
+            except FileNotFoundError:
+                continue
+            reclamados.append(destino)
+        if not reclamados:
+            return
+        registros = []
+        for path in reclamados:
+            with open(path, encoding="utf-8") as f:
+                registros.extend(json.loads(l) for l in f if l.strip())
+        descartadas = {r["tx"] for r in registros if r.get("descartada")}
+        vistos, eventos = set(), []
+        for r in registros:
+            if r.get("descartada") or r.get("tx") in descartadas:
+                continue
+            clave = (r.get("tx"), r.get("n")) if r.get("tx") else None
+            if clave is not None:
+                if clave in vistos:
+                    continue  # re-anotado al rotar
+                vistos.add(clave)
+            eventos.append(r)
+        if eventos:
+            self._insertar(eventos)
+        for path in reclamados:
+            os.remove(path)
+
+
+def _proceso_vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+escritor = EscritorAuditoria()
+
+
+def init_app(app):
+    escritor.init_app(app)
+
+
+def registrar(entidad: str, id_entidad: int, accion: str, id_usuario=None, id_empresa=None, datos=None):
+    """Registra un evento de auditoría ligado a la transacción actual."""
+    evento = dict(
+        entidad=entidad,
+        id_entidad=id_entidad,
+        accion=accion,
+        id_usuario=id_usuario,
+        id_empresa=id_empresa,
+        ts=datetime.now().isoformat(timespec="microseconds"),
+        datos=json.dumps(datos or {}, ensure_ascii=False, default=str),
+    )
+    if not escritor.activo:
+        evento["ts"] = datetime.fromisoformat(evento["ts"])
+        db.session.add(ChangeLog(**evento))
+        return
+    db.session.info.setdefault(_PENDIENTES, []).append(evento)
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _antes_de_confirmar(session):
+    eventos = session.info.get(_PENDIENTES)
+    if eventos and escritor.activo and _TX not in session.info:
+        session.info[_TX] = escritor.anotar(eventos)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _al_confirmar(session):
+    session.info.pop(_PENDIENTES, None)
+    tx = session.info.pop(_TX, None)
+    if tx is not None:
+        escritor.confirmar(tx)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _al_descartar(session, previous_transaction):
+    session.info.pop(_PENDIENTES, None)
+    tx = session.info.pop(_TX, None)
+    if tx is not None:
+        escritor.descartar(tx)
@@ -0,0 +1,195 @@
+# services/bus_libro.py
+"""
+Bus de invalidación entre workers del mismo host.
+
+Con gunicorn cada worker es un proceso y las cachés en memoria (índice de
+cuentas, historial SSE) solo se enteran de los cambios que hace ese mismo
+proceso. Cada libro_confirmado se anota además en un registro circular
+compartido por mmap (BUS_LIBRO_ARCHIVO, por defecto instance/bus_libro.mmap):
+
+    cabecera: magia, capacidad, cabeza (cantidad de entradas escritas)
+    entrada:  secuencia, pid, empresa, versión, id_entidad, código (entidad/acción)
+
+Escribir toma un flock exclusivo; cada entrada se escribe con la secuencia en
+cero y se publica al final (seqlock), así un lector nunca toma una entrada a
+medio escribir. Un hilo por proceso mira la cabeza cada BUS_LIBRO_INTERVALO
+segundos (por defecto 100 ms) y emite eventos.libro_remoto por cada entrada de
+otro pid. Mientras la cabeza no se mueve el intervalo se duplica hasta
+BUS_LIBRO_INTERVALO_MAX (500 ms); con la primera entrada nueva vuelve al mínimo. Si se atrasó más que la capacidad o la entrada ya fue pisada, emite
+libro_remoto con sender None (invalidar todo).
+
+Sin fcntl (Windows) el bus queda apagado.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+
+from services import eventos, sincronizacion
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_MAGIA = b"BUSLIB01"
+_CABECERA = struct.Struct("<8sqq")          # magia, capacidad, cabeza
+_ENTRADA = struct.Struct("<qqqqqq")         # secuencia, pid, empresa, version, id_entidad, codigo
+_INICIO = 64
+ENTIDADES = ("asiento", "cuenta")
+ACCIONES = ("create", "update", "delete")
+
+
+def _codigo(entidad: str, accion: str) -> int:
+    return (ENTIDADES.index(entidad) + 1) * 4 + ACCIONES.index(accion) + 1
+
+
+def _decodificar(codigo: int):
+    e, a = divmod(codigo, 4)
+    return ENTIDADES[e - 1], ACCIONES[a - 1]
+
+
+class BusLibro:
+    def __init__(self, capacidad: int = 4096):
+        self.app = None
+        self.capacidad = capacidad
+        self.ruta = None
+        self.intervalo = 0.1
+        self.intervalo_max = 0.5
+        self.mm = None
+        self.fd = None
+        self.pid = None
+        self.hilo = None
+        self.lock = threading.Lock()
+        self.ultima = 0
+
+    # --- configuración ---
+    def init_app(self, app):
+        if fcntl is None or not app.config.get("BUS_LIBRO", True):
+            return
+        self.app = app
+        self.capacidad = app.config.get("BUS_LIBRO_CAPACIDAD", self.capacidad)
+        self.intervalo = app.config.get("BUS_LIBRO_INTERVALO", self.intervalo)
+        self.intervalo_max = max(app.config.get("BUS_LIBRO_INTERVALO_MAX", self.intervalo_max), self.intervalo)
+        self.ruta = app.config.get("BUS_LIBRO_ARCHIVO") or os.path.join(app.instance_path, "bus_libro.mmap")
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+
+        @app.before_request
+        def _arrancar_bus():
+            self._asegurar_hilo()
+
+    @property
+    def activo(self) -> bool:
+        return self.app is not None
+
+    def _abrir(self):
+        """Mapea el archivo (uno por proceso: tras el fork se vuelve a abrir)."""
+        tam = _INICIO + self.capacidad * _ENTRADA.size
+        fd = os.open(self.ruta, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < tam:
+                os.ftruncate(fd, tam)
+            mm = mmap.mmap(fd, tam)
+            magia, capacidad, _cabeza = _CABECERA.unpack_from(mm, 0)
+            if magia != _MAGIA or capacidad != self.capacidad:
+                mm[:tam] = bytes(tam)
+                _CABECERA.pack_into(mm, 0, _MAGIA, self.capacidad, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self.fd, self.mm, self.pid = fd, mm, os.getpid()
+
+    def _asegurar_hilo(self):
+        if self.hilo is not None and self.pid == os.getpid() and self.hilo.is_alive():
+            return
+        with self.lock:
+            if self.hilo is not None and self.pid == os.getpid() and self.hilo.is_alive():
+                return
+            self._abrir()
+            self.ultima = self._cabeza()
+            self.hilo = threading.Thread(target=self._bucle, name="bus_libro", daemon=True)
+            self.hilo.start()
+
+    def _cabeza(self) -> int:
+        return _CABECERA.unpack_from(self.mm, 0)[2]
+
+    # --- productor ---
+    def publicar(self, empresa_id: int, entidad: str, accion: str, id_entidad: int, version=None):
+        if not self.activo or entidad not in ENTIDADES or accion not in ACCIONES:
+            return
+        self._asegurar_hilo()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            cabeza = self._cabeza() + 1
+            off = _INICIO + (cabeza - 1) % self.capacidad * _ENTRADA.size
+            _ENTRADA.pack_into(self.mm, off, 0, self.pid, empresa_id, version or 0, id_entidad or 0,
+                               _codigo(entidad, accion))
+            struct.pack_into("<q", self.mm, off, cabeza)
+            struct.pack_into("<q", self.mm, 16, cabeza)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    # --- consumidor ---
+    def _bucle(self):
+        espera = self.intervalo
+        while True:
+            time.sleep(espera)
+            antes = self.ultima
+            try:
+                self.leer()
+            except Exception:
+                self.app.logger.exception("[BUS_LIBRO] no se pudo leer el registro")
+            espera = self.intervalo if self.ultima != antes else min(espera * 2, self.intervalo_max)
+
+    def leer(self) -> int:
+        """Emite libro_remoto por las entradas nuevas de otros procesos. Devuelve cuántas leyó."""
+        cabeza = self._cabeza()
+        if cabeza == self.ultima:
+            return 0
+        if cabeza < self.ultima or cabeza - self.ultima > self.capacidad:
+            self.ultima = cabeza
+            self._emitir_todo()
+            return 0
+        leidas = 0
+        for sec in range(self.ultima + 1, cabeza + 1):
+            off = _INICIO + (sec - 1) % self.capacidad * _ENTRADA.size
+            entrada = _ENTRADA.unpack_from(self.mm, off)
+            if entrada[0] != sec or struct.unpack_from("<q", self.mm, off)[0] != sec:
+                self.ultima = cabeza
+                self._emitir_todo()  # pisada por un productor que dio toda la vuelta
+                return leidas
+            _sec, pid, empresa_id, version, id_entidad, codigo = entrada
+            leidas += 1
+            if pid == self.pid:
+                continue
+            entidad, accion = _decodificar(codigo)
+            self._emitir(empresa_id, entidad=entidad, accion=accion, id_entidad=id_entidad, version=version)
+        self.ultima = cabeza
+        return leidas
+
+    def _emitir(self, empresa_id, **datos):
+        with self.app.app_context():
+            try:
+                eventos.libro_remoto.send(empresa_id, **datos)
+            except Exception:
+                self.app.logger.exception("[BUS_LIBRO] falló un suscriptor de libro_remoto")
+
+    def _emitir_todo(self):
+        self._emitir(None, entidad=None, accion=None, id_entidad=None, version=None)
+
+
+bus = BusLibro()
+
+
+def init_app(app):
+    bus.init_app(app)
+
+
+@eventos.libro_confirmado.connect
+def _al_confirmar(empresa_id, entidad=None, accion=None, id_entidad=None, **extra):
+    if not bus.activo:
+        return
+    bus.publicar(empresa_id, entidad, accion, id_entidad, sincronizacion.version_en_sesion(empresa_id))
+    if extra.get("id_base") is not None and accion == "update":
+        bus.publicar(empresa_id, entidad, "delete", extra["id_base"], sincronizacion.version_en_sesion(empresa_id))
@@ -0,0 +1,93 @@
+# services/busqueda_asientos.py
+"""
+Búsqueda de texto en asientos (leyenda y doc_respaldatorio).
+
+- MySQL/MariaDB: índice FULLTEXT ft_asiento_texto, consultado con MATCH ... AGAINST
+  en modo booleano.
+- SQLite: tabla virtual FTS5 asientos_fts con contenido externo, mantenida por
+  triggers. init_app() la crea (y la llena) si no existe.
+- Otros motores, o SQLite sin FTS5: LIKE sobre ambas columnas.
+"""
+import re
+
+from sqlalchemy import Integer, and_, column, or_, text
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.exc import OperationalError
+
+from models import db, Asiento
+
+_TERMINO = re.compile(r"\w+", re.UNICODE)
+_fts5 = False
+
+_DDL_SQLITE = (
+    """CREATE VIRTUAL TABLE asientos_fts USING fts5(
+        leyenda, doc_respaldatorio,
+        content='asientos_diarios', content_rowid='id_asiento',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS asientos_fts_ai AFTER INSERT ON asientos_diarios BEGIN
+        INSERT INTO asientos_fts(rowid, leyenda, doc_respaldatorio)
+        VALUES (new.id_asiento, new.leyenda, new.doc_respaldatorio);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS asientos_fts_ad AFTER DELETE ON asientos_diarios BEGIN
+        INSERT INTO asientos_fts(asientos_fts, rowid, leyenda, doc_respaldatorio)
+        VALUES ('delete', old.id_asiento, old.leyenda, old.doc_respaldatorio);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS asientos_fts_au AFTER UPDATE OF leyenda, doc_respaldatorio ON asientos_diarios BEGIN
+        INSERT INTO asientos_fts(asientos_fts, rowid, leyenda, doc_respaldatorio)
+        VALUES ('delete', old.id_asiento, old.leyenda, old.doc_respaldatorio);
+        INSERT INTO asientos_fts(rowid, leyenda, doc_respaldatorio)
+        VALUES (new.id_asiento, new.leyenda, new.doc_respaldatorio);
+    END""",
+    "INSERT INTO asientos_fts(asientos_fts) VALUES ('rebuild')",
+)
+
+
+def init_app(app):
+    """Prepara el índice de texto en SQLite; en MySQL lo crea schema.sql / create_all."""
+    global _fts5
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            return
+        existe = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'asientos_fts'")
+        ).first()
+        if not existe:
+            try:
+                for sql in _DDL_SQLITE:
+                    db.session.execute(text(sql))
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                app.logger.warning("[BUSQUEDA] SQLite sin FTS5: la búsqueda de texto usa LIKE")
+                return
+        _fts5 = True
+
+
+def terminos(q: str) -> list:
+    return _TERMINO.findall(q or "")
+
+
+def filtro_texto(q: str):
+    """Condición sobre Asiento para los términos de q (todos requeridos, por prefijo); None si no hay términos."""
+    palabras = terminos(q)
+    if not palabras:
+        return None
+    dialecto = db.engine.dialect.name
+    if dialecto in ("mysql", "mariadb"):
+        expr = " ".join(f"+{p}*" for p in palabras)
+        return match(Asiento.leyenda, Asiento.doc_respaldatorio, against=expr).in_boolean_mode()
+    if dialecto == "sqlite" and _fts5:
+        expr = " ".join(f'"{p}"*' for p in palabras)
+        ids = text("SELECT rowid FROM asientos_fts WHERE asientos_fts MATCH :fts").bindparams(fts=expr)
+        return Asiento.id_asiento.in_(ids.columns(column("rowid", Integer)))
+    condiciones = []
+    for p in palabras:
+        patron = f"%{p}%"
+        condiciones.append(or_(Asiento.leyenda.ilike(patron), Asiento.doc_respaldatorio.ilike(patron)))
+    return and_(*condiciones)
+
+
+def coincide(palabras: list, *textos) -> bool:
+    """Lo mismo que filtro_texto para asientos fuera de la base (archivados): cada término en algún texto."""
+    texto = " ".join(t or "" for t in textos).casefold()
+    return all(p.casefold() in texto for p in palabras)
@@ -0,0 +1,223 @@
+# services/busqueda_cuentas.py
+"""
+Búsqueda de cuentas en memoria, por empresa.
+
+Cada índice guarda las cuentas visibles de una empresa (ver services.plan) con:
+- un índice de prefijos: lista ordenada de palabras y campos completos, que se
+  recorre con bisect;
+- un índice de trigramas para tolerar errores de tipeo.
+
+Se indexan cuenta, cod_rubro y subrubro. Los índices se arman la primera vez
+que se busca en la empresa, se actualizan con los eventos de cuentas
+(libro_confirmado) y vencen a los BUSQUEDA_CUENTAS_TTL segundos, para tomar
+cambios hechos por otros procesos.
+
+Cada índice tiene su propio lock: búsquedas y cambios de una empresa no
+esperan a los de otra. El lock de CacheIndices solo cubre el diccionario de
+índices (buscar, insertar, desalojar), nunca una búsqueda.
+"""
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+
+from services import eventos
+
+# campo -> peso en el ranking
+_CAMPOS = (("cuenta", 3), ("cod_rubro", 2), ("subrubro", 1))
+# puntaje base por tipo de coincidencia
+_EXACTA, _INICIO, _PALABRA, _TRIGRAMA = 100, 60, 40, 20
+_SIMILITUD_MIN = 0.4
+
+
+def normalizar(texto) -> str:
+    """Minúsculas y sin acentos."""
+    t = str(texto or "").lower()
+    if t.isascii():
+        return t.strip()
+    t = unicodedata.normalize("NFKD", t)
+    return "".join(ch for ch in t if not unicodedata.combining(ch)).strip()
+
+
+def trigramas(palabra: str) -> set:
+    p = f"  {palabra} "
+    return {p[i:i + 3] for i in range(len(p) - 2)}
+
+
+class IndiceCuentas:
+    __slots__ = ("docs", "claves", "refs", "tri", "creado", "lock")
+
+    def __init__(self, cuentas=()):
+        self.docs = {}       # id_cuenta -> dict serializado
+        self.tri = {}        # trigrama -> {(id_cuenta, campo)}
+        self.creado = time.monotonic()
+        self.lock = threading.Lock()
+        pares = []
+        for c in cuentas:
+            pares.extend(self._indexar(c))
+        pares.sort(key=lambda p: p[0])
+        self.claves = [p[0] for p in pares]  # palabras/campos normalizados, ordenados
+        self.refs = [p[1] for p in pares]    # (id_cuenta, campo, tipo) paralelo a claves
+
+    def _indexar(self, cuenta: dict) -> list:
+        """Registra la cuenta y sus trigramas; devuelve sus (clave, ref) de prefijo."""
+        id_cuenta = cuenta["id_cuenta"]
+        self.docs[id_cuenta] = cuenta
+        pares = []
+        for campo, _peso in _CAMPOS:
+            valor = normalizar(cuenta.get(campo))
+            if not valor:
+                continue
+            pares.append((valor, (id_cuenta, campo, _INICIO)))
+            tris = set()
+            for palabra in valor.split():
+                if palabra != valor:
+                    pares.append((palabra, (id_cuenta, campo, _PALABRA)))
+                tris |= trigramas(palabra)
+            for t in tris:
+                refs = self.tri.get(t)
+                if refs is None:
+                    refs = self.tri[t] = set()
+                refs.add((id_cuenta, campo))
+        return pares
+
+    def agregar(self, cuenta: dict):
+        self.quitar(cuenta["id_cuenta"])
+        for clave, ref in self._indexar(cuenta):
+            i = bisect_left(self.claves, clave)
+            self.claves.insert(i, clave)
+            self.refs.insert(i, ref)
+
+    def quitar(self, id_cuenta: int):
+        cuenta = self.docs.pop(id_cuenta, None)
+        if cuenta is None:
+            return
+        vivos = [i for i, ref in enumerate(self.refs) if ref[0] != id_cuenta]
+        self.claves = [self.claves[i] for i in vivos]
+        self.refs = [self.refs[i] for i in vivos]
+        for campo, _peso in _CAMPOS:
+            for palabra in normalizar(cuenta.get(campo)).split():
+                for t in trigramas(palabra):
+                    self.tri.get(t, set()).discard((id_cuenta, campo))
+
+    def buscar(self, q: str, limite: int = 20) -> list:
+        """Cuentas que coinciden con todos los términos de q, de mayor a menor puntaje."""
+        terminos = normalizar(q).split()
+        if not terminos:
+            return []
+        total = None
+        for termino in terminos:
+            puntajes = self._puntajes_termino(termino)
+            if total is None:
+                total = puntajes
+            else:
+                total = {k: total[k] + v for k, v in puntajes.items() if k in total}
+            if not total:
+                return []
+        orden = heapq.nsmallest(
+            limite, total.items(),
+            key=lambda kv: (-kv[1], len(self.docs[kv[0]].get("cuenta") or ""), self.docs[kv[0]].get("cuenta") or ""),
+        )
+        return [dict(self.docs[i], puntaje=round(p, 1)) for i, p in orden]
+
+    def _puntajes_termino(self, termino: str) -> dict:
+        mejor = {}
+
+        def anotar(id_cuenta, puntos):
+            if puntos > mejor.get(id_cuenta, 0):
+                mejor[id_cuenta] = puntos
+
+        pesos = dict(_CAMPOS)
+        lo = bisect_left(self.claves, termino)
+        hi = bisect_left(self.claves, termino + "\uffff", lo)
+        for i in range(lo, hi):
+            id_cuenta, campo, tipo = self.refs[i]
+            base = _EXACTA if tipo == _INICIO and self.claves[i] == termino else tipo
+            anotar(id_cuenta, base * pesos[campo])
+        if len(termino) >= 3:
+            tris = trigramas(termino)
+            comunes = Counter()
+            for t in tris:
+                comunes.update(self.tri.get(t, ()))
+            for (id_cuenta, campo), n in comunes.items():
+                similitud = n / len(tris)
+                if similitud >= _SIMILITUD_MIN:
+                    anotar(id_cuenta, _TRIGRAMA * similitud * pesos[campo])
+        return mejor
+
+
+class CacheIndices:
+    """Índices por empresa, con LRU y vencimiento."""
+
+    def __init__(self, max_empresas: int = 200, ttl: float = 300):
+        self.max_empresas = max_empresas
+        self.ttl = ttl
+        self.indices = OrderedDict()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_empresas = app.config.get("BUSQUEDA_CUENTAS_MAX_EMPRESAS", self.max_empresas)
+        self.ttl = app.config.get("BUSQUEDA_CUENTAS_TTL", self.ttl)
+
+    def obtener(self, empresa_id: int, cargar) -> IndiceCuentas:
+        """Índice de la empresa; cargar() devuelve sus cuentas serializadas si hay que armarlo."""
+        with self.lock:
+            ind = self.indices.get(empresa_id)
+            if ind is not None and time.monotonic() - ind.creado < self.ttl:
+                self.indices.move_to_end(empresa_id)
+                return ind
+        ind = IndiceCuentas(cargar())
+        with self.lock:
+            self.indices[empresa_id] = ind
+            self.indices.move_to_end(empresa_id)
+            while len(self.indices) > self.max_empresas:
+                self.indices.popitem(last=False)
+        return ind
+
+    def buscar(self, empresa_id: int, q: str, limite: int, cargar) -> list:
+        ind = self.obtener(empresa_id, cargar)
+        with ind.lock:
+            return ind.buscar(q, limite)
+
+    def aplicar(self, empresa_id: int, accion: str, id_cuenta: int, cuenta=None, id_base=None):
+        """Refleja un alta/baja/modificación; sin índice armado no hay nada que hacer."""
+        with self.lock:
+            ind = self.indices.get(empresa_id)
+        if ind is None:
+            return
+        with ind.lock:
+            if accion in ("delete", "update"):
+                ind.quitar(id_cuenta)
+            if id_base is not None:
+                ind.quitar(id_base)
+            if accion in ("create", "update") and cuenta is not None:
+                ind.agregar(cuenta)
+
+    def invalidar(self, empresa_id=None):
+        with self.lock:
+            if empresa_id is None:
+                self.indices.clear()
+            else:
+                self.indices.pop(empresa_id, None)
+
+
+cache = CacheIndices()
+
+
+def init_app(app):
+    cache.init_app(app)
+
+
+@eventos.libro_confirmado.connect
+def _al_confirmar(empresa_id, entidad=None, accion=None, id_entidad=None, **extra):
+    if entidad == "cuenta":
+        cache.aplicar(empresa_id, accion, id_entidad, cuenta=extra.get("cuenta"), id_base=extra.get("id_base"))
+
+
+@eventos.libro_remoto.connect
+def _al_cambiar_en_otro_worker(empresa_id, entidad=None, **extra):
+    # el bus no trae la cuenta serializada: se rearma el índice al próximo pedido
+    if empresa_id is None or entidad == "cuenta":
+        cache.invalidar(empresa_id)
@@ -0,0 +1,348 @@
+# services/cache_reportes.py
+"""
+Caché de reportes (balance, estados, índices, mayor) y precalentado en segundo plano.
+
+Cada resultado se guarda junto con la versión del libro de la empresa
+(empresas.version_libro) con la que se calculó y sirve mientras esa versión no
+cambie: cualquier asiento, cuenta, cierre o archivado la sube, así que no hay
+que invalidar nada. Hay dos niveles: un LRU en memoria por proceso y un JSON
+por entrada en REPORTES_CACHE_DIR (por defecto instance/cache_reportes),
+compartido entre workers; ahí deja sus resultados "flask precalentar-reportes".
+En disco quedan a lo sumo REPORTES_CACHE_ARCHIVOS por empresa: al escribir se
+borran los de mtime más viejo, y leer uno le actualiza el mtime (LRU).
+
+Los cálculos se registran con registrar(nombre, funcion); accounting registra
+los suyos al importarse. Después de cada commit que toca el libro la empresa
+queda pendiente y, cuando pasan REPORTES_DEBOUNCE segundos sin cambios nuevos
+(o REPORTES_DEBOUNCE_MAX desde el primero), un pool de hilos recalcula sus
+reportes por defecto, los que se pidieron hace poco y el mayor de las cuentas
+tocadas. A las horas de REPORTES_PRECALENTAR_HORAS (antes de clase) un solo
+worker precalienta las empresas con actividad reciente.
+
+Los pedidos iguales que llegan mientras un reporte se calcula esperan ese
+cálculo en vez de repetirlo (services/coalescencia.py).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from models import db, Asiento, CambioLibro, ChangeLog, DetalleAsiento
+from services import coalescencia, eventos, sincronizacion
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin candado entre workers
+    fcntl = None
+
+# estados e índices sin fechas los sirve estados_materializados
+POR_DEFECTO = (("balance", {}),)
+MAX_MAYORES = 20
+
+_calculos = {}
+
+
+def registrar(nombre: str, funcion):
+    """funcion(empresa_id, **params) -> dict serializable a JSON."""
+    _calculos[nombre] = funcion
+
+
+def _clave(nombre: str, params: dict) -> tuple:
+    return (nombre, tuple(sorted((k, v) for k, v in params.items() if v not in (None, ""))))
+
+
+class CacheReportes:
+    def __init__(self, max_entradas: int = 2000, max_archivos: int = 200):
+        self.app = None
+        self.max_entradas = max_entradas
+        self.max_archivos = max_archivos
+        self.entradas = OrderedDict()   # (empresa, clave) -> (version, valor)
+        self.pedidos = {}               # empresa -> OrderedDict de claves pedidas hace poco
+        self.lock = threading.Lock()
+        self.dir = None
+        self.precalentar_activo = False
+        self.debounce = 2.0
+        self.debounce_max = 30.0
+        self.horas = []
+        self.dias_activas = 7
+        self.max_pedidos = 20
+        # programador (uno por proceso, se arranca perezosamente tras el fork)
+        self.cond = threading.Condition(self.lock)
+        self.pendientes = {}            # empresa -> (vence, limite, cuentas)
+        self.hilo = None
+        self.pool = None
+        self.pid = None
+        self.hilos = 2
+
+    # --- configuración ---
+    def init_app(self, app):
+        self.app = app
+        self.max_entradas = app.config.get("REPORTES_CACHE_MAX", self.max_entradas)
+        self.max_archivos = app.config.get("REPORTES_CACHE_ARCHIVOS", self.max_archivos)
+        self.dir = app.config.get("REPORTES_CACHE_DIR") or os.path.join(app.instance_path, "cache_reportes")
+        os.makedirs(self.dir, exist_ok=True)
+        self.precalentar_activo = app.config.get("REPORTES_PRECALENTAR", True)
+        self.debounce = app.config.get("REPORTES_DEBOUNCE", self.debounce)
+        self.debounce_max = app.config.get("REPORTES_DEBOUNCE_MAX", self.debounce_max)
+        self.horas = [
+            tuple(int(x) for x in h.split(":"))
+            for h in app.config.get("REPORTES_PRECALENTAR_HORAS", []) if h
+        ]
+        self.dias_activas = app.config.get("REPORTES_DIAS_ACTIVAS", self.dias_activas)
+        self.hilos = app.config.get("REPORTES_HILOS", self.hilos)
+
+        @app.before_request
+        def _arrancar_programador():
+            if self.precalentar_activo and self.horas:
+                self._asegurar_hilo()
+
+    # --- lectura ---
+    def obtener(self, empresa_id: int, nombre: str, **params) -> dict:
+        """Resultado del reporte para la versión actual del libro; lo calcula si no está."""
+        clave = _clave(nombre, params)
+        version = sincronizacion.version_actual(empresa_id)
+        valor = self._leer(empresa_id, clave, version)
+        if valor is None:
+            valor = self._calcular(empresa_id, clave, version)
+        self._anotar_pedido(empresa_id, clave)
+        return valor
+
+    def calcular(self, empresa_id: int, nombre: str, **params) -> dict:
+        """Calcula y guarda el reporte si no está al día (precalentado); None si ya estaba."""
+        clave = _clave(nombre, params)
+        version = sincronizacion.version_actual(empresa_id)
+        if self._leer(empresa_id, clave, version) is not None:
+            return None
+        return self._calcular(empresa_id, clave, version)
+
+    def _calcular(self, empresa_id: int, clave: tuple, version: int) -> dict:
+        """Calcula y guarda; pedidos iguales simultáneos (y el precalentado) comparten el cálculo."""
+        def calculo():
+            valor = _calculos[clave[0]](empresa_id, **dict(clave[1]))
+            self._guardar(empresa_id, clave, version, valor)
+            return valor
+        return coalescencia.una_vez((empresa_id, clave[0], clave[1], version), calculo)
+
+    def _ruta(self, empresa_id: int, clave: tuple) -> str:
+        nombre = hashlib.sha1(repr(clave).encode()).hexdigest()
+        return os.path.join(self.dir, str(empresa_id), f"{clave[0]}-{nombre}.json")
+
+    def _leer(self, empresa_id: int, clave: tuple, version: int):
+        with self.lock:
+            e = self.entradas.get((empresa_id, clave))
+            if e is not None and e[0] == version:
+                self.entradas.move_to_end((empresa_id, clave))
+                return e[1]
+        if self.dir is None:
+            return None
+        ruta = self._ruta(empresa_id, clave)
+        try:
+            with open(ruta, encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if datos.get("version") != version:
+            return None
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass  # otro worker lo acaba de podar
+        self._recordar(empresa_id, clave, version, datos["valor"])
+        return datos["valor"]
+
+    def _recordar(self, empresa_id: int, clave: tuple, version: int, valor):
+        with self.lock:
+            self.entradas[(empresa_id, clave)] = (version, valor)
+            self.entradas.move_to_end((empresa_id, clave))
+            while len(self.entradas) > self.max_entradas:
+                self.entradas.popitem(last=False)
+
+    def _guardar(self, empresa_id: int, clave: tuple, version: int, valor):
+        self._recordar(empresa_id, clave, version, valor)
+        if self.dir is None:
+            return
+        ruta = self._ruta(empresa_id, clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(dict(version=version, valor=valor), f, ensure_ascii=False)
+            os.replace(tmp, ruta)
+            self._podar(os.path.dirname(ruta))
+        except OSError:
+            if self.app is not None:
+                self.app.logger.exception("[CACHE_REPORTES] no se pudo escribir %s", ruta)
+
+    def _podar(self, directorio: str):
+        """Deja en el directorio de la empresa los max_archivos usados más recientemente."""
+        archivos = []
+        with os.scandir(directorio) as it:
+            for e in it:
+                if e.name.endswith(".json"):
+                    try:
+                        archivos.append((e.stat().st_mtime, e.path))
+                    except FileNotFoundError:
+                        pass
+        if len(archivos) <= self.max_archivos:
+            return
+        archivos.sort()
+        for _mtime, ruta in archivos[:len(archivos) - self.max_archivos]:
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+    def _anotar_pedido(self, empresa_id: int, clave: tuple):
+        with self.lock:
+            recientes = self.pedidos.setdefault(empresa_id, OrderedDict())
+            recientes[clave] = time.monotonic()
+            recientes.move_to_end(clave)
+            while len(recientes) > self.max_pedidos:
+                recientes.popitem(last=False)
+
+    # --- precalentado ---
+    def tareas(self, empresa_id: int, cuentas=()) -> list:
+        """[(nombre, params)]: reportes por defecto, pedidos recientes y mayor de 'cuentas'."""
+        out = OrderedDict((_clave(n, p), None) for n, p in POR_DEFECTO)
+        with self.lock:
+            out.update((c, None) for c in self.pedidos.get(empresa_id, ()))
+        for id_cuenta in list(cuentas)[:MAX_MAYORES]:
+            out[_clave("mayor", dict(cuenta=id_cuenta))] = None
+        return [(nombre, dict(params)) for nombre, params in out if nombre in _calculos]
+
+    def precalentar(self, empresa_id: int, cuentas=()) -> int:
+        """Recalcula los reportes de la empresa que no estén al día. Devuelve cuántos calculó."""
+        hechos = 0
+        for nombre, params in self.tareas(empresa_id, cuentas):
+            try:
+                if self.calcular(empresa_id, nombre, **params) is not None:
+                    hechos += 1
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception("[CACHE_REPORTES] falló %s %s de la empresa %s", nombre, params, empresa_id)
+        return hechos
+
+    def programar(self, empresa_id: int, cuentas=()):
+        """Deja la empresa para precalentar cuando dejen de llegar cambios (debounce)."""
+        if not self.precalentar_activo:
+            return
+        self._asegurar_hilo()
+        ahora = time.monotonic()
+        with self.cond:
+            _vence, limite, previas = self.pendientes.get(empresa_id, (None, ahora + self.debounce_max, set()))
+            previas.update(cuentas)
+            self.pendientes[empresa_id] = (min(ahora + self.debounce, limite), limite, previas)
+            self.cond.notify()
+
+    def _asegurar_hilo(self):
+        # Como en auditoria: cada worker (post-fork) arranca el suyo
+        if self.hilo is not None and self.pid == os.getpid() and self.hilo.is_alive():
+            return
+        with self.lock:
+            if self.hilo is not None and self.pid == os.getpid() and self.hilo.is_alive():
+                return
+            self.pid = os.getpid()
+            self.pendientes = {}
+            self.pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="precalentar")
+            self.hilo = threading.Thread(target=self._bucle, name="cache_reportes", daemon=True)
+            self.hilo.start()
+
+    def _proxima_hora(self, desde: datetime):
+        candidatas = []
+        for h, m in self.horas:
+            t = desde.replace(hour=h, minute=m, second=0, microsecond=0)
+            candidatas.append(t if t > desde else t + timedelta(days=1))
+        return min(candidatas) if candidatas else None
+
+    def _bucle(self):
+        proxima = self._proxima_hora(datetime.now())
+        while True:
+            with self.cond:
+                ahora = time.monotonic()
+                vencidas = [e for e, (vence, _l, _c) in self.pendientes.items() if vence <= ahora]
+                listas = [(e, self.pendientes.pop(e)[2]) for e in vencidas]
+                if not listas:
+                    espera = [v for v, _l, _c in self.pendientes.values()]
+                    timeout = min(espera) - ahora if espera else 60.0
+                    if proxima is not None:
+                        timeout = min(timeout, max(0.0, (proxima - datetime.now()).total_seconds()))
+                    self.cond.wait(timeout=max(0.05, timeout))
+            for empresa_id, cuentas in listas:
+                self.pool.submit(self._en_contexto, self.precalentar, empresa_id, cuentas)
+            if proxima is not None and datetime.now() >= proxima:
+                self.pool.submit(self._en_contexto, self._antes_de_clase, proxima)
+                proxima = self._proxima_hora(datetime.now())
+
+    def _en_contexto(self, funcion, *args):
+        try:
+            with self.app.app_context():
+                funcion(*args)
+        except Exception:
+            self.app.logger.exception("[CACHE_REPORTES] falló el precalentado")
+
+    def _antes_de_clase(self, turno: datetime):
+        """Precalentado del turno; con varios workers lo hace solo el primero que llega."""
+        marca = os.path.join(self.dir, ".turno")
+        with open(os.path.join(self.dir, ".turno.lock"), "a") as candado:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(candado, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+            try:
+                with open(marca, encoding="utf-8") as f:
+                    if f.read().strip() == turno.isoformat():
+                        return
+            except OSError:
+                pass
+            with self.lock:
+                en_memoria = set(self.pedidos)
+            for empresa_id in sorted(en_memoria | set(empresas_activas(self.dias_activas))):
+                self.precalentar(empresa_id, cuentas_recientes(empresa_id))
+            with open(marca, "w", encoding="utf-8") as f:
+                f.write(turno.isoformat())
+
+
+def empresas_activas(dias: int = 7) -> list:
+    """Empresas con cambios en la bitácora en los últimos 'dias'."""
+    desde = datetime.now() - timedelta(days=dias)
+    return list(db.session.execute(
+        select(ChangeLog.id_empresa).where(ChangeLog.ts >= desde, ChangeLog.id_empresa.is_not(None)).distinct()
+    ).scalars())
+
+
+def cuentas_recientes(empresa_id: int, ultimos: int = 200) -> list:
+    """Cuentas de los asientos tocados en las últimas 'ultimos' versiones del libro."""
+    version = sincronizacion.version_actual(empresa_id)
+    asientos = (
+        select(CambioLibro.id_entidad)
+        .where(CambioLibro.id_empresa == empresa_id, CambioLibro.entidad == "asiento",
+               CambioLibro.version > version - ultimos)
+    )
+    return list(db.session.execute(
+        select(DetalleAsiento.id_cuenta)
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .where(Asiento.id_empresa == empresa_id, Asiento.id_asiento.in_(asientos))
+        .distinct()
+        .limit(MAX_MAYORES)
+    ).scalars())
+
+
+cache = CacheReportes()
+
+
+def init_app(app):
+    cache.init_app(app)
+
+
+@eventos.libro_confirmado.connect
+def _al_confirmar(empresa_id, entidad=None, accion=None, id_entidad=None, deltas=None, **extra):
+    if cache.app is None:
+        return
+    cache.programar(empresa_id, {id_cuenta for id_cuenta, _f in (deltas or {})})
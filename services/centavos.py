@@ -0,0 +1,29 @@
+# services/centavos.py
+"""
+Importes en centavos enteros con signo (debe +, haber -).
+
+Sumar enteros da el mismo resultado que sumar Decimal y se puede hacer en SQL
+o con NumPy (services/agregados.py). Este módulo no depende de numpy: lo usan
+los servicios que tienen que andar aunque no esté instalado.
+"""
+from decimal import Decimal
+
+from sqlalchemy import Integer, case, cast, func
+
+CENTAVO = Decimal("0.01")
+
+
+def a_centavos(importe) -> int:
+    return int((Decimal(importe) * 100).to_integral_value())
+
+
+def centavos_sql(tipo_col, importe_col):
+    """Expresión SQL del importe en centavos enteros con signo (debe +, haber -).
+    El ROUND cubre motores que guardan NUMERIC como coma flotante (SQLite).
+    """
+    cts = cast(func.round(importe_col * 100), Integer)
+    return case((tipo_col == "debe", cts), else_=-cts)
+
+
+def de_centavos(centavos) -> Decimal:
+    return (Decimal(int(centavos)) / 100).quantize(CENTAVO)
@@ -0,0 +1,94 @@
+# services/coalescencia.py
+"""
+Cálculos idénticos en curso compartidos (single-flight) dentro de cada worker.
+
+Cuando una clase abre a la vez los reportes de la misma empresa llegan decenas
+de pedidos iguales. El primero que pide una clave (empresa, reporte, parámetros
+normalizados, versión del libro) la calcula; los que llegan mientras tanto, de
+cualquier hilo, esperan ese mismo cálculo y reciben su resultado. Si falló,
+cada uno recibe una excepción propia encadenada a la original: las
+HTTPException se copian con su código y su respuesta (el 429 conserva el JSON
+y Retry-After), las demás llegan como RuntimeError. Un mismo objeto excepción
+no se relanza desde varios hilos. Mientras esperan ceden su lugar
+del control de admisión (admision.ceder), así no ocupan cupo sin calcular. Al
+terminar la clave se libera: el pedido siguiente ya encuentra el resultado en
+la caché de reportes o, si el libro cambió, la versión es otra.
+
+La versión va en la clave, así que un pedido posterior a un cambio nunca recibe
+un resultado calculado antes del cambio.
+
+estado() da, por reporte, cuántos cálculos se hicieron, cuántos pedidos se
+sumaron a uno en curso y cuántos hay en curso ahora.
+"""
+import threading
+from collections import Counter
+
+from werkzeug.exceptions import HTTPException
+
+from services import admision
+
+
+class Vuelo:
+    __slots__ = ("evento", "valor", "error", "esperando")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.valor = None
+        self.error = None
+        self.esperando = 0
+
+
+def _error_compartido(clave: tuple, error: BaseException) -> BaseException:
+    if isinstance(error, HTTPException):
+        return type(error)(description=error.description, response=error.response)
+    return RuntimeError(f"falló el cálculo compartido de {clave[1]}: {error!r}")
+
+
+class Coalescedor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vuelos = {}                 # clave -> Vuelo
+        self.calculados = Counter()      # reporte -> cálculos hechos
+        self.coalescidos = Counter()     # reporte -> pedidos que esperaron uno en curso
+
+    def una_vez(self, clave: tuple, funcion):
+        """Resultado de funcion(); si ya hay uno en curso con la misma clave, lo espera.
+        clave[1] es el nombre del reporte (para las métricas)."""
+        with self.lock:
+            vuelo = self.vuelos.get(clave)
+            propio = vuelo is None
+            if propio:
+                vuelo = self.vuelos[clave] = Vuelo()
+                self.calculados[clave[1]] += 1
+            else:
+                vuelo.esperando += 1
+                self.coalescidos[clave[1]] += 1
+        if not propio:
+            with admision.ceder():
+                vuelo.evento.wait()
+            if vuelo.error is not None:
+                raise _error_compartido(clave, vuelo.error) from vuelo.error
+            return vuelo.valor
+        try:
+            vuelo.valor = funcion()
+            return vuelo.valor
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self.lock:
+                self.vuelos.pop(clave, None)
+            vuelo.evento.set()
+
+    def estado(self) -> dict:
+        with self.lock:
+            en_curso = Counter(clave[1] for clave in self.vuelos)
+            nombres = set(self.calculados) | set(self.coalescidos)
+            return {
+                n: dict(calculados=self.calculados[n], coalescidos=self.coalescidos[n], en_curso=en_curso[n])
+                for n in sorted(nombres)
+            }
+
+
+coalescedor = Coalescedor()
+una_vez = coalescedor.una_vez
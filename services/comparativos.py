@@ -0,0 +1,124 @@
+# services/comparativos.py
+"""
+Estados comparativos: saldos de muchos períodos en una sola pasada.
+
+movimientos() hace un único GROUP BY (año, mes, clase de asiento, cuenta) sobre
+los renglones del rango y lo reparte en períodos de mes, trimestre o año con
+las reducciones de services/agregados.py:
+
+- flujos[p]: movimiento del período p sin asientos de cierre (estado de resultados);
+- saldos[p]: saldo acumulado al final del período p (situación patrimonial).
+  Arranca en la apertura del ejercicio que contiene el primer período; el
+  asiento de cierre cuenta al día siguiente de la fecha de cierre, como en
+  saldos_diarios, así que al final de cada período queda el saldo del ejercicio
+  vigente.
+
+Los ejercicios archivados que entran en el rango se leen del archivo.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import extract, func
+
+from models import db, Asiento, CierreEjercicio, DetalleAsiento
+from services import agregados, archivo, ejercicios
+from services.centavos import centavos_sql
+
+GRANULARIDADES = {"mes": 1, "trimestre": 3, "anio": 12}
+MAX_PERIODOS = 120
+
+
+class ErrorPeriodo(ValueError):
+    pass
+
+
+def _inicio_periodo(f: date, meses: int) -> date:
+    return date(f.year, (f.month - 1) // meses * meses + 1, 1)
+
+
+def _sumar_meses(f: date, meses: int) -> date:
+    m = f.month - 1 + meses
+    return date(f.year + m // 12, m % 12 + 1, 1)
+
+
+def _clave(inicio: date, granularidad: str) -> str:
+    if granularidad == "anio":
+        return str(inicio.year)
+    if granularidad == "trimestre":
+        return f"{inicio.year}-T{(inicio.month - 1) // 3 + 1}"
+    return f"{inicio.year}-{inicio.month:02d}"
+
+
+def periodos(granularidad: str, desde: date, hasta: date) -> list:
+    """[(clave, inicio, fin)] de calendario que cubren [desde, hasta]."""
+    meses = GRANULARIDADES.get(granularidad)
+    if meses is None:
+        raise ErrorPeriodo("Período inválido: use mes, trimestre o anio")
+    if desde > hasta:
+        raise ErrorPeriodo("El rango de fechas está invertido")
+    out = []
+    inicio = _inicio_periodo(desde, meses)
+    while inicio <= hasta:
+        siguiente = _sumar_meses(inicio, meses)
+        out.append((_clave(inicio, granularidad), inicio, siguiente - timedelta(days=1)))
+        if len(out) > MAX_PERIODOS:
+            raise ErrorPeriodo(f"Demasiados períodos (máximo {MAX_PERIODOS})")
+        inicio = siguiente
+    return out
+
+
+def movimientos(empresa_id: int, pers: list):
+    """(flujos, saldos): una lista de {id_cuenta: centavos debe - haber} por período."""
+    inicio, fin = pers[0][1], pers[-1][2]
+    apertura = ejercicios.inicio_ejercicio(empresa_id, inicio)
+
+    anio = extract("year", Asiento.fecha)
+    mes = extract("month", Asiento.fecha)
+    q = (
+        db.session.query(anio, mes, Asiento.clase, DetalleAsiento.id_cuenta,
+                         func.sum(centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe)))
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .filter(Asiento.id_empresa == empresa_id, Asiento.fecha <= fin)
+    )
+    if apertura is not None:
+        q = q.filter(Asiento.fecha >= apertura)
+    q = q.group_by(anio, mes, Asiento.clase, DetalleAsiento.id_cuenta)
+
+    # el grupo de cierre de un mes se ubica por su fecha de cierre real
+    cierres = {
+        (c.fecha_cierre.year, c.fecha_cierre.month): c.fecha_cierre
+        for c in CierreEjercicio.query.filter(CierreEjercicio.id_empresa == empresa_id)
+    }
+    filas = []  # (id_cuenta, centavos, fecha en que impacta, es cierre)
+    for a, m, clase, id_cuenta, cts in q:
+        f = cierres.get((int(a), int(m))) if clase == "cierre" else None
+        filas.append((id_cuenta, int(cts or 0), f or date(int(a), int(m), 1), clase == "cierre"))
+    for t in archivo.tramos(empresa_id, apertura, fin):
+        for id_cuenta, f, clase, cts in t.totales_diarios():
+            if (apertura is None or f >= apertura) and f <= fin:
+                filas.append((id_cuenta, cts, f, clase == "cierre"))
+    filas = [
+        (id_cuenta, cts, f + timedelta(days=1) if cierre else f, cierre)
+        for id_cuenta, cts, f, cierre in filas
+        if not cierre or f < fin
+    ]
+
+    ids = sorted({fila[0] for fila in filas})
+    indice = {c: i for i, c in enumerate(ids)}
+    cortes = [p[1].toordinal() for p in pers]
+    # fila 0: anterior al primer período (solo cuenta para el saldo inicial)
+    mov = agregados.saldos_por_periodo(agregados.cargar(filas, indice), len(ids), cortes)
+    flu = agregados.saldos_por_periodo(
+        agregados.cargar([f for f in filas if not f[3]], indice), len(ids), cortes)
+    saldos = agregados.acumulados(mov[1:], mov[0])
+
+    def por_cuenta(fila):
+        return {ids[i]: int(v) for i, v in enumerate(fila.tolist())}
+    return [por_cuenta(f) for f in flu[1:]], [por_cuenta(f) for f in saldos]
+
+def variaciones(valores: list) -> list:
+    """Variación contra el período anterior: [{abs, pct}] (None en el primero)."""
+    out = [None]
+    for prev, act in zip(valores, valores[1:]):
+        dif = act - prev
+        out.append(dict(abs=round(dif, 2), pct=round(dif / abs(prev) * 100, 2) if prev else None))
+    return out
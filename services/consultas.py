@@ -0,0 +1,156 @@
+# services/consultas.py
+"""
+Consultas de los reportes (asientos, mayor, balance, estados, diario) armadas una vez.
+
+Cada reporte filtra por empresa, rango de fechas y, los que suman saldos, por
+el ejercicio vigente (desde la apertura, sin asientos de cierre). En vez de
+encadenar q.filter(...) en cada pedido, cada combinación de filtros presentes
+(desde, hasta, inicio) arma su SELECT una sola vez por proceso con parámetros
+ligados; el pedido solo ejecuta con los valores. Así SQLAlchemy encuentra la
+sentencia compilada en su caché sin volver a construirla ni calcular su clave.
+
+fechas() valida 'YYYY-MM-DD' (ValueError si no, al armar la consulta); las
+funciones devuelven una Consulta perezosa que no toca la base hasta .all() o
+.scalars(): los reportes que salen del libro residente o del archivo no pagan
+ni la búsqueda del inicio del ejercicio.
+"""
+from datetime import date
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, Asiento, DetalleAsiento, PlanCuenta
+from services import ejercicios
+from services.centavos import centavos_sql
+
+_SENTENCIAS = {}
+
+
+class Consulta:
+    """Sentencia y parámetros; 'preparar' los resuelve al ejecutar (p. ej. el inicio del ejercicio)."""
+    __slots__ = ("preparar",)
+
+    def __init__(self, preparar):
+        self.preparar = preparar
+
+    def all(self):
+        stmt, params = self.preparar()
+        return db.session.execute(stmt, params).all()
+
+    def scalars(self):
+        stmt, params = self.preparar()
+        return db.session.execute(stmt, params).scalars().all()
+
+
+def fechas(desde=None, hasta=None):
+    """(desde, hasta) como date o None; acepta date o 'YYYY-MM-DD'."""
+    def _a_fecha(v):
+        if not v:
+            return None
+        return v if isinstance(v, date) else date.fromisoformat(v)
+    return _a_fecha(desde), _a_fecha(hasta)
+
+
+def _filtrar(stmt, desde: bool, hasta: bool, inicio: bool = False):
+    stmt = stmt.where(Asiento.id_empresa == bindparam("empresa"))
+    if desde:
+        stmt = stmt.where(Asiento.fecha >= bindparam("desde"))
+    if hasta:
+        stmt = stmt.where(Asiento.fecha <= bindparam("hasta"))
+    if inicio:
+        stmt = stmt.where(Asiento.fecha >= bindparam("inicio"))
+    return stmt
+
+
+def _sentencia(nombre: str, armar, *claves):
+    clave = (nombre,) + claves
+    stmt = _SENTENCIAS.get(clave)
+    if stmt is None:
+        stmt = _SENTENCIAS[clave] = armar(*claves)
+    return stmt
+
+
+def _params(empresa_id, desde, hasta, inicio=None, **otros):
+    p = dict(empresa=empresa_id, **otros)
+    for nombre, valor in (("desde", desde), ("hasta", hasta), ("inicio", inicio)):
+        if valor is not None:
+            p[nombre] = valor
+    return p
+
+
+# --- renglones del ejercicio: (id_cuenta, centavos con signo, fecha) ---
+def _armar_renglones(desde, hasta, inicio):
+    stmt = (
+        select(DetalleAsiento.id_cuenta, centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe), Asiento.fecha)
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .where(Asiento.clase != "cierre")
+    )
+    return _filtrar(stmt, desde, hasta, inicio)
+
+
+def renglones(empresa_id: int, desde=None, hasta=None) -> Consulta:
+    """Renglones del ejercicio que contiene 'hasta' (o el último), sin asientos de cierre."""
+    desde, hasta = fechas(desde, hasta)
+
+    def preparar():
+        inicio = ejercicios.inicio_ejercicio(empresa_id, hasta)
+        stmt = _sentencia("renglones", _armar_renglones, desde is not None, hasta is not None, inicio is not None)
+        return stmt, _params(empresa_id, desde, hasta, inicio=inicio)
+    return Consulta(preparar)
+
+
+# --- mayor de una cuenta: (fecha, leyenda, importe, tipo) en orden ---
+def _armar_mayor(desde, hasta, inicio):
+    stmt = (
+        select(Asiento.fecha, Asiento.leyenda, DetalleAsiento.importe, DetalleAsiento.tipo)
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .where(DetalleAsiento.id_cuenta == bindparam("cuenta"), Asiento.clase != "cierre")
+        .order_by(Asiento.fecha.asc(), Asiento.num_asiento.asc(), DetalleAsiento.id_detalle.asc())
+    )
+    return _filtrar(stmt, desde, hasta, inicio)
+
+
+def mayor(empresa_id: int, id_cuenta: int, desde=None, hasta=None) -> Consulta:
+    desde, hasta = fechas(desde, hasta)
+
+    def preparar():
+        inicio = ejercicios.inicio_ejercicio(empresa_id, hasta)
+        stmt = _sentencia("mayor", _armar_mayor, desde is not None, hasta is not None, inicio is not None)
+        return stmt, _params(empresa_id, desde, hasta, inicio=inicio, cuenta=id_cuenta)
+    return Consulta(preparar)
+
+
+# --- asientos con sus renglones, del más nuevo al más viejo ---
+def _armar_asientos(desde, hasta):
+    stmt = (
+        select(Asiento)
+        .options(selectinload(Asiento.detalles).joinedload(DetalleAsiento.cuenta_ref))
+        .order_by(Asiento.fecha.desc(), Asiento.num_asiento.desc())
+    )
+    return _filtrar(stmt, desde, hasta)
+
+
+def asientos(empresa_id: int, desde=None, hasta=None) -> Consulta:
+    desde, hasta = fechas(desde, hasta)
+    stmt = _sentencia("asientos", _armar_asientos, desde is not None, hasta is not None)
+    return Consulta(lambda: (stmt, _params(empresa_id, desde, hasta)))
+
+
+# --- libro diario: (id, fecha, número, leyenda, cuenta, tipo, importe) por renglón ---
+def _armar_diario(desde, hasta):
+    stmt = (
+        select(
+            Asiento.id_asiento, Asiento.fecha, Asiento.num_asiento, Asiento.leyenda,
+            PlanCuenta.cuenta, DetalleAsiento.tipo, DetalleAsiento.importe,
+        )
+        .outerjoin(DetalleAsiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .outerjoin(PlanCuenta, PlanCuenta.id_cuenta == DetalleAsiento.id_cuenta)
+        .order_by(Asiento.fecha.asc(), Asiento.num_asiento.asc(), DetalleAsiento.id_detalle.asc())
+    )
+    return _filtrar(stmt, desde, hasta)
+
+
+def diario(empresa_id: int, desde=None, hasta=None) -> Consulta:
+    desde, hasta = fechas(desde, hasta)
+    stmt = _sentencia("diario", _armar_diario, desde is not None, hasta is not None)
+    return Consulta(lambda: (stmt, _params(empresa_id, desde, hasta)))
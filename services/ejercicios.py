@@ -0,0 +1,164 @@
+# services/ejercicios.py
+"""
+Cierre de ejercicio y arrastre de saldos.
+
+cerrar() genera, para la fecha de cierre:
+- el asiento de cierre (clase 'cierre'), que deja en cero todas las cuentas;
+- el asiento de apertura (clase 'apertura', al día siguiente), que reabre las
+  cuentas patrimoniales y lleva el resultado del ejercicio a una cuenta de
+  resultados acumulados;
+- el registro en cierres_ejercicio. Desde ahí los asientos con fecha <= fecha
+  de cierre no se pueden crear, modificar ni borrar.
+
+Los reportes usan desde_apertura(): leen solo desde la apertura del ejercicio
+que contiene la fecha "hasta" y nunca suman asientos de cierre, así que no
+vuelven a agregar los años anteriores.
+"""
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from models import db, Asiento, CierreEjercicio, DetalleAsiento, PlanCuenta
+from services import plan
+from services.centavos import centavos_sql, de_centavos
+
+_PATRIMONIALES = ("activo", "pasivo", "patrimonio")
+_RESULTADOS = ("ingreso", "venta", "gasto", "costo", "egreso", "resultado")
+_CUENTA_RESULTADOS = ("RESULTADOS ACUMULADOS", "RESULTADOS NO ASIGNADOS", "RESULTADO DEL EJERCICIO")
+
+
+class ErrorCierre(ValueError):
+    pass
+
+
+def es_resultado(c: PlanCuenta) -> bool:
+    """Cuenta de resultado (se cierra contra resultados acumulados) según rubro/subrubro."""
+    rubro = (c.rubro or "").lower()
+    if any(k in rubro for k in _PATRIMONIALES):
+        return False
+    txt = " ".join(filter(None, [c.rubro, c.subrubro])).lower()
+    return any(k in txt for k in _RESULTADOS)
+
+
+def ultimo_cierre(empresa_id: int, antes_de: date = None):
+    q = CierreEjercicio.query.filter(CierreEjercicio.id_empresa == empresa_id)
+    if antes_de is not None:
+        q = q.filter(CierreEjercicio.fecha_cierre < antes_de)
+    return q.order_by(CierreEjercicio.fecha_cierre.desc()).first()
+
+
+def fecha_cerrada(empresa_id: int):
+    """Última fecha de cierre (inclusive) o None."""
+    return db.session.query(func.max(CierreEjercicio.fecha_cierre)).filter(
+        CierreEjercicio.id_empresa == empresa_id).scalar()
+
+
+def en_periodo_cerrado(empresa_id: int, *fechas) -> bool:
+    cerrada = fecha_cerrada(empresa_id)
+    return cerrada is not None and any(f is not None and f <= cerrada for f in fechas)
+
+
+def inicio_ejercicio(empresa_id: int, hasta: date = None):
+    """Fecha de apertura del ejercicio que contiene 'hasta' (o el último); None si nunca se cerró."""
+    cierre = ultimo_cierre(empresa_id, antes_de=hasta)
+    return cierre.fecha_cierre + timedelta(days=1) if cierre else None
+
+
+def desde_apertura(q, empresa_id: int, hasta=None):
+    """Limita una consulta de renglones (con join a Asiento) al ejercicio de 'hasta'
+    (date o 'YYYY-MM-DD') y excluye los asientos de cierre."""
+    if isinstance(hasta, str):
+        hasta = date.fromisoformat(hasta) if hasta else None
+    q = q.filter(Asiento.clase != "cierre")
+    inicio = inicio_ejercicio(empresa_id, hasta)
+    if inicio is not None:
+        q = q.filter(Asiento.fecha >= inicio)
+    return q
+
+
+def saldos_al(empresa_id: int, fecha: date) -> dict:
+    """{id_cuenta: centavos debe - haber} al cierre del día 'fecha', desde la última apertura."""
+    q = (
+        db.session.query(DetalleAsiento.id_cuenta, func.sum(centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe)))
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .filter(Asiento.id_empresa == empresa_id, Asiento.fecha <= fecha)
+    )
+    q = desde_apertura(q, empresa_id, fecha)
+    return {id_cuenta: int(c) for id_cuenta, c in q.group_by(DetalleAsiento.id_cuenta) if c}
+
+
+def _cuenta_resultados(empresa_id: int, id_cuenta=None):
+    """(cuenta, creada): la indicada, una de resultados acumulados del plan o una nueva."""
+    visibles = plan.cuentas_de_empresa(empresa_id)
+    if id_cuenta:
+        c = visibles.filter(PlanCuenta.id_cuenta == id_cuenta).first()
+        if c is None:
+            raise ErrorCierre("Cuenta de resultados no encontrada")
+        return c, False
+    for c in visibles.all():
+        txt = " ".join(filter(None, [c.cuenta, c.subrubro])).upper()
+        if any(k in txt for k in _CUENTA_RESULTADOS):
+            return c, False
+    c = PlanCuenta(
+        id_empresa=empresa_id, cuenta="RESULTADOS NO ASIGNADOS",
+        rubro="Patrimonio", cod_subrubro="3.2", subrubro="Resultados Acumulados",
+    )
+    db.session.add(c)
+    db.session.flush()
+    return c, True
+
+
+def _renglones(saldos: dict) -> list:
+    """{id_cuenta: centavos debe - haber} -> [(id_cuenta, tipo, importe)]."""
+    return [
+        (id_cuenta, "debe" if cts > 0 else "haber", de_centavos(abs(cts)))
+        for id_cuenta, cts in sorted(saldos.items()) if cts
+    ]
+
+
+def cerrar(empresa_id: int, fecha_cierre: date, id_usuario=None, id_cuenta_resultados=None):
+    """Genera asientos de cierre y apertura y registra el ejercicio cerrado (sin commit).
+    Devuelve (cierre, asiento_cierre, asiento_apertura, cuenta_creada | None)."""
+    anterior = fecha_cerrada(empresa_id)
+    if anterior is not None and fecha_cierre <= anterior:
+        raise ErrorCierre(f"Ya hay un ejercicio cerrado al {anterior.isoformat()}")
+    saldos = saldos_al(empresa_id, fecha_cierre)
+    if not saldos:
+        raise ErrorCierre("No hay saldos para cerrar en el ejercicio")
+    if sum(saldos.values()) != 0:
+        raise ErrorCierre("El libro no balancea (Debe != Haber); revise los asientos del ejercicio")
+
+    cuentas = {c.id_cuenta: c for c in PlanCuenta.query.filter(PlanCuenta.id_cuenta.in_(saldos)).all()}
+    resultados, creada = _cuenta_resultados(empresa_id, id_cuenta_resultados)
+    apertura = Counter()
+    for id_cuenta, cts in saldos.items():
+        c = cuentas.get(id_cuenta)
+        if c is not None and es_resultado(c):
+            apertura[resultados.id_cuenta] += cts
+        else:
+            apertura[id_cuenta] += cts
+
+    ultimo = db.session.query(func.max(Asiento.num_asiento)).filter_by(id_empresa=empresa_id).scalar() or 0
+    a_cierre = Asiento(
+        id_empresa=empresa_id, fecha=fecha_cierre, num_asiento=ultimo + 1, clase="cierre",
+        id_usuario=id_usuario, doc_respaldatorio="", leyenda=f"Asiento de cierre del ejercicio al {fecha_cierre.isoformat()}",
+    )
+    a_apertura = Asiento(
+        id_empresa=empresa_id, fecha=fecha_cierre + timedelta(days=1), num_asiento=ultimo + 2, clase="apertura",
+        id_usuario=id_usuario, doc_respaldatorio="", leyenda=f"Asiento de apertura (saldos al {fecha_cierre.isoformat()})",
+    )
+    db.session.add_all([a_cierre, a_apertura])
+    db.session.flush()
+    for a, renglones in ((a_cierre, _renglones({k: -v for k, v in saldos.items()})),
+                         (a_apertura, _renglones(apertura))):
+        for id_cuenta, tipo, importe in renglones:
+            db.session.add(DetalleAsiento(id_asiento=a.id_asiento, id_cuenta=id_cuenta, tipo=tipo, importe=importe))
+    cierre = CierreEjercicio(
+        id_empresa=empresa_id, fecha_cierre=fecha_cierre,
+        id_asiento_cierre=a_cierre.id_asiento, id_asiento_apertura=a_apertura.id_asiento,
+        id_cuenta_resultados=resultados.id_cuenta, id_usuario=id_usuario,
+    )
+    db.session.add(cierre)
+    db.session.flush()
+    return cierre, a_cierre, a_apertura, (resultados if creada else None)
@@ -0,0 +1,399 @@
+# services/estados_materializados.py
+"""
+Estados contables materializados por empresa (vista por defecto: ejercicio en curso, sin fechas).
+
+- estado_resultados: saldo de cada cuenta de resultado (ejercicios.es_resultado);
+- estado_fondos: saldo de las demás cuentas;
+- estado_situacion_patrimonial: importe por rubro y subrubro, como /api/estado-patrimonial;
+- analisis_indices: una fila por empresa con los componentes e índices de
+  /api/indices y la versión del libro (empresas.version_libro) que reflejan las
+  cuatro tablas.
+
+Los saldos van normalizados según la naturaleza de la cuenta. libro_modificado
+solo anota en la sesión los deltas de cada empresa; antes del commit, si las
+tablas estaban al día con la versión previa a la transacción, se suman los
+deltas a las filas de las cuentas tocadas y se recalculan rubros e índices desde
+las filas por cuenta. La fila de analisis_indices, bloqueada con FOR UPDATE,
+ordena las transacciones de una misma empresa; las demás filas no se bloquean.
+
+Si cambió el plan, hubo un cierre o las tablas estaban atrasadas (archivado,
+recién migrado), la transacción no las toca: después del commit la empresa
+queda programada y un hilo por worker las rehace completas cuando dejan de
+llegar cambios (ESTADOS_DEBOUNCE segundos, a lo sumo ESTADOS_DEBOUNCE_MAX),
+como el precalentado de cache_reportes. Los endpoints las leen solo si su
+versión es la del libro; mientras tanto calculan como antes.
+
+Las reglas de clasificación (naturaleza, rubros, índices) son las de accounting,
+que las registra al importarse. verificar() compara las tablas con un recálculo
+completo ("flask recalcular-estados --verificar").
+"""
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import delete, event, insert, select
+
+from models import (
+    db, AnalisisIndices, EstadoFondos, EstadoResultados, EstadoSituacionPatrimonial, RoutingSession,
+)
+from services import ejercicios, eventos, plan, sincronizacion
+from services.centavos import de_centavos
+
+_PENDIENTES = "estados_pendientes"
+_REHACER = "estados_rehacer"
+_ENTIDADES = ("asiento", "cuenta")
+_MAX_INDICE = Decimal("99999999")   # DECIMAL(12,4)
+
+_activo = False
+_naturaleza = None   # cuenta -> 'D' | 'H'
+_derivar = None      # (cuentas, nb_map, saldos) -> (filas patrimonial, componentes de índices)
+
+# componente -> columnas de analisis_indices
+_COLUMNAS = dict(
+    activo_corriente=("activos_corrientes",),
+    pasivo_corriente=("pasivos_corrientes",),
+    activo=("saldos_activos",),
+    pasivo=("saldos_pasivos", "saldo_de_pasivo"),
+    patrimonio=("saldo_pn", "patrimonio_neto"),
+    ventas=("ventas",),
+    costo_ventas=("costo_mercancias_vendidas",),
+    utilidad=("utilidad_del_ejercicio",),
+)
+# índice -> (columna, numerador, denominador)
+_INDICES = (
+    ("indice_de_liquidez", "activo_corriente", "pasivo_corriente"),
+    ("indice_de_solvencia", "activo", "pasivo"),
+    ("indice_de_endeudamiento", "pasivo", "patrimonio"),
+    ("indice_costo_ventas", "costo_ventas", "ventas"),
+    ("indice_retorno_inversion", "utilidad", "patrimonio"),
+)
+
+
+def registrar(naturaleza, derivar):
+    global _naturaleza, _derivar
+    _naturaleza, _derivar = naturaleza, derivar
+
+
+class Programador:
+    """Reconstrucciones diferidas por empresa (debounce), en un hilo por worker."""
+
+    def __init__(self):
+        self.app = None
+        self.debounce = 1.0
+        self.debounce_max = 10.0
+        self.cond = threading.Condition()
+        self.pendientes = {}   # empresa -> (vence, límite), en monotonic
+        self.hilo = None
+        self.pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.debounce = app.config.get("ESTADOS_DEBOUNCE", self.debounce)
+        self.debounce_max = app.config.get("ESTADOS_DEBOUNCE_MAX", self.debounce_max)
+
+    def programar(self, empresa_id: int):
+        self._asegurar_hilo()
+        ahora = time.monotonic()
+        with self.cond:
+            _vence, limite = self.pendientes.get(empresa_id, (None, ahora + self.debounce_max))
+            self.pendientes[empresa_id] = (min(ahora + self.debounce, limite), limite)
+            self.cond.notify()
+
+    def _asegurar_hilo(self):
+        # Como en cache_reportes: cada worker (post-fork) arranca el suyo
+        if self.hilo is not None and self.pid == os.getpid() and self.hilo.is_alive():
+            return
+        with self.cond:
+            if self.hilo is not None and self.pid == os.getpid() and self.hilo.is_alive():
+                return
+            self.pid = os.getpid()
+            self.pendientes = {}
+            self.hilo = threading.Thread(target=self._bucle, name="estados_materializados", daemon=True)
+            self.hilo.start()
+
+    def _bucle(self):
+        while True:
+            with self.cond:
+                ahora = time.monotonic()
+                listas = [e for e, (vence, _l) in self.pendientes.items() if vence <= ahora]
+                for e in listas:
+                    del self.pendientes[e]
+                if not listas:
+                    espera = [v for v, _l in self.pendientes.values()]
+                    self.cond.wait(timeout=max(0.05, min(espera) - ahora) if espera else None)
+                    continue
+            for empresa_id in listas:
+                self._rehacer(empresa_id)
+
+    def _rehacer(self, empresa_id: int):
+        with self.app.app_context():
+            try:
+                db.session.execute(
+                    select(AnalisisIndices.id_empresa).where(AnalisisIndices.id_empresa == empresa_id).with_for_update()
+                )
+                reconstruir(empresa_id)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception("[ESTADOS] no se pudieron rehacer los estados de la empresa %s", empresa_id)
+
+
+programador = Programador()
+
+
+def init_app(app):
+    global _activo
+    _activo = app.config.get("ESTADOS_MATERIALIZADOS", True)
+    programador.init_app(app)
+
+
+def _signo(c) -> int:
+    return 1 if _naturaleza(c) == "D" else -1
+
+
+def _clave_grupo(rubro, subrubro) -> tuple:
+    return ((rubro or "").strip().upper(), (subrubro or "").strip().upper())
+
+
+def _indice(n: Decimal, d: Decimal):
+    if not d:
+        return None
+    v = (n / d).quantize(Decimal("0.0001"))
+    return v if abs(v) < _MAX_INDICE else None
+
+
+def _valores_indices(comp: dict) -> dict:
+    valores = {col: comp[k] for k, cols in _COLUMNAS.items() for col in cols}
+    for col, n, d in _INDICES:
+        valores[col] = _indice(comp[n], comp[d])
+    return valores
+
+
+# --- lectura ---
+def _vigente(empresa_id: int):
+    """Fila de analisis_indices si los estados reflejan la versión actual del libro; None si no."""
+    if not _activo or _derivar is None:
+        return None
+    fila = db.session.execute(
+        select(AnalisisIndices).where(AnalisisIndices.id_empresa == empresa_id)
+    ).scalar()
+    if fila is None or fila.version != sincronizacion.version_actual(empresa_id):
+        return None
+    return fila
+
+
+def _por_cuenta(empresa_id: int) -> list:
+    """Filas de estado_resultados y estado_fondos (tienen los atributos de cuenta que usan los reportes)."""
+    filas = []
+    for modelo in (EstadoResultados, EstadoFondos):
+        q = select(modelo).where(modelo.id_empresa == empresa_id).order_by(modelo.id_cuenta)
+        filas.extend(db.session.execute(q).scalars())
+    return filas
+
+
+def _saldo(fila) -> Decimal:
+    return fila.saldo if isinstance(fila, EstadoResultados) else fila.importe
+
+
+def patrimonial(empresa_id: int):
+    """Filas del estado patrimonial materializado; None si no está al día."""
+    if _vigente(empresa_id) is None:
+        return None
+    filas = db.session.execute(
+        select(EstadoSituacionPatrimonial).where(EstadoSituacionPatrimonial.id_empresa == empresa_id)
+    ).scalars()
+    rows = [
+        dict(cod_rubro=f.cod_rubro or "", rubro=f.rubro or "", cod_subrubro=f.cod_subrubro or "",
+             subrubro=f.subrubro or "", importe=float(f.importe or 0))
+        for f in filas
+    ]
+    rows.sort(key=lambda x: ((x["rubro"] or "").upper(), (x["subrubro"] or "").upper()))
+    return rows
+
+
+def saldos(empresa_id: int):
+    """(cuentas, {id_cuenta: saldo normalizado}) materializados; None si no están al día."""
+    if _vigente(empresa_id) is None:
+        return None
+    filas = _por_cuenta(empresa_id)
+    return filas, {f.id_cuenta: _saldo(f) or Decimal("0") for f in filas}
+
+
+def indices(empresa_id: int):
+    """Componentes de los índices (Decimal); None si no están al día."""
+    fila = _vigente(empresa_id)
+    if fila is None:
+        return None
+    return {k: getattr(fila, cols[0]) or Decimal("0") for k, cols in _COLUMNAS.items()}
+
+
+# --- escritura (sin commit) ---
+def calcular(empresa_id: int):
+    """Recálculo completo desde el libro: (cuentas, nb_map, saldos, filas patrimonial, componentes)."""
+    cuentas = plan.cuentas_de_empresa(empresa_id).all()
+    cts = ejercicios.saldos_al(empresa_id, date.max)
+    nb_map = {c.id_cuenta: _naturaleza(c) for c in cuentas}
+    saldos_ = {
+        c.id_cuenta: de_centavos(cts.get(c.id_cuenta, 0) * (1 if nb_map[c.id_cuenta] == "D" else -1))
+        for c in cuentas
+    }
+    grupos, comp = _derivar(cuentas, nb_map, saldos_)
+    return cuentas, nb_map, saldos_, grupos, comp
+
+
+def reconstruir(empresa_id: int) -> int:
+    """Rehace los cuatro estados de la empresa. Devuelve la cantidad de cuentas.
+    La fila de analisis_indices se actualiza en el lugar: es la que bloquean las transacciones.
+    La versión se lee antes que los saldos: si entra un cambio en el medio, las
+    tablas quedan con una versión vieja (no se usan) y nunca con una adelantada."""
+    version = sincronizacion.version_actual(empresa_id)
+    cuentas, _nb, saldos_, grupos, comp = calcular(empresa_id)
+    for modelo in (EstadoResultados, EstadoFondos, EstadoSituacionPatrimonial):
+        db.session.execute(
+            delete(modelo).where(modelo.id_empresa == empresa_id).execution_options(synchronize_session=False)
+        )
+    resultados, fondos = [], []
+    for c in cuentas:
+        datos = dict(id_empresa=empresa_id, id_cuenta=c.id_cuenta, cod_rubro=c.cod_rubro, rubro=c.rubro,
+                     cod_subrubro=c.cod_subrubro, subrubro=c.subrubro, cuenta=c.cuenta)
+        if ejercicios.es_resultado(c):
+            resultados.append(dict(datos, saldo=saldos_[c.id_cuenta]))
+        else:
+            fondos.append(dict(datos, importe=saldos_[c.id_cuenta]))
+    for modelo, filas in ((EstadoResultados, resultados), (EstadoFondos, fondos)):
+        if filas:
+            db.session.execute(insert(modelo), filas)
+    if grupos:
+        db.session.execute(insert(EstadoSituacionPatrimonial), [dict(g, id_empresa=empresa_id) for g in grupos])
+    valores = dict(_valores_indices(comp), version=version)
+    fila = db.session.execute(select(AnalisisIndices).where(AnalisisIndices.id_empresa == empresa_id)).scalar()
+    if fila is None:
+        db.session.add(AnalisisIndices(id_empresa=empresa_id, **valores))
+    else:
+        for col, v in valores.items():
+            setattr(fila, col, v)
+    db.session.flush()
+    return len(cuentas)
+
+
+def aplicar(empresa_id: int, deltas: dict) -> bool:
+    """Suma deltas {id_cuenta: centavos debe - haber} y recalcula rubros e índices.
+    False si alguna cuenta no tiene fila (hay que reconstruir). Quien llama tiene
+    bloqueada la fila de analisis_indices de la empresa."""
+    filas = _por_cuenta(empresa_id)
+    por_id = {f.id_cuenta: f for f in filas}
+    if any(id_cuenta not in por_id for id_cuenta in deltas):
+        return False
+    saldos_ = {f.id_cuenta: _saldo(f) or Decimal("0") for f in filas}
+    for id_cuenta, cts in deltas.items():
+        saldos_[id_cuenta] += de_centavos(cts * _signo(por_id[id_cuenta]))
+    grupos, comp = _derivar(filas, {f.id_cuenta: _naturaleza(f) for f in filas}, saldos_)
+    existentes = {
+        _clave_grupo(g.rubro, g.subrubro): g
+        for g in db.session.execute(
+            select(EstadoSituacionPatrimonial).where(EstadoSituacionPatrimonial.id_empresa == empresa_id)
+        ).scalars()
+    }
+    nuevos = {_clave_grupo(g["rubro"], g["subrubro"]): g for g in grupos}
+    if set(existentes) != set(nuevos):
+        return False
+
+    # recién acá se tocan los objetos: si antes devolvió False, reconstruir() no pisa nada pendiente
+    for id_cuenta in deltas:
+        f = por_id[id_cuenta]
+        if isinstance(f, EstadoResultados):
+            f.saldo = saldos_[id_cuenta]
+        else:
+            f.importe = saldos_[id_cuenta]
+    for clave, g in nuevos.items():
+        if existentes[clave].importe != g["importe"]:
+            existentes[clave].importe = g["importe"]
+    fila = db.session.execute(
+        select(AnalisisIndices).where(AnalisisIndices.id_empresa == empresa_id)
+    ).scalar()
+    for col, v in _valores_indices(comp).items():
+        setattr(fila, col, v)
+    fila.version = sincronizacion.version_actual(empresa_id)
+    return True
+
+
+def verificar(empresa_id: int) -> list:
+    """Diferencias entre los estados materializados y un recálculo completo ([] si coinciden)."""
+    difs = []
+    fila = db.session.execute(select(AnalisisIndices).where(AnalisisIndices.id_empresa == empresa_id)).scalar()
+    version = sincronizacion.version_actual(empresa_id)
+    if fila is None:
+        return ["sin estados materializados"]
+    if fila.version != version:
+        difs.append(f"versión {fila.version}, el libro está en {version}")
+    cuentas, _nb, saldos_, grupos, comp = calcular(empresa_id)
+    mat = {f.id_cuenta: f for f in _por_cuenta(empresa_id)}
+    for c in cuentas:
+        f = mat.pop(c.id_cuenta, None)
+        if f is None:
+            difs.append(f"cuenta {c.id_cuenta}: sin fila")
+        elif (_saldo(f) or 0) != saldos_[c.id_cuenta]:
+            difs.append(f"cuenta {c.id_cuenta}: {_saldo(f)} != {saldos_[c.id_cuenta]}")
+        elif isinstance(f, EstadoResultados) != ejercicios.es_resultado(c):
+            difs.append(f"cuenta {c.id_cuenta}: en la tabla equivocada")
+    difs.extend(f"cuenta {i}: fila de más" for i in mat)
+    esperados = {_clave_grupo(g["rubro"], g["subrubro"]): g["importe"] for g in grupos}
+    for g in db.session.execute(
+        select(EstadoSituacionPatrimonial).where(EstadoSituacionPatrimonial.id_empresa == empresa_id)
+    ).scalars():
+        clave = _clave_grupo(g.rubro, g.subrubro)
+        if clave not in esperados:
+            difs.append(f"rubro {clave}: de más")
+        elif (g.importe or 0) != esperados.pop(clave):
+            difs.append(f"rubro {clave}: {g.importe}")
+    difs.extend(f"rubro {clave}: falta" for clave in esperados)
+    for col, v in _valores_indices(comp).items():
+        if getattr(fila, col) != v:
+            difs.append(f"{col}: {getattr(fila, col)} != {v}")
+    return difs
+
+
+# --- mantenimiento en la transacción del cambio ---
+@eventos.libro_modificado.connect
+def _al_modificar(empresa_id, entidad=None, accion=None, id_entidad=None, deltas=None, **extra):
+    if not _activo or _derivar is None:
+        return
+    p = db.session.info.setdefault(_PENDIENTES, {}).setdefault(
+        empresa_id, dict(cambios=0, deltas=Counter(), rehacer=False))
+    if entidad in _ENTIDADES:
+        p["cambios"] += 1  # cada uno sube una versión (sincronizacion.avanzar)
+    if entidad != "asiento" or extra.get("clase") in ("cierre", "apertura"):
+        # plan o ejercicio distinto: cambian la clasificación o el inicio del ejercicio
+        p["rehacer"] = True
+        return
+    for (id_cuenta, _fecha), cts in (deltas or {}).items():
+        p["deltas"][id_cuenta] += cts
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _antes_de_confirmar(session):
+    pendientes = session.info.pop(_PENDIENTES, None)
+    for empresa_id, p in (pendientes or {}).items():
+        fila = session.execute(
+            select(AnalisisIndices.version).where(AnalisisIndices.id_empresa == empresa_id).with_for_update()
+        ).first()
+        previa = sincronizacion.version_actual(empresa_id) - p["cambios"]
+        deltas = {k: v for k, v in p["deltas"].items() if v}
+        if p["rehacer"] or fila is None or fila.version != previa or not aplicar(empresa_id, deltas):
+            # quedan con la versión vieja (los endpoints no las usan) hasta que corra el programador
+            session.info.setdefault(_REHACER, set()).add(empresa_id)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _despues_de_confirmar(session):
+    for empresa_id in session.info.pop(_REHACER, ()):
+        programador.programar(empresa_id)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _al_descartar(session, previous_transaction):
+    session.info.pop(_PENDIENTES, None)
+    session.info.pop(_REHACER, None)
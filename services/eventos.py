@@ -0,0 +1,73 @@
+# services/eventos.py
+"""
+Señales del libro contable.
+
+- libro_modificado: se emite dentro de la transacción (antes del commit). Los
+  suscriptores que mantienen saldos materializados escriben en la misma sesión,
+  así que quedan consistentes con el libro o se descartan juntos.
+- libro_confirmado: se emite después del commit (cachés, avisos a clientes).
+- libro_remoto: un cambio confirmado en otro worker, recibido por el bus
+  (services/bus_libro.py) con entidad, accion, id_entidad y version; sin
+  deltas ni objetos. Con sender None hay que invalidar todas las empresas.
+
+Ambas reciben como sender el id de la empresa y los kwargs entidad, accion,
+id_entidad y deltas: {(id_cuenta, fecha): centavos} con el cambio neto de
+debe - haber. Solo aparecen las cuentas y fechas cuyo saldo cambió. Un lote
+(p. ej. transacciones contabilizadas) llega como un solo evento con id_entidad
+None, ids=[...] y los deltas sumados: sube una sola versión del libro.
+"""
+from collections import Counter
+
+from blinker import Namespace
+from flask import current_app
+from sqlalchemy import event
+
+from models import db, RoutingSession
+from services.centavos import a_centavos
+
+_senales = Namespace()
+libro_modificado = _senales.signal("libro-modificado")
+libro_confirmado = _senales.signal("libro-confirmado")
+libro_remoto = _senales.signal("libro-remoto")
+
+_PENDIENTES = "eventos_libro_pendientes"
+
+
+def deltas_renglones(renglones, fecha, signo: int = 1) -> Counter:
+    """renglones: iterable de (id_cuenta, tipo, importe). signo=-1 para restar."""
+    out = Counter()
+    for id_cuenta, tipo, importe in renglones:
+        c = a_centavos(importe)
+        out[(id_cuenta, fecha)] += signo * (c if tipo == "debe" else -c)
+    return out
+
+
+def neto(*deltas) -> dict:
+    """Suma varios conjuntos de deltas y descarta los que se anulan."""
+    total = Counter()
+    for d in deltas:
+        for k, v in d.items():
+            total[k] += v
+    return {k: v for k, v in total.items() if v}
+
+
+def notificar(empresa_id: int, entidad: str, accion: str, id_entidad: int, deltas=None, **extra):
+    """Emite libro_modificado ahora y deja libro_confirmado para después del commit."""
+    datos = dict(entidad=entidad, accion=accion, id_entidad=id_entidad, deltas=deltas or {}, **extra)
+    libro_modificado.send(empresa_id, **datos)
+    db.session.info.setdefault(_PENDIENTES, []).append((empresa_id, datos))
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _al_confirmar(session):
+    for empresa_id, datos in session.info.pop(_PENDIENTES, None) or ():
+        # el commit ya ocurrió: un suscriptor que falla no debe convertirlo en error
+        try:
+            libro_confirmado.send(empresa_id, **datos)
+        except Exception:
+            current_app.logger.exception("[EVENTOS] fallo un suscriptor de libro_confirmado")
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _al_descartar(session, previous_transaction):
+    session.info.pop(_PENDIENTES, None)
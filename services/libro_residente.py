@@ -0,0 +1,270 @@
+# services/libro_residente.py
+"""
+Libro residente en memoria por empresa, para calcular reportes sin leer detalle_asiento.
+
+Por cada empresa activa se guarda el plan visible (objetos Cuenta con
+__slots__) y los renglones como arreglos tipados paralelos (array del
+estándar, ~25 bytes por renglón):
+
+- cta: posición de la cuenta en el plan (-1: renglón borrado, hueco)
+- cts: centavos con signo (debe +, haber -)
+- fecha: date.toordinal() del asiento
+- num, asiento: número e id del asiento
+- clase: posición en archivo.CLASES (normal, cierre, apertura)
+
+El libro lleva la versión (empresas.version_libro) que refleja. Al pedirlo se
+compara con la de la base y se pone al día con cambios_libro: los asientos
+creados o modificados se agregan al final, los borrados o modificados dejan
+huecos que se compactan cuando pasan del 25 %. Si cambió el plan se rearma el
+índice de cuentas (o se recarga todo si hay renglones de cuentas que ya no se
+ven). Así cada worker queda consistente aunque el cambio lo haya hecho otro.
+
+El total se mantiene bajo LIBRO_MEMORIA_MB desalojando las empresas usadas
+hace más tiempo. Sin init_app() (scripts) obtener() devuelve None y los
+reportes leen de la base.
+"""
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Asiento, DetalleAsiento
+from services import agregados, archivo, plan, sincronizacion
+from services.centavos import centavos_sql
+
+_BYTES_CUENTA = 400          # estimación por objeto Cuenta con sus cadenas
+_MAX_CAMBIOS = 5000          # más cambios pendientes que esto: se recarga todo
+_COLUMNAS = (("cta", "i"), ("cts", "q"), ("fecha", "i"), ("num", "i"), ("asiento", "i"), ("clase", "b"))
+
+
+class Cuenta:
+    """Cuenta del plan visible para la empresa (mismos atributos que PlanCuenta que usan los reportes)."""
+    __slots__ = ("id_cuenta", "cuenta", "rubro", "subrubro", "cod_rubro", "cod_subrubro")
+
+    def __init__(self, c):
+        for k in self.__slots__:
+            setattr(self, k, getattr(c, k))
+
+
+def _ordinal(f) -> int:
+    if f is None:
+        return None
+    if isinstance(f, str):
+        f = date.fromisoformat(f)
+    return f.toordinal()
+
+
+class LibroEmpresa:
+    __slots__ = ("empresa_id", "version", "cuentas", "indice", "huecos", "lock") + tuple(c for c, _t in _COLUMNAS)
+
+    def __init__(self, empresa_id: int):
+        self.empresa_id = empresa_id
+        self.version = None  # sin cargar
+        self.cuentas = []
+        self.indice = {}
+        self.huecos = 0
+        self.lock = threading.RLock()
+        self._vaciar()
+
+    def _vaciar(self):
+        for col, tipo in _COLUMNAS:
+            setattr(self, col, array(tipo))
+        self.huecos = 0
+
+    def __len__(self):
+        return len(self.cta)
+
+    def tamano(self) -> int:
+        """Bytes aproximados del libro."""
+        return sum(len(getattr(self, c)) * getattr(self, c).itemsize for c, _t in _COLUMNAS) + \
+            len(self.cuentas) * _BYTES_CUENTA
+
+    # --- carga y puesta al día ---
+    def cargar(self):
+        """Lee el plan y todos los renglones de la empresa."""
+        self.version = sincronizacion.version_actual(self.empresa_id)
+        self._cargar_cuentas()
+        self._vaciar()
+        self._agregar(Asiento.id_empresa == self.empresa_id)
+
+    def _cargar_cuentas(self):
+        self.cuentas = [Cuenta(c) for c in plan.cuentas_de_empresa(self.empresa_id)]
+        self.indice = {c.id_cuenta: i for i, c in enumerate(self.cuentas)}
+
+    def _agregar(self, *filtros):
+        """Agrega al final los renglones que cumplen los filtros, en orden de id_detalle."""
+        q = (
+            select(DetalleAsiento.id_cuenta, centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe),
+                   Asiento.fecha, Asiento.num_asiento, Asiento.id_asiento, Asiento.clase)
+            .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+            .where(*filtros)
+            .order_by(DetalleAsiento.id_detalle)
+        )
+        get = self.indice.get
+        clases = {c: i for i, c in enumerate(archivo.CLASES)}
+        for id_cuenta, cts, fecha, num, id_asiento, clase in db.session.execute(q):
+            self.cta.append(get(id_cuenta, -1))
+            self.cts.append(int(cts or 0))
+            self.fecha.append(fecha.toordinal())
+            self.num.append(num)
+            self.asiento.append(id_asiento)
+            self.clase.append(clases.get(clase, 0))
+
+    def _quitar(self, asientos: set):
+        """Deja huecos en los renglones de esos asientos."""
+        if not len(self):
+            return
+        marcados = np.isin(np.frombuffer(self.asiento, dtype=np.int32), np.fromiter(asientos, dtype=np.int32))
+        posiciones = np.flatnonzero(marcados & (np.frombuffer(self.cta, dtype=np.int32) != -1)).tolist()
+        for i in posiciones:
+            self.cta[i] = -1
+            self.cts[i] = 0
+        self.huecos += len(posiciones)
+
+    def _compactar(self):
+        vivos = [i for i, c in enumerate(self.cta) if c != -1]
+        for col, tipo in _COLUMNAS:
+            viejo = getattr(self, col)
+            setattr(self, col, array(tipo, (viejo[i] for i in vivos)))
+        self.huecos = 0
+
+    def poner_al_dia(self, version: int) -> bool:
+        """Aplica los cambios hasta 'version'. False si conviene recargar todo."""
+        if version - self.version > _MAX_CAMBIOS:
+            return False
+        cambios = sincronizacion.cambios_desde(self.empresa_id, self.version, version)
+        if any(entidad == "cuenta" for entidad, _i in cambios):
+            ids = [c.id_cuenta for c in self.cuentas]
+            self._cargar_cuentas()
+            nuevo = [self.indice.get(i, -1) for i in ids]
+            for i, c in enumerate(self.cta):
+                if c == -1:
+                    continue
+                if nuevo[c] == -1:
+                    return False  # renglones de una cuenta que ya no se ve (se movieron a su copia)
+                self.cta[i] = nuevo[c]
+        asientos = {i for (entidad, i) in cambios if entidad == "asiento"}
+        if asientos:
+            self._quitar(asientos)
+            vigentes = [i for (entidad, i), accion in cambios.items() if entidad == "asiento" and accion != "delete"]
+            for k in range(0, len(vigentes), 500):
+                self._agregar(Asiento.id_empresa == self.empresa_id, Asiento.id_asiento.in_(vigentes[k:k + 500]))
+        if self.huecos > len(self) // 4:
+            self._compactar()
+        self.version = version
+        return True
+
+    # --- consultas ---
+    def _filas(self, desde, hasta, inicio, pos=None):
+        """Posiciones de renglones vigentes sin cierre dentro de [max(desde, inicio), hasta]
+        (solo de la cuenta en la posición 'pos' si se indica)."""
+        d = max(x for x in (_ordinal(desde), _ordinal(inicio), 0) if x is not None)
+        h = _ordinal(hasta)
+        cierre = archivo.CLASES.index("cierre")
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        cta = np.frombuffer(self.cta, dtype=np.int32)
+        fecha = np.frombuffer(self.fecha, dtype=np.int32)
+        ok = (cta >= 0) if pos is None else (cta == pos)
+        ok &= (np.frombuffer(self.clase, dtype=np.int8) != cierre) & (fecha >= d)
+        if h is not None:
+            ok &= fecha <= h
+        return np.flatnonzero(ok)
+
+    def saldos(self, desde=None, hasta=None, inicio=None) -> dict:
+        """{id_cuenta: centavos debe - haber}, con los mismos filtros que desde_apertura."""
+        with self.lock:
+            n = len(self.cuentas)
+            sel = self._filas(desde, hasta, inicio)
+            if len(sel):
+                mov = agregados.Movimientos(
+                    np.frombuffer(self.cta, dtype=np.int32)[sel].astype(np.int64),
+                    np.frombuffer(self.cts, dtype=np.int64)[sel],
+                    np.frombuffer(self.fecha, dtype=np.int32)[sel],
+                )
+                tot = agregados.saldos_por_cuenta(mov, n).tolist()
+            else:
+                tot = [0] * n
+            return {c.id_cuenta: tot[i] for i, c in enumerate(self.cuentas)}
+
+    def movimientos(self, id_cuenta: int, desde=None, hasta=None, inicio=None) -> list:
+        """[(fecha, id_asiento, centavos)] de la cuenta, ordenados por fecha y número de asiento."""
+        with self.lock:
+            pos = self.indice.get(id_cuenta)
+            if pos is None:
+                return []
+            # sort estable: dentro del asiento se conserva el orden de id_detalle
+            filas = sorted(map(int, self._filas(desde, hasta, inicio, pos)), key=lambda i: (self.fecha[i], self.num[i]))
+            return [(date.fromordinal(self.fecha[i]), self.asiento[i], self.cts[i]) for i in filas]
+
+    def cuenta(self, id_cuenta: int):
+        pos = self.indice.get(id_cuenta)
+        return None if pos is None else self.cuentas[pos]
+
+
+class AlmacenLibros:
+    """Libros residentes por empresa, con LRU bajo un presupuesto de memoria."""
+
+    def __init__(self, memoria_mb: float = 256):
+        self.app = None
+        self.presupuesto = int(memoria_mb * 1024 * 1024)
+        self.libros = OrderedDict()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        if not app.config.get("LIBRO_RESIDENTE", True):
+            return
+        self.app = app
+        self.presupuesto = int(app.config.get("LIBRO_MEMORIA_MB", 256) * 1024 * 1024)
+
+    @property
+    def activo(self) -> bool:
+        return self.app is not None
+
+    def obtener(self, empresa_id: int):
+        """Libro de la empresa al día con la base; None si el almacén no está activo."""
+        if not self.activo:
+            return None
+        version = sincronizacion.version_actual(empresa_id)
+        with self.lock:
+            libro = self.libros.get(empresa_id)
+            if libro is None:
+                libro = self.libros[empresa_id] = LibroEmpresa(empresa_id)
+            self.libros.move_to_end(empresa_id)
+        with libro.lock:
+            # una réplica atrasada puede ver una versión anterior: el libro ya está más nuevo
+            if libro.version is None or (version > libro.version and not libro.poner_al_dia(version)):
+                libro.cargar()
+        self._desalojar(empresa_id)
+        return libro
+
+    def _desalojar(self, actual: int):
+        with self.lock:
+            total = sum(l.tamano() for l in self.libros.values())
+            for empresa_id in list(self.libros):
+                if total <= self.presupuesto:
+                    break
+                if empresa_id == actual:
+                    continue
+                total -= self.libros.pop(empresa_id).tamano()
+
+    def descartar(self, empresa_id=None):
+        with self.lock:
+            if empresa_id is None:
+                self.libros.clear()
+            else:
+                self.libros.pop(empresa_id, None)
+
+
+almacen = AlmacenLibros()
+
+
+def init_app(app):
+    almacen.init_app(app)
+
+
+def obtener(empresa_id: int):
+    return almacen.obtener(empresa_id)
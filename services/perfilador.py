@@ -0,0 +1,383 @@
+# services/perfilador.py
+"""
+Perfilado a pedido de requests de producción.
+
+Un admin arma una captura (POST /admin/api/perfilador) con filtros opcionales
+por endpoint ("accounting.api_balance" o solo "api_balance") y por empresa,
+una tasa de muestreo (0-1), la cantidad de pedidos a guardar y el formato:
+
+- colapsado: un hilo por worker toma cada PERFILADOR_INTERVALO segundos (5 ms)
+  la pila de los hilos que atienden pedidos capturados (sys._current_frames) y
+  cuenta pilas en formato "colapsado" (una línea "a;b;c cantidad" por pila, la
+  entrada de flamegraph.pl / speedscope). Costo bajo, apto para producción.
+  Con workers gevent el muestreador es igual un hilo del sistema (primitivas
+  sin parchear): de cada greenlet capturado toma gr_frame mientras espera, o la
+  pila del hilo del hub cuando es el que está corriendo.
+- pstats: cProfile determinístico del pedido; más preciso, bastante más caro.
+  Un solo pedido por proceso a la vez (desde Python 3.12 cProfile es global al
+  intérprete y un segundo enable() falla): los que llegan mientras tanto no se
+  perfilan. Con gevent incluye lo que corren otros greenlets en ese lapso.
+
+La captura armada vive en PERFILADOR_DIR/armado.json (por defecto
+instance/perfiles), así la ven todos los workers del host: cada uno revisa el
+archivo a lo sumo una vez por PERFILADOR_REVISAR segundos. Sin captura armada
+el costo por pedido es comparar un reloj. La empresa recién se conoce al final
+del pedido (g.empresa_usuario o ?empresa= del docente): si no coincide, lo
+perfilado se descarta.
+
+Cada pedido capturado queda en <id>-<pid>-<n>.folded o .prof, con una línea en
+<id>.jsonl (endpoint, empresa, estado, ms, muestras). La captura se desarma
+sola al llegar a 'cantidad' pedidos guardados (contando los de todos los
+workers) o al vencer.
+"""
+import cProfile
+import json
+import marshal
+import os
+import pstats
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+FORMATOS = ("colapsado", "pstats")
+_EXTENSION = {"colapsado": ".folded", "pstats": ".prof"}
+
+
+class Perfil:
+    """Lo que se está midiendo de un pedido."""
+    __slots__ = ("captura", "hilo", "greenlet", "inicio", "pilas", "profile", "estado")
+
+    def __init__(self, captura: dict):
+        self.captura = captura
+        self.hilo = _original("_thread", "get_ident")()
+        self.greenlet = _greenlet_actual()
+        self.inicio = time.perf_counter()
+        self.pilas = Counter()
+        self.profile = None
+        self.estado = None
+
+
+def _original(modulo: str, nombre: str):
+    """El objeto sin el parche de gevent (workers `gunicorn -k gevent`): con
+    threading parcheado get_ident() da el id del greenlet, que no figura en
+    sys._current_frames(), y un "hilo" muestreador sería otro greenlet que solo
+    corre cuando el pedido cede el control."""
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is not None:
+        return monkey.get_original(modulo, nombre)
+    return getattr(sys.modules[modulo], nombre)
+
+
+def _greenlet_actual():
+    """Greenlet que atiende el pedido si gevent parcheó threading; si no None."""
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is None or not monkey.is_module_patched("threading"):
+        return None
+    from greenlet import getcurrent
+    return getcurrent()
+
+
+def _nombre(code) -> str:
+    modulo = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{modulo}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _pila(frame) -> str:
+    nombres = []
+    while frame is not None:
+        nombres.append(_nombre(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(nombres))
+
+
+class Perfilador:
+    def __init__(self):
+        self.app = None
+        self.dir = None
+        self.intervalo = 0.005
+        self.revisar = 1.0
+        self.captura = None          # dict de armado.json, o None
+        self.mtime = None
+        self.proxima = float("inf")  # próxima revisión de armado.json (monotonic)
+        self.lock = _original("_thread", "allocate_lock")()
+        self.activos = set()         # Perfil en curso (solo formato colapsado)
+        self.muestreando = False
+        self.pstats = None           # el único Perfil pstats en curso del proceso
+        self.guardados = 0
+
+    # --- configuración ---
+    def init_app(self, app):
+        if not app.config.get("PERFILADOR", True):
+            return
+        self.app = app
+        self.dir = app.config.get("PERFILADOR_DIR") or os.path.join(app.instance_path, "perfiles")
+        os.makedirs(self.dir, exist_ok=True)
+        self.intervalo = app.config.get("PERFILADOR_INTERVALO", self.intervalo)
+        self.revisar = app.config.get("PERFILADOR_REVISAR", self.revisar)
+        self.proxima = 0.0
+
+        @app.before_request
+        def _perfilar():
+            if time.monotonic() >= self.proxima:
+                self._revisar()
+            if self.captura is not None:
+                self._empezar()
+
+        @app.after_request
+        def _estado_perfil(response):
+            perfil = g.get("_perfil")
+            if perfil is not None:
+                perfil.estado = response.status_code
+            return response
+
+        @app.teardown_request
+        def _terminar_perfil(exc=None):
+            perfil = g.pop("_perfil", None)
+            if perfil is not None:
+                self._terminar(perfil)
+
+    @property
+    def activo(self) -> bool:
+        return self.app is not None
+
+    @property
+    def _armado(self) -> str:
+        return os.path.join(self.dir, "armado.json")
+
+    def _revisar(self):
+        """Relee armado.json si cambió; desarma si la captura venció."""
+        self.proxima = time.monotonic() + self.revisar
+        try:
+            mtime = os.stat(self._armado).st_mtime_ns
+        except FileNotFoundError:
+            self.captura, self.mtime = None, None
+            return
+        if mtime != self.mtime:
+            try:
+                with open(self._armado, encoding="utf-8") as f:
+                    self.captura = json.load(f)
+            except (OSError, ValueError):
+                self.captura = None
+            self.mtime = mtime
+        if self.captura is not None and time.time() >= self.captura["vence"]:
+            self.desarmar(self.captura["id"])
+
+    # --- armado ---
+    def armar(self, endpoint=None, empresa=None, cantidad: int = 10, tasa: float = 1.0,
+              formato: str = "colapsado", minutos: float = 10) -> dict:
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato inválido: use {', '.join(FORMATOS)}")
+        if not 0 < tasa <= 1:
+            raise ValueError("La tasa debe estar entre 0 y 1")
+        if not 1 <= cantidad <= 1000:
+            raise ValueError("La cantidad debe estar entre 1 y 1000")
+        if not 0 < minutos <= 24 * 60:
+            raise ValueError("Los minutos deben estar entre 0 y 1440")
+        ahora = time.time()
+        captura = dict(
+            id=datetime.now().strftime("%Y%m%d-%H%M%S-") + f"{random.randrange(16 ** 4):04x}",
+            endpoint=endpoint or None, empresa=empresa, cantidad=cantidad, tasa=tasa, formato=formato,
+            creada=ahora, vence=ahora + minutos * 60,
+        )
+        tmp = f"{self._armado}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(captura, f)
+        os.replace(tmp, self._armado)
+        self.proxima = 0.0
+        return captura
+
+    def desarmar(self, id_captura=None) -> bool:
+        """Quita la captura armada (si id_captura no es None, solo si sigue siendo esa)."""
+        self.proxima = 0.0
+        if id_captura is not None and (self._leer_armado() or {}).get("id") != id_captura:
+            return False
+        try:
+            os.remove(self._armado)
+        except FileNotFoundError:
+            return False
+        self.captura = None
+        return True
+
+    def _leer_armado(self):
+        try:
+            with open(self._armado, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # --- por pedido ---
+    def _coincide_endpoint(self, captura: dict) -> bool:
+        filtro = captura.get("endpoint")
+        ep = request.endpoint or ""
+        return not filtro or ep == filtro or ep.rsplit(".", 1)[-1] == filtro
+
+    def _empezar(self):
+        captura = self.captura
+        if not self._coincide_endpoint(captura) or request.endpoint == "static":
+            return
+        if captura["tasa"] < 1 and random.random() >= captura["tasa"]:
+            return
+        perfil = Perfil(captura)
+        if captura["formato"] == "pstats":
+            with self.lock:
+                if self.pstats is not None:
+                    return
+                self.pstats = perfil
+            perfil.profile = cProfile.Profile()
+            try:
+                perfil.profile.enable()
+            except ValueError:
+                # Otro perfilador (un depurador, coverage) ocupa el intérprete.
+                with self.lock:
+                    self.pstats = None
+                return
+            g._perfil = perfil
+            return
+        g._perfil = perfil
+        with self.lock:
+            self.activos.add(perfil)
+            if not self.muestreando:
+                self.muestreando = True
+                _original("_thread", "start_new_thread")(self._muestrear, ())
+
+    def _muestrear(self):
+        dormir = _original("time", "sleep")
+        while True:
+            dormir(self.intervalo)
+            with self.lock:
+                if not self.activos:
+                    self.muestreando = False
+                    return
+                frames = sys._current_frames()
+                for perfil in self.activos:
+                    # gr_frame es None mientras el greenlet es el que corre en su
+                    # hilo: ahí su pila es la del hilo.
+                    frame = perfil.greenlet.gr_frame if perfil.greenlet is not None else None
+                    if frame is None:
+                        frame = frames.get(perfil.hilo)
+                    if frame is not None:
+                        perfil.pilas[_pila(frame)] += 1
+            frames = frame = None
+
+    def _terminar(self, perfil: Perfil):
+        if perfil.profile is not None:
+            perfil.profile.disable()
+            with self.lock:
+                self.pstats = None
+        else:
+            with self.lock:
+                self.activos.discard(perfil)
+        ms = (time.perf_counter() - perfil.inicio) * 1000.0
+        captura = perfil.captura
+        empresa = g.get("empresa_usuario") or request.args.get("empresa", type=int)
+        if captura.get("empresa") is not None and empresa != captura["empresa"]:
+            return
+        try:
+            self._guardar(perfil, empresa, ms)
+        except Exception:
+            self.app.logger.exception("[PERFILADOR] no se pudo guardar el perfil")
+
+    def _guardar(self, perfil: Perfil, empresa, ms: float):
+        captura = perfil.captura
+        with self.lock:
+            self.guardados += 1
+            n = self.guardados
+        archivo = f"{captura['id']}-{os.getpid()}-{n}{_EXTENSION[captura['formato']]}"
+        ruta = os.path.join(self.dir, archivo)
+        if perfil.profile is not None:
+            perfil.profile.dump_stats(ruta)
+            muestras = None
+        else:
+            with open(ruta, "w", encoding="utf-8") as f:
+                f.writelines(f"{pila} {c}\n" for pila, c in perfil.pilas.items())
+            muestras = sum(perfil.pilas.values())
+        linea = dict(archivo=archivo, pid=os.getpid(), ts=time.time(), endpoint=request.endpoint,
+                     metodo=request.method, ruta=request.full_path.rstrip("?"), empresa=empresa,
+                     estado=perfil.estado, ms=round(ms, 1), muestras=muestras)
+        indice = os.path.join(self.dir, f"{captura['id']}.jsonl")
+        with open(indice, "a", encoding="utf-8") as f:
+            f.write(json.dumps(linea) + "\n")
+        with open(indice, encoding="utf-8") as f:
+            hechos = sum(1 for _ in f)
+        if hechos >= captura["cantidad"]:
+            self.desarmar(captura["id"])
+
+    # --- lectura ---
+    def _indice(self, id_captura: str) -> list:
+        ruta = os.path.join(self.dir, f"{id_captura}.jsonl")
+        if os.path.basename(ruta) != f"{id_captura}.jsonl" or not os.path.exists(ruta):
+            return []
+        with open(ruta, encoding="utf-8") as f:
+            return [json.loads(l) for l in f if l.strip()]
+
+    def capturas(self) -> list:
+        """Resumen de las capturas guardadas, de la más nueva a la más vieja."""
+        res = []
+        for nombre in sorted(os.listdir(self.dir), reverse=True):
+            if not nombre.endswith(".jsonl"):
+                continue
+            id_captura = nombre[:-len(".jsonl")]
+            pedidos = self._indice(id_captura)
+            if not pedidos:
+                continue
+            ms = sorted(p["ms"] for p in pedidos)
+            res.append(dict(
+                id=id_captura, pedidos=len(pedidos),
+                formato="pstats" if pedidos[0]["archivo"].endswith(".prof") else "colapsado",
+                endpoints=dict(Counter(p["endpoint"] for p in pedidos)),
+                empresas=sorted({p["empresa"] for p in pedidos if p["empresa"] is not None}),
+                ms_mediana=ms[len(ms) // 2], ms_max=ms[-1],
+            ))
+        return res
+
+    def detalle(self, id_captura: str) -> list:
+        return self._indice(id_captura)
+
+    def exportar(self, id_captura: str, archivo=None):
+        """(bytes, formato) con los pedidos de la captura sumados (o uno solo); None si no existe."""
+        pedidos = self._indice(id_captura)
+        if archivo is not None:
+            pedidos = [p for p in pedidos if p["archivo"] == archivo]
+        rutas = [os.path.join(self.dir, p["archivo"]) for p in pedidos]
+        rutas = [r for r in rutas if os.path.exists(r)]
+        if not rutas:
+            return None
+        if rutas[0].endswith(".prof"):
+            stats = pstats.Stats(rutas[0])
+            for r in rutas[1:]:
+                stats.add(r)
+            return marshal.dumps(stats.stats), "pstats"
+        total = Counter()
+        for r in rutas:
+            with open(r, encoding="utf-8") as f:
+                for linea in f:
+                    pila, _, c = linea.rstrip("\n").rpartition(" ")
+                    if pila:
+                        total[pila] += int(c)
+        return "".join(f"{pila} {c}\n" for pila, c in total.most_common()).encode(), "colapsado"
+
+    def borrar(self, id_captura: str) -> int:
+        pedidos = self._indice(id_captura)
+        for p in pedidos:
+            try:
+                os.remove(os.path.join(self.dir, p["archivo"]))
+            except FileNotFoundError:
+                pass
+        if pedidos:
+            os.remove(os.path.join(self.dir, f"{id_captura}.jsonl"))
+        return len(pedidos)
+
+    def estado(self) -> dict:
+        self._revisar()
+        return dict(pid=os.getpid(), armado=self.captura, en_curso=len(self.activos), intervalo=self.intervalo)
+
+
+perfilador = Perfilador()
+
+
+def init_app(app):
+    perfilador.init_app(app)
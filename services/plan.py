@@ -1,16 +1,234 @@
 # services/plan.py
-from models import db
-from models import Empresa  # si lo necesitaras para checks
-from sqlalchemy import text
+"""
+Plan de cuentas con copia en escritura.
 
-def clonar_plan_para_empresa(id_empresa: int):
+Las cuentas de plan_cuentas_plantilla existen una sola vez en plan_cuentas como
+filas compartidas (id_empresa NULL) y todas las empresas las ven. Una empresa
+solo tiene filas propias cuando:
+- agrega una cuenta (id_base NULL),
+- personaliza una compartida (id_base = cuenta compartida),
+- da de baja una compartida (id_base = cuenta compartida, oculta = True).
+"""
+from collections import Counter
+
+from sqlalchemy import and_, delete, func, or_, select, text, update
+
+from models import db, Asiento, CierreEjercicio, DetalleAsiento, MapeoTransaccion, PlanCuenta, SaldoDiario
+from services.centavos import centavos_sql
+
+_CAMPOS = ("cod_rubro", "rubro", "cod_subrubro", "subrubro", "cuenta")
+_plan_compartido_listo = False
+
+
+def asegurar_plan_compartido():
+    """Crea las cuentas compartidas que falten según la plantilla. O(1) luego de la primera vez por proceso."""
+    global _plan_compartido_listo
+    if _plan_compartido_listo:
+        return
+    sincronizar_plantilla()
+    _plan_compartido_listo = True
+
+
+def _insertar_si_falta() -> str:
+    dialecto = db.engine.dialect.name
+    if dialecto in ("mysql", "mariadb"):
+        return "INSERT IGNORE"
+    if dialecto == "sqlite":
+        return "INSERT OR IGNORE"
+    return "INSERT"
+
+
+def sincronizar_plantilla() -> int:
+    """Inserta como compartidas las filas de la plantilla que todavía no lo estén.
+    El NOT EXISTS evita el trabajo; la clave única uq_pc_compartida (con el IGNORE)
+    descarta lo que otro proceso haya insertado a la vez."""
+    sql = text(f"""
+        {_insertar_si_falta()} INTO plan_cuentas (id_empresa, cod_rubro, rubro, cod_subrubro, subrubro, cuenta, oculta)
+        SELECT NULL, t.cod_rubro, t.rubro, t.cod_subrubro, t.subrubro, t.cuenta, :falso
+        FROM plan_cuentas_plantilla t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM plan_cuentas p
+            WHERE p.id_empresa IS NULL
+              AND COALESCE(p.cod_rubro, '') = COALESCE(t.cod_rubro, '')
+              AND COALESCE(p.rubro, '') = COALESCE(t.rubro, '')
+              AND COALESCE(p.cod_subrubro, '') = COALESCE(t.cod_subrubro, '')
+              AND COALESCE(p.subrubro, '') = COALESCE(t.subrubro, '')
+              AND COALESCE(p.cuenta, '') = COALESCE(t.cuenta, '')
+        )
+    """)
+    return db.session.execute(sql, {"falso": False}).rowcount
+
+
+def cuentas_de_empresa(id_empresa: int):
+    """Query de las cuentas visibles para la empresa: propias + compartidas no reemplazadas."""
+    reemplazadas = select(PlanCuenta.id_base).where(
+        PlanCuenta.id_empresa == id_empresa, PlanCuenta.id_base.isnot(None)
+    )
+    return PlanCuenta.query.filter(or_(
+        and_(PlanCuenta.id_empresa == id_empresa, PlanCuenta.oculta.is_(False)),
+        and_(PlanCuenta.id_empresa.is_(None), PlanCuenta.id_cuenta.notin_(reemplazadas)),
+    ))
+
+
+def cuenta_de_empresa(id_cuenta: int, id_empresa: int):
+    """La cuenta si es visible para la empresa; None si no."""
+    return cuentas_de_empresa(id_empresa).filter(PlanCuenta.id_cuenta == id_cuenta).first()
+
+
+def _usos_en_empresa(id_cuenta: int, id_empresa: int, hasta=None):
+    q = (
+        db.session.query(DetalleAsiento.id_detalle)
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .filter(Asiento.id_empresa == id_empresa, DetalleAsiento.id_cuenta == id_cuenta)
+    )
+    if hasta is not None:
+        q = q.filter(Asiento.fecha <= hasta)
+    return q
+
+
+def en_uso(id_cuenta: int, id_empresa: int, hasta=None) -> bool:
+    """Si la empresa tiene renglones en la cuenta (con fecha <= hasta si se indica)."""
+    return db.session.query(_usos_en_empresa(id_cuenta, id_empresa, hasta).exists()).scalar()
+
+
+def _repuntar_renglones(id_origen: int, id_destino: int, id_empresa: int) -> dict:
+    """Mueve los renglones de la empresa de una cuenta a otra y devuelve los deltas del cambio
+    ({(id_cuenta, fecha): centavos}, ver services.eventos)."""
+    por_fecha = (
+        db.session.query(Asiento.fecha, func.sum(centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe)))
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .filter(Asiento.id_empresa == id_empresa, DetalleAsiento.id_cuenta == id_origen)
+        .group_by(Asiento.fecha)
+        .all()
+    )
+    asientos = select(Asiento.id_asiento).where(Asiento.id_empresa == id_empresa)
+    db.session.execute(
+        update(DetalleAsiento)
+        .where(DetalleAsiento.id_cuenta == id_origen, DetalleAsiento.id_asiento.in_(asientos))
+        .values(id_cuenta=id_destino)
+        .execution_options(synchronize_session=False)
+    )
+    deltas = Counter()
+    for fecha, cts in por_fecha:
+        if cts:
+            deltas[(id_origen, fecha)] -= int(cts)
+            deltas[(id_destino, fecha)] += int(cts)
+    return dict(deltas)
+
+
+def materializar(base: PlanCuenta, id_empresa: int, **cambios):
+    """Copia propia de una cuenta compartida con los cambios pedidos.
+    Los renglones de la empresa pasan a la copia. Devuelve (copia, deltas).
+    No apto si la cuenta tiene renglones en ejercicios cerrados o archivados (se
+    reescribirían asientos cerrados y el archivo seguiría con la compartida): el
+    llamador lo verifica antes.
     """
-    Copia todas las filas de plan_cuentas_plantilla a plan_cuentas con id_empresa dado.
-    Usa SQL directo para ser eficiente.
+    datos = {k: getattr(base, k) for k in _CAMPOS}
+    datos.update({k: v for k, v in cambios.items() if k in _CAMPOS})
+    copia = PlanCuenta(id_empresa=id_empresa, id_base=base.id_cuenta, oculta=False, **datos)
+    db.session.add(copia)
+    db.session.flush()
+    return copia, _repuntar_renglones(base.id_cuenta, copia.id_cuenta, id_empresa)
+
+
+def ocultar(base: PlanCuenta, id_empresa: int) -> PlanCuenta:
+    """Baja de una cuenta compartida solo para esta empresa."""
+    marca = PlanCuenta(
+        id_empresa=id_empresa, id_base=base.id_cuenta, oculta=True,
+        **{k: getattr(base, k) for k in _CAMPOS},
+    )
+    db.session.add(marca)
+    return marca
+
+
+def _clave(c: PlanCuenta) -> tuple:
+    return tuple(getattr(c, k) or "" for k in _CAMPOS)
+
+
+def _cuentas_archivadas() -> set:
+    """Ids de cuenta con renglones en algún ejercicio archivado (de cualquier empresa)."""
+    empresas = [e for (e,) in db.session.query(CierreEjercicio.id_empresa).filter(
+        CierreEjercicio.archivado.isnot(None)).distinct()]
+    if not empresas:
+        return set()
+    from services import archivo  # usa numpy: solo si hay ejercicios archivados
+    return {i for e in empresas for t in archivo.tramos(e) for i in t.cuentas}
+
+
+def deduplicar_compartidas() -> dict:
+    """Fusiona las compartidas repetidas que dejaron sincronizaciones concurrentes
+    antes de la clave única: queda la de menor id y lo que apuntaba a las demás pasa
+    a ella. Las que aparecen en un ejercicio archivado no se tocan (el archivo guarda
+    el id) y se informan. Los saldos diarios de las cuentas tocadas se borran: hay que
+    recalcularlos, igual que los estados. Sin commit."""
+    grupos = {}
+    for c in PlanCuenta.query.filter(PlanCuenta.id_empresa.is_(None)).order_by(PlanCuenta.id_cuenta):
+        grupos.setdefault(_clave(c), []).append(c)
+    repetidas = [(filas[0], dup) for filas in grupos.values() for dup in filas[1:]]
+    resumen = dict(fusionadas=0, en_archivo=[])
+    if not repetidas:
+        return resumen
+    archivadas = _cuentas_archivadas()
+    referencias = (
+        DetalleAsiento.id_cuenta, PlanCuenta.id_base, MapeoTransaccion.id_cuenta_debe,
+        MapeoTransaccion.id_cuenta_haber, CierreEjercicio.id_cuenta_resultados,
+    )
+    for queda, dup in repetidas:
+        if dup.id_cuenta in archivadas:
+            resumen["en_archivo"].append(dup.id_cuenta)
+            continue
+        for col in referencias:
+            db.session.execute(
+                update(col.class_).where(col == dup.id_cuenta).values({col.key: queda.id_cuenta})
+                .execution_options(synchronize_session=False)
+            )
+        db.session.execute(
+            delete(SaldoDiario).where(SaldoDiario.id_cuenta.in_((dup.id_cuenta, queda.id_cuenta)))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.delete(dup)
+        resumen["fusionadas"] += 1
+    db.session.flush()
+    return resumen
+
+
+def migrar_a_plan_compartido() -> dict:
+    """Migra empresas con el plan clonado (esquema anterior) al plan compartido.
+
+    Cada fila de empresa idéntica a una compartida se elimina y sus renglones
+    pasan a la compartida. A las compartidas que la empresa no tenía (las había
+    borrado) se les agrega una marca oculta para que no reaparezcan. Las empresas
+    sin ninguna fila clonada se consideran ya migradas, así que es idempotente.
+    Antes fusiona las compartidas repetidas (deduplicar_compartidas).
     """
-    sql = text("""
-        INSERT INTO plan_cuentas (id_empresa, cod_rubro, rubro, cod_subrubro, subrubro, cuenta)
-        SELECT :id_empresa, cod_rubro, rubro, cod_subrubro, subrubro, cuenta
-        FROM plan_cuentas_plantilla
-    """)
-    db.session.execute(sql, {"id_empresa": id_empresa})
+    duplicadas = deduplicar_compartidas()
+    sincronizar_plantilla()
+    db.session.flush()
+    compartidas = {_clave(c): c for c in PlanCuenta.query.filter(PlanCuenta.id_empresa.is_(None)).all()}
+    empresas = [e for (e,) in db.session.query(PlanCuenta.id_empresa).filter(
+        PlanCuenta.id_empresa.isnot(None)).distinct()]
+    resumen = dict(empresas=0, filas_eliminadas=0, renglones_movidos=0, ocultas=0,
+                   compartidas_fusionadas=duplicadas["fusionadas"], compartidas_en_archivo=duplicadas["en_archivo"])
+    for id_empresa in empresas:
+        propias = PlanCuenta.query.filter_by(id_empresa=id_empresa).all()
+        if any(c.id_base is not None for c in propias):
+            continue  # ya usa el plan compartido
+        pares = {}
+        for c in propias:
+            base = compartidas.get(_clave(c))
+            if base is not None and base.id_cuenta not in pares:
+                pares[base.id_cuenta] = c
+        if not pares:
+            continue  # sin filas clonadas: ya migrada
+        for id_base, c in pares.items():
+            resumen["renglones_movidos"] += _usos_en_empresa(c.id_cuenta, id_empresa).count()
+            _repuntar_renglones(c.id_cuenta, id_base, id_empresa)
+            db.session.delete(c)
+            resumen["filas_eliminadas"] += 1
+        for base in compartidas.values():
+            if base.id_cuenta not in pares:
+                ocultar(base, id_empresa)
+                resumen["ocultas"] += 1
+        resumen["empresas"] += 1
+    db.session.commit()
+    return resumen
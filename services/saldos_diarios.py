@@ -0,0 +1,178 @@
+# services/saldos_diarios.py
+"""
+Saldos acumulados por empresa, cuenta y día (tabla saldos_diarios).
+
+Cada fila guarda el saldo debe - haber en centavos de una cuenta al final de un
+día con movimientos. El saldo a una fecha es la última fila con fecha <= X: una
+búsqueda por la clave primaria (id_empresa, id_cuenta, fecha), sin volver a
+sumar renglones.
+
+La tabla se mantiene con los deltas de libro_modificado, en la misma
+transacción que el asiento. El asiento de cierre impacta al día siguiente de la
+fecha de cierre: así el saldo al día del cierre es el previo al cierre (como en
+los reportes) y desde el día de apertura queda el saldo del ejercicio nuevo.
+
+Archivar un ejercicio no toca la tabla. reconstruir() la rehace desde la base
+y el archivo (sumas acumuladas con services/agregados.py); la usa
+"flask recalcular-saldos-diarios" tras migrar. verificar() compara la tabla con
+ese recálculo sin escribir ("--verificar").
+"""
+from bisect import bisect_right
+from datetime import date, timedelta
+
+from sqlalchemy import and_, delete, func, insert, select, update
+
+from models import db, Asiento, DetalleAsiento, SaldoDiario
+from services import agregados, archivo, eventos
+from services.centavos import centavos_sql
+
+_DIA = timedelta(days=1)
+
+
+def _insertar_si_falta():
+    return insert(SaldoDiario).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+
+
+def aplicar(empresa_id: int, deltas: dict, cierre: bool = False):
+    """Suma deltas {(id_cuenta, fecha): centavos} a los acumulados (sin commit).
+
+    La fila previa se lee con FOR UPDATE: en MySQL (REPEATABLE READ) es una
+    lectura actual que además bloquea el hueco, así otra transacción no puede
+    sembrar ni mover filas de la cuenta hasta el commit. Las cuentas se
+    recorren en orden para tomar los bloqueos siempre en el mismo orden.
+    """
+    for (id_cuenta, fecha), cts in sorted(deltas.items()):
+        if not cts:
+            continue
+        if cierre:
+            fecha = fecha + _DIA
+        clave = (SaldoDiario.id_empresa == empresa_id, SaldoDiario.id_cuenta == id_cuenta)
+        previo = db.session.execute(
+            select(SaldoDiario.acumulado).where(*clave, SaldoDiario.fecha < fecha)
+            .order_by(SaldoDiario.fecha.desc()).limit(1).with_for_update()
+        ).scalar()
+        db.session.execute(_insertar_si_falta(), [dict(
+            id_empresa=empresa_id, id_cuenta=id_cuenta, fecha=fecha, acumulado=previo or 0,
+        )])
+        db.session.execute(
+            update(SaldoDiario).where(*clave, SaldoDiario.fecha >= fecha)
+            .values(acumulado=SaldoDiario.acumulado + int(cts))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def saldo_a_fecha(empresa_id: int, id_cuenta: int, fecha: date) -> int:
+    """Centavos debe - haber de la cuenta al final del día 'fecha'."""
+    return db.session.execute(
+        select(SaldoDiario.acumulado)
+        .where(SaldoDiario.id_empresa == empresa_id, SaldoDiario.id_cuenta == id_cuenta, SaldoDiario.fecha <= fecha)
+        .order_by(SaldoDiario.fecha.desc())
+        .limit(1)
+    ).scalar() or 0
+
+
+def saldos_a_fecha(empresa_id: int, fecha: date) -> dict:
+    """{id_cuenta: centavos debe - haber} de todas las cuentas al final del día 'fecha'."""
+    ultima = (
+        select(SaldoDiario.id_cuenta, func.max(SaldoDiario.fecha).label("fecha"))
+        .where(SaldoDiario.id_empresa == empresa_id, SaldoDiario.fecha <= fecha)
+        .group_by(SaldoDiario.id_cuenta)
+        .subquery()
+    )
+    filas = db.session.execute(
+        select(SaldoDiario.id_cuenta, SaldoDiario.acumulado)
+        .join(ultima, and_(SaldoDiario.id_cuenta == ultima.c.id_cuenta, SaldoDiario.fecha == ultima.c.fecha))
+        .where(SaldoDiario.id_empresa == empresa_id)
+    ).all()
+    return {id_cuenta: int(v) for id_cuenta, v in filas if v}
+
+
+def _calcular(empresa_id: int, cuentas=None) -> list:
+    """[(id_cuenta, fecha, acumulado)] recalculados desde la base y el archivo."""
+    q = (
+        select(DetalleAsiento.id_cuenta, Asiento.fecha, Asiento.clase,
+               func.sum(centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe)))
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .where(Asiento.id_empresa == empresa_id)
+        .group_by(DetalleAsiento.id_cuenta, Asiento.fecha, Asiento.clase)
+    )
+    if cuentas is not None:
+        q = q.where(DetalleAsiento.id_cuenta.in_(cuentas))
+    fuentes = [db.session.execute(q).all()] + [t.totales_diarios(cuentas) for t in archivo.tramos(empresa_id)]
+    filas = [
+        (id_cuenta, int(cts or 0), fecha + _DIA if clase == "cierre" else fecha)
+        for totales in fuentes
+        for id_cuenta, fecha, clase, cts in totales
+    ]
+    ids = sorted({f[0] for f in filas})
+    idx, ordinales, acumulados = agregados.acumulados_diarios(
+        agregados.cargar(filas, {c: i for i, c in enumerate(ids)}))
+    return [
+        (ids[i], date.fromordinal(o), v)
+        for i, o, v in zip(idx.tolist(), ordinales.tolist(), acumulados.tolist())
+    ]
+
+
+def reconstruir(empresa_id: int, cuentas=None) -> int:
+    """Rehace los acumulados de la empresa (o solo de 'cuentas') desde la base y el archivo.
+    Devuelve la cantidad de filas escritas (sin commit)."""
+    borrar = delete(SaldoDiario).where(SaldoDiario.id_empresa == empresa_id)
+    if cuentas is not None:
+        cuentas = list(cuentas)
+        borrar = borrar.where(SaldoDiario.id_cuenta.in_(cuentas))
+    db.session.execute(borrar.execution_options(synchronize_session=False))
+    filas = [
+        dict(id_empresa=empresa_id, id_cuenta=id_cuenta, fecha=fecha, acumulado=acumulado)
+        for id_cuenta, fecha, acumulado in _calcular(empresa_id, cuentas)
+    ]
+    if filas:
+        db.session.execute(insert(SaldoDiario), filas)
+    return len(filas)
+
+
+def verificar(empresa_id: int) -> list:
+    """Diferencias entre la tabla y un recálculo completo ([] si coinciden).
+
+    Compara el saldo de cada cuenta en cada fecha que aparece en alguno de los
+    dos lados, así una fila de más con el saldo correcto no cuenta como deriva.
+    """
+    tabla = {}
+    for id_cuenta, fecha, acumulado in db.session.execute(
+        select(SaldoDiario.id_cuenta, SaldoDiario.fecha, SaldoDiario.acumulado)
+        .where(SaldoDiario.id_empresa == empresa_id)
+        .order_by(SaldoDiario.id_cuenta, SaldoDiario.fecha)
+    ):
+        tabla.setdefault(id_cuenta, []).append((fecha, int(acumulado)))
+    esperado = {}
+    for id_cuenta, fecha, acumulado in _calcular(empresa_id):
+        esperado.setdefault(id_cuenta, []).append((fecha, acumulado))
+
+    def saldo(dias, fecha):
+        i = bisect_right(dias, (fecha, float("inf"))) - 1
+        return dias[i][1] if i >= 0 else 0
+
+    difs = []
+    for id_cuenta in sorted(set(tabla) | set(esperado)):
+        t, e = tabla.get(id_cuenta, []), esperado.get(id_cuenta, [])
+        for fecha in sorted({f for f, _ in t} | {f for f, _ in e}):
+            if saldo(t, fecha) != saldo(e, fecha):
+                difs.append(f"cuenta {id_cuenta} al {fecha}: {saldo(t, fecha)} != {saldo(e, fecha)}")
+                break
+    return difs
+
+
+@eventos.libro_modificado.connect
+def _al_modificar(empresa_id, entidad=None, accion=None, id_entidad=None, deltas=None, **extra):
+    if entidad == "cuenta":
+        if accion == "delete":
+            db.session.execute(
+                delete(SaldoDiario)
+                .where(SaldoDiario.id_empresa == empresa_id, SaldoDiario.id_cuenta == id_entidad)
+                .execution_options(synchronize_session=False)
+            )
+        elif deltas:
+            # renglones movidos entre cuentas (copia de una compartida): pueden incluir cierres
+            reconstruir(empresa_id, {c for c, _f in deltas})
+        return
+    if deltas:
+        aplicar(empresa_id, deltas, cierre=extra.get("clase") == "cierre")
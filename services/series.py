@@ -0,0 +1,171 @@
+# services/series.py
+"""
+Series de tiempo para gráficos, agregadas en SQL por día, semana o mes.
+
+calcular() recibe qué cuentas forman cada serie y con qué signo:
+- niveles: saldo acumulado al final de cada período (parte de saldos_diarios
+  al día anterior a "desde", así que no recorre el libro previo);
+- flujos: movimiento del período, sin asientos de cierre.
+
+Los asientos de cierre impactan al día siguiente, como en saldos_diarios. Los
+ejercicios archivados del rango se leen del archivo. Si hay más períodos que
+"puntos", se juntan períodos consecutivos: los flujos se suman y los niveles
+toman el último valor, así los totales no cambian con el muestreo.
+
+Los renglones se reparten por período y cuenta con services/agregados.py y cada
+serie sale de multiplicar esa matriz por los signos de sus cuentas.
+"""
+import math
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import Date, cast, extract, func
+
+from models import db, Asiento, DetalleAsiento
+from services import agregados, archivo, saldos_diarios
+from services.centavos import centavos_sql, de_centavos
+
+AGRUPACIONES = ("dia", "semana", "mes")
+MAX_PERIODOS = 20000
+_DIA = timedelta(days=1)
+
+
+class ErrorSerie(ValueError):
+    pass
+
+
+def inicio_periodo(f: date, agrupar: str) -> date:
+    if agrupar == "semana":
+        return f - timedelta(days=f.weekday())  # lunes
+    if agrupar == "mes":
+        return date(f.year, f.month, 1)
+    return f
+
+
+def _siguiente(f: date, agrupar: str) -> date:
+    if agrupar == "semana":
+        return f + timedelta(days=7)
+    if agrupar == "mes":
+        return date(f.year + f.month // 12, f.month % 12 + 1, 1)
+    return f + _DIA
+
+
+def periodos(agrupar: str, desde: date, hasta: date) -> list:
+    """Inicios de todos los períodos entre desde y hasta (incluidos los vacíos)."""
+    if agrupar not in AGRUPACIONES:
+        raise ErrorSerie("Agrupación inválida: use dia, semana o mes")
+    if desde > hasta:
+        raise ErrorSerie("El rango de fechas está invertido")
+    out = []
+    f = inicio_periodo(desde, agrupar)
+    while f <= hasta:
+        out.append(f)
+        if len(out) > MAX_PERIODOS:
+            raise ErrorSerie("Rango demasiado largo para esa agrupación")
+        f = _siguiente(f, agrupar)
+    return out
+
+
+def _expr_periodo(agrupar: str):
+    """Expresión SQL del inicio de período de Asiento.fecha (mes: año * 100 + mes)."""
+    if agrupar == "mes":
+        return extract("year", Asiento.fecha) * 100 + extract("month", Asiento.fecha)
+    if agrupar == "semana":
+        dialecto = db.engine.dialect.name
+        if dialecto == "sqlite":
+            return func.date(Asiento.fecha, "weekday 0", "-6 days")
+        if dialecto in ("mysql", "mariadb"):
+            return func.subdate(Asiento.fecha, func.weekday(Asiento.fecha))
+        return cast(func.date_trunc("week", Asiento.fecha), Date)
+    return Asiento.fecha
+
+
+def _a_fecha(valor) -> date:
+    if isinstance(valor, date):
+        return valor
+    if isinstance(valor, str):
+        return date.fromisoformat(valor[:10])
+    valor = int(valor)
+    return date(valor // 100, valor % 100, 1)
+
+
+def _reducir(n: int, puntos: int):
+    """Grupos de índices consecutivos para que queden a lo sumo 'puntos'."""
+    paso = max(1, math.ceil(n / max(1, puntos)))
+    return [range(i, min(i + paso, n)) for i in range(0, n, paso)]
+
+
+def calcular(empresa_id: int, agrupar: str, desde: date, hasta: date,
+             niveles: dict, flujos: dict, puntos: int = 120) -> dict:
+    """niveles / flujos: {serie: {id_cuenta: signo}}. Devuelve {labels, niveles, flujos}
+    con una lista de valores por serie."""
+    inicios = periodos(agrupar, desde, hasta)
+    filas = []  # (id_cuenta, centavos, fecha en que impacta, es cierre)
+
+    def sumar(f: date, clase, id_cuenta, cts):
+        if clase == "cierre":
+            f = f + _DIA
+        if desde <= f <= hasta:
+            filas.append((id_cuenta, cts, f, clase == "cierre"))
+
+    cts = func.sum(centavos_sql(DetalleAsiento.tipo, DetalleAsiento.importe))
+    per = _expr_periodo(agrupar)
+    base = (
+        db.session.query()
+        .select_from(DetalleAsiento)
+        .join(Asiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .filter(Asiento.id_empresa == empresa_id)
+    )
+    # movimientos normales, agrupados por período en la base
+    for p, id_cuenta, v in (
+        base.add_columns(per, DetalleAsiento.id_cuenta, cts)
+        .filter(Asiento.fecha >= desde, Asiento.fecha <= hasta, Asiento.clase != "cierre")
+        .group_by(per, DetalleAsiento.id_cuenta)
+    ):
+        sumar(max(_a_fecha(p), desde), None, id_cuenta, int(v or 0))
+    # asientos de cierre (pocos): por fecha, para correrlos al día siguiente
+    for f, id_cuenta, v in (
+        base.add_columns(Asiento.fecha, DetalleAsiento.id_cuenta, cts)
+        .filter(Asiento.fecha >= desde - _DIA, Asiento.fecha < hasta, Asiento.clase == "cierre")
+        .group_by(Asiento.fecha, DetalleAsiento.id_cuenta)
+    ):
+        sumar(f, "cierre", id_cuenta, int(v or 0))
+    for t in archivo.tramos(empresa_id, desde - _DIA, hasta):
+        for id_cuenta, f, clase, v in t.totales_diarios():
+            sumar(f, clase, id_cuenta, v)
+
+    inicial = saldos_diarios.saldos_a_fecha(empresa_id, desde - _DIA)
+    cuentas = sorted({c for definicion in (niveles, flujos) for cs in definicion.values() for c in cs})
+    indice = {c: i for i, c in enumerate(cuentas)}
+    cortes = [f.toordinal() for f in inicios]
+    # por período x cuenta; la fila 0 (anterior a "desde") queda vacía por el filtro de sumar()
+    mov = agregados.saldos_por_periodo(agregados.cargar(filas, indice), len(cuentas), cortes)[1:]
+    flu = agregados.saldos_por_periodo(
+        agregados.cargar([f for f in filas if not f[3]], indice), len(cuentas), cortes)[1:]
+
+    def pesos(definicion: dict):
+        """Matriz cuenta x serie con el signo de cada cuenta en cada serie."""
+        w = np.zeros((len(cuentas), len(definicion)), dtype=np.int64)
+        for j, cs in enumerate(definicion.values()):
+            for id_cuenta, signo in cs.items():
+                w[indice[id_cuenta], j] += signo
+        return w
+
+    grupos = _reducir(len(inicios), puntos)
+    ultimos = [g[-1] for g in grupos]
+    primeros = [g[0] for g in grupos]
+
+    def valores(columna) -> list:
+        return [float(de_centavos(v)) for v in columna.tolist()]
+
+    w = pesos(niveles)
+    al_inicio = np.array([inicial.get(c, 0) for c in cuentas], dtype=np.int64) @ w
+    por_nivel = agregados.acumulados(mov @ w, al_inicio)[ultimos]
+    out_niveles = {nombre: valores(por_nivel[:, j]) for j, nombre in enumerate(niveles)}
+    por_flujo = np.add.reduceat(flu @ pesos(flujos), primeros, axis=0)
+    out_flujos = {nombre: valores(por_flujo[:, j]) for j, nombre in enumerate(flujos)}
+    return dict(
+        labels=[inicios[g[0]].isoformat() for g in grupos],
+        niveles=out_niveles,
+        flujos=out_flujos,
+    )
@@ -0,0 +1,86 @@
+# services/sincronizacion.py
+"""
+Versión del libro por empresa, para la sincronización incremental del cliente.
+
+Cada libro_modificado sobre asientos o cuentas sube empresas.version_libro y
+anota en cambios_libro qué entidad cambió, en la misma transacción que el
+cambio. Así, "cambios desde la versión N" es una consulta por índice
+(id_empresa, version), y un rollback descarta la versión junto con el cambio.
+
+La última versión asignada en la transacción queda en la sesión hasta que
+termina (version_en_sesion), para que los suscriptores de libro_confirmado la
+conozcan sin volver a consultarla.
+"""
+from sqlalchemy import event, insert, select, update
+
+from models import db, CambioLibro, Empresa, RoutingSession
+from services import eventos
+
+_ENTIDADES = ("asiento", "cuenta")
+_VERSIONES = "versiones_libro"
+
+
+def version_actual(empresa_id: int) -> int:
+    return db.session.execute(
+        select(Empresa.version_libro).where(Empresa.id_empresa == empresa_id)
+    ).scalar() or 0
+
+
+def avanzar(empresa_id: int, cambios) -> int:
+    """Sube la versión de la empresa y registra cambios: [(entidad, id_entidad, accion)]."""
+    db.session.execute(
+        update(Empresa)
+        .where(Empresa.id_empresa == empresa_id)
+        .values(version_libro=Empresa.version_libro + 1)
+        .execution_options(synchronize_session=False)
+    )
+    version = version_actual(empresa_id)
+    db.session.execute(insert(CambioLibro), [
+        dict(id_empresa=empresa_id, version=version, entidad=e, id_entidad=i, accion=a)
+        for e, i, a in cambios
+    ])
+    db.session.info.setdefault(_VERSIONES, {})[empresa_id] = version
+    return version
+
+
+def version_en_sesion(empresa_id: int):
+    """Versión que la transacción en curso (o recién confirmada) asignó a la empresa; None si ninguna."""
+    return db.session.info.get(_VERSIONES, {}).get(empresa_id)
+
+
+def cambios_desde(empresa_id: int, desde: int, hasta: int) -> dict:
+    """Última acción por (entidad, id) entre las versiones (desde, hasta]."""
+    filas = db.session.execute(
+        select(CambioLibro.entidad, CambioLibro.id_entidad, CambioLibro.accion)
+        .where(
+            CambioLibro.id_empresa == empresa_id,
+            CambioLibro.version > desde,
+            CambioLibro.version <= hasta,
+        )
+        .order_by(CambioLibro.version, CambioLibro.id)
+    ).all()
+    ultimo = {}
+    for entidad, id_entidad, accion in filas:
+        ultimo[(entidad, id_entidad)] = accion
+    return ultimo
+
+
+@eventos.libro_modificado.connect
+def _al_modificar(empresa_id, entidad=None, accion=None, id_entidad=None, **extra):
+    if entidad not in _ENTIDADES:
+        return
+    if extra.get("ids") is not None:
+        cambios = [(entidad, i, accion) for i in extra["ids"]]
+    else:
+        cambios = [(entidad, id_entidad, accion)]
+    if extra.get("id_base") is not None and accion == "update":
+        # cuenta compartida reemplazada por la copia propia: para el cliente es una baja
+        cambios.append((entidad, extra["id_base"], "delete"))
+    avanzar(empresa_id, cambios)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _al_terminar(session, transaction):
+    # after_commit (y con él libro_confirmado) ya corrió
+    if transaction.parent is None:
+        session.info.pop(_VERSIONES, None)
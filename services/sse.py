@@ -0,0 +1,210 @@
+# services/sse.py
+"""
+Avisos en vivo por empresa (Server-Sent Events).
+
+Cada evento de libro_confirmado sobre asientos o cuentas se convierte en un
+mensaje compacto que se reparte a las conexiones abiertas de esa empresa. Cada
+conexión tiene una cola acotada (SSE_COLA_MAX): si el cliente no la consume a
+tiempo se descartan los mensajes y recibe un evento "reset" para recargar.
+
+Se guarda además un historial corto por empresa para que un cliente que se
+reconecta con Last-Event-ID reciba lo que se perdió. Los ids llevan el pid del
+proceso: si el id no es de este proceso o ya salió del historial, el cliente
+recibe "reset".
+
+Los cambios hechos en otros workers llegan por el bus (libro_remoto) y se
+reenvían como evento "version" {entidad, accion, id, version}: el cliente pide
+/api/changes desde su versión. Si el bus perdió mensajes, todas las conexiones
+reciben "reset". Los lotes (ids=[...]) también se avisan como "version".
+
+Las conexiones no hacen consultas a la base y esperan en una Condition. Con
+gunicorn -k gevent (gunicorn.conf.py) cada conexión es un greenlet y no ocupa
+un worker. Con workers sincrónicos o de hilos cada conexión tomaría un worker
+entero, así que transmite() da False y /api/stream responde 204: EventSource
+no se reconecta y el cliente consulta /api/changes periódicamente. SSE_MODO
+("auto", "siempre", "nunca") fuerza una u otra cosa; con "siempre" una conexión
+se cierra a los SSE_DURACION_MAX segundos y EventSource se reconecta solo.
+"""
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from services import eventos, sincronizacion
+
+_ENTIDADES = ("asiento", "cuenta")
+
+
+class Suscripcion:
+    __slots__ = ("empresa_id", "cola", "cond", "reset")
+
+    def __init__(self, empresa_id: int, tam: int):
+        self.empresa_id = empresa_id
+        self.cola = deque(maxlen=tam)
+        self.cond = threading.Condition()
+        self.reset = False
+
+    def publicar(self, mensaje):
+        with self.cond:
+            if len(self.cola) == self.cola.maxlen:
+                self.cola.clear()
+                self.reset = True
+            else:
+                self.cola.append(mensaje)
+            self.cond.notify()
+
+    def esperar(self, timeout: float):
+        """Devuelve (mensajes, reset) apenas haya algo o al vencer timeout."""
+        with self.cond:
+            if not self.cola and not self.reset:
+                self.cond.wait(timeout)
+            mensajes, reset = list(self.cola), self.reset
+            self.cola.clear()
+            self.reset = False
+        return mensajes, reset
+
+
+class Difusor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.suscripciones = {}   # empresa -> set(Suscripcion)
+        self.historial = {}       # empresa -> deque((id, evento, data))
+        self.secuencia = itertools.count(1)
+        self.tam_cola = 100
+        self.tam_historial = 200
+        self.keepalive = 15
+        self.duracion_max = 300
+        self.modo = "auto"
+
+    def init_app(self, app):
+        self.tam_cola = app.config.get("SSE_COLA_MAX", self.tam_cola)
+        self.tam_historial = app.config.get("SSE_HISTORIAL", self.tam_historial)
+        self.keepalive = app.config.get("SSE_KEEPALIVE", self.keepalive)
+        self.duracion_max = app.config.get("SSE_DURACION_MAX", self.duracion_max)
+        self.modo = app.config.get("SSE_MODO", self.modo)
+
+    def transmite(self, environ) -> bool:
+        """Si este proceso puede sostener conexiones largas sin bloquear un worker:
+        bajo gunicorn solo con gevent (threading parcheado); el servidor de
+        desarrollo abre un hilo por pedido y transmite siempre."""
+        if self.modo != "auto":
+            return self.modo == "siempre"
+        if not str(environ.get("SERVER_SOFTWARE", "")).startswith("gunicorn"):
+            return True
+        monkey = sys.modules.get("gevent.monkey")
+        return monkey is not None and monkey.is_module_patched("threading")
+
+    def _nuevo_id(self) -> str:
+        return f"{os.getpid()}-{next(self.secuencia)}"
+
+    def publicar(self, empresa_id: int, evento: str, data: dict):
+        mensaje = (self._nuevo_id(), evento, json.dumps(data, separators=(",", ":"), default=str))
+        with self.lock:
+            hist = self.historial.get(empresa_id)
+            if hist is None:
+                hist = self.historial[empresa_id] = deque(maxlen=self.tam_historial)
+            hist.append(mensaje)
+            subs = list(self.suscripciones.get(empresa_id, ()))
+        for s in subs:
+            s.publicar(mensaje)
+
+    def suscribir(self, empresa_id: int, ultimo_id=None) -> Suscripcion:
+        s = Suscripcion(empresa_id, self.tam_cola)
+        with self.lock:
+            self.suscripciones.setdefault(empresa_id, set()).add(s)
+            if ultimo_id:
+                perdidos = self._desde(empresa_id, ultimo_id)
+                if perdidos is None:
+                    s.reset = True
+                else:
+                    for m in perdidos[-self.tam_cola:]:
+                        s.cola.append(m)
+        return s
+
+    def _desde(self, empresa_id: int, ultimo_id: str):
+        """Mensajes posteriores a ultimo_id; None si no se puede saber."""
+        hist = list(self.historial.get(empresa_id, ()))
+        pid, _, n = ultimo_id.partition("-")
+        if pid != str(os.getpid()) or not n.isdigit():
+            return None
+        n = int(n)
+        if hist and int(hist[0][0].split("-")[1]) > n + 1:
+            return None  # el historial ya no llega hasta ese id
+        return [m for m in hist if int(m[0].split("-")[1]) > n]
+
+    def reiniciar(self):
+        """Manda "reset" a todas las conexiones abiertas."""
+        with self.lock:
+            subs = [s for grupo in self.suscripciones.values() for s in grupo]
+        for s in subs:
+            with s.cond:
+                s.cola.clear()
+                s.reset = True
+                s.cond.notify()
+
+    def desuscribir(self, s: Suscripcion):
+        with self.lock:
+            subs = self.suscripciones.get(s.empresa_id)
+            if subs is not None:
+                subs.discard(s)
+                if not subs:
+                    del self.suscripciones[s.empresa_id]
+
+    def flujo(self, empresa_id: int, ultimo_id=None):
+        """Generador del cuerpo text/event-stream."""
+        s = self.suscribir(empresa_id, ultimo_id)
+        fin = time.monotonic() + self.duracion_max
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                restante = fin - time.monotonic()
+                if restante <= 0:
+                    return
+                mensajes, reset = s.esperar(min(self.keepalive, restante))
+                if reset:
+                    yield "event: reset\ndata: {}\n\n"
+                for id_msg, evento, data in mensajes:
+                    yield f"id: {id_msg}\nevent: {evento}\ndata: {data}\n\n"
+                if not mensajes and not reset:
+                    yield ": ping\n\n"
+        finally:
+            self.desuscribir(s)
+
+
+difusor = Difusor()
+
+
+def init_app(app):
+    difusor.init_app(app)
+
+
+@eventos.libro_confirmado.connect
+def _al_confirmar(empresa_id, entidad=None, accion=None, id_entidad=None, **extra):
+    if entidad not in _ENTIDADES:
+        return
+    if extra.get("ids") is not None:
+        # lote: el cliente trae los cambios con /api/changes, como los de otro worker
+        version = sincronizacion.version_en_sesion(empresa_id)
+        difusor.publicar(empresa_id, "version", dict(entidad=entidad, accion=accion, id=None, version=version))
+        return
+    data = dict(accion=accion, id=id_entidad)
+    if extra.get(entidad) is not None:
+        data[entidad] = extra[entidad]  # asiento/cuenta serializado
+    if extra.get("id_base") is not None:
+        data["id_base"] = extra["id_base"]
+    deltas = extra.get("deltas")
+    if deltas:
+        data["deltas"] = [[c, f, v] for (c, f), v in deltas.items()]
+    difusor.publicar(empresa_id, entidad, data)
+
+
+@eventos.libro_remoto.connect
+def _al_cambiar_en_otro_worker(empresa_id, entidad=None, accion=None, id_entidad=None, version=None, **extra):
+    if empresa_id is None:
+        difusor.reiniciar()
+        return
+    # id 0: lote (el bus no lleva la lista de ids)
+    difusor.publicar(empresa_id, "version", dict(entidad=entidad, accion=accion, id=id_entidad or None, version=version))
@@ -0,0 +1,141 @@
+# services/transacciones.py
+"""
+Contabilización en lote de transacciones (ingresos y egresos) como asientos.
+
+Cada transacción pendiente genera un asiento de dos renglones por su importe:
+debe y haber salen de mapeo_transacciones según (tipo, condición), y si no hay
+uno para la condición se usa el de la condición NULL (cualquiera). Las que no
+se pueden contabilizar (sin mapeo, cuenta no visible, ejercicio cerrado,
+importe no positivo) quedan en estado 'error' con el motivo y no frenan al resto.
+
+contabilizar() procesa hasta 'limite' pendientes en orden de fecha con una sola
+reserva del correlativo (bloqueando la fila de la empresa), inserta asientos y
+renglones con executemany y emite un único libro_modificado con ids=[...] y los
+deltas sumados, así saldos diarios, estados y versión del libro se actualizan
+una vez por lote y no por asiento. La bitácora sí lleva un evento por asiento
+(con su id_transaccion), que el escritor de auditoría inserta en lote. No hace
+commit.
+"""
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import func, insert, select, update
+
+from models import db, Asiento, DetalleAsiento, Empresa, MapeoTransaccion, PlanCuenta, Transaccion
+from services import auditoria, ejercicios, eventos, plan
+from services.centavos import a_centavos
+
+TIPOS = ("ingreso", "egreso")
+LOTE = 5000
+
+
+def _condicion(valor) -> str:
+    return (valor or "").strip().lower() or None
+
+
+def mapeos(empresa_id: int) -> dict:
+    """{(tipo, condicion normalizada | None): (id_cuenta_debe, id_cuenta_haber)}."""
+    return {
+        (m.tipo, _condicion(m.condicion)): (m.id_cuenta_debe, m.id_cuenta_haber)
+        for m in MapeoTransaccion.query.filter_by(id_empresa=empresa_id)
+    }
+
+
+def importe_valido(valor):
+    """Decimal con dos decimales, o None si no es un importe positivo."""
+    try:
+        monto = Decimal(str(valor)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+    return monto if monto > 0 else None
+
+
+def contabilizar(empresa_id: int, id_usuario=None, hasta=None, limite: int = LOTE) -> dict:
+    """Contabiliza hasta 'limite' transacciones pendientes (con fecha <= hasta si se indica)."""
+    q = (
+        select(Transaccion)
+        .where(Transaccion.id_empresa == empresa_id, Transaccion.estado == "pendiente")
+        .order_by(Transaccion.fecha, Transaccion.id_transaccion)
+        .limit(limite)
+        .with_for_update()
+    )
+    if hasta is not None:
+        q = q.where(Transaccion.fecha <= hasta)
+    pendientes = db.session.execute(q).scalars().all()
+    if not pendientes:
+        return dict(asientos=0, errores=[], quedan=0)
+
+    reglas = mapeos(empresa_id)
+    visibles = {
+        i for (i,) in db.session.execute(
+            plan.cuentas_de_empresa(empresa_id).with_entities(PlanCuenta.id_cuenta).statement)
+    }
+    cerrada = ejercicios.fecha_cerrada(empresa_id)
+
+    validas, errores = [], []
+    for t in pendientes:
+        cuentas = reglas.get((t.tipo, _condicion(t.condicion))) or reglas.get((t.tipo, None))
+        if importe_valido(t.importe) is None:
+            motivo = "Importe debe ser positivo"
+        elif cerrada is not None and t.fecha <= cerrada:
+            motivo = "La fecha pertenece a un ejercicio cerrado"
+        elif cuentas is None:
+            motivo = f"Sin mapeo para {t.tipo} / {t.condicion or 'cualquier condición'}"
+        elif not set(cuentas) <= visibles:
+            motivo = "El mapeo usa una cuenta que la empresa no tiene"
+        else:
+            validas.append((t, cuentas))
+            continue
+        errores.append(dict(id_transaccion=t.id_transaccion, estado="error", error=motivo))
+
+    ids = []
+    deltas = Counter()
+    if validas:
+        # una reserva del correlativo para todo el lote
+        db.session.execute(select(Empresa.id_empresa).where(Empresa.id_empresa == empresa_id).with_for_update())
+        ultimo = db.session.query(func.max(Asiento.num_asiento)).filter_by(id_empresa=empresa_id).scalar() or 0
+        db.session.execute(insert(Asiento), [
+            dict(
+                id_empresa=empresa_id, fecha=t.fecha, num_asiento=ultimo + k, clase="normal",
+                doc_respaldatorio=t.doc_respaldatorio or "", id_usuario=id_usuario,
+                leyenda=" - ".join(filter(None, [t.tipo.capitalize(), t.contacto, t.condicion])),
+            )
+            for k, (t, _c) in enumerate(validas, start=1)
+        ])
+        por_num = dict(db.session.execute(
+            select(Asiento.num_asiento, Asiento.id_asiento)
+            .where(Asiento.id_empresa == empresa_id, Asiento.num_asiento > ultimo,
+                   Asiento.num_asiento <= ultimo + len(validas))
+        ).all())
+        renglones, marcadas = [], []
+        for k, (t, (debe, haber)) in enumerate(validas, start=1):
+            id_asiento = por_num[ultimo + k]
+            monto = importe_valido(t.importe)
+            renglones.append(dict(id_asiento=id_asiento, id_cuenta=debe, tipo="debe", importe=monto))
+            renglones.append(dict(id_asiento=id_asiento, id_cuenta=haber, tipo="haber", importe=monto))
+            deltas[(debe, t.fecha)] += a_centavos(monto)
+            deltas[(haber, t.fecha)] -= a_centavos(monto)
+            marcadas.append(dict(id_transaccion=t.id_transaccion, estado="contabilizada", id_asiento=id_asiento, error=None))
+            ids.append(id_asiento)
+        db.session.execute(insert(DetalleAsiento), renglones)
+        db.session.execute(update(Transaccion), marcadas)
+        # un evento por asiento (el escritor de auditoría los inserta en lote)
+        for k, (t, _c) in enumerate(validas, start=1):
+            auditoria.registrar(
+                "asiento", por_num[ultimo + k], "create", id_usuario=id_usuario, id_empresa=empresa_id,
+                datos=dict(fecha=t.fecha.isoformat(), num=ultimo + k, renglones=2,
+                           id_transaccion=t.id_transaccion, lote=len(ids)),
+            )
+        eventos.notificar(empresa_id, "asiento", "create", None, deltas=eventos.neto(deltas), ids=ids)
+    if errores:
+        db.session.execute(update(Transaccion), errores)
+
+    q_quedan = db.session.query(func.count(Transaccion.id_transaccion)).filter(
+        Transaccion.id_empresa == empresa_id, Transaccion.estado == "pendiente")
+    if hasta is not None:
+        q_quedan = q_quedan.filter(Transaccion.fecha <= hasta)
+    return dict(
+        asientos=len(ids),
+        errores=[dict(id_transaccion=e["id_transaccion"], error=e["error"]) for e in errores],
+        quedan=q_quedan.scalar(),
+    )
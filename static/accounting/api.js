@@ -14,8 +14,26 @@ export async function fetchJSON(url, opts = {}) {
 export const AccountingAPI = {
   // Examples (to be used in future refactor replacing localStorage)
   listCuentas: (empresa) => fetchJSON(`/accounting/api/cuentas${empresa?`?empresa=${empresa}`:''}`),
+  searchCuentas: (empresa, q, limite = 20) => fetchJSON(`/accounting/api/cuentas/search?${new URLSearchParams({ q, limite, ...(empresa ? { empresa } : {}) })}`),
+  // Sobre una cuenta compartida crea la copia propia de la empresa (cambia id_cuenta)
+  updateCuenta: (id, payload) => fetchJSON(`/accounting/api/cuentas/${id}`, { method: 'PATCH', body: JSON.stringify(payload) }),
+  // { empresa, version, completo, asientos, cuentas, eliminados: { asientos, cuentas } }
+  changes: (empresa, since = 0) => fetchJSON(`/accounting/api/changes?since=${since}${empresa?`&empresa=${empresa}`:''}`),
   listAsientos: (empresa) => fetchJSON(`/accounting/api/asientos${empresa?`?empresa=${empresa}`:''}`),
+  // filtros: { q, cuenta, importe_min, importe_max, usuario, desde, hasta, limite, cursor }
+  searchAsientos: (empresa, filtros = {}) => fetchJSON(`/accounting/api/asientos/search?${new URLSearchParams({ ...filtros, ...(empresa ? { empresa } : {}) })}`),
   createAsiento: (payload) => fetchJSON(`/accounting/api/asientos`, { method: 'POST', body: JSON.stringify(payload) }),
+  // PATCH: solo los campos enviados; los renglones con id_detalle se actualizan en su lugar
+  updateAsiento: (id, payload) => fetchJSON(`/accounting/api/asientos/${id}`, { method: 'PATCH', body: JSON.stringify(payload) }),
+  deleteAsiento: (id) => fetchJSON(`/accounting/api/asientos/${id}`, { method: 'DELETE' }),
+  // handlers: { asiento(ev), cuenta(ev), reset() }; devuelve el EventSource para cerrarlo.
+  // sinStream() se llama si el servidor no transmite (204): hay que consultar changes() periódicamente
+  stream: (empresa, handlers = {}, sinStream = null) => {
+    const es = new EventSource(`/accounting/api/stream${empresa?`?empresa=${empresa}`:''}`);
+    for (const [evento, fn] of Object.entries(handlers)) es.addEventListener(evento, (e) => fn(JSON.parse(e.data || '{}')));
+    es.addEventListener('error', () => { if (es.readyState === EventSource.CLOSED && sinStream) sinStream(); });
+    return es;
+  },
   mayor: (empresa, cuenta) => fetchJSON(`/accounting/api/mayor?cuenta=${cuenta}${empresa?`&empresa=${empresa}`:''}`),
   balance: (empresa) => fetchJSON(`/accounting/api/balance${empresa?`?empresa=${empresa}`:''}`),
   estados: (empresa) => fetchJSON(`/accounting/api/estados${empresa?`?empresa=${empresa}`:''}`),
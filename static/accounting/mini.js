@@ -249,10 +249,77 @@
     // Mayor/Balance/Estados trasladados a Reportes
   }
 
-  async function loadCuentas(){ const url = empresa? `/accounting/api/cuentas?empresa=${empresa}` : `/accounting/api/cuentas`; const res = await fetch(url, { credentials: 'same-origin' }); cuentas = res.ok ? await res.json() : []; }
-  async function loadAsientos(){ const url = empresa? `/accounting/api/asientos?empresa=${empresa}` : `/accounting/api/asientos`; const res = await fetch(url, { credentials: 'same-origin' }); asientos = res.ok ? await res.json() : []; }
+  const porFechaDesc = (a,b)=> (b.fecha||'').localeCompare(a.fecha||'') || (b.num_asiento - a.num_asiento);
+  const porNombre = (a,b)=> (a.cuenta||'').localeCompare(b.cuenta||'');
+  function upsert(lista, item, key){ const i = lista.findIndex(x=>x[key]===item[key]); if(i>=0) lista[i] = item; else lista.push(item); }
+
+  // Cache local (localStorage) + /accounting/api/changes: cada carga trae solo lo que cambió
+  const CACHE_KEY = `msc-libro-${empresa || 'propia'}`;
+  let cache = { empresa: null, version: 0 };
+  function leerCache(){
+    try{ const c = JSON.parse(localStorage.getItem(CACHE_KEY) || 'null'); if(c){ cache = { empresa: c.empresa, version: c.version || 0 }; cuentas = c.cuentas || []; asientos = c.asientos || []; } }catch(_){ cache = { empresa: null, version: 0 }; }
+  }
+  function guardarCache(){
+    try{ localStorage.setItem(CACHE_KEY, JSON.stringify({ ...cache, cuentas, asientos })); }catch(_){ /* sin espacio: se sincroniza completo la próxima vez */ }
+  }
+  async function sincronizar(){
+    const pedir = async (since)=>{ const res = await fetch(`/accounting/api/changes?since=${since}${empresa?`&empresa=${empresa}`:''}`, { credentials: 'same-origin' }); return res.ok ? res.json() : null; };
+    let d = await pedir(cache.version);
+    if(d && !d.completo && d.empresa !== cache.empresa) d = await pedir(0);
+    if(!d) return;
+    if(d.completo){ cuentas = d.cuentas; asientos = d.asientos; }
+    else {
+      const delA = new Set(d.eliminados.asientos), delC = new Set(d.eliminados.cuentas);
+      asientos = asientos.filter(a=>!delA.has(a.id_asiento)); cuentas = cuentas.filter(c=>!delC.has(c.id_cuenta));
+      d.asientos.forEach(a=>upsert(asientos, a, 'id_asiento')); d.cuentas.forEach(c=>upsert(cuentas, c, 'id_cuenta'));
+    }
+    asientos.sort(porFechaDesc); cuentas.sort(porNombre);
+    cache = { empresa: d.empresa, version: d.version }; guardarCache();
+  }
+  const loadCuentas = sincronizar;
+  const loadAsientos = sincronizar;
+
+  // Sin eventos en vivo (navegador sin EventSource o worker que no transmite): /api/changes cada tanto
+  const SONDEO_MS = 15000;
+  function sondear(){
+    setInterval(async ()=>{
+      const antes = cache.version;
+      try{ await sincronizar(); }catch(_){ return; }
+      if(cache.version !== antes){ renderCuentas(); renderDiario(); renderEntrada(); renderTodo(); }
+    }, SONDEO_MS);
+  }
+
+  // Eventos en vivo: se aplican por id, así que repetir uno no rompe el estado
+  function suscribirEnVivo(){
+    if(!window.EventSource){ sondear(); return; }
+    const es = new EventSource(empresa? `/accounting/api/stream?empresa=${empresa}` : `/accounting/api/stream`);
+    // 204 del servidor: EventSource queda cerrado y no se reconecta
+    es.addEventListener('error', ()=>{ if(es.readyState === EventSource.CLOSED) sondear(); });
+    es.addEventListener('asiento', (e)=>{
+      const ev = JSON.parse(e.data);
+      if(ev.accion === 'delete') asientos = asientos.filter(a=>a.id_asiento !== ev.id);
+      else if(ev.asiento){ upsert(asientos, ev.asiento, 'id_asiento'); asientos.sort(porFechaDesc); }
+      renderDiario(); renderTodo();
+    });
+    es.addEventListener('cuenta', (e)=>{
+      const ev = JSON.parse(e.data);
+      if(ev.id_base) cuentas = cuentas.filter(c=>c.id_cuenta !== ev.id_base);
+      if(ev.accion === 'delete') cuentas = cuentas.filter(c=>c.id_cuenta !== ev.id);
+      else if(ev.cuenta){ upsert(cuentas, ev.cuenta, 'id_cuenta'); cuentas.sort(porNombre); }
+      renderCuentas(); renderEntrada();
+    });
+    es.addEventListener('reset', async ()=>{ await sincronizar(); renderCuentas(); renderDiario(); renderEntrada(); renderTodo(); });
+    // cambio hecho en otro worker: llega sin el objeto, se trae con /api/changes
+    es.addEventListener('version', async (e)=>{
+      const ev = JSON.parse(e.data);
+      if(ev.version && ev.version <= cache.version) return;
+      await sincronizar(); renderCuentas(); renderDiario(); renderEntrada(); renderTodo();
+    });
+  }
+
   async function init(){
-    initTabs(); await loadCuentas(); await loadAsientos(); renderCuentas(); renderDiario(); renderEntrada(); renderTodo(); bindEvents();
+    initTabs(); leerCache(); await sincronizar(); renderCuentas(); renderDiario(); renderEntrada(); renderTodo(); bindEvents();
+    suscribirEnVivo();
   }
 
   if (document.readyState === 'loading') document.addEventListener('DOMContentLoaded', init); else init();
@@ -0,0 +1,89 @@
+# tests/conftest.py
+"""
+Entorno de pruebas: la aplicación se crea al importar app.py con la
+configuración del entorno, así que las variables se fijan antes de que algún
+módulo de prueba la importe. Dos archivos SQLite hacen de primario y réplica.
+
+Las lecturas de la API contable van a la réplica (copia del primario al crear
+el módulo de test_replica.py): las pruebas que escriben verifican contra la
+base desde el contexto de la aplicación, que siempre usa el primario.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+_DIR = tempfile.mkdtemp(prefix="sistema-contable-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{_DIR}/primario.db"
+os.environ["DATABASE_REPLICA_URL"] = f"sqlite:///{_DIR}/replica.db"
+os.environ.setdefault("GOOGLE_CLIENT_ID", "tests")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "tests")
+for variable, sub in (
+    ("AUDITORIA_WAL_DIR", "auditoria"),
+    ("BUS_LIBRO_ARCHIVO", "bus_libro.mmap"),
+    ("ARCHIVO_DIR", "archivo"),
+    ("REPORTES_CACHE_DIR", "cache_reportes"),
+    ("PERFILADOR_DIR", "perfiles"),
+):
+    os.environ[variable] = os.path.join(_DIR, sub)
+os.environ["REPORTES_PRECALENTAR"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_PLAN = (
+    ("1", "ACTIVO", "1.1", "ACTIVO CORRIENTE", "CAJA"),
+    ("1", "ACTIVO", "1.1", "ACTIVO CORRIENTE", "BANCOS"),
+    ("2", "PASIVO", "2.1", "PASIVO CORRIENTE", "PROVEEDORES"),
+    ("3", "PATRIMONIO", "3.1", "PATRIMONIO NETO", "CAPITAL"),
+    ("4", "RESULTADO", "4.1", "INGRESOS", "VENTAS"),
+    ("5", "RESULTADO", "5.1", "EGRESOS", "COSTO DE VENTAS"),
+)
+_numero = itertools.count(1)
+
+
+@pytest.fixture
+def nueva_empresa():
+    """Crea una empresa con su dueño y un plan propio chico.
+
+    Devuelve un cliente con la sesión del dueño, con .empresa_id y .cuentas
+    ({nombre: id_cuenta}) y .asiento(fecha, [(cuenta, tipo, importe)]).
+    """
+    from app import app
+    from models import db, Empresa, PlanCuenta, Rol, Usuario
+
+    def crear():
+        n = next(_numero)
+        app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+        with app.app_context():
+            u = Usuario(nombre=f"Dueño {n}", correo=f"dueno{n}@empresa.test", rol=Rol.dueno)
+            db.session.add(u)
+            db.session.flush()
+            e = Empresa(nombre=f"Empresa {n}", id_gerente=u.id)
+            db.session.add(e)
+            db.session.flush()
+            cuentas = {}
+            for cod_rubro, rubro, cod_subrubro, subrubro, cuenta in _PLAN:
+                c = PlanCuenta(id_empresa=e.id_empresa, cod_rubro=cod_rubro, rubro=rubro,
+                               cod_subrubro=cod_subrubro, subrubro=subrubro, cuenta=cuenta)
+                db.session.add(c)
+                db.session.flush()
+                cuentas[cuenta] = c.id_cuenta
+            db.session.commit()
+            uid, empresa_id = u.id, e.id_empresa
+        cliente = app.test_client()
+        with cliente.session_transaction() as s:
+            s["uid"] = uid
+        cliente.empresa_id, cliente.cuentas = empresa_id, cuentas
+
+        def asiento(fecha, renglones):
+            r = cliente.post("/accounting/api/asientos", json=dict(fecha=fecha, leyenda="prueba", renglones=[
+                dict(id_cuenta=cuentas[cuenta], tipo=tipo, importe=importe) for cuenta, tipo, importe in renglones
+            ]))
+            assert r.status_code == 201, r.get_data(as_text=True)
+            return r.get_json()
+        cliente.asiento = asiento
+        return cliente
+    return crear
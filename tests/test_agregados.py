@@ -0,0 +1,114 @@
+# tests/test_agregados.py
+"""
+Motor vectorizado (services/agregados.py): sumar centavos int64 con NumPy
+tiene que dar al centavo lo mismo que sumar Decimal renglón por renglón, en
+los reductores y en el balance que los usa.
+"""
+import random
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import accounting  # noqa: E402
+from app import app  # noqa: E402
+from services import agregados  # noqa: E402
+
+INICIO = date(2023, 1, 1)
+
+
+def _importe(rnd) -> Decimal:
+    # centavos sueltos (0.10 + 0.20 no da 0.30 en float) mezclados con importes grandes
+    return rnd.choice((
+        Decimal(rnd.randint(1, 99)) / 100,
+        Decimal(rnd.randint(1, 10**12 - 1)) / 100,  # tope de DECIMAL(12,2)
+        Decimal("0.10"), Decimal("0.20"),
+    ))
+
+
+@pytest.fixture
+def renglones():
+    """(id_cuenta, importe Decimal con signo, fecha)."""
+    rnd = random.Random(27)
+    return [
+        (rnd.choice((11, 12, 13, 14, 15)),
+         _importe(rnd) * rnd.choice((1, -1)),
+         INICIO + timedelta(days=rnd.randint(0, 730)))
+        for _ in range(5000)
+    ]
+
+
+def test_reductores_dan_lo_mismo_que_decimal(renglones):
+    indice = {11: 0, 12: 1, 13: 2, 14: 3, 15: 4}
+    mov = agregados.cargar([(c, agregados.a_centavos(i), f) for c, i, f in renglones], indice)
+
+    por_cuenta = defaultdict(Decimal)
+    for c, i, _f in renglones:
+        por_cuenta[c] += i
+    saldos = agregados.saldos_por_cuenta(mov, len(indice))
+    assert {c: agregados.de_centavos(saldos[p]) for c, p in indice.items()} == por_cuenta
+
+    cortes = [date(2023, m, 1).toordinal() for m in (3, 6, 9, 12)] + [date(2024, 6, 1).toordinal()]
+    por_periodo = agregados.saldos_por_periodo(mov, len(indice), cortes)
+    acumulado = agregados.acumulados(por_periodo[1:], por_periodo[0])
+    for c, p in indice.items():
+        periodos = defaultdict(Decimal)
+        for cc, i, f in renglones:
+            if cc == c:
+                periodos[bisect_right(cortes, f.toordinal())] += i
+        assert [agregados.de_centavos(v) for v in por_periodo[:, p]] == [periodos[k] for k in range(len(cortes) + 1)]
+        esperado = periodos[0]
+        for k in range(len(cortes)):
+            esperado += periodos[k + 1]
+            assert agregados.de_centavos(acumulado[k, p]) == esperado
+
+    por_dia = defaultdict(Decimal)
+    for c, i, f in renglones:
+        por_dia[(c, f)] += i
+    idx, ords, acum = agregados.acumulados_diarios(mov)
+    posiciones = {p: c for c, p in indice.items()}
+    obtenido = [(posiciones[int(p)], date.fromordinal(int(o)), agregados.de_centavos(v)) for p, o, v in zip(idx, ords, acum)]
+    esperado, corrido, anterior = [], Decimal("0"), None
+    for (c, f) in sorted(por_dia, key=lambda k: (indice[k[0]], k[1])):
+        corrido = por_dia[(c, f)] + (corrido if c == anterior else 0)
+        anterior = c
+        esperado.append((c, f, corrido))
+    assert obtenido == esperado
+
+
+def test_balance_al_centavo(nueva_empresa):
+    c = nueva_empresa()
+    rnd = random.Random(270)
+    nombres = sorted(c.cuentas)
+    libro = []
+    for _ in range(60):
+        debe, haber = rnd.sample(nombres, 2)
+        importe = _importe(rnd)
+        fecha = INICIO + timedelta(days=rnd.randint(0, 300))
+        c.asiento(fecha.isoformat(), [(debe, "debe", str(importe)), (haber, "haber", str(importe))])
+        libro.append((c.cuentas[debe], importe, fecha))
+        libro.append((c.cuentas[haber], -importe, fecha))
+
+    def esperado(hasta=None, desde=None):
+        saldos = defaultdict(Decimal)
+        for id_cuenta, importe, fecha in libro:
+            if (desde is None or fecha >= desde) and (hasta is None or fecha <= hasta):
+                saldos[id_cuenta] += importe
+        return saldos
+
+    corte = INICIO + timedelta(days=150)
+    with app.test_request_context():
+        for datos, saldos in (
+            (accounting._balance_datos(c.empresa_id), esperado()),
+            (accounting._balance_datos(c.empresa_id, al=corte.isoformat()), esperado(hasta=corte)),
+            (accounting._balance_datos(c.empresa_id, desde=corte.isoformat()), esperado(desde=corte)),
+        ):
+            assert datos["cuadra"]
+            for fila in datos["rows"]:
+                saldo = saldos[fila["id_cuenta"]]
+                assert (fila["deudor"], fila["acreedor"]) == (
+                    (float(saldo), 0.0) if saldo >= 0 else (0.0, float(-saldo))), fila
@@ -0,0 +1,84 @@
+# tests/test_estados.py
+"""
+Estados materializados (services/estados_materializados.py): lo que suman las
+transacciones en el before_commit tiene que coincidir con un recálculo
+completo, y "recalcular-estados --verificar" lo comprueba.
+
+El programador queda reemplazado por una lista: así se ve qué cambios
+aplicaron sus deltas en la transacción y cuáles dejaron la empresa para
+rehacer, sin un hilo que reconstruya por detrás de la prueba.
+"""
+import pytest
+from sqlalchemy import text
+
+from app import app
+from models import db
+from services import estados_materializados
+
+
+@pytest.fixture
+def programadas(monkeypatch):
+    lista = []
+    monkeypatch.setattr(estados_materializados.programador, "programar", lista.append)
+    return lista
+
+
+def _cli(*argumentos):
+    return app.test_cli_runner().invoke(args=["recalcular-estados", *argumentos])
+
+
+def _verificar(empresa_id):
+    with app.app_context():
+        return estados_materializados.verificar(empresa_id)
+
+
+def test_los_deltas_de_cada_transaccion_coinciden_con_el_recalculo(nueva_empresa, programadas):
+    c = nueva_empresa()
+    empresa = str(c.empresa_id)
+    c.asiento("2024-01-02", [("CAJA", "debe", "5000.00"), ("CAPITAL", "haber", "5000.00")])
+    assert _verificar(c.empresa_id) == ["sin estados materializados"]
+    assert programadas == [c.empresa_id]
+    r = _cli("--empresa", empresa, "--verificar")
+    assert r.exit_code != 0 and "1 empresa(s) con diferencias" in r.output
+    assert _cli("--empresa", empresa).exit_code == 0
+    assert _cli("--empresa", empresa, "--verificar").exit_code == 0
+
+    # altas, modificaciones y bajas de asientos: se aplican los deltas sin programar nada
+    programadas.clear()
+    venta = c.asiento("2024-02-10", [("BANCOS", "debe", "1234.56"), ("VENTAS", "haber", "1234.56")])
+    costo = c.asiento("2024-02-10", [("COSTO DE VENTAS", "debe", "700.01"), ("CAJA", "haber", "700.01")])
+    c.asiento("2024-03-01", [("CAJA", "debe", "0.99"), ("PROVEEDORES", "haber", "0.99")])
+    r = c.patch(f"/accounting/api/asientos/{venta['id_asiento']}", json=dict(renglones=[
+        dict(id_cuenta=c.cuentas["BANCOS"], tipo="debe", importe="1500.00"),
+        dict(id_cuenta=c.cuentas["VENTAS"], tipo="haber", importe="1500.00"),
+    ]))
+    assert r.status_code < 400, r.get_data(as_text=True)
+    assert c.delete(f"/accounting/api/asientos/{costo['id_asiento']}").status_code < 400
+    assert programadas == []
+    assert _verificar(c.empresa_id) == []
+
+    # un cambio del plan no se aplica en la transacción: queda para rehacer
+    r = c.post("/accounting/api/cuentas", json={"nombre": "Clientes", "tipo": "activo"})
+    assert r.status_code < 400, r.get_data(as_text=True)
+    assert programadas == [c.empresa_id]
+    assert any(d.startswith("versión") for d in _verificar(c.empresa_id))
+    assert _cli("--empresa", empresa).exit_code == 0
+    assert _verificar(c.empresa_id) == []
+
+
+def test_verificar_detecta_una_fila_alterada(nueva_empresa, programadas):
+    c = nueva_empresa()
+    empresa = str(c.empresa_id)
+    c.asiento("2024-01-02", [("CAJA", "debe", "100.00"), ("VENTAS", "haber", "100.00")])
+    assert _cli("--empresa", empresa).exit_code == 0
+    with app.app_context():
+        db.session.execute(text(
+            "UPDATE estado_fondos SET importe = importe + 0.01 WHERE id_empresa = :e AND id_cuenta = :c"
+        ), dict(e=c.empresa_id, c=c.cuentas["CAJA"]))
+        db.session.commit()
+    difs = _verificar(c.empresa_id)
+    assert difs and any(d.startswith(f"cuenta {c.cuentas['CAJA']}:") for d in difs)
+    r = _cli("--empresa", empresa, "--verificar")
+    assert r.exit_code != 0 and "1 empresa(s) con diferencias" in r.output
+    assert _cli("--empresa", empresa).exit_code == 0
+    assert _cli("--empresa", empresa, "--verificar").exit_code == 0
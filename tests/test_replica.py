@@ -0,0 +1,128 @@
+# tests/test_replica.py
+"""
+Ruteo de lecturas a la réplica (RoutingSession + route_reads en app.py).
+
+El primario y la réplica son dos archivos SQLite; la réplica arranca como
+copia del primario. Cada prueba anota por qué engine pasó cada sentencia.
+"""
+import shutil
+
+import pytest
+from flask import g
+from sqlalchemy import event
+
+from app import app
+from models import db, Empresa, PlanCuenta, Rol, Usuario
+
+
+@pytest.fixture(scope="module")
+def dueno():
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        u = Usuario(nombre="Dueña", correo="duena@replica.test", rol=Rol.dueno)
+        db.session.add(u)
+        db.session.flush()
+        e = Empresa(nombre="Réplica SA", id_gerente=u.id)
+        db.session.add(e)
+        db.session.flush()
+        db.session.add(PlanCuenta(id_empresa=e.id_empresa, cod_rubro="1", rubro="ACTIVO",
+                                  cod_subrubro="1.1", subrubro="ACTIVO CORRIENTE", cuenta="CAJA"))
+        db.session.commit()
+        uid = u.id
+        primario, replica = db.engine, db.engines["replica"]
+        primario.dispose()
+        replica.dispose()
+        shutil.copyfile(primario.url.database, replica.url.database)
+    return uid
+
+
+@pytest.fixture
+def cliente(dueno):
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s["uid"] = dueno
+    return c
+
+
+@pytest.fixture
+def sentencias():
+    """Lista de (engine, sql) de lo ejecutado mientras dura la prueba."""
+    hechas = []
+    with app.app_context():
+        engines = {"primario": db.engine, "replica": db.engines["replica"]}
+    oyentes = []
+    for nombre, engine in engines.items():
+        def oyente(conn, cursor, sql, params, context, many, nombre=nombre):
+            hechas.append((nombre, sql))
+        event.listen(engine, "before_cursor_execute", oyente)
+        oyentes.append((engine, oyente))
+    yield hechas
+    for engine, oyente in oyentes:
+        event.remove(engine, "before_cursor_execute", oyente)
+
+
+def _engines(hechas):
+    return {nombre for nombre, _ in hechas}
+
+
+def test_get_reportes_lee_de_la_replica(cliente, sentencias):
+    r = cliente.get("/reports/api/series")
+    assert r.status_code == 200
+    assert "replica" in _engines(sentencias)
+    # En el primario solo se carga el usuario, antes de decidir el ruteo
+    assert all(nombre == "replica" or "usuarios" in sql for nombre, sql in sentencias)
+
+
+def test_get_api_contable_lee_de_la_replica(cliente, sentencias):
+    with app.app_context():
+        db.session.add(PlanCuenta(id_empresa=None, cod_rubro="2", rubro="PASIVO",
+                                  cod_subrubro="2.1", subrubro="PASIVO CORRIENTE", cuenta="SOLO EN PRIMARIO"))
+        db.session.commit()
+    r = cliente.get("/accounting/api/cuentas")
+    assert r.status_code == 200
+    nombres = {c["cuenta"] for c in r.get_json()}
+    assert "CAJA" in nombres and "SOLO EN PRIMARIO" not in nombres
+    assert "replica" in _engines(sentencias)
+
+
+def test_get_de_balance_lee_de_la_replica(cliente, sentencias):
+    assert cliente.get("/accounting/api/balance").status_code == 200
+    assert "replica" in _engines(sentencias)
+
+
+def test_get_fuera_de_reportes_y_api_usa_el_primario(cliente, sentencias):
+    cliente.get("/companies/")
+    assert sentencias and _engines(sentencias) == {"primario"}
+
+
+@pytest.mark.parametrize("ruta", [
+    "/accounting/api/asientos/search?q=caja",
+    "/accounting/api/changes",
+    "/accounting/api/asientos",
+])
+def test_busqueda_y_versiones_usan_el_primario(cliente, sentencias, ruta):
+    r = cliente.get(ruta)
+    assert r.status_code == 200
+    assert "replica" not in _engines(sentencias)
+
+
+def test_escrituras_van_al_primario(dueno, cliente, sentencias):
+    r = cliente.post("/accounting/api/cuentas", json={"nombre": "Bancos", "tipo": "activo"})
+    assert r.status_code < 400
+    assert _engines(sentencias) == {"primario"}
+    with app.app_context():
+        empresa = Empresa.query.filter_by(id_gerente=dueno).one()
+        assert PlanCuenta.query.filter_by(id_empresa=empresa.id_empresa, cuenta="BANCOS").count() == 1
+
+
+def test_sesion_con_cambios_y_flush_usan_el_primario(dueno, sentencias):
+    with app.test_request_context("/accounting/api/cuentas"):
+        g.db_replica = True
+        assert db.session.get_bind() is db.engines["replica"]
+        db.session.add(PlanCuenta(id_empresa=None, cuenta="PENDIENTE"))
+        assert db.session.get_bind() is db.engine
+        db.session.flush()
+        assert all(nombre == "primario" for nombre, sql in sentencias if "INSERT" in sql)
+        assert any("INSERT" in sql for _, sql in sentencias)
+        db.session.rollback()
+        assert db.session.get_bind() is db.engines["replica"]
@@ -0,0 +1,88 @@
+# tests/test_saldos_diarios.py
+"""
+Saldos acumulados por día (services/saldos_diarios.py): la tabla que mantienen
+los eventos del libro tiene que coincidir con sumar los renglones a cada fecha,
+y verificar() / "recalcular-saldos-diarios --verificar" detectan la deriva.
+"""
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app import app
+from models import db, Asiento, DetalleAsiento
+from services import saldos_diarios
+from services.centavos import a_centavos
+
+CUENTAS = ("CAJA", "BANCOS", "PROVEEDORES", "CAPITAL", "VENTAS", "COSTO DE VENTAS")
+
+
+def _libro(empresa_id):
+    """{(id_cuenta, día en que impacta): centavos} sumando los renglones."""
+    por_dia = Counter()
+    for a, d in (
+        db.session.query(Asiento, DetalleAsiento)
+        .join(DetalleAsiento, DetalleAsiento.id_asiento == Asiento.id_asiento)
+        .filter(Asiento.id_empresa == empresa_id)
+    ):
+        f = a.fecha + timedelta(days=1) if a.clase == "cierre" else a.fecha
+        cts = a_centavos(d.importe)
+        por_dia[(d.id_cuenta, f)] += cts if d.tipo == "debe" else -cts
+    return por_dia
+
+
+@pytest.fixture
+def empresa(nueva_empresa):
+    c = nueva_empresa()
+    rnd = random.Random(11)
+    ids = []
+    for _ in range(40):
+        debe, haber = rnd.sample(CUENTAS, 2)
+        importe = f"{rnd.randint(1, 99999)}.{rnd.randint(0, 99):02d}"
+        fecha = date(2023, 1, 1) + timedelta(days=rnd.randint(0, 600))
+        ids.append(c.asiento(fecha.isoformat(), [(debe, "debe", importe), (haber, "haber", importe)])["id_asiento"])
+    # modificaciones y bajas también mueven la tabla
+    for id_asiento in ids[:5]:
+        assert c.delete(f"/accounting/api/asientos/{id_asiento}").status_code < 400
+    r = c.patch(f"/accounting/api/asientos/{ids[5]}", json=dict(fecha="2023-03-15"))
+    assert r.status_code < 400, r.get_data(as_text=True)
+    assert c.post("/accounting/api/cierres", json=dict(fecha="2023-12-31")).status_code < 400
+    return c
+
+
+def test_saldo_a_fecha_es_la_suma_de_los_renglones(empresa):
+    with app.app_context():
+        por_dia = _libro(empresa.empresa_id)
+        assert any(f == date(2024, 1, 1) for _c, f in por_dia)  # el cierre impacta al día siguiente
+        fechas = sorted({f for _c, f in por_dia})
+        fechas = sorted(set(fechas) | {f - timedelta(days=1) for f in fechas})
+        for id_cuenta in empresa.cuentas.values():
+            esperado = 0
+            movs = sorted((f, cts) for (c, f), cts in por_dia.items() if c == id_cuenta)
+            i = 0
+            for f in fechas:
+                while i < len(movs) and movs[i][0] <= f:
+                    esperado += movs[i][1]
+                    i += 1
+                assert saldos_diarios.saldo_a_fecha(empresa.empresa_id, id_cuenta, f) == esperado, (id_cuenta, f)
+        assert saldos_diarios.verificar(empresa.empresa_id) == []
+
+
+def test_verificar_detecta_la_deriva_y_reconstruir_la_corrige(empresa):
+    runner = app.test_cli_runner()
+    argumentos = ["recalcular-saldos-diarios", "--empresa", str(empresa.empresa_id), "--verificar"]
+    assert runner.invoke(args=argumentos).exit_code == 0
+    with app.app_context():
+        db.session.execute(text(
+            "UPDATE saldos_diarios SET acumulado = acumulado + 1"
+            " WHERE id_empresa = :e AND id_cuenta = :c AND fecha >= '2024-01-01'"
+        ), dict(e=empresa.empresa_id, c=empresa.cuentas["CAJA"]))
+        db.session.commit()
+        difs = saldos_diarios.verificar(empresa.empresa_id)
+        assert len(difs) == 1 and f"cuenta {empresa.cuentas['CAJA']} " in difs[0]
+    r = runner.invoke(args=argumentos)
+    assert r.exit_code != 0 and "1 empresa(s) con diferencias" in r.output
+    assert runner.invoke(args=argumentos[:-1]).exit_code == 0
+    assert runner.invoke(args=argumentos).exit_code == 0
@@ -0,0 +1,74 @@
+# tests/test_transacciones.py
+"""
+Contabilización en lote (services/transacciones.py): las transacciones que no
+se pueden contabilizar quedan en 'error' con su motivo sin frenar ni alterar
+al resto del lote, y reintentar las vuelve a procesar.
+"""
+from app import app
+from models import db, Asiento, DetalleAsiento, Transaccion
+from services import saldos_diarios
+
+
+def _estados(empresa_id):
+    with app.app_context():
+        return {
+            t.doc_respaldatorio: (t.estado, t.error, t.id_asiento)
+            for t in Transaccion.query.filter_by(id_empresa=empresa_id)
+        }
+
+
+def test_los_errores_no_frenan_al_resto_del_lote(nueva_empresa):
+    c = nueva_empresa()
+    cta = c.cuentas
+    c.asiento("2023-06-30", [("CAJA", "debe", "1000.00"), ("CAPITAL", "haber", "1000.00")])
+    assert c.post("/accounting/api/cierres", json=dict(fecha="2023-12-31")).status_code < 400
+    r = c.put("/accounting/api/transacciones/mapeos", json=[
+        dict(tipo="ingreso", condicion="", id_cuenta_debe=cta["CAJA"], id_cuenta_haber=cta["VENTAS"]),
+        dict(tipo="ingreso", condicion="Banco", id_cuenta_debe=cta["BANCOS"], id_cuenta_haber=cta["VENTAS"]),
+    ])
+    assert r.status_code == 200, r.get_data(as_text=True)
+    r = c.post("/accounting/api/transacciones", json=dict(transacciones=[
+        dict(tipo="ingreso", fecha="2024-01-10", importe="100.10", doc="ok-caja"),
+        dict(tipo="ingreso", fecha="2023-11-02", importe="50", doc="cerrada"),
+        dict(tipo="egreso", fecha="2024-01-11", importe="70", doc="sin-mapeo"),
+        dict(tipo="ingreso", fecha="2024-01-12", importe="200.25", doc="ok-banco", condicion="banco"),
+    ]))
+    assert r.status_code == 201, r.get_data(as_text=True)
+
+    r = c.post("/accounting/api/transacciones/contabilizar", json={})
+    assert r.status_code == 200, r.get_data(as_text=True)
+    res = r.get_json()
+    assert res["asientos"] == 2 and res["quedan"] == 0
+    assert len(res["errores"]) == 2
+
+    estados = _estados(c.empresa_id)
+    assert estados["cerrada"][:2] == ("error", "La fecha pertenece a un ejercicio cerrado")
+    assert estados["sin-mapeo"][0] == "error" and "Sin mapeo para egreso" in estados["sin-mapeo"][1]
+    assert estados["cerrada"][2] is None and estados["sin-mapeo"][2] is None
+    with app.app_context():
+        for doc, debe, importe in (("ok-caja", "CAJA", "100.10"), ("ok-banco", "BANCOS", "200.25")):
+            estado, error, id_asiento = estados[doc]
+            assert (estado, error) == ("contabilizada", None)
+            a = db.session.get(Asiento, id_asiento)
+            assert a.doc_respaldatorio == doc
+            renglones = {(d.id_cuenta, d.tipo, str(d.importe)) for d in
+                         DetalleAsiento.query.filter_by(id_asiento=id_asiento)}
+            assert renglones == {(cta[debe], "debe", importe), (cta["VENTAS"], "haber", importe)}
+        nums = sorted(a.num_asiento for a in Asiento.query.filter_by(id_empresa=c.empresa_id))
+        assert nums == list(range(1, len(nums) + 1))  # correlativo sin huecos pese a los errores
+        assert saldos_diarios.verificar(c.empresa_id) == []
+
+    # con el mapeo cargado, reintentar contabiliza la que faltaba y no toca las demás
+    r = c.put("/accounting/api/transacciones/mapeos", json=[
+        dict(tipo="ingreso", condicion="", id_cuenta_debe=cta["CAJA"], id_cuenta_haber=cta["VENTAS"]),
+        dict(tipo="ingreso", condicion="Banco", id_cuenta_debe=cta["BANCOS"], id_cuenta_haber=cta["VENTAS"]),
+        dict(tipo="egreso", condicion="", id_cuenta_debe=cta["COSTO DE VENTAS"], id_cuenta_haber=cta["CAJA"]),
+    ])
+    assert r.status_code == 200, r.get_data(as_text=True)
+    r = c.post("/accounting/api/transacciones/contabilizar", json=dict(reintentar=True))
+    res = r.get_json()
+    assert res["asientos"] == 1 and len(res["errores"]) == 1
+    nuevos = _estados(c.empresa_id)
+    assert nuevos["sin-mapeo"][0] == "contabilizada"
+    assert nuevos["cerrada"][0] == "error"
+    assert nuevos["ok-caja"] == estados["ok-caja"] and nuevos["ok-banco"] == estados["ok-banco"]